@@ -7,3 +7,6 @@ class AuthConfig(AppConfig):
     label = 'user_auth'  # Уникальная метка, чтобы избежать конфликта с django.contrib.auth
     verbose_name = 'Авторизация'
 
+    def ready(self):
+        # Подключение сигналов сброса кэша справочников
+        from . import reference  # noqa: F401
@@ -0,0 +1,127 @@
+"""
+Стартовые данные мобильного приложения одним ответом
+
+Ответ целиком хранится в общем кэше под ключом, равным составному ETag. ETag
+строится из версий всех входящих в ответ данных (статусы, отделы, справочник
+пользователей, права доступа) и id пользователя, поэтому для его вычисления
+не нужны запросы к БД, а повторный запуск приложения обходится ответом 304.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+
+from apps.core.cache import get_version
+from apps.projects.reference import statuses
+from apps.projects.serializers import StatusSerializer
+from .models import PagePermission, USER_DIRECTORY_VERSION, PAGE_PERMISSIONS_VERSION
+from .reference import departments
+
+CACHE_KEY_PREFIX = 'bootstrap:'
+
+
+def get_user_data(user):
+    """Данные текущего пользователя (как в /api/auth/me/)"""
+    data = {
+        'id': user.id,
+        'username': user.username,
+        'is_superuser': user.is_superuser,
+        'department_id': None,
+        'department': None,
+    }
+    if hasattr(user, 'profile') and user.profile.department:
+        department = user.profile.department
+        data['department_id'] = department.id
+        data['department'] = {
+            'id': department.id,
+            'name': department.name,
+            'color': department.color,
+        }
+    return data
+
+
+def get_user_pages(user):
+    """Страницы, доступные пользователю (как в /api/auth/user-permissions/)"""
+    # Суперпользователь видит все страницы
+    if user.is_superuser:
+        return [choice[0] for choice in PagePermission.PAGE_CHOICES]
+
+    # Если у пользователя нет отдела, видит только главную
+    department = None
+    if hasattr(user, 'profile') and user.profile.department:
+        department = user.profile.department
+    if not department:
+        return ['home']
+
+    permissions = PagePermission.objects.filter(
+        department=department,
+        has_access=True
+    ).values_list('page_name', flat=True)
+
+    # Главная страница всегда доступна
+    return ['home'] + list(permissions)
+
+
+def get_versions(user):
+    """Версии данных ответа для пользователя"""
+    return {
+        'statuses': get_version(statuses.namespace),
+        'departments': get_version(departments.namespace),
+        'users': get_version(USER_DIRECTORY_VERSION),
+        'pages': get_version(PAGE_PERMISSIONS_VERSION),
+        'user': str(user.pk),
+    }
+
+
+def get_etag(versions):
+    """Составной ETag ответа по версиям get_versions()"""
+    return hashlib.sha1(':'.join(versions.values()).encode()).hexdigest()
+
+
+def _build(user, versions):
+    # Снимки справочников не старше версий, из которых построен ETag: иначе
+    # устаревшие данные попали бы в кэш под новым ETag
+    status_data = StatusSerializer(statuses.all(versions['statuses']), many=True).data
+    directory = User.objects.order_by('id').values_list(
+        'id', 'username', 'first_name', 'last_name', 'is_active', 'profile__department_id'
+    )
+    return {
+        'user': get_user_data(user),
+        'pages': get_user_pages(user),
+        'statuses': {
+            status_type: [item for item in status_data if item['status_type'] == status_type]
+            for status_type, _ in statuses.model.STATUS_TYPES
+        },
+        'departments': [
+            {
+                'id': dept.id,
+                'name': dept.name,
+                'description': dept.description,
+                'color': dept.color,
+            }
+            for dept in sorted(departments.all(versions['departments']), key=lambda dept: dept.name)
+        ],
+        'users': [
+            {
+                'id': pk,
+                'username': username,
+                'first_name': first_name,
+                'last_name': last_name,
+                'is_active': is_active,
+                'department_id': department_id,
+            }
+            for pk, username, first_name, last_name, is_active, department_id in directory
+        ],
+    }
+
+
+def get_bootstrap(user, versions=None):
+    """Данные для ответа; берутся из кэша, при промахе собираются и кэшируются"""
+    versions = versions or get_versions(user)
+    key = f'{CACHE_KEY_PREFIX}{get_etag(versions)}'
+    data = cache.get(key)
+    if data is None:
+        data = _build(user, versions)
+        cache.set(key, data, settings.BOOTSTRAP_CACHE_TIMEOUT)
+    return data
@@ -1,7 +1,12 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from apps.core.cache import bump_version
+
+# Версии данных, входящих в ответ /api/auth/bootstrap/
+USER_DIRECTORY_VERSION = 'user-directory'
+PAGE_PERMISSIONS_VERSION = 'page-permissions'
 
 
 class Department(models.Model):
@@ -93,3 +98,16 @@ class PagePermission(models.Model):
     
     def __str__(self):
         return f"{self.department.name} - {self.get_page_name_display()}"
+
+
+@receiver([post_save, post_delete], sender=User)
+@receiver([post_save, post_delete], sender=UserProfile)
+def invalidate_user_directory(sender, **kwargs):
+    """Сбрасывает кэш справочника пользователей после коммита"""
+    transaction.on_commit(lambda: bump_version(USER_DIRECTORY_VERSION))
+
+
+@receiver([post_save, post_delete], sender=PagePermission)
+def invalidate_page_permissions(sender, **kwargs):
+    """Сбрасывает кэш прав доступа к страницам после коммита"""
+    transaction.on_commit(lambda: bump_version(PAGE_PERMISSIONS_VERSION))
@@ -0,0 +1,7 @@
+"""
+Кэш справочника отделов
+"""
+from apps.core.reference import ReferenceCache
+from .models import Department
+
+departments = ReferenceCache(Department)
@@ -1,11 +1,14 @@
 """
 Тесты для проверки доступа по отделам
 """
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from rest_framework.test import APIClient
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
+from apps.core.testing import QueryBudgetMixin
+from apps.projects.models import Status
 from .models import Department, UserProfile, PagePermission
 
 
@@ -212,3 +215,129 @@ class DepartmentPagePermissionsTest(TestCase):
         self.assertNotIn('tasks', pages)
         self.assertEqual(set(pages), {'home'})
 
+
+class BootstrapTest(TestCase):
+    """Тесты стартового эндпоинта /api/auth/bootstrap/"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        # Версии и ответы хранятся в кэше процесса, общем для всех тестов
+        cache.clear()
+        self.client = APIClient()
+        # Ключи, записанные незавершенной транзакцией, в L1 не кладутся: имитируем коммит
+        with self.captureOnCommitCallbacks(execute=True):
+            self.department = Department.objects.create(name='IT', color='#0000FF')
+            self.user = User.objects.create_user(username='it_user', password='testpass123')
+            self.user.profile.department = self.department
+            self.user.profile.save()
+            PagePermission.objects.create(page_name='tasks', department=self.department, has_access=True)
+            Status.objects.create(name='Активный', status_type='sheet')
+            Status.objects.create(name='В работе', status_type='stage')
+        
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+    
+    def test_bootstrap_contains_startup_data(self):
+        """Проверка: ответ содержит пользователя, страницы, статусы, отделы и пользователей"""
+        response = self.client.get('/api/auth/bootstrap/')
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.has_header('ETag'))
+        data = response.data
+        self.assertEqual(data['user']['department_id'], self.department.id)
+        self.assertEqual(set(data['pages']), {'home', 'tasks'})
+        self.assertEqual([item['name'] for item in data['statuses']['sheet']], ['Активный'])
+        self.assertEqual([item['name'] for item in data['statuses']['stage']], ['В работе'])
+        self.assertEqual([item['name'] for item in data['departments']], ['IT'])
+        self.assertEqual(data['users'][0]['username'], 'it_user')
+        self.assertEqual(data['users'][0]['department_id'], self.department.id)
+    
+    def test_matching_etag_returns_304(self):
+        """Проверка: повторный запрос с If-None-Match возвращает 304 без обращений к данным"""
+        with self.captureOnCommitCallbacks(execute=True):
+            etag = self.client.get('/api/auth/bootstrap/')['ETag']
+        
+        with self.assertNumQueries(1):  # только загрузка пользователя из JWT
+            response = self.client.get('/api/auth/bootstrap/', HTTP_IF_NONE_MATCH=etag)
+        
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+    
+    def test_changes_update_etag(self):
+        """Проверка: изменение отдела или прав доступа меняет ETag и данные"""
+        etag = self.client.get('/api/auth/bootstrap/')['ETag']
+        
+        with self.captureOnCommitCallbacks(execute=True):
+            self.department.name = 'ИТ'
+            self.department.save()
+        response = self.client.get('/api/auth/bootstrap/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['departments'][0]['name'], 'ИТ')
+        
+        etag = response['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            PagePermission.objects.filter(page_name='tasks').get().delete()
+        response = self.client.get('/api/auth/bootstrap/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['pages'], ['home'])
+    
+    def test_etag_is_per_user(self):
+        """Проверка: ETag другого пользователя не подходит"""
+        etag = self.client.get('/api/auth/bootstrap/')['ETag']
+        other = User.objects.create_user(username='other', password='testpass123')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(other).access_token}')
+        
+        response = self.client.get('/api/auth/bootstrap/', HTTP_IF_NONE_MATCH=etag)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['user']['username'], 'other')
+
+
+class QueryBudgetTest(QueryBudgetMixin, TransactionTestCase):
+    """Число SQL-запросов эндпоинтов пользователей не зависит от числа пользователей
+
+    TransactionTestCase: внутри транзакции TestCase кэш справочников не сохраняет
+    снимок и читает таблицу при каждом обращении.
+    """
+    
+    # (путь, параметры, максимум запросов)
+    BUDGETS = [
+        ('/api/auth/users/', {'page_size': 100}, 3),
+        ('/api/auth/departments/', {}, 1),
+        ('/api/auth/bootstrap/', {}, 1),
+    ]
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        cache.clear()
+        self.client = APIClient()
+        self.department = Department.objects.create(name='IT', color='#0000FF')
+        self.user = User.objects.create_superuser(username='admin', password='testpass123')
+        self.user.profile.department = self.department
+        self.user.profile.save()
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.rows = 0
+        self._add_users(1)
+    
+    def _add_users(self, count):
+        """Добавить пользователей, каждого в своем отделе"""
+        for _ in range(count):
+            self.rows += 1
+            user = User.objects.create_user(username=f'user{self.rows}', password='testpass123')
+            user.profile.department = Department.objects.create(name=f'Отдел {self.rows}', color='#00FF00')
+            user.profile.save()
+    
+    def _get(self, path, params):
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content[:500])
+        return response
+    
+    def test_endpoints_stay_within_budget(self):
+        for path, params, budget in self.BUDGETS:
+            with self.subTest(path=path):
+                first, second = self.assertQueryBudgetStable(
+                    budget, lambda: self._get(path, params), lambda: self._add_users(2)
+                )
+                self.assertGreater(len(second.content), len(first.content))
@@ -18,6 +18,7 @@ urlpatterns = [
     path('page-permissions/', views.page_permissions, name='page_permissions'),
     path('page-permissions/update/', views.update_page_permissions, name='update_page_permissions'),
     path('user-permissions/', views.user_permissions, name='user_permissions'),
+    path('bootstrap/', views.bootstrap, name='bootstrap'),
     path('', include(router.urls)),
 ]
 
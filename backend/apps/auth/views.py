@@ -1,7 +1,7 @@
 """
 API views для авторизации
 """
-from rest_framework import status, generics, viewsets
+from rest_framework import status, generics
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser, BasePermission
 from rest_framework.response import Response
@@ -10,7 +10,11 @@ from rest_framework.filters import SearchFilter
 from django.contrib.auth.models import User
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate
+from django.utils.http import parse_etags, quote_etag
+from apps.core import viewsets
 from .models import Department, UserProfile, PagePermission
+from . import reference
+from .bootstrap import get_bootstrap, get_etag, get_user_data, get_user_pages, get_versions
 
 
 class HasPagePermission(BasePermission):
@@ -118,27 +122,28 @@ def login(request):
 @permission_classes([IsAuthenticated])
 def current_user(request):
     """Получение информации о текущем пользователе"""
-    user = request.user
-    response_data = {
-        'id': user.id,
-        'username': user.username,
-        'is_superuser': user.is_superuser,
-    }
-    
-    # Добавляем информацию об отделе, если есть профиль
-    if hasattr(user, 'profile') and user.profile.department:
-        department = user.profile.department
-        response_data['department_id'] = department.id
-        response_data['department'] = {
-            'id': department.id,
-            'name': department.name,
-            'color': department.color,
-        }
+    return Response(get_user_data(request.user), status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def bootstrap(request):
+    """Стартовые данные приложения: пользователь, страницы, статусы, отделы, пользователи
+
+    Поддерживает If-None-Match: при совпадении ETag возвращается 304 без тела.
+    """
+    versions = get_versions(request.user)
+    etag = get_etag(versions)
+    quoted_etag = quote_etag(etag)
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (if_none_match.strip() == '*' or quoted_etag in parse_etags(if_none_match)):
+        response = Response(status=status.HTTP_304_NOT_MODIFIED)
     else:
-        response_data['department_id'] = None
-        response_data['department'] = None
-    
-    return Response(response_data, status=status.HTTP_200_OK)
+        response = Response(get_bootstrap(request.user, versions), status=status.HTTP_200_OK)
+    response['ETag'] = quoted_etag
+    # Клиент хранит ответ у себя, но всегда перепроверяет его по ETag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 @api_view(['GET'])
@@ -167,7 +172,7 @@ class UserPagination(PageNumberPagination):
 
 class UserViewSet(viewsets.ModelViewSet):
     """ViewSet для управления пользователями"""
-    queryset = User.objects.all().order_by('id')
+    queryset = User.objects.select_related('profile').order_by('id')
     pagination_class = UserPagination
     permission_classes = [IsAuthenticated]
     filter_backends = [SearchFilter]
@@ -191,11 +196,13 @@ class UserViewSet(viewsets.ModelViewSet):
     def _get_user_data(self, user):
         """Вспомогательный метод для получения данных пользователя"""
         department_data = None
-        if hasattr(user, 'profile') and user.profile.department:
+        # Отдел берется из кэша справочника, профиль — из select_related
+        department = reference.departments.get(user.profile.department_id) if hasattr(user, 'profile') else None
+        if department:
             department_data = {
-                'id': user.profile.department.id,
-                'name': user.profile.department.name,
-                'color': user.profile.department.color,
+                'id': department.id,
+                'name': department.name,
+                'color': department.color,
             }
         
         return {
@@ -212,12 +219,13 @@ class UserViewSet(viewsets.ModelViewSet):
     
     def list(self, request, *args, **kwargs):
         """Получение списка пользователей с пагинацией"""
-        page = self.paginate_queryset(self.queryset)
+        queryset = self.get_queryset()
+        page = self.paginate_queryset(queryset)
         if page is not None:
             users_data = [self._get_user_data(user) for user in page]
             return self.get_paginated_response(users_data)
         
-        users_data = [self._get_user_data(user) for user in self.queryset]
+        users_data = [self._get_user_data(user) for user in queryset]
         return Response(users_data)
     
     def retrieve(self, request, *args, **kwargs):
@@ -437,8 +445,7 @@ class DepartmentViewSet(viewsets.ModelViewSet):
     
     def list(self, request, *args, **kwargs):
         """Получение списка отделов"""
-        # Принудительно обновляем queryset, чтобы получить свежие данные
-        departments = Department.objects.all().order_by('name')
+        # Отделы берутся из кэша справочника (сбрасывается при любом изменении)
         departments_data = [
             {
                 'id': dept.id,
@@ -446,7 +453,7 @@ class DepartmentViewSet(viewsets.ModelViewSet):
                 'description': dept.description,
                 'color': dept.color,
             }
-            for dept in departments
+            for dept in sorted(reference.departments.all(), key=lambda dept: dept.name)
         ]
         return Response(departments_data)
     
@@ -622,35 +629,9 @@ def update_page_permissions(request):
 def user_permissions(request):
     """Получение доступных страниц для текущего пользователя"""
     try:
-        user = request.user
-        
-        # Суперпользователь видит все страницы
-        if user.is_superuser:
-            pages = [choice[0] for choice in PagePermission.PAGE_CHOICES]
-            return Response({'pages': pages})
-        
-        # Получаем отдел пользователя
-        department = None
-        if hasattr(user, 'profile') and user.profile.department:
-            department = user.profile.department
-        
-        # Если у пользователя нет отдела, видит только главную
-        if not department:
-            return Response({'pages': ['home']})
-        
-        # Получаем права доступа для отдела
-        permissions = PagePermission.objects.filter(
-            department=department,
-            has_access=True
-        ).values_list('page_name', flat=True)
-        
-        # Главная страница всегда доступна
-        pages = ['home'] + list(permissions)
-        
-        return Response({'pages': pages})
+        return Response({'pages': get_user_pages(request.user)})
     except Exception as e:
         return Response(
             {'error': str(e)},
             status=status.HTTP_400_BAD_REQUEST
         )
-
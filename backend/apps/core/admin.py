@@ -0,0 +1,37 @@
+from django.contrib import admin
+from .models import Blob, PendingFileDeletion, SlowQuery
+
+
+@admin.register(SlowQuery)
+class SlowQueryAdmin(admin.ModelAdmin):
+    list_display = ['view', 'short_sql', 'calls', 'total_time', 'max_time', 'last_seen']
+    list_filter = ['view']
+    search_fields = ['sql', 'view']
+    readonly_fields = [field.name for field in SlowQuery._meta.fields]
+
+    def short_sql(self, obj):
+        return obj.sql[:100]
+    short_sql.short_description = 'SQL'
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(Blob)
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ['digest', 'size', 'ref_count', 'created_at']
+    search_fields = ['digest']
+    readonly_fields = [field.name for field in Blob._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(PendingFileDeletion)
+class PendingFileDeletionAdmin(admin.ModelAdmin):
+    list_display = ['name', 'not_before', 'created_at']
+    search_fields = ['name']
+    readonly_fields = [field.name for field in PendingFileDeletion._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,19 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class CoreConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'apps.core'
+    label = 'core'
+    verbose_name = 'Ядро'
+
+    def ready(self):
+        from . import blobs, checks, instrumentation, invalidation, previews, slow_queries  # noqa: F401 (connection_created, checks)
+        instrumentation.configure()
+        invalidation.connect_model_signals()
+        blobs.connect_model_signals()
+        previews.connect_model_signals()
+        if settings.NPLUSONE['ENABLED']:
+            from . import nplusone
+            nplusone.install()
@@ -0,0 +1,195 @@
+"""
+Бенчмарк основных эндпоинтов API
+
+Сценарий — запрос к эндпоинту с характерными для клиента фильтрами от имени
+суперпользователя или обычного пользователя с отделом. Каждый сценарий
+выполняется в процессе через django.test.Client: сначала прогревочные
+итерации, затем замеряемые (p50/p95 времени ответа и число SQL-запросов),
+затем одна итерация под tracemalloc для пикового объема памяти (tracemalloc
+замедляет выполнение, поэтому в замеры времени она не входит).
+
+Результаты сравниваются с базовым файлом JSON: регрессией считается рост p95
+или пиковой памяти больше чем на threshold и любой рост числа запросов. В файле
+записаны СУБД (connection.vendor) и масштабы замеров: сравнение с файлом другой
+СУБД или без нужного масштаба не выполняется.
+Запуск — команда benchmark, см. docs/benchmarks.md.
+"""
+import json
+import math
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from rest_framework_simplejwt.tokens import RefreshToken
+
+
+@dataclass
+class Scenario:
+    """Запрос к эндпоинту: params — словарь или функция(fixtures) -> словарь"""
+    name: str
+    path: str
+    params: object = field(default_factory=dict)
+    user: str = 'superuser'
+
+    def resolve_params(self, fixtures):
+        return self.params(fixtures) if callable(self.params) else self.params
+
+
+SCENARIOS = [
+    Scenario('auth.bootstrap', '/api/auth/bootstrap/', user='user'),
+    Scenario('auth.me', '/api/auth/me/', user='user'),
+    Scenario('auth.user-permissions', '/api/auth/user-permissions/', user='user'),
+    Scenario('user.list', '/api/auth/users/', {'page_size': 100}),
+    Scenario('user.search', '/api/auth/users/', {'search': 'user1', 'page_size': 20}),
+    Scenario('department.list', '/api/auth/departments/'),
+    Scenario('status.list', '/api/projects/statuses/', {'status_type': 'sheet'}),
+    Scenario('construction-site.list', '/api/projects/construction-sites/'),
+    Scenario('project.list', '/api/projects/projects/',
+             lambda f: {'construction_site_id': f['site_id']}),
+    Scenario('project.retrieve', lambda f: f'/api/projects/projects/{f["project_id"]}/'),
+    Scenario('project-sheet.list', '/api/projects/project-sheets/',
+             lambda f: {'project_id': f['project_id'], 'page': 1, 'page_size': 5}),
+    Scenario('project-sheet.list.department', '/api/projects/project-sheets/',
+             {'filter_by_user_department': 'true', 'is_completed': 'false', 'page_size': 100}, user='user'),
+    Scenario('project-sheet.list.created-by', '/api/projects/project-sheets/',
+             {'filter_by_created_by': 'true', 'is_completed': 'false', 'page_size': 100}, user='user'),
+    Scenario('project-sheet.list.site', '/api/projects/project-sheets/',
+             lambda f: {'construction_site_id': f['site_id'], 'page_size': 100}),
+    Scenario('project-stage.list', '/api/projects/project-stages/',
+             lambda f: {'project_id': f['project_id'], 'page': 1, 'page_size': 5}),
+    Scenario('project-stage.list.user', '/api/projects/project-stages/', {'page_size': 20}, user='user'),
+    Scenario('dashboard.data', '/api/projects/dashboard/data/', {'granularity': 'month'}),
+    Scenario('dashboard.data.filtered', '/api/projects/dashboard/data/',
+             lambda f: {'construction_site_ids[]': [f['site_id']], 'date_from': f['date_from'],
+                        'granularity': 'day'}),
+]
+
+
+def percentile(values, fraction):
+    """Перцентиль по методу ближайшего ранга"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+
+def fixtures():
+    """Объекты для параметров сценариев: самый крупный участок и проект, дата"""
+    from apps.projects.models import ConstructionSite, Project, ProjectSheet
+    from django.db.models import Count
+
+    site = ConstructionSite.objects.annotate(n=Count('projects')).order_by('-n', 'id').first()
+    project = Project.objects.annotate(n=Count('sheets')).order_by('-n', 'id').first()
+    latest = ProjectSheet.objects.order_by('-created_at').values_list('created_at', flat=True).first()
+    return {
+        'site_id': site.id if site else 0,
+        'project_id': project.id if project else 0,
+        'date_from': (latest.date().replace(day=1).isoformat() if latest else '2000-01-01'),
+    }
+
+
+def clients():
+    """Клиенты с JWT: суперпользователь и обычный пользователь с отделом"""
+    superuser, created = User.objects.get_or_create(
+        username='benchmark_admin', defaults={'is_superuser': True, 'is_staff': True}
+    )
+    user = (
+        User.objects.filter(is_superuser=False, profile__department__isnull=False).order_by('id').first()
+        or superuser
+    )
+    result = {}
+    for kind, account in (('superuser', superuser), ('user', user)):
+        token = RefreshToken.for_user(account).access_token
+        result[kind] = Client(HTTP_AUTHORIZATION=f'Bearer {token}')
+    return result
+
+
+def run_scenario(scenario, client, fixtures, iterations, warmup):
+    """Замеры одного сценария: {'p50_ms', 'p95_ms', 'queries', 'peak_kb', 'status'}"""
+    path = scenario.path(fixtures) if callable(scenario.path) else scenario.path
+    params = scenario.resolve_params(fixtures)
+
+    response = None
+    for _ in range(warmup):
+        response = client.get(path, params)
+
+    durations = []
+    queries = 0
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = client.get(path, params)
+            durations.append(time.perf_counter() - start)
+        queries = max(queries, len(captured))
+
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    baseline, _ = tracemalloc.get_traced_memory()
+    client.get(path, params)
+    _, peak = tracemalloc.get_traced_memory()
+    if not tracing:
+        tracemalloc.stop()
+
+    return {
+        'p50_ms': round(percentile(durations, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(durations, 0.95) * 1000, 2),
+        'queries': queries,
+        'peak_kb': round((peak - baseline) / 1024, 1),
+        'status': response.status_code if response is not None else None,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Регрессии относительно базового файла: список строк"""
+    regressions = []
+    for key, current in sorted(results.items()):
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        for metric in ('p95_ms', 'peak_kb'):
+            if previous.get(metric) and current[metric] > previous[metric] * (1 + threshold):
+                regressions.append(
+                    f'{key}: {metric} {previous[metric]} -> {current[metric]} '
+                    f'(+{(current[metric] / previous[metric] - 1) * 100:.0f}%)'
+                )
+        if previous.get('queries') is not None and current['queries'] > previous['queries']:
+            regressions.append(f'{key}: queries {previous["queries"]} -> {current["queries"]}')
+    return regressions
+
+
+class BaselineMismatch(Exception):
+    """Базовый файл записан на другой СУБД или без нужных масштабов"""
+
+
+def load_baseline(path):
+    """Базовый файл {'vendor', 'scales', 'results'}; без файла — пустые результаты"""
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'vendor': None, 'scales': [], 'results': {}}
+
+
+def check_baseline(baseline, vendor, scales):
+    """BaselineMismatch, если замеры на vendor и scales не с чем сравнивать"""
+    if baseline.get('vendor') != vendor:
+        raise BaselineMismatch(
+            f'Базовый файл записан на {baseline.get("vendor") or "неизвестной СУБД"}, замеры — на {vendor}'
+        )
+    missing = sorted(set(scales) - set(baseline.get('scales', [])))
+    if missing:
+        raise BaselineMismatch(f'В базовом файле нет масштабов {", ".join(f"{scale:g}" for scale in missing)}')
+
+
+def save_baseline(path, vendor, scales, results):
+    data = {'vendor': vendor, 'scales': sorted(scales), 'results': results}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2, sort_keys=True)
+        f.write('\n')
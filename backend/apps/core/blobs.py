@@ -0,0 +1,132 @@
+"""
+Счетчики ссылок на блобы ContentAddressedStorage
+
+Для каждого FileField с ContentAddressedStorage сигналы моделей ведут
+Blob.ref_count: сохранение записи с новым файлом добавляет ссылку на его блоб
+и снимает ссылку со старого, удаление записи (в том числе каскадное) снимает
+ссылку. Исходные имена файлов запоминаются при загрузке объекта (post_init),
+поэтому сохранение не требует лишних запросов.
+
+Счетчики меняются и блоб, у которого не осталось ссылок, и старый файл с
+обычным именем ставятся в очередь PendingFileDeletion в транзакции, в которой
+сохраняется или удаляется запись: при ее откате файлы остаются на месте, а
+удаляет их после фиксации сборщик apps.core.filegc. Model.delete() сам
+выполняется в транзакции, а Model.save() — нет: ViewSet моделей с файлами
+сохраняют записи в транзакции (apps.core.viewsets.AtomicWritesMixin), и так же
+нужно сохранять их в своем коде. Иначе строка записи фиксируется до изменения
+счетчиков, и сбой между ними оставит ref_count неверным. Такие расхождения,
+как и изменения через QuerySet.update() и bulk_create (они сигналов не
+отправляют), исправляет команда reconcile_files — ее нужно запускать регулярно.
+"""
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import F, FileField
+from django.db.models.signals import post_delete, post_init, post_save, pre_save
+
+from . import filegc
+from .models import Blob
+from .storage import ContentAddressing
+
+_fields = {}
+
+
+def tracked_fields(model):
+    """FileField модели, хранящие файлы в хранилище с дедупликацией (ContentAddressing)"""
+    if model not in _fields:
+        _fields[model] = [
+            field for field in model._meta.concrete_fields
+            if isinstance(field, FileField) and isinstance(field.storage, ContentAddressing)
+        ]
+    return _fields[model]
+
+
+def tracked():
+    """Пары (модель, поле) для всех моделей с файлами в ContentAddressedStorage"""
+    return [(model, field) for model in apps.get_models() for field in tracked_fields(model)]
+
+
+def _name(value):
+    return getattr(value, 'name', value) or None
+
+
+def acquire(storage, name):
+    """Добавить ссылку на блоб имени name (обычные имена пропускаются)"""
+    digest = storage.digest(name)
+    if digest is None:
+        return
+    if Blob.objects.filter(digest=digest).update(ref_count=F('ref_count') + 1):
+        return
+    try:
+        with transaction.atomic():
+            Blob.objects.create(digest=digest, size=storage.size(name), ref_count=1)
+    except IntegrityError:
+        # Запись блоба создала параллельная транзакция
+        Blob.objects.filter(digest=digest).update(ref_count=F('ref_count') + 1)
+
+
+def release(storage, name):
+    """Снять ссылку на файл; файл без ссылок ставится в очередь на удаление"""
+    if not name:
+        return
+    digest = storage.digest(name)
+    if digest is not None:
+        Blob.objects.filter(digest=digest, ref_count__gt=0).update(ref_count=F('ref_count') - 1)
+        if not Blob.objects.filter(digest=digest, ref_count=0).exists():
+            return
+    # Ссылки на файлы с обычными именами не считаются: сборщик проверит их по БД
+    filegc.enqueue([storage.stored_name(name)])
+
+
+def _remember(sender, instance, **kwargs):
+    # Отложенные поля (only/defer) в __dict__ отсутствуют
+    instance._blob_names = {
+        field.attname: _name(instance.__dict__[field.attname])
+        for field in tracked_fields(sender) if field.attname in instance.__dict__
+    }
+
+
+def _load_unknown(sender, instance, raw=False, update_fields=None, **kwargs):
+    """Имена отложенных полей до сохранения — из БД"""
+    if raw or instance._state.adding:
+        return
+    known = getattr(instance, '_blob_names', {})
+    missing = [
+        field.attname for field in tracked_fields(sender)
+        if field.attname not in known and (update_fields is None or field.name in update_fields)
+    ]
+    if missing:
+        row = sender._base_manager.using(instance._state.db).filter(pk=instance.pk).values(*missing).first() or {}
+        instance._blob_names = {**known, **{attname: row.get(attname) or None for attname in missing}}
+
+
+def _on_save(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    known = {} if created else getattr(instance, '_blob_names', {})
+    for field in tracked_fields(sender):
+        if update_fields is not None and field.name not in update_fields:
+            continue
+        old, new = known.get(field.attname), _name(getattr(instance, field.attname))
+        if old != new:
+            acquire(field.storage, new)
+            release(field.storage, old)
+    _remember(sender, instance)
+
+
+def _on_delete(sender, instance, **kwargs):
+    known = getattr(instance, '_blob_names', {})
+    for field in tracked_fields(sender):
+        old = known.get(field.attname, _name(instance.__dict__.get(field.attname)))
+        release(field.storage, old)
+
+
+def connect_model_signals():
+    """Вести Blob.ref_count для моделей с FileField в ContentAddressedStorage"""
+    for model in apps.get_models():
+        if not tracked_fields(model):
+            continue
+        label = model._meta.label
+        post_init.connect(_remember, sender=model, dispatch_uid=f'blobs:init:{label}')
+        pre_save.connect(_load_unknown, sender=model, dispatch_uid=f'blobs:pre_save:{label}')
+        post_save.connect(_on_save, sender=model, dispatch_uid=f'blobs:save:{label}')
+        post_delete.connect(_on_delete, sender=model, dispatch_uid=f'blobs:delete:{label}')
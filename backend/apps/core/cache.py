@@ -0,0 +1,39 @@
+"""
+Версионные ключи в общем кэше Django
+
+Версия пространства имен — случайный токен. Процессы сравнивают свой токен с общим
+и перечитывают данные при расхождении. Случайный токен (а не счетчик) исключает
+совпадение версий после вытеснения ключа из кэша.
+
+Токены видны всем воркерам, только если кэш по умолчанию общий: TwoTierCache с
+L2 в таблице БД (CACHE_L2_BACKEND=database, по умолчанию). С locmem у каждого
+процесса свои версии, и смену данных видит только процесс, который ее сделал, —
+это годится лишь для одного процесса (runserver); проверка core.W001
+предупреждает о такой настройке вне DEBUG.
+"""
+import uuid
+
+from django.core.cache import cache
+
+VERSION_KEY_PREFIX = 'version:'
+
+
+def _version_key(namespace):
+    return f'{VERSION_KEY_PREFIX}{namespace}'
+
+
+def get_version(namespace):
+    """Текущая версия пространства имен (создается при первом обращении)"""
+    key = _version_key(namespace)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(namespace):
+    """Сменить версию пространства имен, сделав устаревшими все копии данных"""
+    version = uuid.uuid4().hex
+    cache.set(_version_key(namespace), version, None)
+    return version
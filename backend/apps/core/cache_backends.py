@@ -0,0 +1,251 @@
+"""
+Двухуровневый кэш: L1 в памяти процесса (LRU) поверх общего L2
+
+L2 — любой настроенный кэш Django (по умолчанию таблица DatabaseCache), он общий
+для всех воркеров. L1 — ограниченный LRU в памяти процесса, общий для всех потоков.
+Каждая запись через этот кэш рассылает имена измененных ключей через шину
+apps.core.invalidation, и остальные процессы за миллисекунды удаляют свои копии
+из L1. L1_TIMEOUT ограничивает жизнь копии на случай потерянного уведомления.
+
+Каждое удаление из L1 увеличивает поколение хранилища. Читатель запоминает
+поколение до чтения L2 и кладет значение в L1, только если ключ с тех пор не
+инвалидировали: иначе прочитанное значение могло устареть.
+
+Записи внутри транзакции не попадают в L1 (при откате копия пережила бы
+значение в L2), а уведомления о них копятся и уходят одним событием после
+коммита. Ключи, записанные текущей незавершенной транзакцией, в L1 не кладутся
+и при чтении. Такая семантика верна для L2 в той же БД (DatabaseCache).
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.db import transaction
+from django.utils.functional import cached_property
+
+from . import invalidation
+from .metrics import CACHE_REQUESTS
+
+# Хранилища L1 по имени кэша: общие для всех потоков процесса
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+class LRUStore:
+    """Ограниченный по числу записей LRU со сроком жизни записей
+
+    generation растет при каждом удалении. Поколения последних удалений хранятся
+    по ключам (не больше max_entries), поколения вытесненных из этого списка и
+    последней очистки — в _floor.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._invalidated = OrderedDict()
+        self._floor = 0
+        self._lock = threading.Lock()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[1] < time.monotonic():
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, expires_at, generation):
+        """Записать значение, прочитанное в поколении generation
+
+        Возвращает False, если ключ после этого инвалидировали, и значение не записано.
+        """
+        with self._lock:
+            if generation < max(self._floor, self._invalidated.get(key, 0)):
+                return False
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+            return True
+
+    def discard(self, keys):
+        """Удалить ключи; возвращает новое поколение"""
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._data.pop(key, None)
+                self._invalidated[key] = self.generation
+                self._invalidated.move_to_end(key)
+            while len(self._invalidated) > self.max_entries:
+                _key, generation = self._invalidated.popitem(last=False)
+                self._floor = max(self._floor, generation)
+            return self.generation
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._floor = self.generation
+            self._invalidated.clear()
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+def _handle_event(event):
+    """Обработчик шины инвалидации: удаление копий из всех L1 процесса"""
+    if event.get('clear'):
+        for store in list(_stores.values()):
+            store.clear()
+    elif event.get('keys'):
+        for store in list(_stores.values()):
+            store.discard(event['keys'])
+
+
+invalidation.subscribe(_handle_event)
+
+
+class TwoTierCache(BaseCache):
+    """Кэш-бэкенд с L1 в памяти процесса и общим L2
+
+    OPTIONS:
+        L2 — алиас общего кэша в CACHES (по умолчанию 'shared');
+        L1_MAX_ENTRIES — максимум записей в L1 (по умолчанию 1000);
+        L1_TIMEOUT — максимальное время жизни копии в L1, сек (по умолчанию 300).
+    """
+
+    def __init__(self, location, params):
+        options = params.get('OPTIONS', {})
+        self._l2_alias = options.get('L2', 'shared')
+        self._l1_timeout = options.get('L1_TIMEOUT', 300)
+        max_entries = options.get('L1_MAX_ENTRIES', 1000)
+        super().__init__(params)
+        name = location or self._l2_alias
+        with _stores_lock:
+            self._l1 = _stores.setdefault(name, LRUStore(max_entries))
+        self._counters = {result: CACHE_REQUESTS.labels(name, result) for result in ('l1', 'l2', 'miss')}
+        invalidation.start_listener()
+
+    @cached_property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    @property
+    def stats(self):
+        """Счетчики попаданий L1 для метрик"""
+        return {'l1_hits': self._l1.hits, 'l1_misses': self._l1.misses, 'l1_entries': len(self._l1)}
+
+    def _l1_set(self, key, value, timeout, generation):
+        if generation is None or key in invalidation.pending('keys'):
+            return
+        ttl = self._l1_timeout
+        if timeout is not DEFAULT_TIMEOUT and timeout is not None:
+            ttl = min(ttl, timeout)
+        if ttl <= 0:
+            return
+        self._l1.set(key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL), time.monotonic() + ttl, generation)
+
+    def _changed(self, keys):
+        """Удалить копии ключей из L1 и разослать их остальным процессам
+
+        Возвращает поколение, с которым записанное значение можно положить в L1,
+        или None внутри транзакции.
+        """
+        invalidation.publish_on_commit('keys', keys)
+        generation = self._l1.discard(keys)
+        if transaction.get_connection().in_atomic_block:
+            return None
+        return generation
+
+    def get(self, key, default=None, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        cached = self._l1.get(full_key)
+        if cached is not None:
+            self._counters['l1'].inc()
+            return pickle.loads(cached)
+        generation = self._l1.generation
+        value = self.l2.get(key, self._missing_key, version=version)
+        if value is self._missing_key:
+            self._counters['miss'].inc()
+            return default
+        self._counters['l2'].inc()
+        self._l1_set(full_key, value, DEFAULT_TIMEOUT, generation)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        self.l2.set(key, value, timeout=timeout, version=version)
+        self._l1_set(full_key, value, timeout, self._changed([full_key]))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        added = self.l2.add(key, value, timeout=timeout, version=version)
+        if added:
+            self._l1_set(full_key, value, timeout, self._changed([full_key]))
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return self.l2.touch(key, timeout=timeout, version=version)
+
+    def delete(self, key, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        deleted = self.l2.delete(key, version=version)
+        self._changed([full_key])
+        return deleted
+
+    def has_key(self, key, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        return self._l1.get(full_key) is not None or self.l2.has_key(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        full_key = self.make_and_validate_key(key, version=version)
+        value = self.l2.incr(key, delta, version=version)
+        self._changed([full_key])
+        return value
+
+    def get_many(self, keys, version=None):
+        result, missing = {}, []
+        for key in keys:
+            cached = self._l1.get(self.make_and_validate_key(key, version=version))
+            if cached is not None:
+                result[key] = pickle.loads(cached)
+            else:
+                missing.append(key)
+        if missing:
+            generation = self._l1.generation
+            fetched = self.l2.get_many(missing, version=version)
+            for key, value in fetched.items():
+                self._l1_set(self.make_and_validate_key(key, version=version), value, DEFAULT_TIMEOUT, generation)
+            result.update(fetched)
+        return result
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.l2.set_many(data, timeout=timeout, version=version)
+        generation = self._changed([self.make_and_validate_key(key, version=version) for key in data])
+        for key, value in data.items():
+            if key not in failed:
+                self._l1_set(self.make_and_validate_key(key, version=version), value, timeout, generation)
+        return failed
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        self.l2.delete_many(keys, version=version)
+        self._changed([self.make_and_validate_key(key, version=version) for key in keys])
+
+    def clear(self):
+        self.l2.clear()
+        self._l1.clear()
+        invalidation.publish({'clear': True})
+
+    def close(self, **kwargs):
+        self.l2.close(**kwargs)
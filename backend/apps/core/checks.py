@@ -0,0 +1,45 @@
+"""
+Проверки настроек (manage.py check)
+"""
+from django.conf import settings
+from django.core import checks
+
+_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def _backend(alias):
+    return settings.CACHES.get(alias, {}).get('BACKEND', '')
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """Версии данных (apps.core.cache) должны лежать в кэше, общем для всех воркеров"""
+    if settings.DEBUG:
+        return []
+    alias = 'default'
+    if _backend(alias) == 'apps.core.cache_backends.TwoTierCache':
+        alias = settings.CACHES[alias].get('OPTIONS', {}).get('L2', 'shared')
+    if _backend(alias) not in _LOCAL_BACKENDS:
+        return []
+    return [checks.Warning(
+        f'Кэш "{alias}" хранится в памяти процесса: версии справочников и ответа bootstrap '
+        'не видны другим воркерам, и они отдают устаревшие данные',
+        hint='Укажите CACHE_L2_BACKEND=database или другой общий кэш',
+        id='core.W001',
+    )]
+
+
+@checks.register(checks.Tags.security, deploy=True)
+def check_metrics_access(app_configs, **kwargs):
+    """/metrics без токена и списка адресов вне DEBUG не отдается"""
+    options = settings.METRICS
+    if not options['ENABLED'] or options.get('PUBLIC') or options.get('TOKEN') or options.get('ALLOWED_IPS'):
+        return []
+    return [checks.Warning(
+        'Для /metrics не заданы METRICS_TOKEN и METRICS_ALLOWED_IPS: метрики будут отвечать 403',
+        hint='Задайте METRICS_TOKEN или METRICS_ALLOWED_IPS (или METRICS_PUBLIC=True для открытого доступа)',
+        id='core.W002',
+    )]
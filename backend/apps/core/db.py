@@ -0,0 +1,47 @@
+"""
+Вспомогательные функции для работы с ORM
+"""
+from django.db import router, transaction
+from django.db.models.signals import m2m_changed
+
+
+def sync_many_to_many(instance, field_name, objects, created=False):
+    """Привести связь ManyToMany к набору objects одной вставкой и одним удалением
+
+    В отличие от RelatedManager.set(), который дважды читает текущие связи,
+    выполняется не более трех запросов: чтение текущих id (пропускается для только
+    что созданного объекта), DELETE удаленных и bulk INSERT добавленных связей.
+    Сигналы m2m_changed отправляются так же, как при add()/remove().
+    Как и в set(), удаление и вставка идут в одной транзакции, а связи, уже
+    добавленные параллельным запросом, пропускаются (ignore_conflicts).
+    """
+    field = instance._meta.get_field(field_name)
+    through = field.remote_field.through
+    source_attname = through._meta.get_field(field.m2m_field_name()).attname
+    target_attname = through._meta.get_field(field.m2m_reverse_field_name()).attname
+    related_model = field.related_model
+    db = router.db_for_write(through, instance=instance)
+    links = through._default_manager.using(db).filter(**{source_attname: instance.pk})
+    signal_kwargs = {'sender': through, 'instance': instance, 'reverse': False, 'model': related_model, 'using': db}
+
+    target_ids = {obj.pk for obj in objects}
+    with transaction.atomic(using=db, savepoint=False):
+        current_ids = set() if created else set(links.values_list(target_attname, flat=True))
+        removed = current_ids - target_ids
+        added = target_ids - current_ids
+        if removed:
+            m2m_changed.send(action='pre_remove', pk_set=removed, **signal_kwargs)
+            links.filter(**{f'{target_attname}__in': removed}).delete()
+            m2m_changed.send(action='post_remove', pk_set=removed, **signal_kwargs)
+        if added:
+            m2m_changed.send(action='pre_add', pk_set=added, **signal_kwargs)
+            through._default_manager.using(db).bulk_create([
+                through(**{source_attname: instance.pk, target_attname: pk})
+                for pk in added
+            ], ignore_conflicts=True)
+            m2m_changed.send(action='post_add', pk_set=added, **signal_kwargs)
+
+    # Как и set(), сбрасываем ранее предзагруженные связанные объекты
+    prefetched = getattr(instance, '_prefetched_objects_cache', None)
+    if prefetched:
+        prefetched.pop(field_name, None)
@@ -0,0 +1,254 @@
+"""
+Отдача файлов моделей (FileField) клиенту
+
+serve() отдает файл с поддержкой:
+- Range (один диапазон байтов) — ответ 206 с Content-Range, 416 для
+  недопустимого диапазона; If-Range с ETag или датой изменения;
+- ETag и Last-Modified по размеру и времени изменения файла — 304 на
+  If-None-Match / If-Modified-Since, 412 на If-Match / If-Unmodified-Since;
+- Content-Type по расширению файла и Content-Disposition с именем в UTF-8.
+
+При FILE_DOWNLOADS['OFFLOAD'] передача после проверки прав и условных
+заголовков отдается фронт-прокси: 'accel' — заголовок X-Accel-Redirect
+(nginx, internal location с префиксом ACCEL_PREFIX, смотрящий на MEDIA_ROOT),
+'sendfile' — X-Sendfile с абсолютным путем (Apache mod_xsendfile, lighttpd).
+Range и повторную проверку условий прокси выполняет сам.
+
+Для файлов ContentAddressedStorage (apps.core.storage) ETag — дайджест
+содержимого, а по неизменяемому URL блоба (immutable=True) ответ кэшируется
+клиентом на год без перепроверки.
+
+Для хранилища с подписанными URL (S3ContentAddressedStorage, apps.core.s3)
+ответ — 302 на presigned URL объекта: права уже проверены, а Range, ETag и
+передачу выполняет само хранилище.
+"""
+import mimetypes
+import os
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe, quote_etag
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+# Типы, которых нет в таблице mimetypes по умолчанию
+EXTRA_CONTENT_TYPES = {
+    '.dwg': 'image/vnd.dwg',
+    '.dxf': 'image/vnd.dxf',
+    '.dwf': 'model/vnd.dwf',
+    '.ifc': 'application/x-step',
+}
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def content_type(name):
+    """MIME-тип по расширению имени файла"""
+    extension = os.path.splitext(name)[1].lower()
+    if extension in EXTRA_CONTENT_TYPES:
+        return EXTRA_CONTENT_TYPES[extension]
+    guessed, encoding = mimetypes.guess_type(name)
+    if encoding:
+        # Сжатый файл отдается как есть, без Content-Encoding
+        return {'gzip': 'application/gzip', 'bzip2': 'application/x-bzip2', 'xz': 'application/x-xz'}.get(
+            encoding, 'application/octet-stream'
+        )
+    return guessed or 'application/octet-stream'
+
+
+# Срок кэширования неизменяемого содержимого
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def file_stat(storage, name):
+    """(размер, время изменения в секундах, путь или None) одним обращением к хранилищу
+
+    FileNotFoundError, если файла нет.
+    """
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        # Хранилище без локальных путей
+        if not storage.exists(name):
+            raise FileNotFoundError(name)
+        return storage.size(name), storage.get_modified_time(name).timestamp(), None
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime, path
+
+
+def make_etag(size, modified):
+    return f'{int(modified * 1000000):x}-{size:x}'
+
+
+def parse_range(header, size):
+    """Диапазон (первый, последний байт) из заголовка Range
+
+    None — заголовок отсутствует, некорректен или содержит несколько диапазонов
+    (отдается весь файл); RangeNotSatisfiable — диапазон вне файла.
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        return None
+    first, dash, last = (part.strip() for part in spec.partition('-'))
+    if not dash or not (first or last) or not all(part.isdigit() for part in (first, last) if part):
+        return None
+    if not first:
+        # bytes=-N: последние N байтов
+        length = int(last)
+        if length == 0 or size == 0:
+            raise RangeNotSatisfiable
+        return max(0, size - length), size - 1
+    start = int(first)
+    if start >= size:
+        raise RangeNotSatisfiable
+    end = int(last) if last else size - 1
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def _if_range_matches(request, etag, modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # Для Range допустимо только сильное сравнение ETag
+        return if_range == quote_etag(etag)
+    since = parse_http_date_safe(if_range)
+    return since is not None and int(modified) == since
+
+
+def _read_range(file, start, length, chunk_size):
+    try:
+        file.seek(start)
+        while length > 0:
+            data = file.read(min(chunk_size, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        file.close()
+
+
+def serve(request, field_file, filename=None, as_attachment=True):
+    """Ответ с файлом FieldFile; FileNotFoundError, если файла нет в хранилище"""
+    return serve_stored(request, field_file.storage, field_file.name, filename, as_attachment)
+
+
+def serve_stored(request, storage, name, filename=None, as_attachment=True, immutable=False):
+    """Ответ с файлом name хранилища storage
+
+    immutable — содержимое по этому URL никогда не меняется (URL блоба с дайджестом).
+    """
+    if hasattr(storage, 'presigned_url'):
+        return _redirect(storage, name, filename, as_attachment, immutable)
+    options = settings.FILE_DOWNLOADS
+    size, modified, path = file_stat(storage, name)
+    digest = storage.digest(name) if hasattr(storage, 'digest') else None
+    etag = digest or make_etag(size, modified)
+    filename = filename or os.path.basename(name)
+
+    def prepare(response):
+        response['Content-Type'] = content_type(filename)
+        response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+        response['ETag'] = quote_etag(etag)
+        response['Last-Modified'] = http_date(modified)
+        response['Accept-Ranges'] = 'bytes'
+        # Файлы доступны только после авторизации: кэш только у клиента. Изменяемый
+        # файл клиент перепроверяет по ETag, неизменяемый хранит без перепроверки
+        if immutable:
+            patch_cache_control(response, private=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+        else:
+            patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+    headers = prepare(HttpResponse())
+    conditional = get_conditional_response(request, etag=quote_etag(etag), last_modified=int(modified),
+                                           response=headers)
+    if conditional is not headers:
+        return conditional
+
+    offload = options['OFFLOAD']
+    if offload == 'accel':
+        stored_name = storage.stored_name(name) if hasattr(storage, 'stored_name') else name
+        headers['X-Accel-Redirect'] = options['ACCEL_PREFIX'].rstrip('/') + '/' + quote(stored_name)
+        return headers
+    if offload == 'sendfile' and path is not None:
+        # Путь в заголовке — только ASCII; mod_xsendfile декодирует %-последовательности
+        headers['X-Sendfile'] = quote(path)
+        return headers
+
+    try:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size) \
+            if _if_range_matches(request, etag, modified) else None
+    except RangeNotSatisfiable:
+        response = prepare(HttpResponse(status=status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE))
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if request.method == 'HEAD':
+        headers['Content-Length'] = size
+        return headers
+
+    file = open(path, 'rb') if path is not None else storage.open(name, 'rb')
+    if byte_range is None or byte_range == (0, size - 1):
+        return prepare(FileResponse(file))
+    start, end = byte_range
+    response = prepare(StreamingHttpResponse(
+        _read_range(file, start, end - start + 1, options['CHUNK_SIZE']),
+        status=status.HTTP_206_PARTIAL_CONTENT,
+    ))
+    response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = end - start + 1
+    return response
+
+
+def _redirect(storage, name, filename, as_attachment, immutable):
+    """Перенаправление на подписанный URL объекта; FileNotFoundError, если объекта нет"""
+    if not storage.exists(name):
+        raise FileNotFoundError(name)
+    expires = settings.S3['URL_EXPIRES']
+    response = HttpResponseRedirect(storage.presigned_url(name, filename, as_attachment, expires))
+    # Перенаправление годно, пока действует подпись: кэшируется на половину ее срока
+    if immutable:
+        patch_cache_control(response, private=True, max_age=expires // 2)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+class FileDownloadMixin:
+    """Действие download_file для ViewSet модели с файлом в поле download_file_field"""
+
+    download_file_field = 'file'
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'download_file':
+            # Для файла не нужны связанные объекты сериализатора
+            queryset = queryset.select_related(None).prefetch_related(None)
+        return queryset
+
+    @action(detail=True, methods=['get'])
+    def download_file(self, request, pk=None):
+        """Скачивание файла с поддержкой Range, ETag и Last-Modified"""
+        field_file = getattr(self.get_object(), self.download_file_field)
+        if not field_file:
+            return Response({'error': 'Файл не прикреплен'}, status=status.HTTP_404_NOT_FOUND)
+        try:
+            return serve(request, field_file)
+        except FileNotFoundError:
+            return Response({'error': 'Файл не найден на сервере'}, status=status.HTTP_404_NOT_FOUND)
+        except OSError as e:
+            return Response(
+                {'error': f'Ошибка при скачивании файла: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
@@ -0,0 +1,336 @@
+"""
+Сборка файлов хранилища, на которые не осталось ссылок
+
+Очередь — таблица PendingFileDeletion. Запись в нее добавляет apps.core.blobs
+в той же транзакции, что снимает последнюю ссылку (замена файла, удаление листа,
+этапа или заметки, в том числе каскадное вместе с проектом; сохранение записи
+атомарно, только если идет в транзакции — см. apps.core.blobs), поэтому откат
+транзакции отменяет и удаление файла. Файл удаляется не раньше чем через
+FILE_GC['DELAY'] секунд: за это время ссылку могут вернуть (восстановление
+записи, повторная загрузка того же содержимого).
+
+collect() разбирает созревшие записи пачками FILE_GC['BATCH_SIZE']. Перед
+удалением ссылки перепроверяются: блоб удаляется, только если его Blob.ref_count
+равен нулю (строка блокируется до конца транзакции, и параллельная загрузка
+того же содержимого ждет ее и затем записывает файл заново), файл с обычным именем — если на него не ссылается
+ни одна запись. Записи разбирает фоновый поток процесса (FILE_GC['AUTO']):
+его будит фиксация транзакции с новыми записями, а созревшие позже он находит
+сам раз в FILE_GC['INTERVAL'] секунд. На PostgreSQL процессы берут разные
+записи (SKIP LOCKED).
+
+reconcile() сверяет хранилище с БД: пересчитывает расходящиеся ref_count,
+ставит в очередь блобы и старые файлы без ссылок, удаляет превью без блобов и
+брошенные временные файлы. Каталог блобов обходится в порядке дайджестов и
+сливается с отсортированными по имени ссылками из БД и строками Blob, которые
+читаются итераторами, поэтому память не зависит от числа файлов. Файлы
+перечисляются и удаляются методами хранилища (scan, delete, delete_blob), так
+что сборка одинакова для диска и S3 (apps.core.s3).
+"""
+import heapq
+import logging
+import os
+import posixpath
+import re
+import threading
+from collections import Counter
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection, connections, transaction
+from django.db.models import F
+from django.db.models.functions import Collate
+from django.utils import timezone
+
+from . import blobs, previews
+from .models import Blob, PendingFileDeletion
+from .storage import BLOBS_DIR, PREFIX, is_digest
+
+logger = logging.getLogger(__name__)
+
+_BLOB_DIR_RE = re.compile(rf'^{BLOBS_DIR}/[0-9a-f]{{2}}/[0-9a-f]{{2}}$')
+_CHUNK_SIZE = 2000
+
+_worker = {'pid': None, 'event': None}
+_worker_lock = threading.Lock()
+
+
+def enqueue(names, delay=None):
+    """Поставить файлы (имена на диске относительно MEDIA_ROOT) в очередь на удаление
+
+    Вызывается в транзакции, снявшей ссылки; после ее фиксации будится фоновый сборщик.
+    """
+    _insert(names, settings.FILE_GC['DELAY'] if delay is None else delay)
+    transaction.on_commit(wake)
+
+
+def _insert(names, delay):
+    not_before = timezone.now() + timedelta(seconds=delay)
+    PendingFileDeletion.objects.bulk_create(
+        [PendingFileDeletion(name=name, not_before=not_before) for name in names], ignore_conflicts=True,
+    )
+
+
+def wake():
+    """Разбудить фоновый сборщик процесса, запустив его при первом вызове"""
+    if not settings.FILE_GC['AUTO']:
+        return
+    pid = os.getpid()
+    if _worker['pid'] != pid:
+        with _worker_lock:
+            if _worker['pid'] != pid:
+                # После fork поток родителя не работает: запускается свой
+                event = threading.Event()
+                threading.Thread(target=_loop, args=(event,), name='filegc', daemon=True).start()
+                _worker.update(pid=pid, event=event)
+    _worker['event'].set()
+
+
+def _loop(event):
+    while True:
+        event.wait(settings.FILE_GC['INTERVAL'])
+        event.clear()
+        try:
+            collect()
+        except Exception:
+            logger.exception('Ошибка сборки файлов без ссылок')
+        finally:
+            connections.close_all()
+
+
+def collect(batch_size=None):
+    """Удалить файлы созревших записей очереди; вернуть число удаленных файлов"""
+    batch_size = batch_size or settings.FILE_GC['BATCH_SIZE']
+    deleted = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                PendingFileDeletion.objects.filter(not_before__lte=timezone.now())
+                .select_for_update(skip_locked=True).order_by('not_before', 'id')[:batch_size]
+            )
+            if not batch:
+                return deleted
+            deleted += _collect_batch([item.name for item in batch])
+            PendingFileDeletion.objects.filter(pk__in=[item.pk for item in batch]).delete()
+
+
+def _collect_batch(names):
+    storage = default_storage
+    digests = [digest for digest in map(storage.blob_digest, names) if digest]
+    plain = [name for name in names if not storage.blob_digest(name)]
+
+    # Блокировка строк: параллельное сохранение того же содержимого (_claim хранилища)
+    # ждет фиксации, не находит строку и записывает файл заново, а acquire() затем
+    # создает строку
+    unreferenced = list(
+        Blob.objects.select_for_update().filter(digest__in=digests, ref_count=0).values_list('digest', flat=True)
+    )
+    Blob.objects.filter(digest__in=unreferenced, ref_count=0).delete()
+
+    referenced = set()
+    if plain:
+        for model, field in blobs.tracked():
+            referenced.update(
+                model._base_manager.filter(**{f'{field.attname}__in': plain}).values_list(field.attname, flat=True)
+            )
+
+    # Файлы удаляются до фиксации: при ошибке фиксации остается лишь строка
+    # Blob без файла, которую уберет reconcile(), а не ссылка на удаленный файл
+    deleted = 0
+    for digest in unreferenced:
+        deleted += _remove(storage.delete_blob, digest)
+        _remove(storage.delete, previews.preview_name(digest))
+    for name in plain:
+        if name not in referenced:
+            deleted += _remove(storage.delete, name)
+    return deleted
+
+
+def _remove(delete, name):
+    """Удалить файл методом хранилища; 1 — удален, 0 — ошибка"""
+    try:
+        delete(name)
+    except Exception:
+        # Запись из очереди все равно снимается: файл найдет reconcile()
+        logger.exception('Не удалось удалить %s', name)
+        return 0
+    return 1
+
+
+def _binary(column):
+    # Слияние требует одного порядка в БД и в sorted(): на PostgreSQL
+    # сравнение по байтам задает COLLATE "C", в SQLite оно по умолчанию
+    if connection.vendor == 'postgresql':
+        return Collate(column, 'C')
+    return F(column)
+
+
+def _stored_blobs(storage, cutoff, stats, dry_run):
+    """(дайджест, вид, (имя, время изменения)) файлов блобов и превью по возрастанию дайджеста
+
+    Остальные файлы каталогов блобов — временные файлы превью; старше cutoff удаляются.
+    """
+    for name, modified in storage.scan(BLOBS_DIR, ordered=True):
+        directory, basename = posixpath.split(name)
+        if not _BLOB_DIR_RE.match(directory):
+            # blobs/tmp и blobs/uploads
+            continue
+        if is_digest(basename):
+            yield basename, 'blob', (name, modified)
+        elif basename.endswith(previews.SUFFIX) and is_digest(basename[:-len(previews.SUFFIX)]):
+            yield basename[:-len(previews.SUFFIX)], 'preview', (name, modified)
+        elif modified < cutoff:
+            stats['temp_files'] += 1
+            if not dry_run:
+                _remove(storage.delete, name)
+
+
+def _referenced_blobs(model, field):
+    names = model._base_manager.filter(**{f'{field.attname}__startswith': f'{PREFIX}/'}).order_by(
+        _binary(field.attname)
+    ).values_list(field.attname, flat=True)
+    for name in names.iterator(chunk_size=_CHUNK_SIZE):
+        digest = field.storage.digest(name)
+        if digest:
+            yield digest, 'ref', None
+
+
+def _blob_rows():
+    rows = Blob.objects.order_by(_binary('digest')).values_list('digest', 'ref_count')
+    for digest, ref_count in rows.iterator(chunk_size=_CHUNK_SIZE):
+        yield digest, 'row', ref_count
+
+
+def _merge(*streams):
+    """Сгруппировать по ключу отсортированные по нему потоки (ключ, вид, значение)"""
+    merged = heapq.merge(*streams, key=itemgetter(0))
+    for key, items in groupby(merged, key=itemgetter(0)):
+        yield key, list(items)
+
+
+def _recount(storage, digest):
+    """Пересчитать ссылки на блоб под блокировкой его строки; вернуть число ссылок"""
+    with transaction.atomic():
+        row = Blob.objects.select_for_update().filter(digest=digest).first()
+        refs = sum(
+            model._base_manager.filter(**{f'{field.attname}__startswith': f'{PREFIX}/{digest}/'}).count()
+            for model, field in blobs.tracked()
+        )
+        if row is not None:
+            Blob.objects.filter(digest=digest).update(ref_count=refs)
+        elif storage.exists(storage.blob_name(digest)):
+            Blob.objects.create(digest=digest, size=storage.size(storage.blob_name(digest)), ref_count=refs)
+    return refs
+
+
+def _reconcile_blobs(storage, cutoff, stats, dry_run):
+    references = [_referenced_blobs(model, field) for model, field in blobs.tracked()]
+    orphans = []
+    for digest, items in _merge(_stored_blobs(storage, cutoff, stats, dry_run), _blob_rows(), *references):
+        kinds = Counter(kind for _, kind, _ in items)
+        found = {kind: value for _, kind, value in items if kind != 'ref'}
+        blob, preview, ref_count = found.get('blob'), found.get('preview'), found.get('row')
+        refs = kinds['ref']
+        if blob is not None:
+            stats['blobs'] += 1
+
+        if refs and blob is None:
+            stats['missing'] += 1
+            logger.warning('Блоб %s отсутствует на диске, ссылок: %s', digest, refs)
+        if ref_count != refs and (ref_count is not None or blob is not None):
+            stats['recounted'] += 1
+            if not dry_run:
+                # Ссылки могли измениться после чтения: точный пересчет под блокировкой
+                refs = _recount(storage, digest)
+        if refs:
+            continue
+
+        if blob is not None:
+            # Свежий блоб может принадлежать незафиксированной загрузке
+            if blob[1] < cutoff:
+                orphans.append(storage.blob_name(digest))
+        elif ref_count is not None:
+            stats['stale_rows'] += 1
+            if not dry_run:
+                Blob.objects.filter(digest=digest, ref_count=0).delete()
+        if blob is None and preview is not None:
+            stats['stale_previews'] += 1
+            if not dry_run:
+                _remove(storage.delete, preview[0])
+
+        if len(orphans) >= _CHUNK_SIZE:
+            _queue_orphans(orphans, stats, 'orphaned_blobs', dry_run)
+    _queue_orphans(orphans, stats, 'orphaned_blobs', dry_run)
+
+
+def _queue_orphans(names, stats, key, dry_run):
+    stats[key] += len(names)
+    if names and not dry_run:
+        # Без задержки: файл и так не менялся дольше FILE_GC['DELAY']
+        _insert(names, 0)
+    names.clear()
+
+
+def _upload_dirs():
+    directories = set()
+    for _, field in blobs.tracked():
+        if isinstance(field.upload_to, str) and field.upload_to.strip('/'):
+            directories.add(field.upload_to.strip('/'))
+    return sorted(directories)
+
+
+def _reconcile_plain(storage, cutoff, stats, dry_run):
+    """Файлы в каталогах upload_to (загруженные до ContentAddressedStorage) без ссылок"""
+    tracked = blobs.tracked()
+    batch = []
+    for directory in _upload_dirs():
+        # Список каталога в память не читается
+        for item in storage.scan(directory):
+            batch.append(item)
+            if len(batch) >= _CHUNK_SIZE:
+                _check_plain(tracked, batch, cutoff, stats, dry_run)
+    _check_plain(tracked, batch, cutoff, stats, dry_run)
+
+
+def _check_plain(tracked, batch, cutoff, stats, dry_run):
+    if not batch:
+        return
+    names = [name for name, _ in batch]
+    referenced = set()
+    for model, field in tracked:
+        referenced.update(
+            model._base_manager.filter(**{f'{field.attname}__in': names}).values_list(field.attname, flat=True)
+        )
+    orphans = []
+    for name, modified in batch:
+        stats['plain_files'] += 1
+        if name not in referenced and modified < cutoff:
+            orphans.append(name)
+    _queue_orphans(orphans, stats, 'orphaned_plain', dry_run)
+    batch.clear()
+
+
+def _reconcile_temp(storage, cutoff, stats, dry_run):
+    """Брошенные временные файлы записи блобов (blobs/tmp)"""
+    for name, modified in storage.scan(f'{BLOBS_DIR}/tmp'):
+        if modified < cutoff:
+            stats['temp_files'] += 1
+            if not dry_run:
+                _remove(storage.delete, name)
+
+
+def reconcile(dry_run=False):
+    """Сверить хранилище с БД; вернуть Counter найденного
+
+    Файлы без ссылок, не менявшиеся дольше FILE_GC['DELAY'], ставятся в очередь
+    с нулевой задержкой и удаляются следующим collect(). dry_run — только подсчет.
+    """
+    storage = default_storage
+    cutoff = (timezone.now() - timedelta(seconds=settings.FILE_GC['DELAY'])).timestamp()
+    stats = Counter()
+    _reconcile_blobs(storage, cutoff, stats, dry_run)
+    _reconcile_plain(storage, cutoff, stats, dry_run)
+    _reconcile_temp(storage, cutoff, stats, dry_run)
+    return stats
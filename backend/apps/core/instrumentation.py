@@ -0,0 +1,182 @@
+"""
+Структурированное диагностическое логирование
+
+Заменяет синхронную запись отладочных JSON-строк в файл. Вызов event() только
+кладет запись в ограниченную очередь, а в файл (или stderr) ее пишет фоновый
+поток QueueListener, поэтому запрос не ждет файловых операций. При переполнении
+очереди записи отбрасываются и учитываются в счетчике dropped.
+
+Настройки INSTRUMENTATION:
+    ENABLED — включить логирование (по умолчанию выключено);
+    LEVEL — минимальный уровень записей ('DEBUG', 'INFO', ...; по умолчанию
+            'DEBUG': event() по умолчанию пишет отладочные события);
+    SAMPLE_RATE — доля записей ниже WARNING, попадающих в лог (0..1);
+    PATH — файл для записей, пустая строка — stderr;
+    QUEUE_SIZE — размер очереди записей.
+
+В выключенном режиме event() возвращается сразу после проверки флага, а
+отложенные данные (data, переданные функцией) не вычисляются. Дорогие проверки
+(лишние запросы к БД) нужно выполнять только под is_enabled().
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+logger = logging.getLogger('mytracker.instrumentation')
+logger.propagate = False
+
+_state = {'enabled': False, 'level': logging.DEBUG, 'sample_rate': 1.0, 'pid': None}
+_lock = threading.Lock()
+_pipeline = {'handler': None, 'listener': None}
+
+
+class JSONFormatter(logging.Formatter):
+    """Одна запись — одна строка JSON"""
+
+    def format(self, record):
+        entry = {
+            'timestamp': int(record.created * 1000),
+            'level': record.levelname,
+            'location': getattr(record, 'location', record.funcName),
+            'message': record.getMessage(),
+            'data': getattr(record, 'data', {}),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        hypothesis = getattr(record, 'hypothesis', None)
+        if hypothesis:
+            entry['hypothesisId'] = hypothesis
+        if record.exc_info:
+            entry['traceback'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['traceback'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при переполнении очереди отбрасывает запись"""
+
+    def __init__(self, queue_):
+        super().__init__(queue_)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Трассировку форматируем в потоке вызова: exc_info не переживает очередь
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def _target_handler(path):
+    if not path:
+        handler = logging.StreamHandler(sys.stderr)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        handler = logging.FileHandler(path, encoding='utf-8')
+    handler.setFormatter(JSONFormatter())
+    return handler
+
+
+def _stop():
+    listener = _pipeline['listener']
+    if listener is not None:
+        listener.stop()
+        listener.handlers[0].close()
+    if _pipeline['handler'] is not None:
+        logger.removeHandler(_pipeline['handler'])
+    _pipeline.update(handler=None, listener=None)
+
+
+def configure():
+    """Применить настройки INSTRUMENTATION и запустить фоновую запись"""
+    options = settings.INSTRUMENTATION
+    with _lock:
+        _stop()
+        _state['enabled'] = False
+        if not options.get('ENABLED'):
+            return
+        level = logging.getLevelName(str(options.get('LEVEL', 'DEBUG')).upper())
+        if not isinstance(level, int):
+            level = logging.DEBUG
+        handler = DroppingQueueHandler(queue.Queue(options.get('QUEUE_SIZE', 10000)))
+        listener = logging.handlers.QueueListener(handler.queue, _target_handler(options.get('PATH')))
+        listener.start()
+        logger.setLevel(level)
+        logger.addHandler(handler)
+        _pipeline.update(handler=handler, listener=listener)
+        _state.update(
+            enabled=True,
+            level=level,
+            sample_rate=float(options.get('SAMPLE_RATE', 1.0)),
+            pid=os.getpid(),
+        )
+
+
+def _restart_after_fork():
+    # Поток записи не переживает fork: в дочернем процессе запускаем свой
+    if _state['enabled']:
+        configure()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+atexit.register(_stop)
+
+
+@receiver(setting_changed)
+def _on_setting_changed(setting, **kwargs):
+    if setting == 'INSTRUMENTATION':
+        configure()
+
+
+def is_enabled(level=logging.DEBUG):
+    """Будет ли записано событие уровня level (без учета выборки)"""
+    return _state['enabled'] and level >= _state['level']
+
+
+def dropped():
+    """Число записей, отброшенных из-за переполнения очереди"""
+    handler = _pipeline['handler']
+    return handler.dropped if handler is not None else 0
+
+
+def event(location, message, data=None, level=logging.DEBUG, hypothesis=None, exc_info=False):
+    """Записать диагностическое событие
+
+    data — словарь или функция без аргументов, возвращающая словарь; функция
+    вызывается только если событие действительно будет записано.
+    """
+    if not _state['enabled'] or level < _state['level']:
+        return
+    if level < logging.WARNING and _state['sample_rate'] < 1.0 and random.random() >= _state['sample_rate']:
+        return
+    if callable(data):
+        data = data()
+    logger.log(
+        level, message, exc_info=exc_info,
+        extra={'location': location, 'data': data or {}, 'hypothesis': hypothesis},
+    )
+
+
+def flush():
+    """Дождаться записи всех событий из очереди (для тестов и команд)"""
+    handler = _pipeline['handler']
+    if handler is not None:
+        handler.queue.join()
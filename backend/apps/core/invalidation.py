@@ -0,0 +1,198 @@
+"""
+Шина инвалидации кэшей между процессами через PostgreSQL LISTEN/NOTIFY
+
+Событие — словарь одного из видов:
+    {'keys': [...]}     — ключи L1-кэша, измененные в другом процессе;
+    {'models': [...]}   — метки моделей (app_label.Model), данные которых изменились;
+    {'clear': True}     — сбросить все локальные копии (например, после переподключения).
+
+publish() сразу доставляет событие подписчикам своего процесса и отправляет его
+через pg_notify. Внутри транзакции PostgreSQL доставит уведомление только после
+коммита, при откате оно не уйдет вовсе. Фоновый поток каждого процесса слушает
+канал и передает чужие события своим подписчикам. Для других СУБД (SQLite в
+разработке) шина работает только в пределах процесса.
+"""
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+
+logger = logging.getLogger(__name__)
+
+# Ограничение PostgreSQL на размер payload — 8000 байт
+MAX_PAYLOAD_BYTES = 7900
+
+_subscribers = []
+_process = {'pid': None, 'id': None}
+_listener_lock = threading.Lock()
+_listener = {'pid': None, 'thread': None}
+_pending = threading.local()
+
+
+def process_id():
+    """Идентификатор текущего процесса (меняется после fork)"""
+    pid = os.getpid()
+    if _process['pid'] != pid:
+        _process['pid'] = pid
+        _process['id'] = uuid.uuid4().hex
+    return _process['id']
+
+
+def subscribe(callback):
+    """Подписать callback(event) на события инвалидации"""
+    if callback not in _subscribers:
+        _subscribers.append(callback)
+
+
+def _dispatch(event):
+    for callback in list(_subscribers):
+        try:
+            callback(event)
+        except Exception:
+            logger.exception('Ошибка обработчика события инвалидации %r', event)
+
+
+def _notify(event, using):
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+    payload = json.dumps({'sender': process_id(), **event})
+    if len(payload.encode()) > MAX_PAYLOAD_BYTES:
+        payload = json.dumps({'sender': process_id(), 'clear': True})
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [settings.CACHE_INVALIDATION['CHANNEL'], payload])
+    except DatabaseError:
+        # Остальные процессы получат изменения по истечении L1_TIMEOUT
+        logger.warning('Не удалось отправить событие инвалидации', exc_info=True)
+
+
+def publish(event, using=DEFAULT_DB_ALIAS):
+    """Доставить событие подписчикам этого процесса и разослать остальным"""
+    _dispatch(event)
+    _notify(event, using)
+
+
+def _handle_notification(payload):
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        logger.warning('Некорректное событие инвалидации: %r', payload)
+        return
+    if event.pop('sender', None) == process_id():
+        return
+    _dispatch(event)
+
+
+class _Listener(threading.Thread):
+    """Фоновый поток LISTEN на отдельном соединении с БД"""
+
+    def __init__(self, using):
+        super().__init__(name='cache-invalidation-listener', daemon=True)
+        self.using = using
+
+    def run(self):
+        delay = 1
+        while True:
+            try:
+                self._listen()
+            except Exception:
+                logger.warning('Соединение LISTEN потеряно, переподключение через %s с', delay, exc_info=True)
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+            else:
+                delay = 1
+
+    def _listen(self):
+        wrapper = connections[self.using]
+        connection = wrapper.Database.connect(**wrapper.get_connection_params())
+        try:
+            connection.autocommit = True
+            with connection.cursor() as cursor:
+                cursor.execute('LISTEN {}'.format(wrapper.ops.quote_name(settings.CACHE_INVALIDATION['CHANNEL'])))
+            # Пока соединения не было, события могли быть пропущены
+            _dispatch({'clear': True})
+            while True:
+                readable, _, _ = select.select([connection], [], [], settings.CACHE_INVALIDATION['KEEPALIVE'])
+                if not readable:
+                    with connection.cursor() as cursor:
+                        cursor.execute('SELECT 1')
+                    continue
+                connection.poll()
+                while connection.notifies:
+                    _handle_notification(connection.notifies.pop(0).payload)
+        finally:
+            connection.close()
+
+
+def start_listener(using=DEFAULT_DB_ALIAS):
+    """Запустить поток LISTEN в текущем процессе (однократно, повторно после fork)"""
+    if not settings.CACHE_INVALIDATION['LISTEN'] or connections[using].vendor != 'postgresql':
+        return
+    pid = os.getpid()
+    with _listener_lock:
+        if _listener['pid'] == pid:
+            return
+        thread = _Listener(using)
+        thread.start()
+        _listener.update(pid=pid, thread=thread)
+
+
+def _flush_pending():
+    events = getattr(_pending, 'events', None)
+    _pending.events = None
+    for kind, values in sorted((events or {}).items()):
+        publish({kind: sorted(values)})
+
+
+def _registered(connection):
+    # После отката транзакции Django отбрасывает callback: тогда регистрируем заново
+    registered = any(func is _flush_pending for _sids, func, _robust in connection.run_on_commit)
+    return registered and getattr(_pending, 'events', None) is not None
+
+
+def publish_on_commit(kind, values):
+    """Разослать {kind: [...]} после коммита текущей транзакции, одним событием на транзакцию
+
+    Вне транзакции событие рассылается сразу.
+    """
+    connection = transaction.get_connection()
+    if not connection.in_atomic_block:
+        publish({kind: list(values)})
+        return
+    if not _registered(connection):
+        _pending.events = {}
+        transaction.on_commit(_flush_pending)
+    _pending.events.setdefault(kind, set()).update(values)
+
+
+def pending(kind):
+    """Значения вида kind, накопленные текущей транзакцией и еще не разосланные"""
+    if not _registered(transaction.get_connection()):
+        return frozenset()
+    return _pending.events.get(kind, frozenset())
+
+
+def _on_model_change(sender, **kwargs):
+    """Накопить метку измененной модели и разослать событие один раз на транзакцию"""
+    if sender._meta.app_label not in settings.CACHE_INVALIDATION['APPS']:
+        return
+    publish_on_commit('models', [sender._meta.label])
+
+
+def connect_model_signals():
+    """Рассылать события об изменении моделей из CACHE_INVALIDATION['APPS']"""
+    for model in apps.get_models():
+        if model._meta.app_label not in settings.CACHE_INVALIDATION['APPS']:
+            continue
+        post_save.connect(_on_model_change, sender=model, dispatch_uid=f'invalidation:save:{model._meta.label}')
+        post_delete.connect(_on_model_change, sender=model, dispatch_uid=f'invalidation:delete:{model._meta.label}')
+    m2m_changed.connect(_on_model_change, dispatch_uid='invalidation:m2m')
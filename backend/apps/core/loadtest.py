@@ -0,0 +1,374 @@
+"""
+Нагрузочное тестирование запущенного backend сценариями экранов Flutter-клиента
+
+Сценарий (flow) повторяет последовательность вызовов экрана из
+frontend/lib/services/api_service.dart: вход, загрузка экрана задач, карточки
+проекта, проектов участка, дашборда, скачивание файлов. Списки проектов и
+листов клиент загружает целиком, проходя страницы по ссылке next (на большинстве
+эндпоинтов по 5 строк), — так же делает и сценарий. При ответе 401 токен
+обновляется через /auth/refresh/ и запрос повторяется, как в клиенте.
+
+Пользователя, права на страницы, статусы и отделы клиент берет из одного ответа
+/auth/bootstrap/, запрошенного после входа и запомненного на сеанс; ETag и тело
+ответа он хранит между входами и перепроверяет их заголовком If-None-Match.
+
+Каждый виртуальный пользователь — отдельный поток со своей сессией: входит,
+затем до окончания теста выбирает сценарии по весам с паузой между ними.
+Используется только стандартная библиотека, запуск — команда load_test.
+"""
+import json
+import math
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+
+
+def percentile(values, fraction):
+    """Перцентиль по методу ближайшего ранга"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[max(1, math.ceil(fraction * len(ordered))) - 1]
+
+
+class Stats:
+    """Потокобезопасный сбор результатов по сценариям"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = defaultdict(list)   # сценарий -> длительности запросов
+        self.errors = defaultdict(int)      # сценарий -> число ошибочных запросов
+        self.runs = defaultdict(list)       # сценарий -> длительности прохождения
+        self.failed_runs = defaultdict(int)
+        self.error_samples = defaultdict(list)
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def add_request(self, flow, duration, error=None):
+        with self._lock:
+            self.requests[flow].append(duration)
+            if error:
+                self.errors[flow] += 1
+                if len(self.error_samples[flow]) < 5:
+                    self.error_samples[flow].append(error)
+
+    def add_run(self, flow, duration, failed):
+        with self._lock:
+            self.runs[flow].append(duration)
+            if failed:
+                self.failed_runs[flow] += 1
+
+    def report(self):
+        """Сводка: сценарий -> показатели"""
+        elapsed = (self.finished or time.perf_counter()) - self.started
+        result = {}
+        for flow in sorted(set(self.requests) | set(self.runs)):
+            durations = self.requests[flow]
+            runs = self.runs[flow]
+            result[flow] = {
+                'runs': len(runs),
+                'failed_runs': self.failed_runs[flow],
+                'requests': len(durations),
+                'rps': round(len(durations) / elapsed, 2) if elapsed else 0.0,
+                'error_rate': round(self.errors[flow] / len(durations), 4) if durations else 0.0,
+                'p50_ms': round(percentile(durations, 0.5) * 1000, 1),
+                'p95_ms': round(percentile(durations, 0.95) * 1000, 1),
+                'p99_ms': round(percentile(durations, 0.99) * 1000, 1),
+                'flow_p50_ms': round(percentile(runs, 0.5) * 1000, 1),
+                'flow_p95_ms': round(percentile(runs, 0.95) * 1000, 1),
+                'errors': list(self.error_samples[flow]),
+            }
+        return result
+
+
+class RequestError(Exception):
+    """Ответ с кодом ошибки или сбой соединения"""
+
+
+class Session:
+    """Сессия виртуального пользователя: JWT, повтор запроса после обновления токена"""
+
+    def __init__(self, base_url, username, password, stats, timeout=30):
+        self.base_url = base_url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.stats = stats
+        self.timeout = timeout
+        self.access = None
+        self.refresh = None
+        self.flow = 'login'
+        self.cache = {}
+        # Стартовые данные сеанса и сохраненный между входами ответ (SharedPreferences клиента)
+        self.bootstrap_data = None
+        self.bootstrap_etag = None
+        self.bootstrap_body = None
+
+    def _url(self, path, params=None):
+        url = path if path.startswith('http') else f'{self.base_url}{path}'
+        if params:
+            url += ('&' if '?' in url else '?') + urllib.parse.urlencode(params, doseq=True)
+        return url
+
+    def _send(self, method, url, body=None, auth=True, headers=None):
+        headers = {'Accept': 'application/json', **(headers or {})}
+        data = None
+        if body is not None:
+            data = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        if auth and self.access:
+            headers['Authorization'] = f'Bearer {self.access}'
+        request = urllib.request.Request(url, data=data, headers=headers, method=method)
+        start = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                content = response.read()
+                status = response.status
+                response_headers = response.headers
+        except urllib.error.HTTPError as exc:
+            content = exc.read()
+            status = exc.code
+            response_headers = exc.headers
+        except (urllib.error.URLError, OSError) as exc:
+            self.stats.add_request(self.flow, time.perf_counter() - start, f'{method} {url}: {exc}')
+            raise RequestError(str(exc))
+        duration = time.perf_counter() - start
+        # 401 с токеном ошибкой не считается: клиент обновляет токен и повторяет запрос
+        failed = status >= 400 and not (status == 401 and auth)
+        error = f'{method} {url}: {status}' if failed else None
+        self.stats.add_request(self.flow, duration, error)
+        return status, content, response_headers
+
+    def _request(self, method, path, params=None, body=None, headers=None):
+        """Запрос с повтором после обновления токена; (код, тело, заголовки ответа)"""
+        url = self._url(path, params)
+        status, content, response_headers = self._send(method, url, body, headers=headers)
+        if status == 401 and self.refresh_token():
+            status, content, response_headers = self._send(method, url, body, headers=headers)
+        if status >= 400:
+            raise RequestError(f'{method} {url}: {status}')
+        return status, content, response_headers
+
+    def request(self, method, path, params=None, body=None, raw=False):
+        """Запрос с повтором после обновления токена; JSON ответа (или байты при raw)"""
+        _, content, _ = self._request(method, path, params, body)
+        if raw:
+            return content
+        return json.loads(content) if content else None
+
+    def get(self, path, params=None):
+        return self.request('GET', path, params)
+
+    def get_all(self, path, params=None):
+        """Все страницы списка по ссылке next, как getProjects и циклы экранов"""
+        results = []
+        data = self.get(path, params)
+        while True:
+            if isinstance(data, list):
+                return results + data
+            results.extend(data.get('results', []))
+            if not data.get('next'):
+                return results
+            data = self.get(data['next'])
+
+    def bootstrap(self):
+        """Стартовые данные сеанса, как _bootstrapData клиента: запрос один раз после входа"""
+        if self.bootstrap_data is None:
+            headers = {'If-None-Match': self.bootstrap_etag} if self.bootstrap_etag else None
+            status, content, response_headers = self._request('GET', '/auth/bootstrap/', headers=headers)
+            if status == 304:
+                content = self.bootstrap_body
+            elif response_headers.get('ETag'):
+                self.bootstrap_etag, self.bootstrap_body = response_headers['ETag'], content
+            self.bootstrap_data = json.loads(content)
+        return self.bootstrap_data
+
+    def login(self):
+        status, content, _ = self._send(
+            'POST', self._url('/auth/login/'),
+            {'username': self.username, 'password': self.password}, auth=False
+        )
+        if status != 200:
+            raise RequestError(f'Вход {self.username}: {status}')
+        data = json.loads(content)
+        self.access, self.refresh = data['access'], data['refresh']
+        self.cache['user'] = data.get('user') or {}
+        # saveToken клиента сбрасывает стартовые данные: после входа они перепроверяются по ETag
+        self.bootstrap_data = None
+
+    def refresh_token(self):
+        if not self.refresh:
+            return False
+        status, content, _ = self._send('POST', self._url('/auth/refresh/'), {'refresh': self.refresh}, auth=False)
+        if status != 200:
+            return False
+        data = json.loads(content)
+        self.access = data['access']
+        self.refresh = data.get('refresh', self.refresh)
+        return True
+
+
+# Сценарии экранов
+
+def flow_login(session, rng):
+    """Вход и главный экран (home_screen.dart): пользователь и страницы из /auth/bootstrap/"""
+    session.login()
+    session.bootstrap()
+
+
+def flow_token_refresh(session, rng):
+    """Истекший access-токен: первый запрос получает 401 и обновляет токен"""
+    session.access = 'expired'
+    session.get('/projects/construction-sites/')
+
+
+def flow_tasks(session, rng):
+    """Экран задач (tasks_screen.dart)"""
+    session.get('/projects/project-sheets/', {'page': 1, 'page_size': 20, 'filter_by_user_department': 'true'})
+    # getCreatedBySheetsCount: все страницы невыполненных листов пользователя
+    session.get_all('/projects/project-sheets/',
+                    {'filter_by_created_by': 'true', 'is_completed': 'false', 'page_size': 100})
+    session.get('/projects/project-stages/', {'page': 1, 'page_size': 20})
+    session.bootstrap()
+    session.cache['projects'] = session.get_all('/projects/projects/')
+
+
+def _pick_project(session, rng):
+    projects = session.cache.get('projects')
+    if projects is None:
+        projects = session.cache['projects'] = session.get_all('/projects/projects/')
+    return rng.choice(projects) if projects else None
+
+
+def _pick_site(session, rng):
+    sites = session.cache.get('sites')
+    if sites is None:
+        sites = session.cache['sites'] = session.get_all('/projects/construction-sites/')
+    return rng.choice(sites) if sites else None
+
+
+def flow_project_detail(session, rng):
+    """Карточка проекта (project_detail_screen.dart)"""
+    project = _pick_project(session, rng)
+    if project is None:
+        return
+    session.bootstrap()
+    session.get(f'/projects/projects/{project["id"]}/')
+    sheets = session.get_all('/projects/project-sheets/', {'project_id': project['id'], 'page_size': 100})
+    session.get('/projects/project-stages/', {'project_id': project['id'], 'page': 1, 'page_size': 5})
+    session.cache['sheets'] = sheets
+
+
+def flow_site_projects(session, rng):
+    """Проекты участка (site_projects_screen.dart): листы каждого проекта загружаются дважды"""
+    site = _pick_site(session, rng)
+    if site is None:
+        return
+    projects = session.get_all('/projects/projects/', {'construction_site_id': site['id']})
+    session.bootstrap()
+    for project in projects:
+        session.get_all('/projects/project-sheets/', {'project_id': project['id'], 'page_size': 100})
+    for project in projects:
+        session.get_all('/projects/project-sheets/', {'project_id': project['id'], 'page_size': 100})
+
+
+def flow_dashboard(session, rng):
+    """Дашборд с фильтрами по участку и периоду"""
+    session.get('/projects/dashboard/data/', {'granularity': 'month'})
+    site = _pick_site(session, rng)
+    if site is not None:
+        session.get('/projects/dashboard/data/', {
+            'construction_site_ids[]': [site['id']],
+            'granularity': rng.choice(['day', 'month', 'quarter']),
+        })
+
+
+def flow_download(session, rng):
+    """Скачивание файлов листов из последней открытой карточки проекта"""
+    sheets = [sheet for sheet in session.cache.get('sheets', []) if sheet.get('file_url')]
+    if not sheets:
+        flow_project_detail(session, rng)
+        sheets = [sheet for sheet in session.cache.get('sheets', []) if sheet.get('file_url')]
+    for sheet in rng.sample(sheets, min(len(sheets), 3)):
+        session.request('GET', f'/projects/project-sheets/{sheet["id"]}/download_file/', raw=True)
+
+
+FLOWS = {
+    'login': flow_login,
+    'token_refresh': flow_token_refresh,
+    'tasks': flow_tasks,
+    'project_detail': flow_project_detail,
+    'site_projects': flow_site_projects,
+    'dashboard': flow_dashboard,
+    'download': flow_download,
+}
+
+DEFAULT_WEIGHTS = {
+    'login': 1, 'token_refresh': 1, 'tasks': 4, 'project_detail': 4,
+    'site_projects': 2, 'dashboard': 1, 'download': 1,
+}
+
+
+def parse_weights(value):
+    """'tasks=3,dashboard=1' -> {'tasks': 3.0, 'dashboard': 1.0}"""
+    weights = {}
+    for part in value.split(','):
+        if not part.strip():
+            continue
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in FLOWS:
+            raise ValueError(f'Неизвестный сценарий: {name}')
+        weights[name] = float(weight) if weight else 1.0
+    return weights
+
+
+def run_flow(session, name, rng):
+    session.flow = name
+    start = time.perf_counter()
+    failed = False
+    try:
+        FLOWS[name](session, rng)
+    except (RequestError, KeyError, ValueError):
+        failed = True
+    session.stats.add_run(name, time.perf_counter() - start, failed)
+
+
+def virtual_user(session, weights, deadline, think_time, rng):
+    """Цикл виртуального пользователя до deadline (time.monotonic)"""
+    run_flow(session, 'login', rng)
+    names, values = list(weights), list(weights.values())
+    while time.monotonic() < deadline:
+        if not session.access:
+            run_flow(session, 'login', rng)
+        else:
+            run_flow(session, rng.choices(names, weights=values)[0], rng)
+        if think_time:
+            time.sleep(min(rng.expovariate(1 / think_time), max(0.0, deadline - time.monotonic())))
+
+
+def run(base_url, credentials, duration, weights=None, think_time=1.0, ramp_up=0.0, seed=None, timeout=30):
+    """Запустить виртуальных пользователей (по одному на пару логин/пароль); вернуть Stats"""
+    stats = Stats()
+    weights = weights or DEFAULT_WEIGHTS
+    deadline = time.monotonic() + ramp_up + duration
+    threads = []
+    for index, (username, password) in enumerate(credentials):
+        session = Session(base_url, username, password, stats, timeout)
+        rng = random.Random(None if seed is None else seed + index)
+        thread = threading.Thread(
+            target=virtual_user, args=(session, weights, deadline, think_time, rng),
+            name=f'virtual-user-{index}', daemon=True,
+        )
+        threads.append(thread)
+    for index, thread in enumerate(threads):
+        if ramp_up and index:
+            time.sleep(ramp_up / len(threads))
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats.finished = time.perf_counter()
+    return stats
@@ -0,0 +1,125 @@
+"""
+Команда для бенчмарка основных эндпоинтов API на синтетических данных
+
+По умолчанию создает временную тестовую БД (test_<имя БД>, как при запуске
+тестов), для каждого масштаба заполняет ее командой generate_load_data,
+выполняет сценарии apps.core.benchmark и удаляет БД. Результаты сравниваются с
+базовым файлом; при регрессиях команда завершается с ошибкой.
+"""
+import io
+import os
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from apps.core import benchmark
+
+
+class Command(BaseCommand):
+    help = 'Замеряет p50/p95, число запросов и пиковую память основных эндпоинтов API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='0.1,1',
+                            help='Масштабы данных через запятую (см. generate_load_data --scale)')
+        parser.add_argument('--iterations', type=int, default=20, help='Замеряемых итераций на сценарий')
+        parser.add_argument('--warmup', type=int, default=3, help='Прогревочных итераций на сценарий')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора данных')
+        parser.add_argument('--only', help='Только сценарии, имя которых содержит подстроку')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'benchmarks', 'baseline.json'),
+                            help='Файл базовых результатов')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Допустимый рост p95 и пиковой памяти (доля)')
+        parser.add_argument('--update-baseline', action='store_true', help='Записать результаты в базовый файл')
+        parser.add_argument('--current-db', action='store_true',
+                            help='Использовать текущую БД вместо временной (данные будут изменены)')
+
+    def handle(self, *args, **options):
+        try:
+            scales = [float(value) for value in options['scales'].split(',') if value.strip()]
+        except ValueError:
+            raise CommandError('--scales: ожидаются числа через запятую')
+        scenarios = [
+            scenario for scenario in benchmark.SCENARIOS
+            if not options['only'] or options['only'] in scenario.name
+        ]
+        if not scenarios:
+            raise CommandError('Нет сценариев для запуска')
+        # Без подходящего базового файла сравнивать не с чем: проверяем до долгих замеров
+        if not options['update_baseline']:
+            if not os.path.exists(options['baseline']):
+                raise CommandError(
+                    f'Нет базового файла {options["baseline"]}: запишите его с --update-baseline'
+                )
+            baseline = benchmark.load_baseline(options['baseline'])
+            try:
+                benchmark.check_baseline(baseline, connection.vendor, scales)
+            except benchmark.BaselineMismatch as e:
+                raise CommandError(f'{e}: запишите базовый файл на этом окружении с --update-baseline')
+
+        # Тестовое окружение нужно для Client (ALLOWED_HOSTS); под тестами оно уже настроено
+        try:
+            setup_test_environment()
+            own_environment = True
+        except RuntimeError:
+            own_environment = False
+        old_name = None
+        if not options['current_db']:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            self.stdout.write(f'Временная БД: {connection.settings_dict["NAME"]}')
+        try:
+            results = {}
+            for scale in scales:
+                results.update(self._run_scale(scale, scenarios, options))
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            if own_environment:
+                teardown_test_environment()
+
+        if options['update_baseline']:
+            os.makedirs(os.path.dirname(options['baseline']) or '.', exist_ok=True)
+            previous = benchmark.load_baseline(options['baseline'])
+            # Результаты другой СУБД с новыми не смешиваются
+            if previous['vendor'] != connection.vendor:
+                previous = {'scales': [], 'results': {}}
+            benchmark.save_baseline(
+                options['baseline'], connection.vendor, set(previous['scales']) | set(scales),
+                {**previous['results'], **results},
+            )
+            self.stdout.write(self.style.SUCCESS(f'Базовые результаты записаны в {options["baseline"]}'))
+            return
+
+        for key in sorted(set(results) - set(baseline['results'])):
+            self.stdout.write(self.style.WARNING(f'{key}: нет в базовом файле, не сравнивается'))
+        regressions = benchmark.compare(results, baseline['results'], options['threshold'])
+        if regressions:
+            for line in regressions:
+                self.stdout.write(self.style.ERROR(line))
+            raise CommandError(f'Регрессий: {len(regressions)}')
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
+
+    def _run_scale(self, scale, scenarios, options):
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Масштаб {scale:g}'))
+        call_command('generate_load_data', '--clear', '--scale', str(scale), '--seed', str(options['seed']),
+                     stdout=io.StringIO())
+        fixtures = benchmark.fixtures()
+        clients = benchmark.clients()
+
+        results = {}
+        self.stdout.write(f'{"сценарий":40} {"p50, мс":>9} {"p95, мс":>9} {"запросов":>9} {"память, КБ":>11}')
+        for scenario in scenarios:
+            result = benchmark.run_scenario(
+                scenario, clients[scenario.user], fixtures, options['iterations'], options['warmup']
+            )
+            if result['status'] != 200:
+                self.stdout.write(self.style.WARNING(f'{scenario.name}: ответ {result["status"]}'))
+            results[f'{scale:g}:{scenario.name}'] = result
+            self.stdout.write(
+                f'{scenario.name:40} {result["p50_ms"]:9.1f} {result["p95_ms"]:9.1f} '
+                f'{result["queries"]:9d} {result["peak_kb"]:11.1f}'
+            )
+        return results
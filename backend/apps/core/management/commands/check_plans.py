@@ -0,0 +1,85 @@
+"""
+Команда для проверки планов выполнения критичных запросов на PostgreSQL
+
+Как и benchmark, по умолчанию создает временную тестовую БД, заполняет ее
+командой generate_load_data, выполняет проверки apps.core.plans и удаляет БД.
+Планы, сводки и разницы с базовыми сводками пишутся в каталог артефактов; при
+нарушении свойств плана команда завершается с ошибкой.
+"""
+import io
+import os
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from apps.core import benchmark, plans
+
+
+class Command(BaseCommand):
+    help = 'Проверяет планы EXPLAIN критичных запросов на засеянной БД PostgreSQL'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0, help='Масштаб данных (см. generate_load_data)')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора данных')
+        parser.add_argument('--only', help='Только проверки, имя которых содержит подстроку')
+        parser.add_argument('--artifacts', default=os.path.join(settings.BASE_DIR, 'plans', 'artifacts'),
+                            help='Каталог для планов, сводок и разниц')
+        parser.add_argument('--baseline', default=os.path.join(settings.BASE_DIR, 'plans', 'baseline'),
+                            help='Каталог базовых сводок планов')
+        parser.add_argument('--update-baseline', action='store_true', help='Записать сводки в базовый каталог')
+        parser.add_argument('--current-db', action='store_true',
+                            help='Использовать текущую БД вместо временной (данные будут изменены)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Проверка планов выполняется только на PostgreSQL')
+        checks = [check for check in plans.CHECKS if not options['only'] or options['only'] in check.name]
+        if not checks:
+            raise CommandError('Нет проверок для запуска')
+
+        # Тестовое окружение нужно для Client (ALLOWED_HOSTS); под тестами оно уже настроено
+        try:
+            setup_test_environment()
+            own_environment = True
+        except RuntimeError:
+            own_environment = False
+        old_name = None
+        if not options['current_db']:
+            old_name = connection.settings_dict['NAME']
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            self.stdout.write(f'Временная БД: {connection.settings_dict["NAME"]}')
+        try:
+            call_command('generate_load_data', '--clear', '--scale', str(options['scale']),
+                         '--seed', str(options['seed']), stdout=io.StringIO())
+            results = plans.run_checks(
+                checks, benchmark.clients(), benchmark.fixtures(), options['artifacts'], options['baseline']
+            )
+        finally:
+            if old_name is not None:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+            if own_environment:
+                teardown_test_environment()
+
+        problems = []
+        for name, result in results.items():
+            changed = ' (план изменился, см. .diff)' if result['diff'] else ''
+            self.stdout.write(f'{name}: {len(result["violations"])} нарушений{changed}')
+            if not result['has_baseline'] and not options['update_baseline']:
+                self.stdout.write(self.style.WARNING(
+                    f'{name}: нет базовой сводки, изменение плана не проверяется (запишите --update-baseline)'
+                ))
+            problems.extend(result['violations'])
+            if options['update_baseline']:
+                plans.save_baseline(options['baseline'], name, result['plan'])
+        self.stdout.write(f'Артефакты: {options["artifacts"]}')
+
+        if options['update_baseline']:
+            self.stdout.write(self.style.SUCCESS(f'Базовые сводки записаны в {options["baseline"]}'))
+        if problems:
+            for line in problems:
+                self.stdout.write(self.style.ERROR(line))
+            raise CommandError(f'Нарушений: {len(problems)}')
+        self.stdout.write(self.style.SUCCESS('Нарушений нет'))
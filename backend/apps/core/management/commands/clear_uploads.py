@@ -0,0 +1,14 @@
+"""
+Команда для удаления брошенных докачиваемых загрузок (apps.core.uploads)
+"""
+from django.core.management.base import BaseCommand
+
+from apps.core import uploads
+
+
+class Command(BaseCommand):
+    help = 'Удаляет просроченные сессии загрузки и их принятые части'
+
+    def handle(self, *args, **options):
+        sessions, files = uploads.clear_expired()
+        self.stdout.write(self.style.SUCCESS(f'Удалено сессий: {sessions}, файлов без сессии: {files}'))
@@ -0,0 +1,70 @@
+"""
+Команда для переноса файлов, загруженных до ContentAddressedStorage, в блобы
+
+Для каждого FileField с ContentAddressedStorage записи со старыми именами
+(project_sheets/..., project_stages/..., project_sheet_notes/...) переводятся на
+имя cas/<sha256>/<имя файла>: содержимое сохраняется в блоб (одинаковые файлы —
+в один), счетчик ссылок увеличивается, старый файл удаляется. Записи читаются
+пачками по первичному ключу.
+"""
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from apps.core import blobs
+from apps.core.storage import PREFIX
+
+
+class Command(BaseCommand):
+    help = 'Переносит ранее загруженные файлы в хранилище с дедупликацией по содержимому'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Записей в пачке')
+        parser.add_argument('--dry-run', action='store_true', help='Только подсчитать файлы для переноса')
+
+    def handle(self, *args, **options):
+        totals = {'files': 0, 'bytes': 0, 'missing': 0}
+        digests = set()
+        for model in apps.get_models():
+            for field in blobs.tracked_fields(model):
+                self._migrate_field(model, field, options, totals, digests)
+        if options['dry_run']:
+            self.stdout.write(f'К переносу: {totals["files"]} файлов, {totals["bytes"]} байт; '
+                              f'нет на диске: {totals["missing"]}')
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f'Перенесено {totals["files"]} файлов ({totals["bytes"]} байт) в {len(digests)} блобов; '
+                f'нет на диске: {totals["missing"]}'
+            ))
+
+    def _migrate_field(self, model, field, options, totals, digests):
+        storage = field.storage
+        manager = model._base_manager
+        legacy = manager.exclude(**{f'{field.attname}__startswith': f'{PREFIX}/'}).exclude(
+            **{f'{field.attname}__isnull': True}
+        ).exclude(**{field.attname: ''}).order_by('pk')
+        last_pk = None
+        while True:
+            batch = legacy if last_pk is None else legacy.filter(pk__gt=last_pk)
+            rows = list(batch.values_list('pk', field.attname)[:options['batch_size']])
+            if not rows:
+                return
+            last_pk = rows[-1][0]
+            for pk, name in rows:
+                if not storage.exists(name):
+                    totals['missing'] += 1
+                    continue
+                size = storage.size(name)
+                if not options['dry_run']:
+                    with storage.open(name, 'rb') as content:
+                        new_name = storage.save(name, content, max_length=field.max_length)
+                    with transaction.atomic():
+                        if not manager.filter(pk=pk, **{field.attname: name}).update(**{field.attname: new_name}):
+                            # Запись изменили во время переноса
+                            continue
+                        blobs.acquire(storage, new_name)
+                    if not manager.filter(**{field.attname: name}).exists():
+                        storage.delete(name)
+                    digests.add(storage.digest(new_name))
+                totals['files'] += 1
+                totals['bytes'] += size
@@ -0,0 +1,42 @@
+"""
+Команда для выгрузки свернутых стеков непрерывного семплера (вход flamegraph.pl / speedscope)
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.core.sampling import format_collapsed, read_windows
+
+
+class Command(BaseCommand):
+    help = 'Объединяет окна семплирования всех воркеров в один профиль свернутых стеков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, default=None, help='Только окна за последние N минут')
+        parser.add_argument('--view', help='Только стеки действия (basename:action)')
+        parser.add_argument('--output', '-o', help='Файл для записи (по умолчанию stdout)')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['minutes']:
+            since = timezone.now() - timedelta(minutes=options['minutes'])
+        counts = read_windows(str(settings.SAMPLING['DIR']), since)
+        if options['view']:
+            prefix = options['view'] + ';'
+            counts = {stack: value for stack, value in counts.items() if stack.startswith(prefix)}
+
+        if not counts:
+            self.stderr.write(self.style.WARNING('Семплов не найдено'))
+            return
+
+        content = format_collapsed(counts)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(content)
+            self.stderr.write(self.style.SUCCESS(
+                f'Записано стеков: {len(counts)}, всего {sum(counts.values()) / 1_000_000:.1f} с в {options["output"]}'
+            ))
+        else:
+            self.stdout.write(content, ending='')
@@ -0,0 +1,40 @@
+"""
+Команда для построения превью блобов, у которых его еще нет (apps.core.previews)
+
+Нужна после переноса старых файлов командой dedupe_files и после изменения
+PREVIEWS['SIZE'] (с --rebuild). Превью строятся в текущем процессе по очереди.
+"""
+from django.core.management.base import BaseCommand
+
+from apps.core import previews
+from apps.core.models import Blob
+
+
+class Command(BaseCommand):
+    help = 'Строит превью изображений и PDF для блобов файлов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Перестроить существующие превью')
+
+    def handle(self, *args, **options):
+        built = skipped = failed = 0
+        digests = Blob.objects.filter(ref_count__gt=0).order_by('digest').values_list('digest', flat=True)
+        for digest in digests.iterator():
+            if options['rebuild']:
+                previews.delete(digest)
+            try:
+                ok = previews.generate(digest)
+            except Exception as e:
+                ok = False
+                failed += 1
+                self.stderr.write(f'{digest}: {e}')
+            else:
+                if ok:
+                    built += 1
+                else:
+                    skipped += 1
+            # Отметка Blob.preview_failed снимается, если превью теперь строится
+            previews.mark_failed(digest, not ok)
+        self.stdout.write(self.style.SUCCESS(
+            f'Превью: {built}, без превью (тип не поддерживается): {skipped}, ошибок: {failed}'
+        ))
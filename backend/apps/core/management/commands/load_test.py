@@ -0,0 +1,75 @@
+"""
+Команда для нагрузочного теста запущенного backend сценариями экранов клиента
+
+Виртуальные пользователи входят под учетными записями, созданными
+generate_load_data (load_user1..N, пароль loadtest), или под одной заданной
+учетной записью. См. apps.core.loadtest.
+"""
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.core import loadtest
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест сценариями экранов Flutter-клиента против запущенного backend'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000/api', help='Базовый URL API')
+        parser.add_argument('--users', type=int, default=10, help='Число виртуальных пользователей')
+        parser.add_argument('--duration', type=float, default=60, help='Длительность теста, секунд')
+        parser.add_argument('--ramp-up', type=float, default=0, help='Время запуска всех пользователей, секунд')
+        parser.add_argument('--think-time', type=float, default=1.0, help='Средняя пауза между сценариями, секунд')
+        parser.add_argument('--flows', help='Веса сценариев, например tasks=4,project_detail=4,dashboard=1 '
+                                            f'(сценарии: {", ".join(loadtest.FLOWS)})')
+        parser.add_argument('--username', help='Одна учетная запись для всех пользователей')
+        parser.add_argument('--password', default='loadtest', help='Пароль учетных записей')
+        parser.add_argument('--user-prefix', default='load_user',
+                            help='Префикс учетных записей <префикс>1..N (если не задан --username)')
+        parser.add_argument('--timeout', type=float, default=30, help='Таймаут запроса, секунд')
+        parser.add_argument('--seed', type=int, help='Зерно выбора сценариев')
+        parser.add_argument('--json', dest='json_path', help='Записать сводку в файл JSON')
+
+    def handle(self, *args, **options):
+        if options['users'] < 1:
+            raise CommandError('--users должен быть положительным')
+        try:
+            weights = loadtest.parse_weights(options['flows']) if options['flows'] else None
+        except ValueError as exc:
+            raise CommandError(str(exc))
+        credentials = [
+            (options['username'] or f'{options["user_prefix"]}{index + 1}', options['password'])
+            for index in range(options['users'])
+        ]
+
+        self.stdout.write(
+            f'{options["users"]} пользователей, {options["duration"]:g} с, {options["url"]}'
+        )
+        stats = loadtest.run(
+            options['url'], credentials, options['duration'], weights=weights,
+            think_time=options['think_time'], ramp_up=options['ramp_up'],
+            seed=options['seed'], timeout=options['timeout'],
+        )
+        report = stats.report()
+
+        self.stdout.write(
+            f'{"сценарий":16} {"прох.":>6} {"сбоев":>6} {"запросов":>9} {"запр/с":>8} {"ошибок":>8} '
+            f'{"p50":>8} {"p95":>8} {"p99":>8} {"сцен.p95":>9}'
+        )
+        for flow, row in report.items():
+            line = (
+                f'{flow:16} {row["runs"]:6d} {row["failed_runs"]:6d} {row["requests"]:9d} {row["rps"]:8.2f} '
+                f'{row["error_rate"] * 100:7.2f}% {row["p50_ms"]:8.1f} {row["p95_ms"]:8.1f} '
+                f'{row["p99_ms"]:8.1f} {row["flow_p95_ms"]:9.1f}'
+            )
+            self.stdout.write(self.style.ERROR(line) if row['error_rate'] else line)
+            for error in row['errors']:
+                self.stdout.write(f'    {error}')
+        total = sum(row['requests'] for row in report.values())
+        elapsed = stats.finished - stats.started
+        self.stdout.write(f'Всего запросов: {total}, {total / elapsed:.1f} запр/с (время в мс)')
+
+        if options['json_path']:
+            with open(options['json_path'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
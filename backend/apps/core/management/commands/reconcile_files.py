@@ -0,0 +1,30 @@
+"""
+Команда сверки файлов хранилища с БД и сборки файлов без ссылок (apps.core.filegc)
+"""
+from django.core.management.base import BaseCommand
+
+from apps.core import filegc
+
+
+class Command(BaseCommand):
+    help = 'Сверяет файлы в MEDIA_ROOT со ссылками в БД и удаляет файлы без ссылок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать, что будет сделано')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        stats = filegc.reconcile(dry_run=dry_run)
+        self.stdout.write(
+            f'Блобов: {stats["blobs"]}, без файла на диске: {stats["missing"]}, '
+            f'счетчиков ссылок исправлено: {stats["recounted"]}'
+        )
+        self.stdout.write(
+            f'Без ссылок: блобов {stats["orphaned_blobs"]}, старых файлов {stats["orphaned_plain"]} '
+            f'(из {stats["plain_files"]}); строк Blob без файла: {stats["stale_rows"]}, '
+            f'превью без блоба: {stats["stale_previews"]}, временных файлов: {stats["temp_files"]}'
+        )
+        if dry_run:
+            return
+        deleted = filegc.collect()
+        self.stdout.write(self.style.SUCCESS(f'Удалено файлов: {deleted}'))
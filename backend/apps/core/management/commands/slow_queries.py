@@ -0,0 +1,44 @@
+"""
+Команда для просмотра медленных запросов к БД (core.SlowQuery)
+"""
+from django.core.management.base import BaseCommand
+
+from apps.core.slow_queries import ORDERINGS, flush, top_slow_queries
+from apps.core.models import SlowQuery
+
+
+class Command(BaseCommand):
+    help = 'Выводит самые затратные медленные запросы к БД'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=20, help='Число запросов в выводе')
+        parser.add_argument('--order', choices=sorted(ORDERINGS), default='total', help='Порядок сортировки')
+        parser.add_argument('--view', help='Только запросы указанного представления (basename:action)')
+        parser.add_argument('--explain', action='store_true', help='Выводить сохраненные планы выполнения')
+        parser.add_argument('--reset', action='store_true', help='Удалить накопленную статистику')
+
+    def handle(self, *args, **options):
+        if options['reset']:
+            deleted, _ = SlowQuery.objects.all().delete()
+            self.stdout.write(self.style.SUCCESS(f'Удалено записей: {deleted}'))
+            return
+
+        # Буфер текущего процесса (если команда что-то накопила сама)
+        flush()
+        queries = top_slow_queries(options['order'], options['view'])[:options['limit']]
+        if not queries:
+            self.stdout.write('Медленных запросов не найдено')
+            return
+
+        for index, query in enumerate(queries, 1):
+            self.stdout.write(self.style.WARNING(
+                f'{index}. {query.view or "-"}: всего {query.total_time * 1000:.0f} мс, '
+                f'вызовов {query.calls}, среднее {query.avg_time * 1000:.1f} мс, '
+                f'максимум {query.max_time * 1000:.1f} мс'
+            ))
+            self.stdout.write(f'   {query.sql}')
+            if query.params_shape:
+                self.stdout.write(f'   Параметры: {query.params_shape}')
+            if options['explain'] and query.explain:
+                for line in query.explain.splitlines():
+                    self.stdout.write(f'   | {line}')
@@ -0,0 +1,145 @@
+"""
+Метрики Prometheus
+
+Метрики запросов собираются MetricsMiddleware с меткой действия вида
+'<basename>:<action>' (например, 'project-sheet:list', 'dashboard:data'), для
+функций-представлений — '<url_name>'. Значения пишет prometheus_client: в одном
+процессе — в память, при заданной переменной окружения PROMETHEUS_MULTIPROC_DIR —
+в mmap-файлы своего процесса, которые объединяются при чтении /metrics. Запись
+значения не требует общих блокировок между процессами.
+
+При работе нескольких воркеров каталог PROMETHEUS_MULTIPROC_DIR должен очищаться
+перед запуском сервера.
+"""
+import ipaddress
+import os
+
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from django.utils.crypto import constant_time_compare
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess,
+)
+
+UNMATCHED_ACTION = 'unmatched'
+
+REQUESTS = Counter(
+    'mytracker_http_requests_total', 'Число запросов',
+    ['action', 'method', 'status'],
+)
+ERRORS = Counter(
+    'mytracker_http_errors_total', 'Число ответов с ошибкой (4xx, 5xx)',
+    ['action', 'status_class'],
+)
+LATENCY = Histogram(
+    'mytracker_http_request_duration_seconds', 'Время обработки запроса',
+    ['action'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10),
+)
+QUERIES = Histogram(
+    'mytracker_http_request_queries', 'Число запросов к БД на один запрос',
+    ['action'],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+RESPONSE_SIZE = Histogram(
+    'mytracker_http_response_size_bytes', 'Размер тела ответа',
+    ['action'],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+CACHE_REQUESTS = Counter(
+    'mytracker_cache_requests_total', 'Чтения двухуровневого кэша по результату (l1, l2, miss)',
+    ['cache', 'result'],
+)
+DB_POOL = Gauge(
+    'mytracker_db_pool_connections', 'Состояние пула соединений с БД (если пул настроен)',
+    ['alias', 'state'],
+    multiprocess_mode='livesum',
+)
+
+
+def action_label(request, view_func):
+    """Метка действия для вызываемого представления"""
+    initkwargs = getattr(view_func, 'initkwargs', None) or {}
+    actions = getattr(view_func, 'actions', None)
+    basename = initkwargs.get('basename')
+    if basename and actions:
+        action = actions.get(request.method.lower())
+        if action:
+            return f'{basename}:{action}'
+    match = request.resolver_match
+    if match is not None and match.url_name:
+        return match.url_name
+    return getattr(view_func, '__name__', UNMATCHED_ACTION)
+
+
+def _response_size(response):
+    if response.streaming:
+        length = response.get('Content-Length')
+        return int(length) if length and length.isdigit() else None
+    return len(response.content)
+
+
+def _observe_pools():
+    # Пул соединений есть не у всех бэкендов (psycopg 3 с OPTIONS['pool'] в Django 5.1+)
+    for alias in connections:
+        pool = getattr(connections[alias], 'pool', None)
+        get_stats = getattr(pool, 'get_stats', None)
+        if get_stats is None:
+            continue
+        stats = get_stats()
+        for state in ('pool_size', 'pool_available', 'requests_waiting'):
+            if state in stats:
+                DB_POOL.labels(alias, state).set(stats[state])
+
+
+def observe_request(action, method, response, duration, queries):
+    """Учесть обработанный запрос"""
+    status = response.status_code
+    REQUESTS.labels(action, method, str(status)).inc()
+    if status >= 400:
+        ERRORS.labels(action, f'{status // 100}xx').inc()
+    LATENCY.labels(action).observe(duration)
+    QUERIES.labels(action).observe(queries)
+    size = _response_size(response)
+    if size is not None:
+        RESPONSE_SIZE.labels(action).observe(size)
+    _observe_pools()
+
+
+def _ip_allowed(address, allowed):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network, strict=False) for network in allowed)
+
+
+def has_access(request):
+    """Доступ к /metrics
+
+    Пускает с заголовком Authorization: Bearer <METRICS['TOKEN']> или с адреса из
+    METRICS['ALLOWED_IPS']. Если ни токен, ни адреса не заданы, метрики отдаются
+    только при DEBUG или явно заданном METRICS['PUBLIC'].
+    """
+    options = settings.METRICS
+    if options.get('PUBLIC'):
+        return True
+    token, allowed = options.get('TOKEN'), options.get('ALLOWED_IPS')
+    if not token and not allowed:
+        return settings.DEBUG
+    if token and constant_time_compare(request.headers.get('Authorization', ''), f'Bearer {token}'):
+        return True
+    return bool(allowed) and _ip_allowed(request.META.get('REMOTE_ADDR', ''), allowed)
+
+
+def metrics_view(request):
+    """Метрики в текстовом формате Prometheus (доступ — has_access)"""
+    if not has_access(request):
+        return HttpResponseForbidden()
+    registry = REGISTRY
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return HttpResponse(generate_latest(registry), content_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,139 @@
+"""
+Middleware общего назначения
+"""
+import logging
+import random
+import time
+
+from django.conf import settings
+
+from . import instrumentation, metrics, nplusone, profiling, sampling
+from .timing import current, measure
+
+# Порядок метрик в заголовке Server-Timing
+SERVER_TIMING_METRICS = ('db', 'permissions', 'serialize', 'render')
+
+
+class MetricsMiddleware:
+    """Сбор метрик Prometheus по действиям ViewSet (см. apps.core.metrics)
+
+    Метка действия передается также непрерывному семплеру стеков (apps.core.sampling).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Метку семплера ставит process_view и при выключенных метриках: снимаем ее всегда
+        try:
+            if not settings.METRICS['ENABLED']:
+                return self.get_response(request)
+            start = time.perf_counter()
+            with measure() as timings:
+                response = self.get_response(request)
+        finally:
+            sampling.clear_request_label()
+        metrics.observe_request(
+            getattr(request, '_metrics_action', metrics.UNMATCHED_ACTION),
+            request.method, response, time.perf_counter() - start, timings.counts.get('db', 0),
+        )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._metrics_action = metrics.action_label(request, view_func)
+        timings = current()
+        if timings is not None:
+            timings.view = request._metrics_action
+        sampling.set_request_label(request._metrics_action)
+
+
+class ServerTimingMiddleware:
+    """Замер этапов запроса с выдачей в заголовке Server-Timing и в лог
+
+    Замер включается для доли запросов SERVER_TIMING['SAMPLE_RATE'] и для
+    пользователей из SERVER_TIMING['USERS']. Пользователь API становится известен
+    только после JWT-аутентификации во view, поэтому при непустом USERS этапы
+    замеряются у всех запросов, а выдаются только для выбранных пользователей.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = settings.SERVER_TIMING
+        if not options['ENABLED']:
+            return self.get_response(request)
+        sampled = random.random() < options['SAMPLE_RATE']
+        if not sampled and not options['USERS']:
+            return self.get_response(request)
+
+        start = time.perf_counter()
+        with measure() as timings:
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        user = getattr(request, 'user', None)
+        if sampled or (user is not None and user.is_authenticated and user.get_username() in options['USERS']):
+            self._emit(request, response, timings, total)
+        return response
+
+    def _emit(self, request, response, timings, total):
+        metrics = []
+        for name in SERVER_TIMING_METRICS:
+            duration = timings.durations.get(name, 0.0) * 1000
+            if name == 'db':
+                metrics.append(f'db;dur={duration:.1f};desc="{timings.counts.get("db", 0)} queries"')
+            else:
+                metrics.append(f'{name};dur={duration:.1f}')
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(metrics)
+
+        user = getattr(request, 'user', None)
+        instrumentation.event('ServerTimingMiddleware', 'Request timings', lambda: {
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'user_id': user.pk if user is not None and user.is_authenticated else None,
+            'queries': timings.counts.get('db', 0),
+            **{f'{name}_ms': round(timings.durations.get(name, 0.0) * 1000, 2) for name in SERVER_TIMING_METRICS},
+            'total_ms': round(total * 1000, 2),
+        }, level=logging.INFO)
+
+
+class ProfilingMiddleware:
+    """Профилирование запроса под cProfile по флагу суперпользователя (см. apps.core.profiling)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profiling.is_requested(request) or not settings.PROFILING['ENABLED']:
+            return self.get_response(request)
+        if not profiling.is_allowed(request):
+            return self.get_response(request)
+        response, profile_id = profiling.run(self.get_response, request)
+        response['X-Profile-Id'] = profile_id
+        return response
+
+
+class NPlusOneMiddleware:
+    """Поиск N+1 и лишних загрузок связей за время запроса (см. apps.core.nplusone)
+
+    Только для разработки и staging: при NPLUSONE['ENABLED'] подменяются
+    дескрипторы связей моделей. Находки пишутся в лог или, при NPLUSONE['RAISE'],
+    выбрасываются как NPlusOneError.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        options = settings.NPLUSONE
+        if not options['ENABLED']:
+            return self.get_response(request)
+        with nplusone.track() as tracker:
+            response = self.get_response(request)
+        findings = tracker.report(options['THRESHOLD'], options['REPORT_UNUSED'])
+        if findings:
+            nplusone.check(f'{request.method} {request.path}', findings, raise_error=options['RAISE'])
+        return response
@@ -0,0 +1,38 @@
+# Generated by Django 5.0.6 on 2026-10-19 07:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('core', '0001_create_cache_table'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SlowQuery',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fingerprint', models.CharField(max_length=40, unique=True, verbose_name='Отпечаток')),
+                ('view', models.CharField(blank=True, max_length=200, verbose_name='Представление')),
+                ('sql', models.TextField(verbose_name='Нормализованный SQL')),
+                ('params_shape', models.CharField(blank=True, max_length=500, verbose_name='Форма параметров')),
+                ('calls', models.PositiveBigIntegerField(default=0, verbose_name='Число вызовов')),
+                ('total_time', models.FloatField(default=0, verbose_name='Суммарное время, сек')),
+                ('max_time', models.FloatField(default=0, verbose_name='Максимальное время, сек')),
+                ('last_time', models.FloatField(default=0, verbose_name='Последнее время, сек')),
+                ('explain', models.TextField(blank=True, verbose_name='План выполнения (EXPLAIN ANALYZE)')),
+                ('explained_at', models.DateTimeField(blank=True, null=True, verbose_name='План получен')),
+                ('first_seen', models.DateTimeField(auto_now_add=True, verbose_name='Впервые')),
+                ('last_seen', models.DateTimeField(auto_now=True, verbose_name='Последний раз')),
+            ],
+            options={
+                'verbose_name': 'Медленный запрос',
+                'verbose_name_plural': 'Медленные запросы',
+                'ordering': ['-total_time'],
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-19 07:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_slowquery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('digest', models.CharField(max_length=64, primary_key=True, serialize=False, verbose_name='SHA-256')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер, байт')),
+                ('ref_count', models.PositiveIntegerField(default=0, verbose_name='Число ссылок')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создан')),
+            ],
+            options={
+                'verbose_name': 'Блоб файла',
+                'verbose_name_plural': 'Блобы файлов',
+            },
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.0.6 on 2026-10-19 08:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingFileDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Имя файла')),
+                ('not_before', models.DateTimeField(db_index=True, verbose_name='Удалить не раньше')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Добавлен')),
+            ],
+            options={
+                'verbose_name': 'Файл к удалению',
+                'verbose_name_plural': 'Файлы к удалению',
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.0.6 on 2026-10-19 08:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_pendingfiledeletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='direct',
+            field=models.BooleanField(default=False, verbose_name='Прямая загрузка'),
+        ),
+        migrations.AddField(
+            model_name='uploadsession',
+            name='sha256',
+            field=models.CharField(blank=True, max_length=64, verbose_name='SHA-256'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-19 08:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_uploadsession_direct'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='preview_failed',
+            field=models.BooleanField(default=False, verbose_name='Превью не строится'),
+        ),
+    ]
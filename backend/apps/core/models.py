@@ -0,0 +1,93 @@
+import uuid
+
+from django.conf import settings
+from django.db import models
+
+
+class SlowQuery(models.Model):
+    """Медленный запрос к БД: агрегат по нормализованному SQL и представлению"""
+    fingerprint = models.CharField('Отпечаток', max_length=40, unique=True)
+    view = models.CharField('Представление', max_length=200, blank=True)
+    sql = models.TextField('Нормализованный SQL')
+    params_shape = models.CharField('Форма параметров', max_length=500, blank=True)
+    calls = models.PositiveBigIntegerField('Число вызовов', default=0)
+    total_time = models.FloatField('Суммарное время, сек', default=0)
+    max_time = models.FloatField('Максимальное время, сек', default=0)
+    last_time = models.FloatField('Последнее время, сек', default=0)
+    explain = models.TextField('План выполнения (EXPLAIN ANALYZE)', blank=True)
+    explained_at = models.DateTimeField('План получен', blank=True, null=True)
+    first_seen = models.DateTimeField('Впервые', auto_now_add=True)
+    last_seen = models.DateTimeField('Последний раз', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Медленный запрос'
+        verbose_name_plural = 'Медленные запросы'
+        ordering = ['-total_time']
+
+    def __str__(self):
+        return f"{self.view or '-'}: {self.sql[:80]}"
+
+    @property
+    def avg_time(self):
+        return self.total_time / self.calls if self.calls else 0
+
+
+class Blob(models.Model):
+    """Содержимое в ContentAddressedStorage и число ссылающихся на него полей моделей"""
+    digest = models.CharField('SHA-256', max_length=64, primary_key=True)
+    size = models.PositiveBigIntegerField('Размер, байт')
+    ref_count = models.PositiveIntegerField('Число ссылок', default=0)
+    # Превью не построено (тип не поддерживается, нет инструмента, ошибка): запросы его не перестраивают
+    preview_failed = models.BooleanField('Превью не строится', default=False)
+    created_at = models.DateTimeField('Создан', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Блоб файла'
+        verbose_name_plural = 'Блобы файлов'
+
+    def __str__(self):
+        return f'{self.digest} ({self.ref_count})'
+
+
+class PendingFileDeletion(models.Model):
+    """Файл хранилища, на который не осталось ссылок: его удалит сборщик apps.core.filegc"""
+    name = models.CharField('Имя файла', max_length=255, unique=True)
+    not_before = models.DateTimeField('Удалить не раньше', db_index=True)
+    created_at = models.DateTimeField('Добавлен', auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Файл к удалению'
+        verbose_name_plural = 'Файлы к удалению'
+
+    def __str__(self):
+        return self.name
+
+
+class UploadSession(models.Model):
+    """Докачиваемая или прямая загрузка файла (apps.core.uploads)"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='upload_sessions',
+        verbose_name='Пользователь'
+    )
+    filename = models.CharField('Имя файла', max_length=255)
+    size = models.PositiveBigIntegerField('Размер, байт')
+    offset = models.PositiveBigIntegerField('Принято, байт', default=0)
+    # Клиент загружает файл прямо в S3-совместимое хранилище (presigned POST)
+    direct = models.BooleanField('Прямая загрузка', default=False)
+    sha256 = models.CharField('SHA-256', max_length=64, blank=True)
+    created_at = models.DateTimeField('Создана', auto_now_add=True)
+    updated_at = models.DateTimeField('Обновлена', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Сессия загрузки'
+        verbose_name_plural = 'Сессии загрузки'
+
+    def __str__(self):
+        return f'{self.filename} ({self.offset}/{self.size})'
+
+    @property
+    def complete(self):
+        return self.offset == self.size
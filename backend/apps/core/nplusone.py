@@ -0,0 +1,318 @@
+"""
+Поиск N+1 в ORM во время запроса (для разработки и staging)
+
+install() подменяет дескрипторы связей моделей (прямые ForeignKey/OneToOne,
+обратные OneToOne, менеджеры обратных ForeignKey и ManyToMany), выполнение
+QuerySet и prefetch_related_objects. Внутри track() каждое обращение к связи
+записывается в Tracker:
+
+- ленивая загрузка — связь не была загружена заранее и читается отдельным
+  запросом. Ленивая загрузка одной связи у нескольких объектов (не меньше THRESHOLD)
+  считается N+1; путь связи строится от модели, с которой начался обход
+  (sheet.project.construction_site -> ProjectSheet, 'project__construction_site'),
+  и предлагается select_related или prefetch_related;
+- заранее загруженная связь (select_related, prefetch_related) отмечается как
+  использованная; связи, загруженные заранее и ни разу не прочитанные, выдаются
+  как лишние.
+
+Вне track() подмененные методы только проверяют contextvar. Подмена
+выполняется, только если NPLUSONE['ENABLED'] (см. NPlusOneMiddleware), или
+первым вызовом track(); uninstall() возвращает исходные методы (для тестов).
+"""
+import contextvars
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+
+from django.core.exceptions import FieldDoesNotExist, ObjectDoesNotExist
+from django.db.models import ForeignObjectRel, query
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.fields.related_descriptors import (
+    ForwardManyToOneDescriptor,
+    ManyToManyDescriptor,
+    ReverseManyToOneDescriptor,
+    ReverseOneToOneDescriptor,
+)
+
+from .testing import call_site
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('nplusone_tracker', default=None)
+_originals = {}
+_install_lock = threading.Lock()
+
+
+class NPlusOneError(Exception):
+    """N+1 или лишняя загрузка связей при NPLUSONE['RAISE']"""
+
+
+class Tracker:
+    """Обращения к связям моделей за время track()"""
+
+    def __init__(self):
+        # (модель обхода, путь) -> {'instances' (id -> объект), 'single', 'site'}
+        self.lazy = {}
+        # (модель, связь), загруженные заранее и прочитанные
+        self.eager = set()
+        self.used = set()
+        # id объекта -> (объект, модель обхода, путь, все связи пути одиночные)
+        self._paths = {}
+        # (id объекта, модель связи) -> (объект, модель обхода, путь) для менеджеров связей:
+        # объекты из их QuerySet продолжают путь
+        self._managers = {}
+        # Внутри prefetch_related_objects обращения к связям выполняет сам Django
+        self.suspended = 0
+
+    def _origin(self, instance):
+        entry = self._paths.get(id(instance))
+        if entry is None or entry[0] is not instance:
+            return instance._meta.label, (), True
+        return entry[1:]
+
+    def access(self, instance, name, value, lazy, single=True, related_model=None):
+        """Обращение к связи name объекта instance
+
+        value — связанный объект одиночной связи, related_model — модель менеджера связи.
+        """
+        root, path, all_single = self._origin(instance)
+        path = path + (name,)
+        all_single = all_single and single
+        if lazy:
+            entry = self.lazy.get((root, path))
+            if entry is None:
+                entry = self.lazy[root, path] = {
+                    'instances': {}, 'single': all_single, 'site': call_site(traceback.extract_stack()[:-2]),
+                }
+            # Считаются разные объекты: повторные запросы по одному объекту — не N+1
+            entry['instances'][id(instance)] = instance
+        else:
+            self.used.add((instance._meta.label, name))
+        if value is not None:
+            self._paths[id(value)] = (value, root, path, all_single)
+        if related_model is not None:
+            self._managers[id(instance), related_model._meta.label] = (instance, root, path)
+
+    def fetched(self, queryset):
+        """Объекты QuerySet менеджера связи продолжают путь объекта-владельца"""
+        owner = queryset._hints.get('instance')
+        entry = self._managers.get((id(owner), queryset.model._meta.label)) if owner is not None else None
+        if entry is None or entry[0] is not owner:
+            return
+        for obj in queryset._result_cache:
+            self._paths[id(obj)] = (obj, entry[1], entry[2], False)
+
+    def loaded(self, model, select_related=None, prefetch_lookups=()):
+        """Связи, загруженные заранее для объектов model"""
+        if isinstance(select_related, dict):
+            self.eager.update(_select_related_pairs(model, select_related))
+        for lookup in prefetch_lookups:
+            if isinstance(lookup, str):
+                pairs = _path_pairs(model, lookup)
+            else:
+                pairs = _path_pairs(model, lookup.prefetch_through)
+                # Список to_attr — обычный атрибут, обращения к нему не отслеживаются
+                if lookup.prefetch_to != lookup.prefetch_through:
+                    pairs = pairs[:-1]
+            self.eager.update(pairs)
+
+    def report(self, threshold=2, unused=True):
+        """Найденные проблемы: список словарей с ключами kind, model, path, count, site, message"""
+        findings = []
+        for (root, path), entry in sorted(self.lazy.items(), key=lambda item: -len(item[1]['instances'])):
+            count = len(entry['instances'])
+            if count < threshold:
+                continue
+            lookup = LOOKUP_SEP.join(path)
+            method = 'select_related' if entry['single'] else 'prefetch_related'
+            findings.append({
+                'kind': 'n_plus_one',
+                'model': root,
+                'path': lookup,
+                'count': count,
+                'site': entry['site'],
+                'message': (
+                    f'N+1: {root}.{".".join(path)} загружено лениво для {count} объектов '
+                    f'({entry["site"]}); добавьте {method}(\'{lookup}\') в запрос {root}'
+                ),
+            })
+        if unused:
+            for model, name in sorted(self.eager - self.used):
+                findings.append({
+                    'kind': 'unused_eager',
+                    'model': model,
+                    'path': name,
+                    'count': 0,
+                    'site': None,
+                    'message': f'Лишняя загрузка: связь {model}.{name} загружена заранее, но не использовалась',
+                })
+        return findings
+
+
+def _relation(model, name):
+    """Поле связи и имя атрибута на объекте, None — если name не связь модели"""
+    try:
+        field = model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None, None
+    if not field.is_relation or field.related_model is None:
+        return None, None
+    return field, field.get_accessor_name() if isinstance(field, ForeignObjectRel) else field.name
+
+
+def _select_related_pairs(model, tree):
+    pairs = []
+    for name, subtree in tree.items():
+        field, attr = _relation(model, name)
+        if field is None:
+            continue
+        pairs.append((model._meta.label, attr))
+        pairs.extend(_select_related_pairs(field.related_model, subtree))
+    return pairs
+
+
+def _path_pairs(model, lookup):
+    pairs = []
+    for name in lookup.split(LOOKUP_SEP):
+        field, attr = _relation(model, name)
+        if field is None:
+            break
+        pairs.append((model._meta.label, attr))
+        model = field.related_model
+    return pairs
+
+
+def _active():
+    tracker = _current.get()
+    return tracker if tracker is not None and not tracker.suspended else None
+
+
+def _forward_get(descriptor, instance, cls=None):
+    tracker = _active() if instance is not None else None
+    if tracker is None:
+        return _originals['forward'](descriptor, instance, cls)
+    cached = descriptor.field.is_cached(instance)
+    value = _originals['forward'](descriptor, instance, cls)
+    tracker.access(instance, descriptor.field.name, value, lazy=not cached and value is not None)
+    return value
+
+
+def _reverse_one_get(descriptor, instance, cls=None):
+    tracker = _active() if instance is not None else None
+    if tracker is None:
+        return _originals['reverse_one'](descriptor, instance, cls)
+    name = descriptor.related.get_accessor_name()
+    lazy = not descriptor.related.is_cached(instance) and instance.pk is not None
+    try:
+        value = _originals['reverse_one'](descriptor, instance, cls)
+    except ObjectDoesNotExist:
+        tracker.access(instance, name, None, lazy)
+        raise
+    tracker.access(instance, name, value, lazy)
+    return value
+
+
+def _many_get(descriptor, instance, cls=None):
+    manager = _originals['many'](descriptor, instance, cls)
+    tracker = _active() if instance is not None else None
+    if tracker is None:
+        return manager
+    if isinstance(descriptor, ManyToManyDescriptor):
+        cache_name = manager.prefetch_cache_name
+        name = descriptor.rel.get_accessor_name() if descriptor.reverse else descriptor.rel.field.name
+    else:
+        cache_name = descriptor.rel.get_cache_name()
+        name = descriptor.rel.get_accessor_name()
+    prefetched = cache_name in getattr(instance, '_prefetched_objects_cache', {})
+    tracker.access(
+        instance, name, None, lazy=not prefetched and instance.pk is not None, single=False,
+        related_model=manager.model,
+    )
+    return manager
+
+
+def _fetch_all(queryset):
+    tracker = _current.get()
+    fetched = queryset._result_cache is not None
+    _originals['fetch_all'](queryset)
+    if tracker is None or fetched or not queryset._result_cache:
+        return
+    if queryset.query.select_related:
+        tracker.loaded(queryset.model, select_related=queryset.query.select_related)
+    if not tracker.suspended and queryset._hints:
+        tracker.fetched(queryset)
+
+
+def _prefetch_related_objects(model_instances, *related_lookups):
+    tracker = _current.get()
+    if tracker is None:
+        return _originals['prefetch'](model_instances, *related_lookups)
+    if model_instances:
+        tracker.loaded(type(model_instances[0]), prefetch_lookups=related_lookups)
+    tracker.suspended += 1
+    try:
+        return _originals['prefetch'](model_instances, *related_lookups)
+    finally:
+        tracker.suspended -= 1
+
+
+def install():
+    """Подменить дескрипторы связей и выполнение QuerySet (повторный вызов ничего не делает)"""
+    with _install_lock:
+        if _originals:
+            return
+        _originals.update(
+            forward=ForwardManyToOneDescriptor.__get__,
+            reverse_one=ReverseOneToOneDescriptor.__get__,
+            many=ReverseManyToOneDescriptor.__get__,
+            fetch_all=query.QuerySet._fetch_all,
+            prefetch=query.prefetch_related_objects,
+        )
+        ForwardManyToOneDescriptor.__get__ = _forward_get
+        ReverseOneToOneDescriptor.__get__ = _reverse_one_get
+        ReverseManyToOneDescriptor.__get__ = _many_get
+        query.QuerySet._fetch_all = _fetch_all
+        query.prefetch_related_objects = _prefetch_related_objects
+
+
+def installed():
+    """Подменены ли дескрипторы связей"""
+    return bool(_originals)
+
+
+def uninstall():
+    """Вернуть исходные дескрипторы связей и выполнение QuerySet"""
+    with _install_lock:
+        if not _originals:
+            return
+        ForwardManyToOneDescriptor.__get__ = _originals['forward']
+        ReverseOneToOneDescriptor.__get__ = _originals['reverse_one']
+        ReverseManyToOneDescriptor.__get__ = _originals['many']
+        query.QuerySet._fetch_all = _originals['fetch_all']
+        query.prefetch_related_objects = _originals['prefetch']
+        _originals.clear()
+
+
+@contextmanager
+def track():
+    """Отслеживание обращений к связям на время блока; если оно уже идет, возвращается текущий Tracker"""
+    install()
+    tracker = _current.get()
+    if tracker is not None:
+        yield tracker
+        return
+    tracker = Tracker()
+    token = _current.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _current.reset(token)
+
+
+def check(label, findings, raise_error=False):
+    """Записать найденные проблемы в лог или выбросить NPlusOneError"""
+    if raise_error:
+        raise NPlusOneError(f'{label}:\n' + '\n'.join(finding['message'] for finding in findings))
+    for finding in findings:
+        logger.warning('%s: %s', label, finding['message'])
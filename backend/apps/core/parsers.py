@@ -0,0 +1,18 @@
+"""
+Парсеры API: тела запросов в формате MessagePack
+"""
+import msgpack
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+
+class MessagePackParser(BaseParser):
+    """Парсер MessagePack (Content-Type: application/msgpack)"""
+    media_type = 'application/msgpack'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            # Timestamp разворачивается в aware datetime (UTC), который принимает DateTimeField
+            return msgpack.unpackb(stream.read(), raw=False, timestamp=3)
+        except (ValueError, TypeError, msgpack.UnpackException) as exc:
+            raise ParseError(f'Ошибка разбора MessagePack: {exc}')
@@ -0,0 +1,11 @@
+"""
+Общие классы прав доступа
+"""
+from rest_framework.permissions import BasePermission
+
+
+class IsSuperUser(BasePermission):
+    """Доступ только для суперпользователя"""
+
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated and request.user.is_superuser)
@@ -0,0 +1,222 @@
+"""
+Проверка планов выполнения критичных запросов (только PostgreSQL)
+
+PlanCheck описывает запрос через сценарий бенчмарка (apps.core.benchmark):
+сценарий выполняется, из выполненных SQL выбирается первый SELECT по основной
+таблице table (и содержащий match, если задан), для него снимается
+EXPLAIN (FORMAT JSON). Так проверяется SQL, который действительно формируют
+get_queryset и представления, включая добавленные позже фильтры и сортировки.
+
+Свойства плана:
+- uses_indexes — в плане есть сканирование по индексу с именем, подходящим под
+  шаблон fnmatch (имена индексов внешних ключей Django содержат хэш);
+- no_seq_scan — нет Seq Scan по таблицам;
+- max_rows — оценка числа строк корневого узла не больше заданной.
+
+Для каждого запроса в каталог артефактов пишутся план (.json), его сводка без
+стоимостей (.txt) и, если сводка отличается от базовой, разница (.diff).
+Запуск — команда check_plans, см. docs/benchmarks.md.
+"""
+import difflib
+import fnmatch
+import json
+import os
+from dataclasses import dataclass
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+@dataclass
+class PlanCheck:
+    name: str
+    scenario: str
+    table: str
+    match: str = None
+    uses_indexes: tuple = ()
+    no_seq_scan: tuple = ()
+    max_rows: int = None
+
+
+CHECKS = [
+    PlanCheck('project-sheet.by-project', 'project-sheet.list', 'projects_projectsheet', match='ORDER BY',
+              uses_indexes=('projects_projectsheet_project_id_*',), no_seq_scan=('projects_projectsheet',),
+              max_rows=500),
+    PlanCheck('project-sheet.created-by', 'project-sheet.list.created-by', 'projects_projectsheet',
+              match='ORDER BY', uses_indexes=('projects_projectsheet_created_by_id_*',), max_rows=1000),
+    PlanCheck('project-sheet.department', 'project-sheet.list.department', 'projects_projectsheet',
+              match='ORDER BY', max_rows=5000),
+    PlanCheck('project-stage.by-project', 'project-stage.list', 'projects_projectstage', match='ORDER BY',
+              uses_indexes=('projects_projectstage_project_id_*',), no_seq_scan=('projects_projectstage',),
+              max_rows=500),
+    PlanCheck('dashboard.chart', 'dashboard.data.filtered', 'projects_projectsheet', match='"completed_at" FROM',
+              max_rows=10000),
+]
+
+# Поля узла плана, попадающие в сводку (стоимости и время меняются от запуска к запуску)
+_SUMMARY_KEYS = ('Index Cond', 'Recheck Cond', 'Filter', 'Join Filter', 'Hash Cond', 'Merge Cond', 'Sort Key')
+
+
+def main_table(sql):
+    """Таблица из FROM верхнего уровня SELECT (подзапросы в скобках пропускаются)"""
+    if not sql.lstrip().upper().startswith('SELECT'):
+        return None
+    depth = 0
+    in_string = False
+    upper = sql.upper()
+    for index, char in enumerate(sql):
+        if char == "'":
+            in_string = not in_string
+        if in_string:
+            continue
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif depth == 0 and upper.startswith(' FROM ', index):
+            rest = sql[index + 6:].lstrip()
+            if rest.startswith('"'):
+                return rest[1:rest.index('"', 1)]
+            return rest.split()[0]
+    return None
+
+
+def find_query(sql_list, table, match=None):
+    """Первый SELECT по основной таблице table, содержащий match"""
+    for sql in sql_list:
+        if main_table(sql) == table and (match is None or match in sql):
+            return sql
+    return None
+
+
+def explain(sql):
+    """План запроса: корневой узел EXPLAIN (FORMAT JSON)"""
+    if connection.vendor != 'postgresql':
+        raise RuntimeError('EXPLAIN (FORMAT JSON) поддерживается только для PostgreSQL')
+    with connection.cursor() as cursor:
+        cursor.execute('EXPLAIN (FORMAT JSON) ' + sql)
+        result = cursor.fetchone()[0]
+    if isinstance(result, str):
+        result = json.loads(result)
+    return result[0]['Plan']
+
+
+def nodes(plan):
+    """Все узлы плана в порядке обхода в глубину"""
+    yield plan
+    for child in plan.get('Plans', ()):
+        yield from nodes(child)
+
+
+def violations(check, plan):
+    """Нарушенные свойства плана: список строк"""
+    problems = []
+    indexes = {node['Index Name'] for node in nodes(plan) if 'Index Name' in node}
+    for pattern in check.uses_indexes:
+        if not any(fnmatch.fnmatchcase(name, pattern) for name in indexes):
+            problems.append(f'{check.name}: не используется индекс {pattern} '
+                            f'(индексы в плане: {", ".join(sorted(indexes)) or "нет"})')
+    for table in check.no_seq_scan:
+        if any(node['Node Type'] == 'Seq Scan' and node.get('Relation Name') == table for node in nodes(plan)):
+            problems.append(f'{check.name}: Seq Scan по {table}')
+    if check.max_rows is not None and plan['Plan Rows'] > check.max_rows:
+        problems.append(f'{check.name}: оценка {plan["Plan Rows"]} строк больше {check.max_rows}')
+    return problems
+
+
+def summarize(plan, depth=0):
+    """Сводка плана: узлы с таблицами, индексами, условиями и оценкой строк"""
+    indent = '  ' * depth
+    title = plan['Node Type']
+    if 'Join Type' in plan and title in ('Hash Join', 'Merge Join', 'Nested Loop'):
+        title += f' ({plan["Join Type"]})'
+    if 'Index Name' in plan:
+        title += f' using {plan["Index Name"]}'
+    if 'Relation Name' in plan:
+        title += f' on {plan["Relation Name"]}'
+    lines = [f'{indent}{"-> " if depth else ""}{title} (rows={plan["Plan Rows"]})']
+    for key in _SUMMARY_KEYS:
+        if key in plan:
+            value = plan[key]
+            value = ', '.join(value) if isinstance(value, list) else value
+            lines.append(f'{indent}     {key}: {value}')
+    for child in plan.get('Plans', ()):
+        lines.extend(summarize(child, depth + 1))
+    return lines
+
+
+def baseline_path(baseline_dir, name):
+    """Путь к базовой сводке проверки name или None, если ее нет"""
+    path = os.path.join(baseline_dir, f'{name}.txt') if baseline_dir else None
+    return path if path and os.path.exists(path) else None
+
+
+def write_artifacts(directory, name, sql, plan, baseline_dir=None):
+    """План, сводка и разница с базовой сводкой; возвращает текст разницы или ''"""
+    os.makedirs(directory, exist_ok=True)
+    summary = '\n'.join(summarize(plan)) + '\n'
+    with open(os.path.join(directory, f'{name}.json'), 'w', encoding='utf-8') as f:
+        json.dump({'sql': sql, 'plan': plan}, f, ensure_ascii=False, indent=2)
+    with open(os.path.join(directory, f'{name}.txt'), 'w', encoding='utf-8') as f:
+        f.write(summary)
+
+    diff_path = os.path.join(directory, f'{name}.diff')
+    path = baseline_path(baseline_dir, name)
+    diff = ''
+    if path:
+        with open(path, encoding='utf-8') as f:
+            baseline = f.read()
+        diff = ''.join(difflib.unified_diff(
+            baseline.splitlines(keepends=True), summary.splitlines(keepends=True),
+            fromfile=f'baseline/{name}.txt', tofile=f'{name}.txt',
+        ))
+    if diff:
+        with open(diff_path, 'w', encoding='utf-8') as f:
+            f.write(diff)
+    elif os.path.exists(diff_path):
+        os.remove(diff_path)
+    return diff
+
+
+def save_baseline(baseline_dir, name, plan):
+    os.makedirs(baseline_dir, exist_ok=True)
+    with open(os.path.join(baseline_dir, f'{name}.txt'), 'w', encoding='utf-8') as f:
+        f.write('\n'.join(summarize(plan)) + '\n')
+
+
+def capture_query(check, client, fixtures):
+    """Выполнить сценарий проверки и вернуть SQL выбранного запроса (работает на любой БД)"""
+    from .benchmark import SCENARIOS
+
+    scenario = next(scenario for scenario in SCENARIOS if scenario.name == check.scenario)
+    path = scenario.path(fixtures) if callable(scenario.path) else scenario.path
+    with CaptureQueriesContext(connection) as context:
+        response = client.get(path, scenario.resolve_params(fixtures))
+    if response.status_code != 200:
+        raise AssertionError(f'{check.name}: {scenario.name} вернул {response.status_code}')
+    sql = find_query([query['sql'] for query in context.captured_queries], check.table, check.match)
+    if sql is None:
+        raise AssertionError(f'{check.name}: в {scenario.name} нет SELECT по {check.table}'
+                             + (f' с {check.match!r}' if check.match else ''))
+    return sql
+
+
+def run_checks(checks, clients, fixtures, artifacts_dir, baseline_dir=None):
+    """Проверить планы; вернуть {имя: {'violations', 'diff', 'plan', 'has_baseline'}}"""
+    from .benchmark import SCENARIOS
+
+    users = {scenario.name: scenario.user for scenario in SCENARIOS}
+    with connection.cursor() as cursor:
+        # Статистика для оценок планировщика по только что созданным данным
+        cursor.execute('ANALYZE')
+    results = {}
+    for check in checks:
+        sql = capture_query(check, clients[users[check.scenario]], fixtures)
+        plan = explain(sql)
+        results[check.name] = {
+            'violations': violations(check, plan),
+            'diff': write_artifacts(artifacts_dir, check.name, sql, plan, baseline_dir),
+            'plan': plan,
+            'has_baseline': baseline_path(baseline_dir, check.name) is not None,
+        }
+    return results
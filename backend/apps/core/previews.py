@@ -0,0 +1,188 @@
+"""
+Превью вложений: уменьшенные JPEG для изображений и первой страницы PDF
+
+Превью строится для блоба ContentAddressedStorage (или S3ContentAddressedStorage)
+и лежит рядом с ним: blobs/ab/cd/<sha256>.preview.jpg. Одинаковые файлы получают одно превью, а
+URL превью (/api/core/previews/<sha256>.jpg) неизменяем, как и URL блоба.
+
+Генерация идет вне запроса: после фиксации транзакции, создавшей Blob, задача
+отправляется в пул потоков процесса (PREVIEWS['WORKERS']). Тип файла
+определяется по содержимому: PDF рендерится утилитой pdftoppm (poppler-utils),
+изображения уменьшаются Pillow. Если нужного инструмента нет, превью не
+строится. Запрос отсутствующего превью ставит его в очередь повторно (например,
+после перезапуска процесса). Неудача (тип не поддерживается, нет инструмента,
+ошибка построения) отмечается в Blob.preview_failed, и такие блобы запросы в
+очередь больше не ставят. Команда generate_previews строит превью для всех
+блобов, включая отмеченные.
+"""
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models.signals import post_save
+from django.urls import reverse
+
+from .models import Blob
+
+logger = logging.getLogger(__name__)
+
+# Расширения, для которых в сериализаторах отдается preview_url
+EXTENSIONS = ('.pdf', '.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.webp')
+# Окончание имени файла превью после дайджеста
+SUFFIX = '.preview.jpg'
+
+_executor = {'pid': None, 'pool': None}
+_executor_lock = threading.Lock()
+# Дайджесты, превью которых строится сейчас
+_pending = set()
+_pending_lock = threading.Lock()
+
+
+def preview_name(digest):
+    """Имя превью в хранилище"""
+    return f'{default_storage.blob_name(digest)}{SUFFIX}'
+
+
+def preview_url(field_file):
+    """URL превью файла модели или None (файл не в блобе или тип без превью)
+
+    Считается по имени, без обращения к диску и БД: превью может быть еще не готово.
+    """
+    if not field_file:
+        return None
+    digest = getattr(field_file.storage, 'digest', lambda name: None)(field_file.name)
+    if digest is None or not field_file.name.lower().endswith(EXTENSIONS):
+        return None
+    return reverse('blob_preview', kwargs={'digest': digest})
+
+
+def _pool():
+    pid = os.getpid()
+    if _executor['pid'] != pid:
+        with _executor_lock:
+            if _executor['pid'] != pid:
+                # После fork пул родителя не работает: создается свой
+                _executor.update(pid=pid, pool=ThreadPoolExecutor(
+                    max_workers=settings.PREVIEWS['WORKERS'], thread_name_prefix='previews',
+                ))
+    return _executor['pool']
+
+
+def schedule(digest):
+    """Поставить построение превью в очередь; Future или None, если оно уже строится"""
+    if not settings.PREVIEWS['ENABLED']:
+        return None
+    with _pending_lock:
+        if digest in _pending:
+            return None
+        _pending.add(digest)
+    return _pool().submit(_run, digest)
+
+
+def _run(digest):
+    try:
+        try:
+            built = generate(digest)
+        except Exception:
+            logger.exception('Ошибка построения превью %s', digest)
+            built = False
+        # Удачная сборка в БД не пишет: превью отдается по наличию файла
+        if not built:
+            mark_failed(digest)
+        return built
+    finally:
+        with _pending_lock:
+            _pending.discard(digest)
+        connections.close_all()
+
+
+def mark_failed(digest, failed=True):
+    """Отметить, что превью блоба не построить (запросы не будут ставить его в очередь)"""
+    Blob.objects.filter(digest=digest).update(preview_failed=failed)
+
+
+def generate(digest):
+    """Построить превью блоба; True — превью есть, False — тип не поддерживается"""
+    options = settings.PREVIEWS
+    storage = default_storage
+    target = preview_name(digest)
+    if storage.exists(target):
+        return True
+    blob = storage.blob_name(digest)
+    if storage.size(blob) > options['MAX_SOURCE_SIZE']:
+        return False
+
+    try:
+        # Рядом с блобом, чтобы замена была переименованием
+        temp_dir = os.path.dirname(storage.path(target))
+    except NotImplementedError:
+        temp_dir = None
+    with storage.local_copy(blob) as source:
+        with open(source, 'rb') as f:
+            header = f.read(8)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir, suffix='.jpg')
+        os.close(fd)
+        try:
+            if header.startswith(b'%PDF'):
+                built = _render_pdf(source, temp_path, options)
+            else:
+                built = _resize_image(source, temp_path, options)
+            if built:
+                storage.replace_file(target, temp_path)
+            return built
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+
+def _render_pdf(source, target, options):
+    executable = shutil.which(options['PDFTOPPM'])
+    if executable is None:
+        return False
+    # pdftoppm сам добавляет расширение к префиксу выходного файла
+    prefix = target[:-len('.jpg')]
+    subprocess.run(
+        [executable, '-f', '1', '-l', '1', '-singlefile', '-jpeg', '-jpegopt', f'quality={options["QUALITY"]}',
+         '-scale-to', str(options['SIZE']), source, prefix],
+        check=True, timeout=options['TIMEOUT'], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    return os.path.getsize(target) > 0
+
+
+def _resize_image(source, target, options):
+    try:
+        from PIL import Image, ImageOps, UnidentifiedImageError
+    except ImportError:
+        return False
+    try:
+        image = Image.open(source)
+    except UnidentifiedImageError:
+        return False
+    with image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((options['SIZE'], options['SIZE']))
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(target, 'JPEG', quality=options['QUALITY'], optimize=True)
+    return True
+
+
+def delete(digest):
+    default_storage.delete(preview_name(digest))
+
+
+def _on_blob_created(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        transaction.on_commit(lambda: schedule(instance.digest))
+
+
+def connect_model_signals():
+    """Строить превью для новых блобов после фиксации транзакции"""
+    post_save.connect(_on_blob_created, sender=Blob, dispatch_uid='previews:blob_created')
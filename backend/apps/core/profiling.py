@@ -0,0 +1,134 @@
+"""
+Профилирование отдельных запросов по запросу суперпользователя
+
+Запрос с параметром ?_profile=1 или заголовком X-Profile: 1 от суперпользователя
+(JWT) выполняется под cProfile, параллельно стек потока семплируется с
+интервалом PROFILING['SAMPLE_INTERVAL'] (граф вызовов cProfile не хранит полных
+стеков). Профиль сохраняется в каталог PROFILING['DIR'] в трех видах:
+статистика pstats (.prof, открывается snakeviz / pstats), свернутые стеки
+(.collapsed, вход для flamegraph.pl / speedscope) и текстовая сводка (.txt).
+Хранится не более PROFILING['MAX_PROFILES'] профилей не старше
+PROFILING['MAX_AGE_DAYS'] дней. В ответ добавляется заголовок X-Profile-Id,
+профиль доступен через /api/core/profiles/<id>/.
+
+Без флага запрос обрабатывается как обычно: проверяется только наличие
+параметра и заголовка. Флаг от остальных пользователей игнорируется.
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import time
+import uuid
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+
+from .sampling import format_collapsed, sample_current_thread
+
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+PROFILE_ID_RE = re.compile(r'^\d{8}T\d{6}-[0-9a-f]{8}$')
+FORMATS = {'pstats': '.prof', 'collapsed': '.collapsed', 'summary': '.txt'}
+
+
+def is_requested(request):
+    """Есть ли в запросе флаг профилирования"""
+    return PROFILE_PARAM in request.GET or PROFILE_HEADER in request.META
+
+
+def is_allowed(request):
+    """Флаг принят: запрос от суперпользователя с действительным JWT"""
+    # Модуль аутентификации импортирует модели, поэтому только здесь
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    try:
+        result = JWTAuthentication().authenticate(request)
+    except (AuthenticationFailed, InvalidToken, TokenError):
+        return False
+    return result is not None and result[0].is_superuser
+
+
+def _directory():
+    directory = str(settings.PROFILING['DIR'])
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def path_for(profile_id, fmt):
+    """Путь к файлу профиля; None для некорректного id или формата"""
+    if not PROFILE_ID_RE.match(profile_id or '') or fmt not in FORMATS:
+        return None
+    return os.path.join(str(settings.PROFILING['DIR']), profile_id + FORMATS[fmt])
+
+
+def list_profiles():
+    """Сохраненные профили, новые первыми"""
+    directory = str(settings.PROFILING['DIR'])
+    if not os.path.isdir(directory):
+        return []
+    result = []
+    for name in os.listdir(directory):
+        profile_id, ext = os.path.splitext(name)
+        if ext == FORMATS['pstats'] and PROFILE_ID_RE.match(profile_id):
+            meta_path = os.path.join(directory, profile_id + FORMATS['summary'])
+            description = ''
+            if os.path.exists(meta_path):
+                with open(meta_path, encoding='utf-8') as f:
+                    description = f.readline().strip()
+            result.append({'id': profile_id, 'request': description})
+    return sorted(result, key=lambda item: item['id'], reverse=True)
+
+
+def _apply_retention(directory):
+    options = settings.PROFILING
+    ids = sorted(
+        {os.path.splitext(name)[0] for name in os.listdir(directory) if PROFILE_ID_RE.match(os.path.splitext(name)[0])},
+        reverse=True,
+    )
+    expired = time.time() - options['MAX_AGE_DAYS'] * 86400
+    for index, profile_id in enumerate(ids):
+        pstats_path = os.path.join(directory, profile_id + FORMATS['pstats'])
+        too_old = os.path.exists(pstats_path) and os.path.getmtime(pstats_path) < expired
+        if index >= options['MAX_PROFILES'] or too_old:
+            for ext in FORMATS.values():
+                try:
+                    os.remove(os.path.join(directory, profile_id + ext))
+                except FileNotFoundError:
+                    pass
+
+
+def save(profiler, samples, request, response, duration):
+    """Сохранить профиль запроса и вернуть его id"""
+    directory = _directory()
+    profile_id = f'{timezone.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}'
+    pstats.Stats(profiler).dump_stats(os.path.join(directory, profile_id + FORMATS['pstats']))
+    with open(os.path.join(directory, profile_id + FORMATS['collapsed']), 'w', encoding='utf-8') as f:
+        # Значение строки — время в микросекундах (число семплов * интервал)
+        f.write(format_collapsed(samples, round(settings.PROFILING['SAMPLE_INTERVAL'] * 1_000_000)))
+
+    summary = io.StringIO()
+    pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(40)
+    with open(os.path.join(directory, profile_id + FORMATS['summary']), 'w', encoding='utf-8') as f:
+        f.write(f'{request.method} {request.get_full_path()} -> {response.status_code}, {duration * 1000:.1f} ms\n\n')
+        f.write(summary.getvalue())
+
+    _apply_retention(directory)
+    return profile_id
+
+
+def run(get_response, request):
+    """Выполнить запрос под cProfile и семплированием стека; вернуть (response, profile_id)"""
+    profiler = cProfile.Profile()
+    sampler = sample_current_thread(settings.PROFILING['SAMPLE_INTERVAL'])
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        response = get_response(request)
+    finally:
+        profiler.disable()
+        samples = sampler.stop()
+    duration = time.perf_counter() - start
+    return response, save(profiler, samples, request, response, duration)
@@ -0,0 +1,103 @@
+"""
+Кэш небольших справочных таблиц (статусы, отделы) в памяти процесса
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+
+from . import invalidation
+from .cache import bump_version, get_version
+
+
+class ReferenceCache:
+    """Снимок справочной таблицы в памяти процесса
+
+    Таблица загружается целиком одним запросом. Актуальность проверяется по общему
+    версионному ключу не чаще раза в REFERENCE_CACHE_CHECK_INTERVAL секунд, поэтому
+    изменение, сделанное в одном воркере, подхватывается всеми остальными.
+    Сохранение и удаление строк сбрасывают локальный снимок сразу, а общую
+    версию — после коммита транзакции. События шины инвалидации об изменении
+    модели сбрасывают снимок немедленно, не дожидаясь проверки версии.
+    """
+
+    def __init__(self, model, namespace=None):
+        self.model = model
+        self.namespace = namespace or f'reference:{model._meta.label_lower}'
+        self._lock = threading.Lock()
+        self._rows = None
+        self._version = None
+        self._checked_at = 0.0
+        dispatch_uid = f'reference-cache:{self.namespace}'
+        post_save.connect(self._on_change, sender=model, weak=False, dispatch_uid=dispatch_uid)
+        post_delete.connect(self._on_change, sender=model, weak=False, dispatch_uid=dispatch_uid)
+        invalidation.subscribe(self._on_event)
+
+    def __deepcopy__(self, memo):
+        # DRF копирует аргументы полей для каждого сериализатора; кэш общий на процесс
+        return self
+
+    def _snapshot(self, version=None):
+        """Словарь pk -> объект, перечитывается при смене версии
+
+        version — уже прочитанная общая версия: снимок не старше нее, без ожидания
+        REFERENCE_CACHE_CHECK_INTERVAL.
+        """
+        rows = self._rows
+        now = time.monotonic()
+        if version is None:
+            if rows is not None and now - self._checked_at < settings.REFERENCE_CACHE_CHECK_INTERVAL:
+                return rows
+            version = get_version(self.namespace)
+        if rows is not None and version == self._version:
+            self._checked_at = now
+            return rows
+        rows = {obj.pk: obj for obj in self.model._default_manager.all()}
+        # Внутри транзакции видны незакоммиченные строки: такой снимок не сохраняем,
+        # иначе после отката он остался бы в памяти до следующей смены версии
+        if not connection.in_atomic_block:
+            with self._lock:
+                self._rows = rows
+                self._version = version
+                self._checked_at = now
+        return rows
+
+    def _on_change(self, sender, **kwargs):
+        self._rows = None
+        transaction.on_commit(self.invalidate)
+
+    def _on_event(self, event):
+        # Изменение в другом воркере приходит через LISTEN/NOTIFY без ожидания проверки версии
+        if event.get('clear') or self.model._meta.label in event.get('models', ()):
+            self._rows = None
+
+    def invalidate(self):
+        """Сбросить снимок во всех процессах"""
+        self._rows = None
+        bump_version(self.namespace)
+
+    def to_pk(self, value):
+        """Приведение значения к типу первичного ключа (ValidationError при ошибке)"""
+        return self.model._meta.pk.to_python(value)
+
+    def get(self, pk):
+        """Объект по первичному ключу или None"""
+        try:
+            pk = self.to_pk(pk)
+        except ValidationError:
+            return None
+        return self._snapshot().get(pk)
+
+    def all(self, version=None):
+        """Все объекты в порядке первичного ключа; version — см. _snapshot()"""
+        return sorted(self._snapshot(version).values(), key=lambda obj: obj.pk)
+
+    def filter(self, **lookups):
+        """Объекты, у которых атрибуты равны переданным значениям"""
+        return [
+            obj for obj in self.all()
+            if all(getattr(obj, attr) == value for attr, value in lookups.items())
+        ]
@@ -0,0 +1,64 @@
+"""
+Рендереры API: компактный бинарный формат MessagePack для мобильного клиента и
+стандартные рендереры DRF с замером времени (этап render в Server-Timing)
+"""
+import datetime
+import decimal
+import uuid
+
+import msgpack
+from django.utils.functional import Promise
+from rest_framework import renderers
+
+from .timing import span
+
+
+def _encode_default(obj):
+    """Преобразование типов, которые msgpack не умеет упаковывать сам"""
+    if isinstance(obj, datetime.datetime):
+        # Aware datetime упаковывается в Timestamp (ext -1): 6-10 байт вместо ~32 символов ISO
+        if obj.tzinfo is not None:
+            return msgpack.Timestamp.from_datetime(obj)
+        return obj.isoformat()
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    if isinstance(obj, datetime.timedelta):
+        return obj.total_seconds()
+    if isinstance(obj, (decimal.Decimal, uuid.UUID, Promise)):
+        return str(obj)
+    if isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+    if hasattr(obj, '__iter__'):
+        return list(obj)
+    raise TypeError(f'Тип {type(obj).__name__} не поддерживается MessagePack')
+
+
+class TimedRendererMixin:
+    """Учет времени render()"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with span('render'):
+            return super().render(data, accepted_media_type, renderer_context)
+
+
+class JSONRenderer(TimedRendererMixin, renderers.JSONRenderer):
+    pass
+
+
+class BrowsableAPIRenderer(TimedRendererMixin, renderers.BrowsableAPIRenderer):
+    pass
+
+
+class MessagePackRenderer(TimedRendererMixin, renderers.BaseRenderer):
+    """Рендерер MessagePack (Accept: application/msgpack)"""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+    # Сериализаторы отдают datetime без преобразования в строку (см. apps.core.serializers.DateTimeField)
+    native_datetimes = True
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_encode_default, use_bin_type=True, datetime=False)
@@ -0,0 +1,248 @@
+"""
+Хранилище файлов в S3-совместимом объектном хранилище (AWS S3, MinIO и т.п.)
+
+S3ContentAddressedStorage именует файлы так же, как ContentAddressedStorage
+(apps.core.storage): в поле модели — cas/<sha256>/<имя файла>, объект блоба —
+<S3['PREFIX']>blobs/ab/cd/<sha256> в бакете S3['BUCKET']. Счетчики ссылок,
+сборка файлов без ссылок и превью работают через методы хранилища и от выбора
+хранилища не зависят. Включается STORAGE_BACKEND=s3; на узлах приложения тогда
+не остается файлов, и их можно запускать несколько.
+
+Скачивание: после проверки прав API отвечает 302 на presigned URL объекта со
+сроком S3['URL_EXPIRES'] (downloads.serve_stored), байты идут клиенту из
+хранилища мимо приложения. Content-Type и Content-Disposition задаются
+параметрами подписанного URL.
+
+Загрузка напрямую (views.upload_direct): клиент получает presigned POST на объект
+blobs/uploads/<id сессии> с условием на точный размер и, при
+S3['POST_CHECKSUM'], на SHA-256 (x-amz-checksum-sha256 проверяет само
+хранилище). attach_upload сверяет SHA-256 по метаданным объекта (HEAD; если
+хранилище контрольную сумму не сохранило — чтением объекта) и копирует объект в
+блоб на стороне хранилища (CopyObject).
+
+boto3 — необязательная зависимость: импортируется при первом обращении к хранилищу.
+"""
+import base64
+import hashlib
+import os
+import posixpath
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.base import File
+from django.core.files.storage import Storage
+from django.utils.functional import cached_property
+from django.utils.http import content_disposition_header
+
+from .downloads import content_type
+from .storage import PREFIX, ContentAddressing
+
+# Больше этого размера CopyObject не копирует: нужна копия частями
+_MAX_COPY_SIZE = 5 * 1024 ** 3
+
+
+def _b64(digest):
+    return base64.b64encode(bytes.fromhex(digest)).decode()
+
+
+class S3ContentAddressedStorage(ContentAddressing, Storage):
+    """Хранилище с дедупликацией по содержимому в бакете S3-совместимого хранилища"""
+
+    def __init__(self, **options):
+        self.options = {**settings.S3, **options}
+        if not self.options['BUCKET']:
+            raise ImproperlyConfigured('Для S3ContentAddressedStorage нужен S3_BUCKET')
+        self.bucket = self.options['BUCKET']
+
+    def _client(self, endpoint_url):
+        try:
+            import boto3
+            from botocore.config import Config
+        except ImportError:
+            raise ImproperlyConfigured('Для S3ContentAddressedStorage нужен пакет boto3')
+        options = self.options
+        return boto3.client(
+            's3',
+            endpoint_url=endpoint_url or None,
+            region_name=options['REGION'],
+            aws_access_key_id=options['ACCESS_KEY'] or None,
+            aws_secret_access_key=options['SECRET_KEY'] or None,
+            config=Config(
+                signature_version='s3v4',
+                s3={'addressing_style': options['ADDRESSING_STYLE']},
+                # Контрольные суммы по умолчанию (CRC) поддерживают не все S3-совместимые хранилища
+                request_checksum_calculation='when_required',
+                response_checksum_validation='when_required',
+            ),
+        )
+
+    @cached_property
+    def client(self):
+        return self._client(self.options['ENDPOINT_URL'])
+
+    @cached_property
+    def signing_client(self):
+        # Клиент может видеть хранилище по другому адресу, чем приложение
+        # (MinIO в docker-compose): подпись включает адрес
+        public = self.options['PUBLIC_ENDPOINT_URL']
+        return self._client(public) if public else self.client
+
+    def key(self, name):
+        """Ключ объекта для имени файла"""
+        return self.options['PREFIX'] + self.stored_name(name)
+
+    def _head(self, name, **params):
+        """Метаданные объекта (HEAD) или None, если его нет"""
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self.key(name), **params)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def _stat(self, name):
+        head = self._head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head
+
+    def exists(self, name):
+        return self._head(name) is not None
+
+    def size(self, name):
+        return self._stat(name)['ContentLength']
+
+    def get_modified_time(self, name):
+        return self._stat(name)['LastModified']
+
+    def _open(self, name, mode='rb'):
+        from botocore.exceptions import ClientError
+        try:
+            body = self.client.get_object(Bucket=self.bucket, Key=self.key(name))['Body']
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey'):
+                raise FileNotFoundError(name)
+            raise
+        return File(body, name)
+
+    def _save(self, name, content):
+        digest = getattr(content, 'content_sha256', None)
+        if digest:
+            if not self._claim(digest):
+                content.seek(0)
+                self.client.upload_fileobj(content, self.bucket, self.key(self.blob_name(digest)))
+            return f'{PREFIX}/{digest}/{os.path.basename(name)}'
+
+        # Дайджест нужен до выбора ключа: содержимое пишется во временный файл с подсчетом хэша
+        sha256 = hashlib.sha256()
+        with tempfile.TemporaryFile() as temp:
+            for chunk in content.chunks():
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                sha256.update(chunk)
+                temp.write(chunk)
+            digest = sha256.hexdigest()
+            if not self._claim(digest):
+                temp.seek(0)
+                self.client.upload_fileobj(temp, self.bucket, self.key(self.blob_name(digest)))
+        return f'{PREFIX}/{digest}/{os.path.basename(name)}'
+
+    def import_file(self, path, filename, digest, max_length=None):
+        """Загрузить готовый локальный файл path с известным дайджестом в блоб; path остается"""
+        if not self._claim(digest):
+            self.client.upload_file(path, self.bucket, self.key(self.blob_name(digest)))
+        return self.cas_name(digest, filename, max_length)
+
+    def import_object(self, name, size, filename, digest, max_length=None):
+        """Скопировать объект name (size байт) с известным дайджестом в блоб на стороне хранилища
+
+        Возвращает имя cas/. Объект name остается, его удаляет вызывающий.
+        """
+        target = self.blob_name(digest)
+        if not self._claim(digest):
+            source = {'Bucket': self.bucket, 'Key': self.key(name)}
+            if size > _MAX_COPY_SIZE:
+                self.client.copy(source, self.bucket, self.key(target))
+            else:
+                self.client.copy_object(CopySource=source, Bucket=self.bucket, Key=self.key(target))
+        return self.cas_name(digest, filename, max_length)
+
+    def object_digest(self, name):
+        """(размер, SHA-256) объекта
+
+        SHA-256 берется из контрольной суммы, сохраненной хранилищем, иначе считается чтением объекта.
+        """
+        head = self._head(name, ChecksumMode='ENABLED')
+        if head is None:
+            raise FileNotFoundError(name)
+        checksum = head.get('ChecksumSHA256')
+        # Сумма объекта, загруженного частями, — сумма сумм частей ("...-N")
+        if checksum and '-' not in checksum:
+            return head['ContentLength'], base64.b64decode(checksum).hex()
+        sha256 = hashlib.sha256()
+        body = self.client.get_object(Bucket=self.bucket, Key=self.key(name))['Body']
+        with body:
+            for chunk in body.iter_chunks(settings.UPLOADS['BUFFER_SIZE']):
+                sha256.update(chunk)
+        return head['ContentLength'], sha256.hexdigest()
+
+    def delete(self, name):
+        if self.digest(name) is None:
+            self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+
+    def delete_blob(self, digest):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(self.blob_name(digest)))
+
+    def url(self, name):
+        if self.digest(name) is None:
+            return self.presigned_url(name, as_attachment=False)
+        return super().url(name)
+
+    def presigned_url(self, name, filename=None, as_attachment=True, expires=None):
+        """Подписанный URL скачивания объекта со сроком S3['URL_EXPIRES']"""
+        filename = filename or posixpath.basename(name)
+        return self.signing_client.generate_presigned_url('get_object', Params={
+            'Bucket': self.bucket,
+            'Key': self.key(name),
+            'ResponseContentType': content_type(filename),
+            'ResponseContentDisposition': content_disposition_header(as_attachment, filename),
+        }, ExpiresIn=expires or self.options['URL_EXPIRES'])
+
+    def presigned_post(self, name, size, sha256=None, expires=None):
+        """Подписанная форма загрузки объекта name размером ровно size байт: {'url', 'fields'}"""
+        fields, conditions = {}, [['content-length-range', size, size]]
+        if sha256 and self.options['POST_CHECKSUM']:
+            fields['x-amz-checksum-sha256'] = _b64(sha256)
+            conditions.append({'x-amz-checksum-sha256': fields['x-amz-checksum-sha256']})
+        return self.signing_client.generate_presigned_post(
+            self.bucket, self.key(name), Fields=fields, Conditions=conditions,
+            ExpiresIn=expires or self.options['UPLOAD_EXPIRES'],
+        )
+
+    @contextmanager
+    def local_copy(self, name):
+        """Путь к временной локальной копии объекта name"""
+        fd, path = tempfile.mkstemp()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.client.download_fileobj(self.bucket, self.key(name), f)
+            yield path
+        finally:
+            os.remove(path)
+
+    def replace_file(self, name, path):
+        """Загрузить локальный файл path в объект name (с заменой) и удалить path"""
+        self.client.upload_file(path, self.bucket, self.key(name))
+        os.remove(path)
+
+    def scan(self, prefix, ordered=False):
+        """(имя, время изменения) объектов с именами под prefix/ в порядке возрастания ключей"""
+        root = self.options['PREFIX']
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=f'{root}{prefix}/'):
+            for item in page.get('Contents', ()):
+                yield item['Key'][len(root):], item['LastModified'].timestamp()
+
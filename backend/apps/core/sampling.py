@@ -0,0 +1,208 @@
+"""
+Семплирование стеков Python-потоков
+
+Стек снимается через sys._current_frames() из отдельного потока и сворачивается в
+строку формата flamegraph.pl / speedscope: кадры от корня к вершине через ';'.
+
+ThreadSampler снимает стек одного потока (профилирование по запросу, см.
+apps.core.profiling). ContinuousSampler при SAMPLING['ENABLED'] работает в
+каждом воркере постоянно: раз в INTERVAL секунд снимает стеки потоков, которые
+обрабатывают запросы, и добавляет в их корень метку действия (basename:action).
+Стеки копятся в окнах по WINDOW секунд; закрытое окно записывается в файл
+SAMPLING['DIR']/<начало окна>-<pid>-<номер>.collapsed (значения — микросекунды), файлы
+старше RETENTION секунд удаляются. Команда dump_samples объединяет окна всех
+воркеров. Если сам семплер занимает больше MAX_OVERHEAD доли времени, интервал
+увеличивается.
+"""
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Максимальная глубина сохраняемого стека (кадры ближе к корню отбрасываются)
+MAX_DEPTH = 200
+
+
+def frame_label(code):
+    return f'{os.path.basename(code.co_filename)}:{code.co_firstlineno}:{code.co_name}'
+
+
+def collapse(frame, prefix=None):
+    """Стек кадра одной строкой от корня к вершине"""
+    labels = []
+    while frame is not None and len(labels) < MAX_DEPTH:
+        labels.append(frame_label(frame.f_code))
+        frame = frame.f_back
+    if prefix:
+        labels.append(prefix)
+    return ';'.join(reversed(labels))
+
+
+def format_collapsed(counts, weight=1):
+    """Строки 'стек значение' из словаря {стек: число семплов}"""
+    return ''.join(f'{stack} {count * weight}\n' for stack, count in sorted(counts.items()))
+
+
+class ThreadSampler(threading.Thread):
+    """Семплирование стека одного потока с заданным интервалом до вызова stop()"""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(name='thread-sampler', daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = {}
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = collapse(frame)
+                self.counts[stack] = self.counts.get(stack, 0) + 1
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+        return self.counts
+
+
+def sample_current_thread(interval):
+    """Запустить ThreadSampler для текущего потока"""
+    sampler = ThreadSampler(threading.get_ident(), interval)
+    sampler.start()
+    return sampler
+
+
+# Потоки, обрабатывающие запросы: id потока -> метка действия
+_requests = {}
+_sampler = {'pid': None, 'thread': None}
+_sampler_lock = threading.Lock()
+
+
+def set_request_label(label):
+    """Отметить текущий поток как обрабатывающий запрос с меткой label"""
+    if not settings.SAMPLING['ENABLED']:
+        return
+    _requests[threading.get_ident()] = label
+    if _sampler['pid'] != os.getpid():
+        start()
+
+
+def clear_request_label():
+    _requests.pop(threading.get_ident(), None)
+
+
+class ContinuousSampler(threading.Thread):
+    """Постоянное семплирование стеков запросов с записью окон в файлы"""
+
+    def __init__(self, options):
+        super().__init__(name='continuous-sampler', daemon=True)
+        self.interval = options['INTERVAL']
+        self.base_interval = options['INTERVAL']
+        self.window = options['WINDOW']
+        self.retention = options['RETENTION']
+        self.max_overhead = options['MAX_OVERHEAD']
+        self.directory = str(options['DIR'])
+        self.counts = {}
+        self.window_start = time.time()
+        self.busy = 0.0
+        self.windows = 0
+        self._stopped = threading.Event()
+
+    def sample_once(self):
+        """Снять стеки всех потоков с запросами; вернуть число снятых стеков"""
+        frames = sys._current_frames()
+        weight = round(self.interval * 1_000_000)
+        sampled = 0
+        for thread_id, label in list(_requests.items()):
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+            stack = collapse(frame, prefix=label)
+            self.counts[stack] = self.counts.get(stack, 0) + weight
+            sampled += 1
+        return sampled
+
+    def _adjust_interval(self, elapsed):
+        # Доля времени, которую занимает семплер; при превышении интервал растет
+        self.busy = self.busy * 0.9 + elapsed / self.interval * 0.1
+        if self.busy > self.max_overhead:
+            self.interval = min(self.interval * 2, 1.0)
+        elif self.busy < self.max_overhead / 4 and self.interval > self.base_interval:
+            self.interval = max(self.interval / 2, self.base_interval)
+
+    def flush(self):
+        """Записать текущее окно в файл и начать новое"""
+        counts, start = self.counts, self.window_start
+        self.counts, self.window_start = {}, time.time()
+        os.makedirs(self.directory, exist_ok=True)
+        if counts:
+            moment = datetime.fromtimestamp(start, tz=timezone.utc)
+            self.windows += 1
+            name = f'{moment:%Y%m%dT%H%M%S}-{os.getpid()}-{self.windows}.collapsed'
+            path = os.path.join(self.directory, name)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(format_collapsed(counts))
+        expired = time.time() - self.retention
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith('.collapsed') and os.path.getmtime(path) < expired:
+                os.remove(path)
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            started = time.perf_counter()
+            try:
+                self.sample_once()
+                if time.time() - self.window_start >= self.window:
+                    self.flush()
+            except Exception:
+                logger.exception('Ошибка семплирования стеков')
+            self._adjust_interval(time.perf_counter() - started)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start():
+    """Запустить ContinuousSampler в текущем процессе (однократно, повторно после fork)"""
+    pid = os.getpid()
+    with _sampler_lock:
+        if _sampler['pid'] == pid:
+            return _sampler['thread']
+        thread = ContinuousSampler(settings.SAMPLING)
+        thread.start()
+        _sampler.update(pid=pid, thread=thread)
+        return thread
+
+
+def read_windows(directory, since=None):
+    """Объединить окна из файлов каталога: {стек: микросекунды}
+
+    since — datetime (aware): учитываются только окна, начатые не раньше.
+    """
+    counts = {}
+    if not os.path.isdir(directory):
+        return counts
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.collapsed'):
+            continue
+        if since is not None:
+            try:
+                started = datetime.strptime(name.split('-', 1)[0], '%Y%m%dT%H%M%S')
+            except ValueError:
+                continue
+            if started.replace(tzinfo=timezone.utc) < since:
+                continue
+        with open(os.path.join(directory, name), encoding='utf-8') as f:
+            for line in f:
+                stack, _, value = line.rstrip('\n').rpartition(' ')
+                if stack and value.isdigit():
+                    counts[stack] = counts.get(stack, 0) + int(value)
+    return counts
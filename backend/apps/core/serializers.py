@@ -0,0 +1,247 @@
+"""
+Базовые классы и поля сериализаторов, общие для всех приложений
+"""
+import os
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation, ValidationError as DjangoValidationError
+from django.core.files.storage import default_storage
+from django.db import models
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+from .db import sync_many_to_many
+from .models import SlowQuery, UploadSession
+from .timing import span
+from .uploads import expires_at
+
+
+class DateTimeField(serializers.DateTimeField):
+    """DateTimeField, отдающий datetime как есть для бинарных рендереров
+
+    Для JSON поведение не меняется (ISO 8601 строка). Если согласованный рендерер
+    объявляет native_datetimes (MessagePack), значение возвращается объектом datetime
+    и упаковывается в компактный Timestamp.
+    """
+
+    def to_representation(self, value):
+        if value and not isinstance(value, str) and self._native_datetimes():
+            return self.enforce_timezone(value)
+        return super().to_representation(value)
+
+    def _native_datetimes(self):
+        request = self.context.get('request')
+        renderer = getattr(request, 'accepted_renderer', None)
+        return getattr(renderer, 'native_datetimes', False)
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """ManyRelatedField, проверяющий все первичные ключи одним запросом IN
+
+    Стандартный ManyRelatedField выполняет queryset.get(pk=...) для каждого id.
+    Здесь объекты загружаются одним in_bulk(), а в ошибке перечисляются все
+    отсутствующие id.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        child = self.child_relation
+        queryset = child.get_queryset()
+        pk_field = queryset.model._meta.pk
+        pks, errors = [], []
+        for item in data:
+            if child.pk_field is not None:
+                item = child.pk_field.to_internal_value(item)
+            if isinstance(item, bool):
+                errors.append(child.error_messages['incorrect_type'].format(data_type=type(item).__name__))
+                continue
+            try:
+                pks.append(pk_field.to_python(item))
+            except DjangoValidationError:
+                errors.append(child.error_messages['incorrect_type'].format(data_type=type(item).__name__))
+
+        pks = list(dict.fromkeys(pks))
+        objects = queryset.in_bulk(pks) if pks else {}
+        errors.extend(
+            child.error_messages['does_not_exist'].format(pk_value=pk)
+            for pk in pks if pk not in objects
+        )
+        if errors:
+            raise serializers.ValidationError(errors)
+        return [objects[pk] for pk in pks]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField, который при many=True проверяет id одним запросом"""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+
+class ListSerializer(serializers.ListSerializer):
+    """ListSerializer с замером времени сериализации (этап serialize в Server-Timing)"""
+
+    @property
+    def data(self):
+        with span('serialize'):
+            return super().data
+
+
+class ModelSerializer(serializers.ModelSerializer):
+    """ModelSerializer проекта
+
+    - даты отдаются в формате, подходящем согласованному рендереру;
+    - связи ManyToMany из полей BulkPrimaryKeyRelatedField(many=True) записываются
+      через sync_many_to_many (одна вставка и одно удаление вместо set());
+    - время получения .data учитывается в этапе serialize.
+    """
+    serializer_field_mapping = {
+        **serializers.ModelSerializer.serializer_field_mapping,
+        models.DateTimeField: DateTimeField,
+    }
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        meta = getattr(cls, 'Meta', None)
+        if meta is not None and not hasattr(meta, 'list_serializer_class'):
+            meta.list_serializer_class = ListSerializer
+        return super().many_init(*args, **kwargs)
+
+    @property
+    def data(self):
+        with span('serialize'):
+            return super().data
+
+    def _pop_bulk_many_to_many(self, validated_data):
+        return {
+            field.source: validated_data.pop(field.source)
+            for field in self._writable_fields
+            if isinstance(field, BulkManyRelatedField) and field.source in validated_data
+        }
+
+    def create(self, validated_data):
+        many_to_many = self._pop_bulk_many_to_many(validated_data)
+        instance = super().create(validated_data)
+        for field_name, objects in many_to_many.items():
+            sync_many_to_many(instance, field_name, objects, created=True)
+        return instance
+
+    def update(self, instance, validated_data):
+        many_to_many = self._pop_bulk_many_to_many(validated_data)
+        instance = super().update(instance, validated_data)
+        for field_name, objects in many_to_many.items():
+            sync_many_to_many(instance, field_name, objects)
+        return instance
+
+
+class ReferencePrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """PrimaryKeyRelatedField, проверяющий id по кэшу справочника без запроса к БД
+
+    limit_choices_to — равенства атрибутов, которым должен соответствовать объект
+    (аналог фильтра queryset, например {'status_type': 'sheet'}).
+    """
+
+    def __init__(self, reference, limit_choices_to=None, **kwargs):
+        self.reference = reference
+        self.limit_choices_to = limit_choices_to or {}
+        if not kwargs.get('read_only'):
+            # queryset нужен только для выбора значений в Browsable API
+            kwargs.setdefault('queryset', reference.model._default_manager.filter(**self.limit_choices_to))
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            self.reference.to_pk(data)
+        except DjangoValidationError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        obj = self.reference.get(data)
+        if obj is None or any(getattr(obj, attr) != value for attr, value in self.limit_choices_to.items()):
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+class ReferenceSerializerField(serializers.Field):
+    """Вложенное представление объекта справочника по его id из кэша
+
+    Используется вместо вложенного сериализатора с read_only=True: source указывает
+    на поле внешнего ключа (например, 'status_id'), объект берется из кэша.
+    """
+
+    def __init__(self, serializer_class, reference, **kwargs):
+        kwargs['read_only'] = True
+        self.serializer_class = serializer_class
+        self.reference = reference
+        super().__init__(**kwargs)
+
+    def bind(self, field_name, parent):
+        super().bind(field_name, parent)
+        self.serializer = self.serializer_class()
+        self.serializer.bind(field_name, self)
+
+    def to_representation(self, value):
+        obj = self.reference.get(value)
+        if obj is None:
+            return None
+        return self.serializer.to_representation(obj)
+
+
+class SlowQuerySerializer(ModelSerializer):
+    """Сериализатор медленного запроса (только чтение)"""
+    avg_time = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = SlowQuery
+        fields = [
+            'id', 'view', 'sql', 'params_shape', 'calls', 'total_time', 'avg_time',
+            'max_time', 'last_time', 'explain', 'explained_at', 'first_seen', 'last_seen',
+        ]
+        read_only_fields = fields
+
+
+class UploadSessionSerializer(ModelSerializer):
+    """Сериализатор сессии докачиваемой загрузки"""
+    expires_at = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = ['id', 'filename', 'size', 'offset', 'created_at', 'expires_at']
+        read_only_fields = ['id', 'offset', 'created_at', 'expires_at']
+
+    def get_expires_at(self, obj):
+        return DateTimeField().to_representation(expires_at(obj))
+
+    def validate_filename(self, value):
+        try:
+            return default_storage.get_valid_name(os.path.basename(value))
+        except SuspiciousFileOperation:
+            raise serializers.ValidationError('Некорректное имя файла')
+
+    def validate_size(self, value):
+        if value > settings.UPLOADS['MAX_SIZE']:
+            raise serializers.ValidationError(f'Размер файла больше {settings.UPLOADS["MAX_SIZE"]} байт')
+        return value
+
+
+class DirectUploadSessionSerializer(UploadSessionSerializer):
+    """Сериализатор сессии прямой загрузки в хранилище: SHA-256 файла обязателен"""
+    sha256 = serializers.RegexField(r'^[0-9a-fA-F]{64}$', max_length=64)
+
+    class Meta(UploadSessionSerializer.Meta):
+        fields = ['id', 'filename', 'size', 'sha256', 'created_at', 'expires_at']
+        read_only_fields = ['id', 'created_at', 'expires_at']
+
+    def validate_sha256(self, value):
+        return value.lower()
@@ -0,0 +1,240 @@
+"""
+Сбор медленных запросов к БД
+
+SlowQueryRecorder подключается к каждому новому соединению как execute_wrapper и
+замеряет все запросы. Запросы дольше SLOW_QUERIES['THRESHOLD_MS'] попадают в
+буфер процесса вместе с меткой представления (см. apps.core.metrics.action_label),
+нормализованным SQL и формой параметров. Фоновый поток раз в FLUSH_INTERVAL
+секунд агрегирует буфер в модель SlowQuery на своем соединении, поэтому запись
+не попадает в транзакцию запроса и не теряется при ее откате.
+
+Для доли EXPLAIN_SAMPLE_RATE медленных SELECT на PostgreSQL фоновый поток
+повторно выполняет запрос как EXPLAIN (ANALYZE, BUFFERS) внутри откатываемой
+транзакции с statement_timeout и сохраняет план.
+"""
+import hashlib
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models import ExpressionWrapper, F, FloatField
+from django.db.models.functions import Greatest
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .timing import current
+
+logger = logging.getLogger(__name__)
+
+_buffer = deque()
+_local = threading.local()
+_flusher = {'pid': None}
+_flusher_lock = threading.Lock()
+
+_STRING_RE = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_RE = re.compile(r'(?<![\w"])-?\d+(?:\.\d+)?\b')
+_LIST_RE = re.compile(r'\((?:\s*(?:%s|\?|\$\d+)\s*,)+\s*(?:%s|\?|\$\d+)\s*\)')
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_sql(sql):
+    """SQL без литералов и с однострочными списками параметров"""
+    sql = _STRING_RE.sub('?', sql)
+    sql = _NUMBER_RE.sub('?', sql)
+    sql = sql.replace('%s', '?')
+    sql = _LIST_RE.sub('(...)', sql)
+    return _SPACE_RE.sub(' ', sql).strip()
+
+
+def params_shape(params, many=False):
+    """Типы параметров без значений: 'int*3,str', для executemany — 'many[10]:int,str'"""
+    if many:
+        params = list(params or ())
+        prefix = f'many[{len(params)}]:'
+        params = params[0] if params else ()
+    else:
+        prefix = ''
+    if isinstance(params, dict):
+        params = params.values()
+    parts = []
+    for param in params or ():
+        name = type(param).__name__
+        if parts and parts[-1][0] == name:
+            parts[-1][1] += 1
+        else:
+            parts.append([name, 1])
+    shape = ','.join(name if count == 1 else f'{name}*{count}' for name, count in parts)
+    return (prefix + shape)[:500]
+
+
+def _fingerprint(view, sql):
+    return hashlib.sha1(f'{view}\n{sql}'.encode()).hexdigest()
+
+
+class SlowQueryRecorder:
+    """execute_wrapper: запись запросов дольше порога в буфер процесса"""
+
+    def __init__(self, alias):
+        self.alias = alias
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            options = settings.SLOW_QUERIES
+            if duration * 1000 >= options['THRESHOLD_MS'] and not getattr(_local, 'suspended', False):
+                _record(self.alias, sql, params, many, duration, options)
+
+
+def _record(alias, sql, params, many, duration, options):
+    if len(_buffer) >= options['MAX_BUFFER']:
+        return
+    timings = current()
+    explain = (
+        not many
+        and sql.lstrip()[:6].upper() == 'SELECT'
+        and ' FOR UPDATE' not in sql.upper()
+        and random.random() < options['EXPLAIN_SAMPLE_RATE']
+    )
+    _buffer.append({
+        'alias': alias,
+        'view': (timings.view if timings is not None else None) or '',
+        'sql': normalize_sql(sql),
+        'params_shape': params_shape(params, many),
+        'duration': duration,
+        # Исходный запрос нужен только для EXPLAIN
+        'raw': (sql, params) if explain else None,
+    })
+    _start_flusher(options)
+
+
+def _explain(alias, sql, params, timeout_ms):
+    connection = connections[alias]
+    if connection.vendor != 'postgresql':
+        return ''
+    try:
+        with transaction.atomic(using=alias):
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL statement_timeout = %s', [int(timeout_ms)])
+                cursor.execute(f'EXPLAIN (ANALYZE, BUFFERS) {sql}', params)
+                plan = '\n'.join(row[0] for row in cursor.fetchall())
+                # Повторное выполнение запроса не должно ничего менять
+                transaction.set_rollback(True, using=alias)
+        return plan
+    except DatabaseError:
+        logger.warning('Не удалось получить план медленного запроса', exc_info=True)
+        return ''
+
+
+def _save(record, calls, total, maximum, last, explain):
+    from .models import SlowQuery
+    fingerprint = _fingerprint(record['view'], record['sql'])
+    values = {'calls': F('calls') + calls, 'total_time': F('total_time') + total,
+              'max_time': Greatest(F('max_time'), maximum), 'last_time': last, 'last_seen': timezone.now()}
+    if explain:
+        values.update(explain=explain, explained_at=timezone.now())
+    if SlowQuery.objects.filter(fingerprint=fingerprint).update(**values):
+        return
+    try:
+        with transaction.atomic():
+            SlowQuery.objects.create(
+                fingerprint=fingerprint, view=record['view'], sql=record['sql'],
+                params_shape=record['params_shape'], calls=calls, total_time=total,
+                max_time=maximum, last_time=last, explain=explain,
+                explained_at=timezone.now() if explain else None,
+            )
+    except IntegrityError:
+        # Запись создал другой процесс
+        SlowQuery.objects.filter(fingerprint=fingerprint).update(**values)
+
+
+def flush():
+    """Сохранить накопленные медленные запросы в SlowQuery"""
+    records = []
+    while _buffer:
+        try:
+            records.append(_buffer.popleft())
+        except IndexError:
+            break
+    if not records:
+        return 0
+    groups = {}
+    for record in records:
+        groups.setdefault((record['view'], record['sql']), []).append(record)
+    options = settings.SLOW_QUERIES
+    _local.suspended = True
+    try:
+        for group in groups.values():
+            durations = [record['duration'] for record in group]
+            sampled = next((record for record in group if record['raw']), None)
+            explain = ''
+            if sampled is not None:
+                explain = _explain(sampled['alias'], *sampled['raw'], options['EXPLAIN_TIMEOUT_MS'])
+            _save(group[-1], len(group), sum(durations), max(durations), durations[-1], explain)
+    finally:
+        _local.suspended = False
+    return len(records)
+
+
+# Порядок вывода: имя -> выражение сортировки
+ORDERINGS = {
+    'total': '-total_time',
+    'max': '-max_time',
+    'calls': '-calls',
+    'avg': '-avg',
+}
+
+
+def top_slow_queries(order='total', view=None):
+    """QuerySet медленных запросов в порядке ORDERINGS[order]"""
+    from .models import SlowQuery
+    queryset = SlowQuery.objects.annotate(
+        avg=ExpressionWrapper(F('total_time') / F('calls'), output_field=FloatField()),
+    ) if order == 'avg' else SlowQuery.objects.all()
+    if view:
+        queryset = queryset.filter(view=view)
+    return queryset.order_by(ORDERINGS[order], 'id')
+
+
+def _flush_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            flush()
+        except Exception:
+            logger.exception('Ошибка сохранения медленных запросов')
+        finally:
+            connections.close_all()
+
+
+def _start_flusher(options):
+    pid = os.getpid()
+    if _flusher['pid'] == pid or not options['FLUSH_INTERVAL']:
+        return
+    with _flusher_lock:
+        if _flusher['pid'] == pid:
+            return
+        threading.Thread(
+            target=_flush_loop, args=(options['FLUSH_INTERVAL'],),
+            name='slow-query-flusher', daemon=True,
+        ).start()
+        _flusher['pid'] = pid
+
+
+@receiver(connection_created)
+def _install_recorder(sender, connection, **kwargs):
+    if not settings.SLOW_QUERIES['ENABLED']:
+        return
+    if not any(isinstance(wrapper, SlowQueryRecorder) for wrapper in connection.execute_wrappers):
+        # В начало списка: execute_wrapper() снимает со стека последний элемент, а
+        # соединение может открыться внутри такого блока
+        connection.execute_wrappers.insert(0, SlowQueryRecorder(connection.alias))
@@ -0,0 +1,291 @@
+"""
+Хранилище файлов с адресацией по содержимому (дедупликация вложений)
+
+ContentAddressedStorage сохраняет содержимое один раз под его SHA-256:
+физический файл — blobs/ab/cd/<sha256> в MEDIA_ROOT, а в поле модели
+записывается имя cas/<sha256>/<имя файла>. Имя файла в нем нужно для
+Content-Type и Content-Disposition; все имена с одним дайджестом указывают на
+один блоб, поэтому повторная загрузка того же чертежа не пишет на диск ничего.
+
+Дайджест считается во время приема загрузки (Hashing*UploadHandler в
+FILE_UPLOAD_HANDLERS): если блоб уже есть, временный файл загрузки просто
+удаляется. Для содержимого без готового дайджеста (ContentFile, команды)
+хэш считается при записи во временный файл рядом с блобами.
+
+Имена без префикса cas/ (файлы, загруженные раньше) хранилище обрабатывает как
+FileSystemStorage. Ссылки на блобы считает apps.core.blobs; delete() для имен
+cas/ ничего не удаляет — блоб без ссылок удаляет сборщик apps.core.filegc.
+Существующему файлу блоба запись доверяет только под блокировкой строки Blob
+(_claim): иначе сборщик мог бы удалить его до того, как на него добавят ссылку.
+URL блоба неизменяем: /api/core/files/<sha256>/<имя файла> (views.blob_file).
+
+Именование вынесено в ContentAddressing: его же использует хранилище в
+S3-совместимом объектном хранилище (apps.core.s3).
+"""
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import uuid
+from contextlib import contextmanager
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.db import transaction
+from django.urls import reverse
+
+from .models import Blob, PendingFileDeletion
+
+PREFIX = 'cas'
+BLOBS_DIR = 'blobs'
+_NAME_RE = re.compile(rf'^{PREFIX}/([0-9a-f]{{64}})/[^/]+$')
+_DIGEST_RE = re.compile(r'^[0-9a-f]{64}$')
+_BLOB_RE = re.compile(rf'^{BLOBS_DIR}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/([0-9a-f]{{64}})$')
+
+
+def is_digest(value):
+    return bool(_DIGEST_RE.match(value or ''))
+
+
+class ContentAddressing:
+    """Имена cas/<sha256>/<имя файла> и имена блобов: общее для хранилищ с дедупликацией"""
+
+    def digest(self, name):
+        """Дайджест содержимого для имени cas/, None — для обычного имени"""
+        match = _NAME_RE.match(name or '')
+        return match.group(1) if match else None
+
+    def blob_name(self, digest):
+        """Физическое имя блоба относительно корня хранилища"""
+        return f'{BLOBS_DIR}/{digest[:2]}/{digest[2:4]}/{digest}'
+
+    def blob_digest(self, stored_name):
+        """Дайджест для физического имени блоба, None — для других имен"""
+        match = _BLOB_RE.match(stored_name or '')
+        return match.group(1) if match else None
+
+    def stored_name(self, name):
+        """Имя файла в хранилище: для cas/ — имя блоба, иначе само имя"""
+        digest = self.digest(name)
+        return self.blob_name(digest) if digest else name
+
+    def _claim(self, digest):
+        """Можно ли не записывать содержимое digest: блоб есть и сборщик его не удалит
+
+        Строки блокируются в том же порядке, что и в filegc.collect (очередь, затем
+        Blob), поэтому сборка этого блоба, если она уже идет, сначала завершится.
+        Блоб без ссылок снимается с очереди на удаление: ссылку на него добавит
+        сохранение записи (blobs.acquire). False — строки Blob или файла нет, и
+        содержимое нужно записать заново.
+        """
+        name = self.blob_name(digest)
+        with transaction.atomic():
+            pending = PendingFileDeletion.objects.select_for_update().filter(name=name)
+            list(pending)
+            ref_count = Blob.objects.select_for_update().filter(digest=digest).values_list(
+                'ref_count', flat=True
+            ).first()
+            if ref_count is None or not self.exists(name):
+                return False
+            if ref_count == 0:
+                pending.delete()
+        return True
+
+    def cas_name(self, digest, filename, max_length=None):
+        return f'{PREFIX}/{digest}/{self.get_available_name(filename, max_length)}'
+
+    def url(self, name):
+        digest = self.digest(name)
+        if digest is None:
+            return super().url(name)
+        return reverse('blob_file', kwargs={'digest': digest, 'filename': posixpath.basename(name)})
+
+    def delete(self, name):
+        # Блоб может использоваться другими записями: его удаляет apps.core.filegc
+        if self.digest(name) is None:
+            super().delete(name)
+
+    def get_available_name(self, name, max_length=None):
+        # Итоговое имя содержит дайджест, который станет известен в _save, и не
+        # зависит от upload_to; здесь только укорачивается имя файла под max_length
+        name = os.path.basename(name)
+        if max_length is None:
+            return name
+        limit = max_length - len(f'{PREFIX}/{"0" * 64}/')
+        if len(name) > limit:
+            stem, extension = os.path.splitext(name)
+            stem = stem[:limit - len(extension)]
+            if not stem:
+                raise SuspiciousFileOperation(f'Имя файла "{name}" не помещается в {max_length} символов')
+            name = stem + extension
+        return name
+
+
+class ContentAddressedStorage(ContentAddressing, FileSystemStorage):
+    """FileSystemStorage, хранящий каждое содержимое один раз под его SHA-256"""
+
+    def path(self, name):
+        return super().path(self.stored_name(name))
+
+    def delete_blob(self, digest):
+        super().delete(self.blob_name(digest))
+
+    def _save(self, name, content):
+        digest = getattr(content, 'content_sha256', None)
+        if not (digest and self._claim(digest)):
+            digest = self._store(content, digest)
+        return f'{PREFIX}/{digest}/{os.path.basename(name)}'
+
+    @contextmanager
+    def local_copy(self, name):
+        """Путь к файлу name на локальном диске"""
+        yield self.path(name)
+
+    def replace_file(self, name, path):
+        """Поставить локальный файл path на место name (path — в том же каталоге, что и name)"""
+        target = self.path(name)
+        self._makedirs(os.path.dirname(target))
+        os.replace(path, target)
+        self._finish(target)
+
+    def scan(self, prefix, ordered=False):
+        """(имя, время изменения) файлов с именами под prefix/
+
+        ordered — в порядке возрастания имен: каталоги читаются по одному и сортируются.
+        """
+        yield from self._scan(super().path(prefix), prefix, ordered)
+
+    def _scan(self, directory, prefix, ordered):
+        try:
+            entries = os.scandir(directory)
+        except FileNotFoundError:
+            return
+        with entries:
+            if ordered:
+                entries = sorted(entries, key=lambda entry: entry.name)
+            for entry in entries:
+                name = f'{prefix}/{entry.name}'
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self._scan(entry.path, name, ordered)
+                elif entry.is_file(follow_symlinks=False):
+                    try:
+                        yield name, entry.stat().st_mtime
+                    except FileNotFoundError:
+                        pass
+
+    def _store(self, content, digest=None):
+        """Записать содержимое в блоб; вернуть дайджест
+
+        digest — известный дайджест, для которого _claim уже вернул False: файл блоба
+        тогда перезаписывается.
+        """
+        if digest and hasattr(content, 'temporary_file_path'):
+            # Временный файл загрузки переносится на место блоба без копирования
+            self._move_to_blob(content.temporary_file_path(), digest)
+            return digest
+
+        temp_dir = super().path(f'{BLOBS_DIR}/tmp')
+        self._makedirs(temp_dir)
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        sha256 = hashlib.sha256()
+        try:
+            with os.fdopen(fd, 'wb') as temp:
+                for chunk in content.chunks():
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    sha256.update(chunk)
+                    temp.write(chunk)
+            checked = digest is not None
+            digest = sha256.hexdigest()
+            target = super().path(self.blob_name(digest))
+            if not checked and self._claim(digest):
+                os.remove(temp_path)
+                return digest
+            self._makedirs(os.path.dirname(target))
+            os.replace(temp_path, target)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._finish(target)
+        return digest
+
+    def import_file(self, path, filename, digest, max_length=None):
+        """Сделать готовый файл path с известным дайджестом блобом; вернуть имя cas/
+
+        Блоб — жесткая ссылка на path, без копирования; сам path остается, его
+        удаляет вызывающий.
+        """
+        if not self._claim(digest):
+            self._link_to_blob(path, digest)
+        return self.cas_name(digest, filename, max_length)
+
+    def _link_to_blob(self, path, digest):
+        target = super().path(self.blob_name(digest))
+        self._makedirs(os.path.dirname(target))
+        temp_dir = super().path(f'{BLOBS_DIR}/tmp')
+        self._makedirs(temp_dir)
+        temp_path = os.path.join(temp_dir, uuid.uuid4().hex)
+        try:
+            os.link(path, temp_path)
+        except OSError:
+            # Файловая система без жестких ссылок
+            shutil.copyfile(path, temp_path)
+        # Замена существующего файла тем же содержимым безопасна: _claim не доверил ему
+        os.replace(temp_path, target)
+        self._finish(target)
+
+    def _move_to_blob(self, path, digest):
+        target = super().path(self.blob_name(digest))
+        self._makedirs(os.path.dirname(target))
+        # Замена существующего файла тем же содержимым безопасна: _claim не доверил ему
+        file_move_safe(path, target, allow_overwrite=True)
+        self._finish(target)
+
+    def _makedirs(self, directory):
+        if self.directory_permissions_mode is None:
+            os.makedirs(directory, exist_ok=True)
+            return
+        # umask, потому что os.makedirs не применяет mode к промежуточным каталогам
+        old_umask = os.umask(0o777 & ~self.directory_permissions_mode)
+        try:
+            os.makedirs(directory, self.directory_permissions_mode, exist_ok=True)
+        finally:
+            os.umask(old_umask)
+
+    def _finish(self, path):
+        if self.file_permissions_mode is not None:
+            os.chmod(path, self.file_permissions_mode)
+        self._ensure_location_group_id(path)
+
+
+class HashingUploadHandlerMixin:
+    """Считает SHA-256 загружаемого файла по мере приема и сохраняет его в content_sha256"""
+
+    def new_file(self, *args, **kwargs):
+        # До super(): MemoryFileUploadHandler.new_file завершается StopFutureHandlers
+        self.sha256 = hashlib.sha256()
+        super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        if getattr(self, 'activated', True):
+            self.sha256.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_sha256 = self.sha256.hexdigest()
+        return file
+
+
+class HashingMemoryFileUploadHandler(HashingUploadHandlerMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingUploadHandlerMixin, TemporaryFileUploadHandler):
+    pass
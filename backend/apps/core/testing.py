@@ -0,0 +1,121 @@
+"""
+Бюджеты SQL-запросов эндпоинтов для тестов
+
+QueryBudgetMixin.assertQueryBudget проверяет, что ответ укладывается в заданное
+число запросов. assertQueryBudgetStable выполняет запрос на двух объемах данных
+(до и после вызова grow) и дополнительно требует одинакового числа запросов:
+рост числа запросов вместе с числом строк означает N+1. При нарушении в
+сообщение выводятся запросы, сгруппированные по месту вызова в коде приложений.
+"""
+import os
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connection
+
+from . import slow_queries
+
+# Инфраструктура apps.core (обертки execute_wrapper, middleware) не считается местом вызова
+_SKIP_MODULES = ('slow_queries', 'timing', 'middleware', 'metrics', 'profiling', 'nplusone', 'testing')
+_SKIP_FILES = tuple(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), f'{name}.py') for name in _SKIP_MODULES
+)
+_ORM_DIR = os.path.join('django', 'db') + os.sep
+
+
+def _location(filename, lineno, name):
+    base = str(settings.BASE_DIR)
+    if filename.startswith(base + os.sep):
+        filename = os.path.relpath(filename, base)
+    elif 'site-packages' + os.sep in filename:
+        filename = filename.split('site-packages' + os.sep, 1)[1]
+    return f'{filename}:{lineno} in {name}'
+
+
+def call_site(stack):
+    """Место вызова запроса: ближайший кадр вне ORM и, если он из библиотеки,
+    ближайший кадр из кода приложений (apps/), например
+    'rest_framework/pagination.py:211 in paginate_queryset <- apps/projects/views.py:60 in list'
+    """
+    apps_dir = os.path.join(str(settings.BASE_DIR), 'apps') + os.sep
+    innermost = None
+    for frame in reversed(stack):
+        filename = os.path.abspath(frame.filename)
+        if filename in _SKIP_FILES:
+            continue
+        if filename.startswith(apps_dir):
+            location = _location(filename, frame.lineno, frame.name)
+            return location if innermost is None else f'{innermost} <- {location}'
+        if innermost is None and 'site-packages' in filename and _ORM_DIR not in filename:
+            innermost = _location(filename, frame.lineno, frame.name)
+    return innermost or '<неизвестно>'
+
+
+class QueryRecorder:
+    """execute_wrapper: SQL и место вызова каждого запроса"""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append((sql, call_site(traceback.extract_stack()[:-1])))
+        return execute(sql, params, many, context)
+
+    def __len__(self):
+        return len(self.queries)
+
+    def report(self):
+        """Запросы по местам вызова: самые частые первыми"""
+        sites = {}
+        for sql, site in self.queries:
+            sites.setdefault(site, Counter())[slow_queries.normalize_sql(sql)] += 1
+        lines = []
+        for site, statements in sorted(sites.items(), key=lambda item: -sum(item[1].values())):
+            lines.append(f'  {site}: {sum(statements.values())}')
+            for sql, count in statements.most_common():
+                lines.append(f'    {count} x {sql[:300]}')
+        return '\n'.join(lines)
+
+
+class QueryBudgetMixin:
+    """Проверки числа SQL-запросов для TestCase"""
+
+    @contextmanager
+    def recordQueries(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            yield recorder
+
+    def assertQueryBudget(self, budget, func, *args, **kwargs):
+        """Выполнить func и проверить, что запросов не больше budget; вернуть результат и число запросов"""
+        with self.recordQueries() as recorder:
+            result = func(*args, **kwargs)
+        if len(recorder) > budget:
+            self.fail(f'Запросов {len(recorder)} при бюджете {budget}:\n{recorder.report()}')
+        return result, len(recorder)
+
+    def assertQueryBudgetStable(self, budget, func, grow):
+        """Бюджет на двух объемах данных: число запросов не должно зависеть от числа строк
+
+        Перед каждым замером func выполняется один раз, чтобы прогреть кэши
+        (версионные ключи, справочники, сброшенные записью в grow): бюджет
+        относится к установившемуся режиму.
+        """
+        func()
+        with self.recordQueries() as small:
+            first = func()
+        grow()
+        func()
+        with self.recordQueries() as large:
+            second = func()
+        for recorder in (small, large):
+            if len(recorder) > budget:
+                self.fail(f'Запросов {len(recorder)} при бюджете {budget}:\n{recorder.report()}')
+        if len(large) != len(small):
+            self.fail(
+                f'Число запросов растет с объемом данных: {len(small)} -> {len(large)}\n'
+                f'Меньший объем:\n{small.report()}\nБольший объем:\n{large.report()}'
+            )
+        return first, second
@@ -0,0 +1,1893 @@
+"""
+Тесты общих компонентов API
+"""
+import base64
+import datetime
+import hashlib
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+import msgpack
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile, TemporaryUploadedFile
+from django.core.files.uploadhandler import StopFutureHandlers
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+from django.db.models.fields.related_descriptors import ForwardManyToOneDescriptor
+from django.http import HttpResponse, UnreadablePostError
+from django.test import LiveServerTestCase, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from prometheus_client import REGISTRY
+from django.contrib.auth.models import User
+from rest_framework.test import APIClient
+from rest_framework import status
+from rest_framework_simplejwt.tokens import RefreshToken
+from apps.auth.models import Department
+from apps.core import (
+    benchmark, blobs, checks, filegc, instrumentation, loadtest, invalidation, nplusone, plans, previews, profiling,
+    sampling, slow_queries, storage, uploads,
+)
+from apps.core.cache import bump_version
+from apps.core.cache_backends import LRUStore
+from apps.core.middleware import NPlusOneMiddleware
+from apps.core.models import Blob, PendingFileDeletion, SlowQuery, UploadSession
+from apps.projects.models import Status, ConstructionSite, Project, ProjectSheet, ProjectSheetNote, ProjectStage
+from apps.projects.reference import statuses
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+try:
+    from botocore.response import StreamingBody
+    from botocore.stub import ANY, Stubber
+except ImportError:
+    Stubber = None
+
+
+class MessagePackNegotiationTest(TestCase):
+    """Тесты согласования формата MessagePack"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        site = ConstructionSite.objects.create(name='Участок')
+        self.project = Project.objects.create(name='Проект', code='P', cipher='C', construction_site=site)
+        self.sheet_status = Status.objects.create(name='Активный', status_type='sheet')
+        ProjectSheet.objects.create(name='Лист', project=self.project, status=self.sheet_status)
+
+    def test_json_is_default(self):
+        """Проверка: без Accept ответ остается в JSON"""
+        response = self.client.get('/api/projects/project-sheets/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_msgpack_response_matches_json(self):
+        """Проверка: MessagePack содержит те же данные, даты упакованы в Timestamp"""
+        json_data = self.client.get('/api/projects/project-sheets/').json()
+        response = self.client.get('/api/projects/project-sheets/', HTTP_ACCEPT='application/msgpack')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        data = msgpack.unpackb(response.content, timestamp=3)
+        self.assertEqual(data['count'], json_data['count'])
+
+        sheet = data['results'][0]
+        self.assertIsInstance(sheet['created_at'], datetime.datetime)
+        self.assertIsInstance(sheet['project']['created_at'], datetime.datetime)
+        self.assertEqual(sheet['name'], json_data['results'][0]['name'])
+        self.assertEqual(sheet['status'], {
+            **json_data['results'][0]['status'],
+            'created_at': sheet['status']['created_at'],
+        })
+        self.assertLess(len(response.content), len(self.client.get('/api/projects/project-sheets/').content))
+
+    def test_msgpack_request_body(self):
+        """Проверка: тело запроса в MessagePack разбирается, включая Timestamp"""
+        stage_status = Status.objects.create(name='В работе', status_type='stage')
+        moment = datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone.utc)
+        body = msgpack.packb({
+            'project_id': self.project.id,
+            'status_id': stage_status.id,
+            'datetime': moment,
+            'description': 'Этап',
+        }, datetime=True)
+
+        response = self.client.post(
+            '/api/projects/project-stages/',
+            data=body,
+            content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        data = msgpack.unpackb(response.content, timestamp=3)
+        self.assertEqual(data['datetime'], moment)
+        self.assertEqual(data['description'], 'Этап')
+
+    def test_malformed_msgpack_body(self):
+        """Проверка: некорректное тело возвращает 400"""
+        response = self.client.post(
+            '/api/projects/statuses/',
+            data=b'\xc1\xc1',
+            content_type='application/msgpack',
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(REFERENCE_CACHE_CHECK_INTERVAL=0)
+class ReferenceCacheTest(TransactionTestCase):
+    """Тесты кэша справочников статусов и отделов"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        site = ConstructionSite.objects.create(name='Участок')
+        self.project = Project.objects.create(name='Проект', code='P', cipher='C', construction_site=site)
+        self.department = Department.objects.create(name='IT')
+        self.sheet_status = Status.objects.create(name='Активный', status_type='sheet')
+        self.stage_status = Status.objects.create(name='В работе', status_type='stage')
+
+    def _sheet_payload(self, **extra):
+        return {'name': 'Лист', 'project_id': self.project.id, **extra}
+
+    def test_validation_uses_cache(self):
+        """Проверка: status_id и responsible_department_id проверяются без запросов к справочникам"""
+        self.client.get('/api/projects/statuses/')
+        self.client.get('/api/auth/departments/')
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/projects/project-sheets/', self._sheet_payload(
+                status_id=self.sheet_status.id,
+                responsible_department_id=self.department.id,
+            ), format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['status']['name'], 'Активный')
+        self.assertEqual(response.data['responsible_department']['name'], 'IT')
+        reference_tables = (Status._meta.db_table, Department._meta.db_table)
+        for query in queries.captured_queries:
+            self.assertFalse(
+                any(f'FROM "{table}"' in query['sql'] for table in reference_tables),
+                query['sql']
+            )
+
+    def test_validation_errors(self):
+        """Проверка: чужой тип статуса, несуществующий id и неверный тип значения отклоняются"""
+        for value in (self.stage_status.id, 999999, 'abc'):
+            response = self.client.post(
+                '/api/projects/project-sheets/', self._sheet_payload(status_id=value), format='json'
+            )
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+            self.assertIn('status_id', response.data)
+
+    def test_local_change_invalidates(self):
+        """Проверка: изменение статуса сразу видно в ответах"""
+        self.client.get('/api/projects/statuses/')
+        self.sheet_status.name = 'Переименован'
+        self.sheet_status.save()
+
+        response = self.client.get('/api/projects/statuses/?status_type=sheet')
+
+        self.assertEqual([item['name'] for item in response.data], ['Переименован'])
+
+    def test_shared_version_invalidates(self):
+        """Проверка: смена общей версии (изменение в другом воркере) сбрасывает снимок"""
+        self.assertIsNotNone(statuses.get(self.sheet_status.id))
+        Status.objects.filter(pk=self.sheet_status.pk).update(name='Из другого процесса')
+        self.assertEqual(statuses.get(self.sheet_status.id).name, 'Активный')
+
+        bump_version(statuses.namespace)
+
+        self.assertEqual(statuses.get(self.sheet_status.id).name, 'Из другого процесса')
+
+    def test_known_version_reloads_snapshot(self):
+        """Проверка: снимок по уже прочитанной версии не отстает на интервал проверки"""
+        with override_settings(REFERENCE_CACHE_CHECK_INTERVAL=60):
+            self.assertEqual(statuses.get(self.sheet_status.id).name, 'Активный')
+            Status.objects.filter(pk=self.sheet_status.pk).update(name='Из другого процесса')
+            version = bump_version(statuses.namespace)
+            self.assertEqual(statuses.get(self.sheet_status.id).name, 'Активный')
+
+            self.assertIn('Из другого процесса', [item.name for item in statuses.all(version)])
+            # Ответ bootstrap под новым ETag собирается из свежих данных
+            response = self.client.get('/api/auth/bootstrap/')
+            self.assertEqual([item['name'] for item in response.data['statuses']['sheet']],
+                             ['Из другого процесса'])
+
+    def test_process_local_cache_warned(self):
+        """Проверка: версии в кэше процесса вне DEBUG — предупреждение core.W001"""
+        local = {**settings.CACHES, 'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+        with override_settings(DEBUG=False, CACHES=local):
+            self.assertEqual([error.id for error in checks.check_shared_cache(None)], ['core.W001'])
+        with override_settings(DEBUG=False):
+            self.assertEqual(checks.check_shared_cache(None), [])
+
+
+class BulkPrimaryKeyRelatedFieldTest(TestCase):
+    """Тесты пакетной проверки id и записи связей ManyToMany"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        site = ConstructionSite.objects.create(name='Участок')
+        self.project = Project.objects.create(name='Проект', code='P', cipher='C', construction_site=site)
+        self.executors = User.objects.bulk_create([User(username=f'executor{i}') for i in range(40)])
+
+    def _create_sheet(self, executor_ids):
+        return self.client.post('/api/projects/project-sheets/', {
+            'name': 'Лист',
+            'project_id': self.project.id,
+            'executor_ids': executor_ids,
+        }, format='json')
+
+    def test_query_count_does_not_depend_on_ids(self):
+        """Проверка: число запросов не растет с количеством исполнителей"""
+        with CaptureQueriesContext(connection) as few:
+            response = self._create_sheet([user.id for user in self.executors[:5]])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        with CaptureQueriesContext(connection) as many:
+            response = self._create_sheet([user.id for user in self.executors])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(len(response.data['executors']), 40)
+
+    def test_all_missing_ids_reported(self):
+        """Проверка: в ошибке перечислены все несуществующие id"""
+        response = self._create_sheet([self.executors[0].id, 999998, 999999])
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        errors = ' '.join(str(error) for error in response.data['executor_ids'])
+        self.assertIn('999998', errors)
+        self.assertIn('999999', errors)
+        self.assertEqual(ProjectSheet.objects.count(), 0)
+
+    def test_update_writes_diff(self):
+        """Проверка: при обновлении удаляются и добавляются только изменившиеся связи"""
+        sheet_id = self._create_sheet([user.id for user in self.executors[:3]]).data['id']
+        new_ids = [self.executors[1].id, self.executors[2].id, self.executors[3].id]
+
+        response = self.client.patch(
+            f'/api/projects/project-sheets/{sheet_id}/', {'executor_ids': new_ids}, format='json'
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sorted(user['id'] for user in response.data['executors']), sorted(new_ids))
+        self.assertEqual(
+            set(ProjectSheet.objects.get(pk=sheet_id).executors.values_list('id', flat=True)),
+            set(new_ids)
+        )
+
+
+class TwoTierCacheTest(TestCase):
+    """Тесты двухуровневого кэша и шины инвалидации"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        cache.clear()
+
+    def test_l1_hit_skips_l2(self):
+        """Проверка: повторное чтение обслуживается из памяти процесса"""
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.set('key', {'value': 1})
+        cache.get('key')
+        caches['shared'].set('key', {'value': 2})
+
+        self.assertEqual(cache.get('key'), {'value': 1})
+
+    def test_l1_miss_reads_l2(self):
+        """Проверка: при промахе L1 значение берется из общего кэша"""
+        caches['shared'].set('other', 'shared')
+
+        self.assertEqual(cache.get('other'), 'shared')
+        self.assertIsNone(cache.get('missing'))
+
+    def test_foreign_notification_drops_l1(self):
+        """Проверка: уведомление другого процесса удаляет копию из L1"""
+        cache.set('key', 'old')
+        caches['shared'].set('key', 'new')
+
+        invalidation._handle_notification(json.dumps({'sender': 'other', 'keys': [cache.make_key('key')]}))
+
+        self.assertEqual(cache.get('key'), 'new')
+
+    def test_own_notification_ignored(self):
+        """Проверка: собственные уведомления процесса не обрабатываются повторно"""
+        received = []
+        invalidation.subscribe(received.append)
+        try:
+            invalidation._handle_notification(json.dumps({'sender': invalidation.process_id(), 'clear': True}))
+        finally:
+            invalidation._subscribers.remove(received.append)
+
+        self.assertEqual(received, [])
+
+    def test_lru_bound(self):
+        """Проверка: L1 не превышает заданного числа записей и вытесняет давние"""
+        store = LRUStore(max_entries=2)
+        store.set('a', b'1', float('inf'), store.generation)
+        store.set('b', b'2', float('inf'), store.generation)
+        store.get('a')
+        store.set('c', b'3', float('inf'), store.generation)
+
+        self.assertEqual(len(store), 2)
+        self.assertIsNone(store.get('b'))
+        self.assertEqual(store.get('a'), b'1')
+
+    def test_stale_fill_rejected(self):
+        """Проверка: значение, прочитанное до инвалидации ключа, не попадает в L1"""
+        store = LRUStore(max_entries=1)
+        generation = store.generation
+        store.discard(['key'])
+
+        self.assertFalse(store.set('key', b'old', float('inf'), generation))
+        self.assertIsNone(store.get('key'))
+        self.assertTrue(store.set('other', b'1', float('inf'), generation))
+
+        # Поколение вытесненных из учета ключей не забывается
+        store.discard(['other'])
+        self.assertFalse(store.set('key', b'old', float('inf'), generation))
+
+    def test_rolled_back_set_not_left_in_l1(self):
+        """Проверка: запись в откаченной транзакции не остается в L1"""
+        with self.captureOnCommitCallbacks(execute=True):
+            cache.set('key', 'old')
+        self.assertEqual(cache.get('key'), 'old')
+
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                cache.set('key', 'new')
+                self.assertEqual(cache.get('key'), 'new')
+                raise RuntimeError
+
+        self.assertEqual(cache.get('key'), 'old')
+
+    def test_key_changes_published_once_per_transaction(self):
+        """Проверка: измененные ключи рассылаются одним событием после коммита"""
+        received = []
+        invalidation.subscribe(received.append)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                cache.set('a', 1)
+                cache.set('b', 2)
+                cache.delete('a')
+                self.assertEqual(received, [])
+        finally:
+            invalidation._subscribers.remove(received.append)
+
+        self.assertEqual(received, [{'keys': sorted([cache.make_key('a'), cache.make_key('b')])}])
+
+    def test_model_change_published_once_per_transaction(self):
+        """Проверка: изменения моделей рассылаются одним событием после коммита"""
+        received = []
+        invalidation.subscribe(received.append)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                Status.objects.create(name='Первый', status_type='sheet')
+                Department.objects.create(name='IT')
+                self.assertEqual(received, [])
+        finally:
+            invalidation._subscribers.remove(received.append)
+
+        model_events = [event for event in received if 'models' in event]
+        self.assertEqual(model_events, [{'models': ['projects.Status', 'user_auth.Department']}])
+
+
+class InstrumentationTest(TestCase):
+    """Тесты диагностического логирования"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        ConstructionSite.objects.create(name='Участок')
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'instrumentation.log')
+
+    def _settings(self, **options):
+        return override_settings(INSTRUMENTATION={
+            'ENABLED': True, 'LEVEL': 'DEBUG', 'SAMPLE_RATE': 1.0, 'PATH': self.path, 'QUEUE_SIZE': 100, **options,
+        })
+
+    def _entries(self):
+        instrumentation.flush()
+        with open(self.path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_disabled_mode_runs_no_extra_queries(self):
+        """Проверка: без диагностики список участков не делает COUNT(*) и не пишет файл"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/projects/construction-sites/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(any('COUNT(*)' in query['sql'] for query in queries.captured_queries))
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_events_written_as_json(self):
+        """Проверка: события записываются фоновым потоком строками JSON"""
+        with self._settings():
+            self.client.get('/api/projects/construction-sites/')
+            entries = self._entries()
+
+        locations = [entry['location'] for entry in entries]
+        self.assertIn('ConstructionSiteViewSet.list:entry', locations)
+        self.assertIn('ConstructionSiteViewSet.list:table_check', locations)
+        check = next(entry for entry in entries if entry['location'].endswith(':table_check'))
+        self.assertEqual(check['data']['count'], 1)
+        self.assertEqual(check['hypothesisId'], 'A')
+
+    def test_default_level_writes_events(self):
+        """Проверка: при включении без LEVEL события event() по умолчанию записываются"""
+        with override_settings(INSTRUMENTATION={'ENABLED': True, 'PATH': self.path}):
+            instrumentation.event('test:default', 'default')
+            entries = self._entries()
+
+        self.assertEqual([entry['location'] for entry in entries], ['test:default'])
+
+    def test_level_and_sampling(self):
+        """Проверка: уровень отсекает отладочные события, выборка не касается ошибок"""
+        with self._settings(LEVEL='INFO', SAMPLE_RATE=0.0):
+            instrumentation.event('test:debug', 'debug')
+            instrumentation.event('test:info', 'info', level=logging.INFO)
+            instrumentation.event('test:lazy', 'lazy', lambda: self.fail('data evaluated'))
+            instrumentation.event('test:error', 'error', level=logging.ERROR)
+            entries = self._entries()
+
+        self.assertEqual([entry['location'] for entry in entries], ['test:error'])
+
+
+class ServerTimingTest(TestCase):
+    """Тесты замера этапов запроса"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        site = ConstructionSite.objects.create(name='Участок')
+        project = Project.objects.create(name='Проект', code='P', cipher='C', construction_site=site)
+        ProjectSheet.objects.create(name='Лист', project=project)
+
+    def _metrics(self, response):
+        metrics = {}
+        for item in response['Server-Timing'].split(', '):
+            name, *params = item.split(';')
+            metrics[name] = dict(param.split('=', 1) for param in params)
+        return metrics
+
+    @override_settings(SERVER_TIMING={'ENABLED': True, 'SAMPLE_RATE': 1.0, 'USERS': []})
+    def test_header_contains_stages(self):
+        """Проверка: заголовок содержит все этапы и число запросов к БД"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/projects/project-sheets/')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        metrics = self._metrics(response)
+        self.assertEqual(list(metrics), ['db', 'permissions', 'serialize', 'render', 'total'])
+        self.assertEqual(metrics['db']['desc'], f'"{len(queries)} queries"')
+        for name in ('serialize', 'render', 'total'):
+            self.assertGreater(float(metrics[name]['dur']), 0)
+
+    @override_settings(SERVER_TIMING={'ENABLED': True, 'SAMPLE_RATE': 0.0, 'USERS': []})
+    def test_not_sampled(self):
+        """Проверка: без выборки заголовок не добавляется"""
+        response = self.client.get('/api/projects/project-sheets/')
+
+        self.assertNotIn('Server-Timing', response)
+
+    @override_settings(SERVER_TIMING={'ENABLED': True, 'SAMPLE_RATE': 0.0, 'USERS': ['user']})
+    def test_selected_user(self):
+        """Проверка: замер включается для выбранного пользователя после JWT-аутентификации"""
+        response = self.client.get('/api/projects/project-sheets/')
+        self.assertIn('Server-Timing', response)
+
+        other = User.objects.create_user(username='other', password='testpass123')
+        token = RefreshToken.for_user(other).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertNotIn('Server-Timing', self.client.get('/api/projects/project-sheets/'))
+
+
+class MetricsTest(TestCase):
+    """Тесты метрик Prometheus"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def _value(self, name, **labels):
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_action_labels(self):
+        """Проверка: запросы учитываются по метке basename:action"""
+        requests_before = self._value(
+            'mytracker_http_requests_total', action='project-sheet:list', method='GET', status='200'
+        )
+        latency_before = self._value('mytracker_http_request_duration_seconds_count', action='project-sheet:list')
+        errors_before = self._value('mytracker_http_errors_total', action='project-sheet:retrieve', status_class='4xx')
+
+        self.client.get('/api/projects/project-sheets/')
+        self.client.get('/api/projects/project-sheets/999999/')
+
+        self.assertEqual(self._value(
+            'mytracker_http_requests_total', action='project-sheet:list', method='GET', status='200'
+        ), requests_before + 1)
+        self.assertEqual(
+            self._value('mytracker_http_request_duration_seconds_count', action='project-sheet:list'),
+            latency_before + 1
+        )
+        self.assertEqual(
+            self._value('mytracker_http_errors_total', action='project-sheet:retrieve', status_class='4xx'),
+            errors_before + 1
+        )
+
+    def test_metrics_endpoint(self):
+        """Проверка: /metrics отдает текстовый формат, токен проверяется"""
+        self.client.get('/api/projects/statuses/')
+
+        with override_settings(METRICS={'ENABLED': True, 'TOKEN': 'secret'}):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.client.credentials(HTTP_AUTHORIZATION='Bearer secret')
+            response = self.client.get('/metrics')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'mytracker_http_request_queries_bucket{action="status:list"', response.content)
+
+    def test_sampling_label_cleared_with_metrics_disabled(self):
+        """Проверка: метка семплера снимается после запроса и при выключенных метриках"""
+        sampling_options = {**settings.SAMPLING, 'ENABLED': True}
+        with override_settings(METRICS={**settings.METRICS, 'ENABLED': False}, SAMPLING=sampling_options):
+            with mock.patch.object(sampling, 'start'):
+                self.client.get('/api/projects/statuses/')
+
+        self.assertNotIn(threading.get_ident(), sampling._requests)
+
+    def test_metrics_access_without_token(self):
+        """Проверка: без токена /metrics отдается только адресам из списка, при DEBUG или PUBLIC"""
+        metrics = {'ENABLED': True, 'TOKEN': '', 'ALLOWED_IPS': [], 'PUBLIC': False}
+        with override_settings(METRICS=metrics):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            with override_settings(DEBUG=True):
+                self.assertEqual(self.client.get('/metrics').status_code, 200)
+            self.assertTrue(any(warning.id == 'core.W002' for warning in checks.check_metrics_access(None)))
+
+        with override_settings(METRICS={**metrics, 'ALLOWED_IPS': ['10.0.0.0/8']}):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.1.2.3').status_code, 200)
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+        with override_settings(METRICS={**metrics, 'PUBLIC': True}):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+
+@override_settings(SLOW_QUERIES={
+    'ENABLED': True, 'THRESHOLD_MS': 0, 'EXPLAIN_SAMPLE_RATE': 0.0,
+    'EXPLAIN_TIMEOUT_MS': 5000, 'FLUSH_INTERVAL': 0, 'MAX_BUFFER': 1000,
+})
+class SlowQueryTest(TestCase):
+    """Тесты сбора медленных запросов"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='admin', password='testpass123', is_superuser=True)
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        slow_queries._buffer.clear()
+
+    def test_normalize_sql(self):
+        """Проверка: литералы и списки параметров схлопываются"""
+        sql = "SELECT * FROM t WHERE a = 'x' AND b = 10 AND c IN (%s, %s, %s) AND \"t2\".\"id\" = %s"
+
+        self.assertEqual(
+            slow_queries.normalize_sql(sql),
+            'SELECT * FROM t WHERE a = ? AND b = ? AND c IN (...) AND "t2"."id" = ?'
+        )
+        self.assertEqual(slow_queries.params_shape([1, 2, 3, 'a']), 'int*3,str')
+
+    def test_queries_aggregated_by_view(self):
+        """Проверка: запросы представления агрегируются с его меткой"""
+        self.client.get('/api/projects/project-sheets/')
+        self.client.get('/api/projects/project-sheets/')
+        slow_queries.flush()
+
+        recorded = SlowQuery.objects.filter(view='project-sheet:list')
+        self.assertTrue(recorded.exists())
+        self.assertTrue(all(query.calls == 2 for query in recorded))
+        self.assertTrue(all("'" not in query.sql for query in recorded))
+
+    def test_api_superuser_only(self):
+        """Проверка: список доступен только суперпользователю и отсортирован по времени"""
+        self.client.get('/api/projects/project-sheets/')
+        slow_queries.flush()
+
+        response = self.client.get('/api/core/slow-queries/?limit=5')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertLessEqual(len(response.data), 5)
+        totals = [item['total_time'] for item in response.data]
+        self.assertEqual(totals, sorted(totals, reverse=True))
+
+        user = User.objects.create_user(username='user', password='testpass123')
+        token = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(self.client.get('/api/core/slow-queries/').status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ProfilingTest(TestCase):
+    """Тесты профилирования запросов по флагу"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.settings_override = override_settings(PROFILING={
+            'ENABLED': True, 'DIR': tmp.name, 'MAX_PROFILES': 2, 'MAX_AGE_DAYS': 7, 'SAMPLE_INTERVAL': 0.0005,
+        })
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.dir = tmp.name
+        self.client = APIClient()
+        self.admin = User.objects.create_user(username='admin', password='testpass123', is_superuser=True)
+        self.user = User.objects.create_user(username='user', password='testpass123')
+
+    def _login(self, user):
+        token = RefreshToken.for_user(user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_superuser_profile(self):
+        """Проверка: профиль суперпользователя сохраняется в pstats и свернутых стеках"""
+        self._login(self.admin)
+        response = self.client.get('/api/projects/project-sheets/?_profile=1')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        profile_id = response['X-Profile-Id']
+        collapsed = self.client.get(f'/api/core/profiles/{profile_id}/?kind=collapsed')
+        self.assertEqual(collapsed.status_code, status.HTTP_200_OK)
+        lines = b''.join(collapsed.streaming_content).decode().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.rsplit(' ', 1)[1].isdigit() for line in lines))
+        self.assertTrue(any('views.py' in line for line in lines))
+
+        self.assertEqual(self.client.get(f'/api/core/profiles/{profile_id}/').status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in self.client.get('/api/core/profiles/').data], [profile_id])
+
+    def test_ordinary_user_ignored(self):
+        """Проверка: флаг обычного пользователя игнорируется, профили ему недоступны"""
+        self._login(self.user)
+        response = self.client.get('/api/projects/project-sheets/', HTTP_X_PROFILE='1')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn('X-Profile-Id', response)
+        self.assertEqual(os.listdir(self.dir), [])
+        self.assertEqual(self.client.get('/api/core/profiles/').status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_retention(self):
+        """Проверка: хранится не больше MAX_PROFILES профилей"""
+        self._login(self.admin)
+        for _ in range(3):
+            self.client.get('/api/projects/statuses/?_profile=1')
+
+        self.assertEqual(len(profiling.list_profiles()), 2)
+        self.assertEqual(self.client.get('/api/core/profiles/..%2Fsecret/').status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ContinuousSamplerTest(TestCase):
+    """Тесты непрерывного семплирования стеков"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.options = {
+            'ENABLED': True, 'INTERVAL': 0.01, 'MAX_OVERHEAD': 0.01,
+            'WINDOW': 60, 'RETENTION': 3600, 'DIR': tmp.name,
+        }
+        self.sampler = sampling.ContinuousSampler(self.options)
+
+        # Поток, "обрабатывающий запрос" до установки события
+        self.release = threading.Event()
+        started = threading.Event()
+
+        def handle_request():
+            sampling._requests[threading.get_ident()] = 'project-sheet:list'
+            started.set()
+            self.release.wait()
+            sampling.clear_request_label()
+
+        self.worker = threading.Thread(target=handle_request)
+        self.worker.start()
+        started.wait()
+        self.addCleanup(self.worker.join)
+        self.addCleanup(self.release.set)
+
+    def test_stacks_tagged_by_action(self):
+        """Проверка: стеки потоков с запросами снимаются с меткой действия в корне"""
+        self.assertEqual(self.sampler.sample_once(), 1)
+        self.sampler.sample_once()
+
+        (stack, value), = self.sampler.counts.items()
+        self.assertTrue(stack.startswith('project-sheet:list;'))
+        self.assertIn(':handle_request;', stack)
+        self.assertEqual(value, 20000)
+
+    def test_dump_merges_windows(self):
+        """Проверка: команда объединяет записанные окна и фильтрует по действию"""
+        for _ in range(2):
+            self.sampler.sample_once()
+            self.sampler.flush()
+        out = StringIO()
+
+        with override_settings(SAMPLING=self.options):
+            call_command('dump_samples', view='project-sheet:list', stdout=out, stderr=StringIO())
+            call_command('dump_samples', view='dashboard:data', stdout=StringIO(), stderr=StringIO())
+
+        lines = out.getvalue().splitlines()
+        self.assertEqual(len(lines), 1)
+        self.assertTrue(lines[0].endswith(' 20000'))
+
+    def test_overhead_limit(self):
+        """Проверка: при превышении доли времени интервал семплирования растет"""
+        for _ in range(20):
+            self.sampler._adjust_interval(0.005)
+        self.assertGreater(self.sampler.interval, self.options['INTERVAL'])
+
+        for _ in range(100):
+            self.sampler._adjust_interval(0.0)
+        self.assertEqual(self.sampler.interval, self.options['INTERVAL'])
+
+
+class NPlusOneTest(TestCase):
+    """Тесты поиска N+1 и лишних загрузок связей"""
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        if not nplusone.installed():
+            self.addCleanup(nplusone.uninstall)
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        for n in range(3):
+            site = ConstructionSite.objects.create(name=f'Участок {n}', manager=self.user)
+            project = Project.objects.create(name=f'Проект {n}', code=f'P{n}', cipher='C', construction_site=site)
+            sheet = ProjectSheet.objects.create(name=f'Лист {n}', project=project, created_by=self.user)
+            sheet.executors.set([self.user])
+
+    def test_uninstall_restores_descriptors(self):
+        """Проверка: uninstall() возвращает исходные методы Django"""
+        nplusone.uninstall()
+        original = ForwardManyToOneDescriptor.__get__
+        with nplusone.track():
+            self.assertIsNot(ForwardManyToOneDescriptor.__get__, original)
+        nplusone.uninstall()
+
+        self.assertFalse(nplusone.installed())
+        self.assertIs(ForwardManyToOneDescriptor.__get__, original)
+        self.assertEqual(ProjectSheet.objects.select_related('project').first().project.code, 'P0')
+
+    def _findings(self, func, **kwargs):
+        with nplusone.track() as tracker:
+            func()
+        return {(f['kind'], f['model'], f['path']): f for f in tracker.report(**kwargs)}
+
+    def test_lazy_chain_suggests_select_related_path(self):
+        """Проверка: sheet.project.construction_site в цикле — select_related от модели запроса"""
+        def walk(queryset):
+            for sheet in queryset:
+                sheet.project.construction_site.name
+
+        findings = self._findings(lambda: walk(ProjectSheet.objects.all()))
+
+        finding = findings['n_plus_one', 'projects.ProjectSheet', 'project__construction_site']
+        self.assertEqual(finding['count'], 3)
+        self.assertIn("select_related('project__construction_site')", finding['message'])
+        self.assertIn('apps/core/tests.py', finding['site'])
+        self.assertIn(('n_plus_one', 'projects.ProjectSheet', 'project'), findings)
+
+        findings = self._findings(lambda: walk(ProjectSheet.objects.select_related('project__construction_site')))
+        self.assertEqual(findings, {})
+
+    def test_reverse_relations_suggest_prefetch_related(self):
+        """Проверка: обратный ForeignKey и ManyToMany в цикле — prefetch_related"""
+        def walk(queryset):
+            for project in queryset:
+                for sheet in project.sheets.all():
+                    list(sheet.executors.all())
+
+        findings = self._findings(lambda: walk(Project.objects.all()))
+
+        self.assertIn("prefetch_related('sheets')", findings['n_plus_one', 'projects.Project', 'sheets']['message'])
+        self.assertIn(('n_plus_one', 'projects.Project', 'sheets__executors'), findings)
+
+        findings = self._findings(lambda: walk(Project.objects.prefetch_related('sheets__executors')))
+        self.assertEqual(findings, {})
+
+    def test_single_lazy_load_is_not_reported(self):
+        """Проверка: связь одного объекта, загруженная лениво, — не N+1"""
+        findings = self._findings(lambda: ProjectSheet.objects.first().project.construction_site)
+        self.assertEqual(findings, {})
+
+    def test_unused_eager_loads_are_reported(self):
+        """Проверка: select_related и prefetch_related без обращений выдаются как лишние"""
+        def walk():
+            for sheet in ProjectSheet.objects.select_related('created_by', 'project').prefetch_related('executors'):
+                sheet.project.name
+
+        findings = self._findings(walk)
+
+        self.assertEqual(set(findings), {
+            ('unused_eager', 'projects.ProjectSheet', 'created_by'),
+            ('unused_eager', 'projects.ProjectSheet', 'executors'),
+        })
+        self.assertEqual(self._findings(walk, unused=False), {})
+
+    def test_middleware_logs_or_raises(self):
+        """Проверка: middleware пишет находки в лог, при RAISE — выбрасывает NPlusOneError"""
+        def get_response(request):
+            for sheet in ProjectSheet.objects.all():
+                sheet.project.name
+            return HttpResponse('ok')
+
+        middleware = NPlusOneMiddleware(get_response)
+        request = RequestFactory().get('/api/projects/project-sheets/')
+        options = {'ENABLED': True, 'THRESHOLD': 2, 'REPORT_UNUSED': True, 'RAISE': False}
+
+        with override_settings(NPLUSONE=options), self.assertLogs('apps.core.nplusone', 'WARNING') as logs:
+            self.assertEqual(middleware(request).content, b'ok')
+        self.assertIn("GET /api/projects/project-sheets/: N+1: projects.ProjectSheet.project", logs.output[0])
+
+        with override_settings(NPLUSONE={**options, 'RAISE': True}):
+            with self.assertRaisesMessage(nplusone.NPlusOneError, "select_related('project')"):
+                middleware(request)
+
+        with override_settings(NPLUSONE={**options, 'ENABLED': False, 'RAISE': True}):
+            self.assertEqual(middleware(request).content, b'ok')
+
+
+class BenchmarkTest(TestCase):
+    """Тесты бенчмарка эндпоинтов и сравнения с базовыми результатами"""
+
+    def test_compare_flags_regressions(self):
+        baseline = {'1:user.list': {'p95_ms': 10.0, 'peak_kb': 100.0, 'queries': 3}}
+        self.assertEqual(benchmark.compare(
+            {'1:user.list': {'p95_ms': 11.0, 'peak_kb': 110.0, 'queries': 3},
+             '1:new': {'p95_ms': 1.0, 'peak_kb': 1.0, 'queries': 1}},
+            baseline, 0.2
+        ), [])
+        regressions = benchmark.compare(
+            {'1:user.list': {'p95_ms': 13.0, 'peak_kb': 100.0, 'queries': 4}}, baseline, 0.2
+        )
+        self.assertEqual(len(regressions), 2)
+        self.assertIn('p95_ms', regressions[0])
+        self.assertIn('queries 3 -> 4', regressions[1])
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 0.5), 50)
+        self.assertEqual(benchmark.percentile(values, 0.95), 95)
+        self.assertEqual(benchmark.percentile([], 0.5), 0.0)
+
+    def test_command_records_and_checks_baseline(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'baseline.json')
+            args = ['benchmark', '--current-db', '--scales', '0.05', '--only', 'department.list',
+                    '--iterations', '2', '--warmup', '0', '--baseline', path]
+            with self.assertRaisesMessage(CommandError, '--update-baseline'):
+                call_command(*args, stdout=StringIO())
+            call_command(*args, '--update-baseline', stdout=StringIO())
+            with open(path, encoding='utf-8') as f:
+                recorded = json.load(f)
+            self.assertEqual(recorded['vendor'], connection.vendor)
+            self.assertEqual(recorded['scales'], [0.05])
+            results = recorded['results']
+            self.assertEqual(set(results), {'0.05:department.list'})
+            self.assertEqual(results['0.05:department.list']['status'], 200)
+            self.assertGreater(results['0.05:department.list']['queries'], 0)
+            call_command(*args, stdout=StringIO())
+
+            # Число запросов в базовом файле меньше фактического — регрессия
+            results['0.05:department.list']['queries'] = 0
+            benchmark.save_baseline(path, connection.vendor, [0.05], results)
+            with self.assertRaisesMessage(CommandError, 'Регрессий: 1'):
+                call_command(*args, stdout=StringIO())
+
+            # Файл другой СУБД или без нужного масштаба не сравнивается
+            benchmark.save_baseline(path, 'other', [0.05], results)
+            with self.assertRaisesMessage(CommandError, 'записан на other'):
+                call_command(*args, stdout=StringIO())
+            benchmark.save_baseline(path, connection.vendor, [1], results)
+            with self.assertRaisesMessage(CommandError, 'нет масштабов 0.05'):
+                call_command(*args, stdout=StringIO())
+
+
+class PlanCheckTest(TestCase):
+    """Тесты проверки планов выполнения критичных запросов"""
+
+    PLAN = {
+        'Node Type': 'Sort', 'Plan Rows': 40, 'Sort Key': ['is_completed', 'name'],
+        'Plans': [{
+            'Node Type': 'Bitmap Heap Scan', 'Relation Name': 'projects_projectsheet', 'Plan Rows': 40,
+            'Recheck Cond': '(project_id = 7)',
+            'Plans': [{
+                'Node Type': 'Bitmap Index Scan', 'Index Name': 'projects_projectsheet_project_id_4b2f3a1c',
+                'Plan Rows': 40, 'Index Cond': '(project_id = 7)',
+            }],
+        }],
+    }
+
+    def test_main_table_skips_subqueries(self):
+        sql = ('SELECT "projects_project"."id", (SELECT U0."status_id" FROM "projects_projectstage" U0 '
+               'WHERE U0."project_id" = ("projects_project"."id") LIMIT 1) AS "last" FROM "projects_project"')
+        self.assertEqual(plans.main_table(sql), 'projects_project')
+        self.assertEqual(plans.main_table("SELECT 'a FROM b' FROM \"x\""), 'x')
+        self.assertIsNone(plans.main_table('UPDATE "x" SET y = 1'))
+        self.assertEqual(plans.find_query(['SELECT COUNT(*) FROM "x"', sql], 'projects_project'), sql)
+        self.assertIsNone(plans.find_query([sql], 'projects_projectstage'))
+
+    def test_violations(self):
+        check = plans.PlanCheck('sheets', 'project-sheet.list', 'projects_projectsheet',
+                                uses_indexes=('projects_projectsheet_project_id_*',),
+                                no_seq_scan=('projects_projectsheet',), max_rows=100)
+        self.assertEqual(plans.violations(check, self.PLAN), [])
+
+        seq_scan = {'Node Type': 'Seq Scan', 'Relation Name': 'projects_projectsheet', 'Plan Rows': 5000}
+        problems = plans.violations(check, seq_scan)
+        self.assertEqual(len(problems), 3)
+        self.assertIn('projects_projectsheet_project_id_*', problems[0])
+        self.assertIn('Seq Scan по projects_projectsheet', problems[1])
+        self.assertIn('5000', problems[2])
+
+    def test_artifacts_and_diff(self):
+        with tempfile.TemporaryDirectory() as directory:
+            artifacts = os.path.join(directory, 'artifacts')
+            baseline = os.path.join(directory, 'baseline')
+            self.assertIsNone(plans.baseline_path(baseline, 'sheets'))
+            self.assertEqual(plans.write_artifacts(artifacts, 'sheets', 'SELECT 1', self.PLAN, baseline), '')
+            with open(os.path.join(artifacts, 'sheets.txt'), encoding='utf-8') as f:
+                summary = f.read()
+            self.assertIn('-> Bitmap Index Scan using projects_projectsheet_project_id_4b2f3a1c', summary)
+            self.assertIn('Sort Key: is_completed, name', summary)
+
+            plans.save_baseline(baseline, 'sheets', self.PLAN)
+            self.assertIsNotNone(plans.baseline_path(baseline, 'sheets'))
+            self.assertEqual(plans.write_artifacts(artifacts, 'sheets', 'SELECT 1', self.PLAN, baseline), '')
+            self.assertFalse(os.path.exists(os.path.join(artifacts, 'sheets.diff')))
+
+            seq_scan = {'Node Type': 'Seq Scan', 'Relation Name': 'projects_projectsheet', 'Plan Rows': 40}
+            diff = plans.write_artifacts(artifacts, 'sheets', 'SELECT 1', seq_scan, baseline)
+            self.assertIn('+Seq Scan on projects_projectsheet (rows=40)', diff)
+            with open(os.path.join(artifacts, 'sheets.diff'), encoding='utf-8') as f:
+                self.assertEqual(f.read(), diff)
+            with open(os.path.join(artifacts, 'sheets.json'), encoding='utf-8') as f:
+                self.assertEqual(json.load(f), {'sql': 'SELECT 1', 'plan': seq_scan})
+
+    def test_checks_find_their_queries(self):
+        """Проверка: каждый зарегистрированный запрос находится среди SQL своего сценария"""
+        call_command('generate_load_data', '--scale', '0.02', stdout=StringIO())
+        users = {scenario.name: scenario.user for scenario in benchmark.SCENARIOS}
+        clients = benchmark.clients()
+        fixtures = benchmark.fixtures()
+        for check in plans.CHECKS:
+            with self.subTest(check=check.name):
+                sql = plans.capture_query(check, clients[users[check.scenario]], fixtures)
+                self.assertEqual(plans.main_table(sql), check.table)
+
+    @skipUnless(connection.vendor == 'postgresql', 'EXPLAIN (FORMAT JSON) — только PostgreSQL')
+    def test_plans_on_seeded_postgres(self):
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('check_plans', '--current-db', '--artifacts', directory, stdout=StringIO())
+            for check in plans.CHECKS:
+                self.assertTrue(os.path.exists(os.path.join(directory, f'{check.name}.txt')))
+
+
+class LoadTestFlowsTest(LiveServerTestCase):
+    """Сценарии нагрузочного теста против запущенного сервера"""
+
+    def test_all_flows_run_without_errors(self):
+        call_command(
+            'generate_load_data', '--scale', '0.05', '--seed', '3',
+            '--sheets-per-project', '8', '--stages-per-project', '3', stdout=StringIO()
+        )
+        stats = loadtest.Stats()
+        session = loadtest.Session(f'{self.live_server_url}/api', 'load_user1', 'loadtest', stats)
+        rng = random.Random(1)
+        for name in loadtest.FLOWS:
+            loadtest.run_flow(session, name, rng)
+        report = stats.report()
+        self.assertEqual(set(report), set(loadtest.FLOWS))
+        for flow, row in report.items():
+            self.assertEqual(row['failed_runs'], 0, (flow, row['errors']))
+            self.assertEqual(row['error_rate'], 0, (flow, row['errors']))
+        # Листы проекта загружаются постранично, как в клиенте (кроме них — карточка и этапы)
+        self.assertGreater(report['project_detail']['requests'], 3)
+        # Обновление токена: 401, /auth/refresh/ и повтор запроса
+        self.assertEqual(report['token_refresh']['requests'], 3)
+
+        # Повторный вход: стартовые данные перепроверяются по сохраненному ETag
+        statuses = []
+        send = session._send
+
+        def recording_send(*args, **kwargs):
+            result = send(*args, **kwargs)
+            statuses.append(result[0])
+            return result
+
+        with mock.patch.object(session, '_send', recording_send):
+            loadtest.run_flow(session, 'login', rng)
+            loadtest.run_flow(session, 'project_detail', rng)
+        self.assertEqual(statuses[:2], [200, 304])
+        self.assertEqual(statuses.count(304), 1)
+
+    def test_run_with_bad_credentials_reports_errors(self):
+        stats = loadtest.run(
+            f'{self.live_server_url}/api', [('nobody', 'wrong')], duration=0, think_time=0
+        )
+        self.assertEqual(stats.report()['login']['failed_runs'], 1)
+        self.assertEqual(stats.report()['login']['error_rate'], 1)
+
+
+class ContentAddressedStorageTest(TestCase):
+    """Тесты хранилища с дедупликацией по содержимому и счетчиков ссылок"""
+
+    CONTENT = b'%PDF-1.4 drawing'
+    DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        # Файлы превью в каталоге блобов здесь не нужны, файлы без ссылок удаляются сразу
+        self.settings_override = override_settings(
+            MEDIA_ROOT=media.name, PREVIEWS={**settings.PREVIEWS, 'ENABLED': False},
+            FILE_GC={**settings.FILE_GC, 'AUTO': False, 'DELAY': 0},
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.media = media.name
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        site = ConstructionSite.objects.create(name='Участок')
+        self.project = Project.objects.create(name='Проект', code='P', cipher='C', construction_site=site)
+
+    def blob_files(self):
+        return sorted(
+            os.path.relpath(os.path.join(root, name), self.media)
+            for root, _, files in os.walk(os.path.join(self.media, storage.BLOBS_DIR)) for name in files
+        )
+
+    def create_sheet(self, name='Чертеж.pdf', content=None):
+        return ProjectSheet.objects.create(
+            name='Лист', project=self.project, file=SimpleUploadedFile(name, content or self.CONTENT),
+        )
+
+    def test_same_content_stored_once(self):
+        sheet = self.create_sheet()
+        stage = ProjectStage.objects.create(
+            project=self.project, datetime=timezone.now(), author=self.user,
+            file=SimpleUploadedFile('план.pdf', self.CONTENT),
+        )
+        note = ProjectSheetNote.objects.create(
+            name='Заметка', note='Текст', project_sheet=sheet, file=SimpleUploadedFile('Чертеж.pdf', self.CONTENT),
+        )
+
+        self.assertEqual(sheet.file.name, f'cas/{self.DIGEST}/Чертеж.pdf')
+        self.assertEqual(stage.file.name, f'cas/{self.DIGEST}/план.pdf')
+        self.assertEqual(self.blob_files(), [f'blobs/{self.DIGEST[:2]}/{self.DIGEST[2:4]}/{self.DIGEST}'])
+        self.assertEqual(Blob.objects.get().ref_count, 3)
+        self.assertEqual(Blob.objects.get().size, len(self.CONTENT))
+        with ProjectSheetNote.objects.get(pk=note.pk).file.open('rb') as f:
+            self.assertEqual(f.read(), self.CONTENT)
+
+    def test_known_digest_skips_write(self):
+        first = default_storage.save('a.pdf', ContentFile(self.CONTENT))
+        blobs.acquire(default_storage, first)
+        blob_path = default_storage.path(first)
+        os.utime(blob_path, (0, 0))
+
+        upload = SimpleUploadedFile('b.pdf', self.CONTENT)
+        upload.content_sha256 = self.DIGEST
+        self.assertEqual(default_storage.save('project_sheets/b.pdf', upload), f'cas/{self.DIGEST}/b.pdf')
+        self.assertEqual(os.stat(blob_path).st_mtime, 0)
+
+        temporary = TemporaryUploadedFile('c.pdf', 'application/pdf', 3, None)
+        temporary.write(b'new')
+        temporary.flush()
+        temporary.content_sha256 = hashlib.sha256(b'new').hexdigest()
+        name = default_storage.save('c.pdf', temporary)
+        # Временный файл загрузки перенесен на место блоба
+        self.assertFalse(os.path.exists(temporary.temporary_file_path()))
+        temporary.close()
+        with default_storage.open(name) as f:
+            self.assertEqual(f.read(), b'new')
+        self.assertFalse(os.listdir(os.path.join(self.media, 'blobs', 'tmp')))
+
+    def test_upload_handler_hashes_while_receiving(self):
+        handler = storage.HashingMemoryFileUploadHandler()
+        handler.handle_raw_input(None, {}, len(self.CONTENT), 'boundary')
+        with self.assertRaises(StopFutureHandlers):
+            handler.new_file('file', 'a.pdf', 'application/pdf', len(self.CONTENT))
+        for start in range(0, len(self.CONTENT), 5):
+            self.assertIsNone(handler.receive_data_chunk(self.CONTENT[start:start + 5], start))
+        self.assertEqual(handler.file_complete(len(self.CONTENT)).content_sha256, self.DIGEST)
+
+    def test_long_name_truncated_to_field_length(self):
+        sheet = self.create_sheet('ч' * 120 + '.pdf')
+        self.assertLessEqual(len(sheet.file.name), 100)
+        self.assertTrue(sheet.file.name.endswith('ч.pdf'))
+
+    def test_replace_and_delete_release_blobs(self):
+        sheet = self.create_sheet()
+        other = self.create_sheet('копия.pdf')
+        sheet = ProjectSheet.objects.get(pk=sheet.pk)
+        sheet.file = SimpleUploadedFile('v2.pdf', b'second version')
+        sheet.save()
+        self.assertEqual(Blob.objects.get(digest=self.DIGEST).ref_count, 1)
+        self.assertFalse(PendingFileDeletion.objects.exists())
+        self.assertEqual(len(self.blob_files()), 2)
+
+        other.delete()
+        self.assertEqual(Blob.objects.get(digest=self.DIGEST).ref_count, 0)
+        self.assertEqual(filegc.collect(), 1)
+        self.assertFalse(Blob.objects.filter(digest=self.DIGEST).exists())
+        self.assertEqual(len(self.blob_files()), 1)
+
+        self.project.delete()
+        self.assertEqual(filegc.collect(), 1)
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(PendingFileDeletion.objects.exists())
+        self.assertEqual(self.blob_files(), [])
+
+    def test_failed_ref_count_rolls_back_api_save(self):
+        """Проверка: ViewSet сохраняет лист в одной транзакции со счетчиками ссылок"""
+        sheet = self.create_sheet()
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser(username='admin', password='testpass123'))
+        with mock.patch.object(blobs, 'release', side_effect=RuntimeError('release failed')):
+            with self.assertRaises(RuntimeError):
+                client.patch(f'/api/projects/project-sheets/{sheet.pk}/',
+                             {'file': SimpleUploadedFile('v2.pdf', b'second version')}, format='multipart')
+        self.assertEqual(ProjectSheet.objects.get(pk=sheet.pk).file.name, sheet.file.name)
+        self.assertEqual(Blob.objects.get().digest, self.DIGEST)
+
+    def test_deferred_field_released_on_replace(self):
+        sheet = self.create_sheet()
+        deferred = ProjectSheet.objects.only('id').get(pk=sheet.pk)
+        deferred.file = SimpleUploadedFile('v2.pdf', b'second version')
+        deferred.save()
+        self.assertEqual(Blob.objects.get(digest=self.DIGEST).ref_count, 0)
+        filegc.collect()
+        self.assertFalse(Blob.objects.filter(digest=self.DIGEST).exists())
+
+    def test_immutable_blob_url(self):
+        sheet = self.create_sheet()
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = sheet.file.url
+        self.assertEqual(url, f'/api/core/files/{self.DIGEST}/%D0%A7%D0%B5%D1%80%D1%82%D0%B5%D0%B6.pdf')
+
+        response = client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+        self.assertEqual(response['ETag'], f'"{self.DIGEST}"')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('max-age=31536000', response['Cache-Control'])
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code,
+                         status.HTTP_304_NOT_MODIFIED)
+
+        self.assertEqual(client.get(f'/api/core/files/{"0" * 64}/a.pdf').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(APIClient().get(url).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_dedupe_files_command(self):
+        for name in ('project_sheets/a.pdf', 'project_sheets/b.pdf'):
+            path = os.path.join(self.media, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(self.CONTENT)
+            ProjectSheet.objects.create(name='Лист', project=self.project, file=name)
+        ProjectSheet.objects.create(name='Лист', project=self.project, file='project_sheets/missing.pdf')
+
+        out = StringIO()
+        call_command('dedupe_files', '--dry-run', stdout=out)
+        self.assertIn('К переносу: 2 файлов', out.getvalue())
+        self.assertFalse(Blob.objects.exists())
+
+        call_command('dedupe_files', stdout=StringIO())
+        names = sorted(ProjectSheet.objects.values_list('file', flat=True))
+        self.assertEqual(names[:2], [f'cas/{self.DIGEST}/a.pdf', f'cas/{self.DIGEST}/b.pdf'])
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+        self.assertEqual(os.listdir(os.path.join(self.media, 'project_sheets')), [])
+
+
+class FileGarbageCollectorTest(TestCase):
+    """Тесты очереди удаления файлов без ссылок и сверки хранилища с БД"""
+
+    CONTENT = b'%PDF-1.4 drawing'
+    DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.settings_override = override_settings(
+            MEDIA_ROOT=media.name, PREVIEWS={**settings.PREVIEWS, 'ENABLED': False},
+            FILE_GC={**settings.FILE_GC, 'AUTO': False, 'DELAY': 600},
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.media = media.name
+        site = ConstructionSite.objects.create(name='Участок')
+        self.project = Project.objects.create(name='Проект', code='P', cipher='C', construction_site=site)
+
+    def write(self, name, content=b'data', age=None):
+        path = os.path.join(self.media, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+        if age is not None:
+            old = time.time() - age
+            os.utime(path, (old, old))
+        return path
+
+    def test_release_queued_in_transaction(self):
+        sheet = ProjectSheet.objects.create(
+            name='Лист', project=self.project, file=SimpleUploadedFile('Чертеж.pdf', self.CONTENT),
+        )
+        legacy_path = self.write('project_sheets/old.pdf')
+        legacy = ProjectSheet.objects.create(name='Старый', project=self.project, file='project_sheets/old.pdf')
+        blob_path = default_storage.path(sheet.file.name)
+
+        # Откат транзакции отменяет и постановку в очередь
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            Project.objects.get(pk=self.project.pk).delete()
+            self.assertEqual(PendingFileDeletion.objects.count(), 2)
+            raise RuntimeError
+        self.assertFalse(PendingFileDeletion.objects.exists())
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            Project.objects.get(pk=self.project.pk).delete()
+        self.assertEqual(set(callbacks), {filegc.wake})
+        self.assertEqual(
+            sorted(PendingFileDeletion.objects.values_list('name', flat=True)),
+            [default_storage.blob_name(self.DIGEST), 'project_sheets/old.pdf'],
+        )
+        # До истечения FILE_GC['DELAY'] файлы не трогаются
+        self.assertEqual(filegc.collect(), 0)
+        self.assertTrue(os.path.exists(blob_path))
+
+        PendingFileDeletion.objects.update(not_before=timezone.now())
+        # Ссылку на старый файл вернули до сборки
+        ProjectSheet.objects.create(name='Старый', project=Project.objects.create(
+            name='Проект 2', code='P2', cipher='C2', construction_site=legacy.project.construction_site,
+        ), file='project_sheets/old.pdf')
+        self.assertEqual(filegc.collect(batch_size=1), 1)
+        self.assertFalse(os.path.exists(blob_path))
+        self.assertTrue(os.path.exists(legacy_path))
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(PendingFileDeletion.objects.exists())
+
+    def test_save_of_queued_blob_survives_collect(self):
+        """Проверка: сохранение содержимого блоба из очереди снимает его с очереди до ссылки"""
+        sheet = ProjectSheet.objects.create(
+            name='Лист', project=self.project, file=SimpleUploadedFile('Чертеж.pdf', self.CONTENT),
+        )
+        sheet.delete()
+        PendingFileDeletion.objects.update(not_before=timezone.now())
+
+        # Сборка между записью файла хранилищем и добавлением ссылки (post_save)
+        name = default_storage.save('Копия.pdf', SimpleUploadedFile('Копия.pdf', self.CONTENT))
+        self.assertEqual(filegc.collect(), 0)
+        self.assertFalse(PendingFileDeletion.objects.exists())
+        blobs.acquire(default_storage, name)
+        self.assertEqual(Blob.objects.get(digest=self.DIGEST).ref_count, 1)
+        with default_storage.open(name) as f:
+            self.assertEqual(f.read(), self.CONTENT)
+
+    def test_missing_blob_row_rewrites_file(self):
+        """Проверка: файлу блоба без строки Blob запись не доверяет и пишет содержимое заново"""
+        path = self.write(default_storage.blob_name(self.DIGEST), b'damaged')
+
+        name = default_storage.save('Чертеж.pdf', SimpleUploadedFile('Чертеж.pdf', self.CONTENT))
+        self.assertEqual(default_storage.digest(name), self.DIGEST)
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), self.CONTENT)
+
+    def test_reconcile(self):
+        sheet = ProjectSheet.objects.create(
+            name='Лист', project=self.project, file=SimpleUploadedFile('Чертеж.pdf', self.CONTENT),
+        )
+        Blob.objects.filter(digest=self.DIGEST).update(ref_count=5)
+        orphan = hashlib.sha256(b'orphan').hexdigest()
+        orphan_path = self.write(default_storage.blob_name(orphan), b'orphan', age=3600)
+        fresh = hashlib.sha256(b'fresh').hexdigest()
+        self.write(default_storage.blob_name(fresh), b'fresh')
+        gone = hashlib.sha256(b'gone').hexdigest()
+        Blob.objects.create(digest=gone, size=4, ref_count=1)
+        stale_preview = self.write(previews.preview_name(gone), age=3600)
+        temp = self.write(f'{storage.BLOBS_DIR}/tmp/tmpabc', age=3600)
+        legacy = self.write('project_sheets/old.pdf', age=3600)
+        self.write('project_sheets/used.pdf', age=3600)
+        ProjectSheet.objects.create(name='Старый', project=self.project, file='project_sheets/used.pdf')
+        # Ссылка на блоб, которого нет на диске (update() сигналов не отправляет)
+        lost = ProjectSheet.objects.create(name='Потерянный', project=self.project)
+        ProjectSheet.objects.filter(pk=lost.pk).update(file=f'cas/{"0" * 64}/a.pdf')
+
+        out = StringIO()
+        with self.assertLogs('apps.core.filegc', 'WARNING') as logs:
+            call_command('reconcile_files', '--dry-run', stdout=out)
+        self.assertIn('0' * 64, logs.output[0])
+        self.assertIn('Блобов: 3, без файла на диске: 1, счетчиков ссылок исправлено: 4', out.getvalue())
+        self.assertIn('Без ссылок: блобов 1, старых файлов 1 (из 2)', out.getvalue())
+        self.assertEqual(Blob.objects.get(digest=self.DIGEST).ref_count, 5)
+        self.assertTrue(os.path.exists(temp))
+
+        out = StringIO()
+        with self.assertLogs('apps.core.filegc', 'WARNING'):
+            call_command('reconcile_files', stdout=out)
+        self.assertIn('превью без блоба: 1, временных файлов: 1', out.getvalue())
+        self.assertIn('Удалено файлов: 2', out.getvalue())
+        self.assertEqual(Blob.objects.get(digest=self.DIGEST).ref_count, 1)
+        self.assertEqual(sorted(Blob.objects.values_list('digest', flat=True)), sorted([self.DIGEST, fresh]))
+        self.assertEqual(Blob.objects.get(digest=fresh).ref_count, 0)
+        for path in (orphan_path, stale_preview, temp, legacy):
+            self.assertFalse(os.path.exists(path), path)
+        self.assertTrue(os.path.exists(default_storage.path(sheet.file.name)))
+        self.assertTrue(os.path.exists(os.path.join(self.media, 'project_sheets', 'used.pdf')))
+        self.assertFalse(PendingFileDeletion.objects.exists())
+
+
+class ResumableUploadTest(TestCase):
+    """Тесты докачиваемой загрузки файлов частями"""
+
+    CONTENT = bytes(range(256)) * 40
+    DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.settings_override = override_settings(
+            MEDIA_ROOT=media.name, PREVIEWS={**settings.PREVIEWS, 'ENABLED': False},
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.media = media.name
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        site = ConstructionSite.objects.create(name='Участок')
+        project = Project.objects.create(name='Проект', code='P', cipher='C', construction_site=site)
+        self.sheet = ProjectSheet.objects.create(name='Лист', project=project, created_by=self.user)
+
+    def start(self, filename='Большой чертеж.pdf', size=None):
+        response = self.client.post('/api/core/uploads/', {'filename': filename, 'size': size or len(self.CONTENT)},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response['Location'], f'/api/core/uploads/{response.data["id"]}/')
+        return response.data['id']
+
+    def put(self, upload_id, offset, data):
+        return self.client.put(f'/api/core/uploads/{upload_id}/', data,
+                               content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def attach(self, upload_id, **extra):
+        return self.client.post(f'/api/projects/project-sheets/{self.sheet.id}/attach_upload/',
+                                {'upload': upload_id, **extra}, format='json')
+
+    def test_chunked_upload_attached_to_sheet(self):
+        upload_id = self.start()
+        for offset in range(0, len(self.CONTENT), 4000):
+            response = self.put(upload_id, offset, self.CONTENT[offset:offset + 4000])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['offset'], min(offset + 4000, len(self.CONTENT)))
+            self.assertEqual(response['Upload-Offset'], str(response.data['offset']))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.attach(upload_id, sha256=self.DIGEST)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.sheet.refresh_from_db()
+        self.assertEqual(self.sheet.file.name, f'cas/{self.DIGEST}/Большой_чертеж.pdf')
+        with self.sheet.file.open('rb') as f:
+            self.assertEqual(f.read(), self.CONTENT)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(self.media, uploads.UPLOADS_DIR)), [])
+
+    def test_failed_attach_keeps_session_file(self):
+        """Проверка: при ошибке сохранения объекта сессию можно прикрепить снова"""
+        upload_id = self.start()
+        self.put(upload_id, 0, self.CONTENT)
+        with mock.patch.object(ProjectSheet, 'save', side_effect=RuntimeError('save failed')):
+            with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+                self.attach(upload_id)
+        session = UploadSession.objects.get(pk=upload_id)
+        with open(uploads.session_path(session), 'rb') as f:
+            self.assertEqual(f.read(), self.CONTENT)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.attach(upload_id, sha256=self.DIGEST).status_code, status.HTTP_200_OK)
+        self.assertEqual(os.listdir(os.path.join(self.media, uploads.UPLOADS_DIR)), [])
+
+    def test_resume_from_server_offset(self):
+        upload_id = self.start()
+        self.put(upload_id, 0, self.CONTENT[:1000])
+
+        response = self.put(upload_id, 500, self.CONTENT[500:2000])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['offset'], 1000)
+        response = self.client.get(f'/api/core/uploads/{upload_id}/')
+        self.assertEqual(response.data['offset'], 1000)
+
+        self.assertEqual(self.attach(upload_id).status_code, status.HTTP_409_CONFLICT)
+        # Следующая часть пришла в другой процесс: хэш пересчитывается по файлу
+        uploads._hashers.clear()
+        self.assertEqual(self.put(upload_id, 1000, self.CONTENT[1000:]).status_code, status.HTTP_200_OK)
+        self.assertEqual(self.attach(upload_id, sha256=self.DIGEST).status_code, status.HTTP_200_OK)
+
+    def test_interrupted_chunk_keeps_received_bytes(self):
+        session = UploadSession.objects.get(pk=self.start())
+
+        class BrokenStream:
+            def __init__(self, data):
+                self.data = data
+
+            def read(self, size):
+                if not self.data:
+                    raise UnreadablePostError('connection reset')
+                chunk, self.data = self.data[:size], self.data[size:]
+                return chunk
+
+        with override_settings(UPLOADS={**settings.UPLOADS, 'BUFFER_SIZE': 100}):
+            with self.assertRaises(UnreadablePostError):
+                uploads.receive(session, BrokenStream(self.CONTENT[:250]), 0, 1000)
+        session.refresh_from_db()
+        self.assertEqual(session.offset, 250)
+        with open(uploads.session_path(session), 'rb') as f:
+            self.assertEqual(f.read(), self.CONTENT[:250])
+
+    def test_stale_chunk_writes_nothing(self):
+        """Проверка: часть с уже принятой позиции отклоняется до записи в файл"""
+        upload_id = self.start()
+        stale = UploadSession.objects.get(pk=upload_id)
+        self.put(upload_id, 0, self.CONTENT[:1000])
+
+        stream = BytesIO(b'x' * 1000)
+        with self.assertRaises(uploads.OffsetConflict):
+            uploads.receive(stale, stream, 0, 1000)
+        self.assertEqual(stream.tell(), 0)
+        with open(uploads.session_path(stale), 'rb') as f:
+            self.assertEqual(f.read(), self.CONTENT[:1000])
+
+    def test_limits_and_validation(self):
+        upload_id = self.start(size=100)
+        self.assertEqual(self.put(upload_id, 0, b'x' * 101).status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        response = self.client.put(f'/api/core/uploads/{upload_id}/', b'x',
+                                   content_type='application/offset+octet-stream')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(UPLOADS={**settings.UPLOADS, 'MAX_SIZE': 10}):
+            response = self.client.post('/api/core/uploads/', {'filename': 'a.pdf', 'size': 11}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.put(upload_id, 0, b'x' * 100)
+        response = self.attach(upload_id, sha256='0' * 64)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(UploadSession.objects.exists())
+
+    def test_sessions_are_private_and_expire(self):
+        upload_id = self.start()
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='other', password='testpass123'))
+        self.assertEqual(other.get(f'/api/core/uploads/{upload_id}/').status_code, status.HTTP_404_NOT_FOUND)
+
+        UploadSession.objects.update(updated_at=timezone.now() - datetime.timedelta(days=2))
+        self.assertEqual(self.client.get(f'/api/core/uploads/{upload_id}/').status_code, status.HTTP_404_NOT_FOUND)
+        out = StringIO()
+        call_command('clear_uploads', stdout=out)
+        self.assertIn('Удалено сессий: 1', out.getvalue())
+        self.assertEqual(os.listdir(os.path.join(self.media, uploads.UPLOADS_DIR)), [])
+
+
+class ConcurrentUploadTest(TransactionTestCase):
+    """Тесты параллельных частей одной сессии докачиваемой загрузки"""
+
+    CONTENT = bytes(range(256)) * 8
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.settings_override = override_settings(
+            MEDIA_ROOT=media.name, PREVIEWS={**settings.PREVIEWS, 'ENABLED': False},
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_overlapping_puts_write_once(self):
+        """Проверка: вторая часть, пока пишется первая, сразу получает 409 и ничего не пишет"""
+        upload_id = self.client.post('/api/core/uploads/', {'filename': 'a.pdf', 'size': len(self.CONTENT)},
+                                     format='json').data['id']
+        reading, release = threading.Event(), threading.Event()
+        content = self.CONTENT
+
+        class SlowStream:
+            """Тело первой части, которое приходит, пока идет вторая"""
+
+            def __init__(self):
+                self.data = content
+
+            def read(self, size):
+                reading.set()
+                release.wait(5)
+                chunk, self.data = self.data[:size], self.data[size:]
+                return chunk
+
+        results = {}
+
+        def first():
+            try:
+                session = UploadSession.objects.get(pk=upload_id)
+                results['first'] = uploads.receive(session, SlowStream(), 0, len(content))
+            finally:
+                connection.close()
+
+        thread = threading.Thread(target=first)
+        thread.start()
+        reading.wait(5)
+        # Первая часть держит блокировку файла сессии, но не строку в БД
+        response = self.client.put(f'/api/core/uploads/{upload_id}/', b'x' * len(content),
+                                   content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET='0')
+        results['second'] = response.status_code
+        self.assertEqual(self.client.get(f'/api/core/uploads/{upload_id}/').data['offset'], 0)
+        release.set()
+        thread.join(10)
+
+        self.assertEqual(results, {'first': len(content), 'second': status.HTTP_409_CONFLICT})
+        session = UploadSession.objects.get(pk=upload_id)
+        self.assertEqual(session.offset, len(content))
+        self.assertEqual(uploads.digest(session), hashlib.sha256(content).hexdigest())
+
+
+@skipUnless(Stubber, 'нужен boto3')
+class S3StorageTest(TestCase):
+    """Тесты хранилища в S3-совместимом объектном хранилище (ответы S3 подставляет Stubber)"""
+
+    CONTENT = b'%PDF-1.4 drawing'
+    DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+    def setUp(self):
+        self.settings_override = override_settings(
+            STORAGES={**settings.STORAGES, 'default': {'BACKEND': 'apps.core.s3.S3ContentAddressedStorage'}},
+            S3={**settings.S3, 'ENDPOINT_URL': 'http://minio:9000', 'PUBLIC_ENDPOINT_URL': 'http://localhost:9000',
+                'BUCKET': 'bucket', 'ACCESS_KEY': 'key', 'SECRET_KEY': 'secret'},
+            PREVIEWS={**settings.PREVIEWS, 'ENABLED': False},
+            FILE_GC={**settings.FILE_GC, 'AUTO': False, 'DELAY': 0},
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.stubber = Stubber(default_storage.client)
+        self.stubber.activate()
+        self.addCleanup(self.stubber.deactivate)
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        site = ConstructionSite.objects.create(name='Участок')
+        project = Project.objects.create(name='Проект', code='P', cipher='C', construction_site=site)
+        self.sheet = ProjectSheet.objects.create(name='Лист', project=project, created_by=self.user)
+        self.blob_key = default_storage.blob_name(self.DIGEST)
+
+    def head(self, key, size=None, **extra):
+        if size is None:
+            self.stubber.add_client_error('head_object', service_error_code='404', http_status_code=404,
+                                          expected_params={'Bucket': 'bucket', 'Key': key, **extra})
+            return
+        self.stubber.add_response('head_object', {'ContentLength': size, 'LastModified': timezone.now()},
+                                  {'Bucket': 'bucket', 'Key': key, **extra})
+
+    def expect(self, operation, **params):
+        self.stubber.add_response(operation, {}, {'Bucket': 'bucket', **params})
+
+    def start(self, sha256=None):
+        response = self.client.post('/api/core/uploads/direct/', {
+            'filename': 'Большой чертеж.pdf', 'size': len(self.CONTENT), 'sha256': sha256 or self.DIGEST.upper(),
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data
+
+    def attach(self, upload_id):
+        return self.client.post(f'/api/projects/project-sheets/{self.sheet.id}/attach_upload/',
+                                {'upload': upload_id}, format='json')
+
+    def test_download_redirects_to_presigned_url(self):
+        # Загрузка: строки Blob нет — объект записывается без проверки; размер для Blob и индекса вложений
+        self.expect('put_object', Key=self.blob_key, Body=ANY)
+        self.head(self.blob_key, len(self.CONTENT))
+        self.head(self.blob_key, len(self.CONTENT))
+        self.sheet.file = SimpleUploadedFile('Чертеж.pdf', self.CONTENT)
+        self.sheet.save()
+        self.assertEqual(self.sheet.file.name, f'cas/{self.DIGEST}/Чертеж.pdf')
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+
+        self.head(self.blob_key, len(self.CONTENT))
+        response = self.client.get(f'/api/projects/project-sheets/{self.sheet.id}/download_file/')
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        location = response['Location']
+        self.assertTrue(location.startswith(f'http://localhost:9000/bucket/{self.blob_key}?'), location)
+        self.assertIn('X-Amz-Expires=300', location)
+        self.assertIn('response-content-disposition=attachment', location)
+        self.assertIn('response-content-type=application%2Fpdf', location)
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        # Неизменяемый URL блоба: перенаправление кэшируется на половину срока подписи
+        self.head(self.blob_key, len(self.CONTENT))
+        response = self.client.get(self.sheet.file.url)
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        self.assertIn('max-age=150', response['Cache-Control'])
+
+        self.head(self.blob_key)
+        self.assertEqual(self.client.get(self.sheet.file.url).status_code, status.HTTP_404_NOT_FOUND)
+        self.stubber.assert_no_pending_responses()
+
+    def test_direct_upload_attached_to_sheet(self):
+        data = self.start()
+        upload_key = f'{uploads.UPLOADS_DIR}/{data["id"]}'
+        checksum = base64.b64encode(bytes.fromhex(self.DIGEST)).decode()
+        self.assertEqual(data['sha256'], self.DIGEST)
+        self.assertEqual(data['upload']['url'], 'http://localhost:9000/bucket')
+        fields = data['upload']['fields']
+        self.assertEqual(fields['key'], upload_key)
+        self.assertEqual(fields['x-amz-checksum-sha256'], checksum)
+        policy = json.loads(base64.b64decode(fields['policy']))
+        self.assertIn(['content-length-range', len(self.CONTENT), len(self.CONTENT)], policy['conditions'])
+        self.assertIn({'x-amz-checksum-sha256': checksum}, policy['conditions'])
+
+        # Файл еще не отправлен в хранилище
+        self.head(upload_key, ChecksumMode='ENABLED')
+        self.assertEqual(self.attach(data['id']).status_code, status.HTTP_409_CONFLICT)
+        self.assertTrue(UploadSession.objects.filter(pk=data['id']).exists())
+        # Куски файла сервер не принимает
+        response = self.client.put(f'/api/core/uploads/{data["id"]}/', b'x',
+                                   content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET='0')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        self.stubber.add_response(
+            'head_object', {'ContentLength': len(self.CONTENT), 'ChecksumSHA256': checksum},
+            {'Bucket': 'bucket', 'Key': upload_key, 'ChecksumMode': 'ENABLED'},
+        )
+        self.expect('copy_object', CopySource={'Bucket': 'bucket', 'Key': upload_key}, Key=self.blob_key)
+        self.head(self.blob_key, len(self.CONTENT))
+        self.head(self.blob_key, len(self.CONTENT))
+        # Объект загрузки удаляется после фиксации транзакции
+        self.expect('delete_object', Key=upload_key)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.attach(data['id'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.sheet.refresh_from_db()
+        self.assertEqual(self.sheet.file.name, f'cas/{self.DIGEST}/Большой_чертеж.pdf')
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertFalse(UploadSession.objects.exists())
+        self.stubber.assert_no_pending_responses()
+
+    def test_direct_upload_checksum_mismatch(self):
+        data = self.start()
+        upload_key = f'{uploads.UPLOADS_DIR}/{data["id"]}'
+        # Хранилище не сохранило контрольную сумму: SHA-256 считается по содержимому
+        self.head(upload_key, len(self.CONTENT), ChecksumMode='ENABLED')
+        self.stubber.add_response(
+            'get_object', {'Body': StreamingBody(BytesIO(b'x' * len(self.CONTENT)), len(self.CONTENT))},
+            {'Bucket': 'bucket', 'Key': upload_key},
+        )
+        self.expect('delete_object', Key=upload_key)
+        response = self.attach(data['id'])
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['sha256'], hashlib.sha256(b'x' * len(self.CONTENT)).hexdigest())
+        self.assertFalse(UploadSession.objects.exists())
+        self.stubber.assert_no_pending_responses()
+
+    def test_chunked_upload_needs_local_storage(self):
+        response = self.client.post('/api/core/uploads/', {'filename': 'a.pdf', 'size': 10}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/core/uploads/direct/', {'filename': 'a.pdf', 'size': 10, 'sha256': 'abc'},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('sha256', response.data)
+
+    def test_collect_deletes_objects(self):
+        Blob.objects.create(digest=self.DIGEST, size=len(self.CONTENT), ref_count=0)
+        PendingFileDeletion.objects.create(name=self.blob_key, not_before=timezone.now())
+        self.expect('delete_object', Key=self.blob_key)
+        self.expect('delete_object', Key=previews.preview_name(self.DIGEST))
+        self.assertEqual(filegc.collect(), 1)
+        self.assertFalse(Blob.objects.exists())
+        self.stubber.assert_no_pending_responses()
+
+
+@skipUnless(Stubber and os.environ.get('S3_TEST_ENDPOINT_URL'), 'нужно S3-совместимое хранилище: S3_TEST_ENDPOINT_URL')
+class S3LiveTest(TestCase):
+    """Тесты с настоящим S3-совместимым хранилищем (MinIO из docker-compose.dev.yml, профиль s3)"""
+
+    CONTENT = b'%PDF-1.4 drawing ' + os.urandom(16).hex().encode()
+    DIGEST = hashlib.sha256(CONTENT).hexdigest()
+
+    def setUp(self):
+        self.settings_override = override_settings(
+            STORAGES={**settings.STORAGES, 'default': {'BACKEND': 'apps.core.s3.S3ContentAddressedStorage'}},
+            S3={**settings.S3, 'ENDPOINT_URL': os.environ['S3_TEST_ENDPOINT_URL'], 'PUBLIC_ENDPOINT_URL': '',
+                'BUCKET': os.environ.get('S3_TEST_BUCKET', 'mytracker-test'),
+                'ACCESS_KEY': os.environ.get('S3_TEST_ACCESS_KEY', 'minioadmin'),
+                'SECRET_KEY': os.environ.get('S3_TEST_SECRET_KEY', 'minioadmin'), 'PREFIX': 'tests/'},
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        client = default_storage.client
+        try:
+            client.create_bucket(Bucket=default_storage.bucket)
+        except client.exceptions.BucketAlreadyOwnedByYou:
+            pass
+
+    def post_form(self, form, content):
+        boundary = os.urandom(16).hex()
+        body = b''.join(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+            for name, value in form['fields'].items()
+        ) + (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="file"\r\n'
+             f'Content-Type: application/octet-stream\r\n\r\n').encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+        request = urllib.request.Request(form['url'], body, method='POST',
+                                         headers={'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        with urllib.request.urlopen(request) as response:
+            return response.status
+
+    def test_objects_and_presigned_urls(self):
+        name = default_storage.save('project_sheets/Чертеж.pdf', ContentFile(self.CONTENT))
+        self.addCleanup(default_storage.delete_blob, self.DIGEST)
+        self.assertEqual(name, f'cas/{self.DIGEST}/Чертеж.pdf')
+        self.assertEqual(default_storage.size(name), len(self.CONTENT))
+        with default_storage.open(name) as f:
+            self.assertEqual(f.read(), self.CONTENT)
+        with urllib.request.urlopen(default_storage.presigned_url(name)) as response:
+            self.assertEqual(response.read(), self.CONTENT)
+            self.assertIn('attachment', response.headers['Content-Disposition'])
+        self.assertIn(default_storage.blob_name(self.DIGEST), [item for item, _ in default_storage.scan('blobs')])
+
+        upload = f'{uploads.UPLOADS_DIR}/live-test'
+        form = default_storage.presigned_post(upload, len(self.CONTENT), self.DIGEST)
+        with self.assertRaises(urllib.error.HTTPError):
+            self.post_form(form, self.CONTENT + b'!')
+        self.assertIn(self.post_form(form, self.CONTENT), (200, 204))
+        self.assertEqual(default_storage.object_digest(upload), (len(self.CONTENT), self.DIGEST))
+        self.assertEqual(default_storage.import_object(upload, len(self.CONTENT), 'a.pdf', self.DIGEST),
+                         f'cas/{self.DIGEST}/a.pdf')
+        self.assertTrue(default_storage.exists(default_storage.blob_name(self.DIGEST)))
+        default_storage.delete(upload)
+
+
+class PreviewTest(TestCase):
+    """Тесты превью вложений"""
+
+    # Минимальный PDF с одной пустой страницей
+    PDF = (b'%PDF-1.4\n1 0 obj<</Type/Catalog/Pages 2 0 R>>endobj\n'
+           b'2 0 obj<</Type/Pages/Kids[3 0 R]/Count 1>>endobj\n'
+           b'3 0 obj<</Type/Page/Parent 2 0 R/MediaBox[0 0 600 400]>>endobj\n'
+           b'trailer<</Root 1 0 R>>\n%%EOF\n')
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.settings_override = override_settings(
+            MEDIA_ROOT=media.name, FILE_GC={**settings.FILE_GC, 'AUTO': False, 'DELAY': 0},
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        site = ConstructionSite.objects.create(name='Участок')
+        self.project = Project.objects.create(name='Проект', code='P', cipher='C', construction_site=site)
+
+    def create_sheet(self, name, content):
+        return ProjectSheet.objects.create(name='Лист', project=self.project, file=SimpleUploadedFile(name, content))
+
+    def png(self, size=(1200, 800)):
+        buffer = BytesIO()
+        Image.new('RGBA', size, (200, 30, 30, 255)).save(buffer, 'PNG')
+        return buffer.getvalue()
+
+    def wait_for_previews(self):
+        deadline = time.monotonic() + 10
+        while previews._pending and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    @skipUnless(Image, 'нужен Pillow')
+    def test_image_preview_built_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            sheet = self.create_sheet('Фото.png', self.png())
+        self.wait_for_previews()
+        digest = sheet.file.storage.digest(sheet.file.name)
+        path = default_storage.path(previews.preview_name(digest))
+        with Image.open(path) as image:
+            self.assertEqual(image.format, 'JPEG')
+            self.assertEqual(image.size, (512, 341))
+
+        data = self.client.get(f'/api/projects/project-sheets/{sheet.id}/').data
+        self.assertEqual(data['preview_url'], f'http://testserver/api/core/previews/{digest}.jpg')
+        response = self.client.get(data['preview_url'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', response['Cache-Control'])
+
+        sheet.delete()
+        filegc.collect()
+        self.assertFalse(os.path.exists(path))
+
+    @skipUnless(shutil.which('pdftoppm'), 'нужен pdftoppm (poppler-utils)')
+    def test_pdf_first_page_preview(self):
+        sheet = self.create_sheet('Чертеж.pdf', self.PDF)
+        digest = sheet.file.storage.digest(sheet.file.name)
+        self.assertTrue(previews.generate(digest))
+        self.assertTrue(os.path.getsize(default_storage.path(previews.preview_name(digest))) > 0)
+
+    def test_missing_preview_is_scheduled(self):
+        sheet = self.create_sheet('Чертеж.pdf', self.PDF)
+        note = self.create_sheet('note.txt', b'text')
+        digest = sheet.file.storage.digest(sheet.file.name)
+        self.assertIsNone(previews.preview_url(note.file))
+        self.assertIsNone(previews.preview_url(ProjectSheet().file))
+
+        with mock.patch.object(previews, 'schedule') as schedule:
+            response = self.client.get(previews.preview_url(sheet.file))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        schedule.assert_called_once_with(digest)
+
+        self.assertFalse(previews.generate(note.file.storage.digest(note.file.name)))
+        with override_settings(PREVIEWS={**settings.PREVIEWS, 'ENABLED': False}):
+            self.assertIsNone(previews.schedule(digest))
+
+    def test_failed_preview_not_rescheduled(self):
+        sheet = self.create_sheet('Скан.png', b'not an image')
+        digest = sheet.file.storage.digest(sheet.file.name)
+        self.assertFalse(previews._run(digest))
+        self.assertTrue(Blob.objects.get(digest=digest).preview_failed)
+
+        with mock.patch.object(previews, 'schedule') as schedule:
+            response = self.client.get(previews.preview_url(sheet.file))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        schedule.assert_not_called()
+
+    @skipUnless(Image, 'нужен Pillow')
+    def test_generate_previews_command(self):
+        self.create_sheet('a.png', self.png((100, 50)))
+        self.create_sheet('b.txt', b'text')
+        out = StringIO()
+        call_command('generate_previews', stdout=out)
+        self.assertIn('Превью: 1, без превью (тип не поддерживается): 1, ошибок: 0', out.getvalue())
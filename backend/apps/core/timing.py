@@ -0,0 +1,81 @@
+"""
+Замер времени этапов обработки запроса
+
+Middleware (apps.core.middleware) через measure() кладет RequestTimings в
+contextvar на время запроса. Запросы к БД учитываются через execute_wrapper,
+остальные этапы — через span() в базовых классах apps.core (сериализаторы,
+рендереры, ViewSet). Вне измеряемого запроса span() ничего не делает.
+"""
+import contextvars
+import time
+from contextlib import ExitStack, contextmanager
+
+from django.db import connections
+
+_current = contextvars.ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    """Накопленные длительности (сек) и число вызовов по этапам
+
+    view — метка вызванного представления (заполняет MetricsMiddleware).
+    """
+
+    __slots__ = ('durations', 'counts', 'view', '_open')
+
+    def __init__(self):
+        self.view = None
+        self.durations = {}
+        self.counts = {}
+        self._open = set()
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def __call__(self, execute, sql, params, many, context):
+        # execute_wrapper соединения: время и число запросов к БД
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.add('db', time.perf_counter() - start)
+
+
+@contextmanager
+def measure():
+    """Замер этапов на время блока; если замер уже идет, возвращается текущий"""
+    timings = _current.get()
+    if timings is not None:
+        yield timings
+        return
+    timings = RequestTimings()
+    token = _current.set(timings)
+    try:
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(timings))
+            yield timings
+    finally:
+        _current.reset(token)
+
+
+def current():
+    """RequestTimings текущего запроса или None, если замер не идет"""
+    return _current.get()
+
+
+@contextmanager
+def span(name):
+    """Учесть время блока в этапе name; вложенные блоки того же этапа не суммируются"""
+    timings = _current.get()
+    if timings is None or name in timings._open:
+        yield
+        return
+    timings._open.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings._open.discard(name)
+        timings.add(name, time.perf_counter() - start)
@@ -0,0 +1,319 @@
+"""
+Докачиваемая загрузка больших файлов частями
+
+Протокол (views.upload_sessions, views.upload_session):
+1. POST /api/core/uploads/ {filename, size} — создать сессию; в ответе id и offset.
+2. PUT /api/core/uploads/<id>/ с заголовком Upload-Offset и телом — часть файла
+   с позиции Upload-Offset. Позиция должна совпадать с offset сессии, иначе 409
+   с текущим offset. После обрыва клиент запрашивает GET /api/core/uploads/<id>/
+   и продолжает с offset: принятые до обрыва байты сохраняются.
+3. POST .../<id объекта>/attach_upload/ {upload, sha256} у листа, этапа или
+   заметки (ResumableUploadMixin) — файл переносится в блоб ContentAddressedStorage
+   и прикрепляется к объекту; sha256 (необязательный) сверяется с вычисленным.
+
+Тело части читается из потока запроса буферами UPLOADS['BUFFER_SIZE'] и пишется
+сразу в файл сессии рядом с блобами, поэтому память не зависит от размера части,
+а перенос в блоб — жесткая ссылка без копирования. SHA-256 досчитывается по мере
+приема; состояние хэша живет в памяти процесса, и если следующая часть пришла
+в другой процесс, хэш при завершении пересчитывается по файлу.
+
+Часть пишется вне транзакции: медленный клиент не держит соединение с БД и
+блокировки строк. Параллельные записи в одну сессию исключает блокировка файла
+сессии, а offset сдвигается условным UPDATE (только если он еще равен позиции
+части).
+
+Докачиваемая загрузка пишет файл сессии на локальный диск и работает только с
+ContentAddressedStorage. С S3-совместимым хранилищем (apps.core.s3) файл
+загружается напрямую, мимо приложения:
+1. POST /api/core/uploads/direct/ {filename, size, sha256} — сессия и подписанная
+   форма upload {url, fields} на объект blobs/uploads/<id сессии>.
+2. Клиент отправляет файл в хранилище формой multipart/form-data: поля fields,
+   затем file. Размер (и SHA-256) проверяет хранилище по условиям подписи.
+3. attach_upload, как выше: SHA-256 объекта сверяется с заявленным при создании
+   сессии, объект копируется в блоб на стороне хранилища.
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import locks
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.decorators import action
+from rest_framework.response import Response
+
+from .models import UploadSession
+from .storage import BLOBS_DIR
+
+UPLOADS_DIR = f'{BLOBS_DIR}/uploads'
+
+# id сессии -> (принято байт, sha256 принятого); не больше _MAX_HASHERS сессий
+_hashers = OrderedDict()
+_hashers_lock = threading.Lock()
+_MAX_HASHERS = 256
+
+
+class OffsetConflict(Exception):
+    """Часть пришла не с текущей позиции сессии"""
+
+
+class ChecksumMismatch(Exception):
+    """SHA-256 принятого файла не совпал с ожидаемым"""
+
+
+class Incomplete(Exception):
+    """Файл прямой загрузки еще не загружен в хранилище"""
+
+
+def session_name(session):
+    """Имя файла сессии в хранилище"""
+    return f'{UPLOADS_DIR}/{session.pk}'
+
+
+def session_path(session):
+    return default_storage.path(session_name(session))
+
+
+def local_sessions():
+    """Докачиваемая загрузка доступна: хранилище держит файлы на локальном диске"""
+    try:
+        default_storage.path(UPLOADS_DIR)
+    except NotImplementedError:
+        return False
+    return True
+
+
+def direct_uploads():
+    """Хранилище принимает прямую загрузку по подписанной форме"""
+    return hasattr(default_storage, 'presigned_post')
+
+
+def expires_at(session):
+    return session.updated_at + timedelta(seconds=settings.UPLOADS['EXPIRES'])
+
+
+def _cutoff():
+    return timezone.now() - timedelta(seconds=settings.UPLOADS['EXPIRES'])
+
+
+def expired():
+    """Сессии без новых частей дольше UPLOADS['EXPIRES']"""
+    return UploadSession.objects.filter(updated_at__lt=_cutoff())
+
+
+def get_session(user, upload_id, for_update=False):
+    """Действующая сессия пользователя или None"""
+    queryset = UploadSession.objects.filter(user=user, updated_at__gte=_cutoff())
+    if for_update:
+        queryset = queryset.select_for_update()
+    try:
+        return queryset.filter(pk=upload_id).first()
+    except (ValidationError, ValueError):
+        # Некорректный UUID
+        return None
+
+
+def create(user, filename, size):
+    session = UploadSession.objects.create(user=user, filename=filename, size=size)
+    path = session_path(session)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666))
+    with _hashers_lock:
+        _hashers[session.pk] = (0, hashlib.sha256())
+        while len(_hashers) > _MAX_HASHERS:
+            _hashers.popitem(last=False)
+    return session
+
+
+def create_direct(user, filename, size, sha256):
+    """Сессия прямой загрузки; вернуть (сессия, подписанная форма {'url', 'fields'})"""
+    session = UploadSession.objects.create(user=user, filename=filename, size=size, direct=True, sha256=sha256)
+    return session, default_storage.presigned_post(session_name(session), size, sha256)
+
+
+def _take_hasher(session, offset):
+    with _hashers_lock:
+        entry = _hashers.pop(session.pk, None)
+    return entry[1] if entry is not None and entry[0] == offset else None
+
+
+def _put_hasher(session, offset, sha256):
+    with _hashers_lock:
+        _hashers[session.pk] = (offset, sha256)
+        while len(_hashers) > _MAX_HASHERS:
+            _hashers.popitem(last=False)
+
+
+def receive(session, stream, start, length):
+    """Записать length байтов из stream с позиции start; вернуть новый offset
+
+    Если поток оборвался, принятые байты сохраняются и исключение чтения
+    пробрасывается дальше. OffsetConflict — в сессию пишет другой запрос или
+    ее позицию он уже сдвинул.
+    """
+    buffer_size = settings.UPLOADS['BUFFER_SIZE']
+    written = 0
+    error = None
+    fd = os.open(session_path(session), os.O_WRONLY)
+    try:
+        # Пока блокировка файла у другого запроса, его часть еще пишется
+        if not locks.lock(fd, locks.LOCK_EX | locks.LOCK_NB):
+            raise OffsetConflict
+        # Позиция перечитывается под блокировкой: предыдущая часть могла завершиться
+        if not UploadSession.objects.filter(pk=session.pk, offset=start).exists():
+            raise OffsetConflict
+        sha256 = _take_hasher(session, start)
+        os.lseek(fd, start, os.SEEK_SET)
+        while written < length:
+            try:
+                data = stream.read(min(buffer_size, length - written))
+            except OSError as e:
+                error = e
+                break
+            if not data:
+                break
+            os.write(fd, data)
+            if sha256 is not None:
+                sha256.update(data)
+            written += len(data)
+        # Offset сессии не должен опережать данные на диске
+        os.fsync(fd)
+
+        offset = start + written
+        updated = UploadSession.objects.filter(pk=session.pk, offset=start).update(
+            offset=offset, updated_at=timezone.now()
+        )
+    finally:
+        # Закрытие файла снимает блокировку
+        os.close(fd)
+    if not updated:
+        # Сессию удалили или отменили, пока шла запись
+        raise OffsetConflict
+    session.offset = offset
+    if sha256 is not None:
+        _put_hasher(session, offset, sha256)
+    if error is not None:
+        raise error
+    return offset
+
+
+def digest(session):
+    """SHA-256 принятого файла: из памяти процесса или по файлу"""
+    sha256 = _take_hasher(session, session.offset)
+    if sha256 is not None:
+        return sha256.hexdigest()
+    sha256 = hashlib.sha256()
+    with open(session_path(session), 'rb') as f:
+        for data in iter(lambda: f.read(settings.UPLOADS['BUFFER_SIZE']), b''):
+            sha256.update(data)
+    return sha256.hexdigest()
+
+
+def finish(session, storage, max_length=None, expected_sha256=None):
+    """Перенести файл завершенной сессии в блоб, удалить сессию; вернуть имя cas/
+
+    Вызывается в транзакции, прикрепляющей файл: принятый файл сессии удаляется
+    только после ее фиксации, а при откате остается вместе со строкой сессии.
+    Incomplete — файла прямой загрузки нет в хранилище.
+    """
+    if session.direct:
+        return _finish_direct(session, storage, max_length, expected_sha256)
+    content_digest = digest(session)
+    if expected_sha256 and expected_sha256.lower() != content_digest:
+        raise ChecksumMismatch(content_digest)
+    name = storage.import_file(session_path(session), session.filename, content_digest, max_length)
+    _delete_on_commit(session)
+    return name
+
+
+def _finish_direct(session, storage, max_length, expected_sha256):
+    name = session_name(session)
+    try:
+        size, content_digest = storage.object_digest(name)
+    except FileNotFoundError:
+        raise Incomplete
+    if size != session.size or any(
+        expected and expected.lower() != content_digest for expected in (session.sha256, expected_sha256)
+    ):
+        raise ChecksumMismatch(content_digest)
+    name = storage.import_object(name, size, session.filename, content_digest, max_length)
+    _delete_on_commit(session)
+    return name
+
+
+def _delete_on_commit(session):
+    name = session_name(session)
+    session.delete()
+    transaction.on_commit(lambda: default_storage.delete(name))
+
+
+def discard(session):
+    """Удалить сессию и принятые байты"""
+    with _hashers_lock:
+        _hashers.pop(session.pk, None)
+    default_storage.delete(session_name(session))
+    session.delete()
+
+
+def clear_expired():
+    """Удалить просроченные сессии и файлы сессий, которых нет в БД; вернуть (сессий, файлов)"""
+    sessions = 0
+    for session in expired().iterator():
+        discard(session)
+        sessions += 1
+    files = 0
+    cutoff = _cutoff().timestamp()
+    for name, modified in default_storage.scan(UPLOADS_DIR):
+        # Свежий файл может принадлежать сессии, которая только создается
+        if modified >= cutoff:
+            continue
+        try:
+            exists = UploadSession.objects.filter(pk=os.path.basename(name)).exists()
+        except ValidationError:
+            exists = False
+        if not exists:
+            default_storage.delete(name)
+            files += 1
+    return sessions, files
+
+
+class ResumableUploadMixin:
+    """Действие attach_upload для ViewSet модели с файлом в поле upload_file_field"""
+
+    upload_file_field = 'file'
+
+    @action(detail=True, methods=['post'])
+    def attach_upload(self, request, pk=None):
+        """Прикрепление завершенной докачиваемой загрузки к объекту"""
+        instance = self.get_object()
+        field = instance._meta.get_field(self.upload_file_field)
+        # Файл сессии удаляется после фиксации: если сохранение объекта не удалось,
+        # сессию можно прикрепить снова
+        with transaction.atomic():
+            session = get_session(request.user, request.data.get('upload'), for_update=True)
+            if session is None:
+                return Response({'error': 'Сессия загрузки не найдена'}, status=status.HTTP_404_NOT_FOUND)
+            if not session.direct and not session.complete:
+                return Response(
+                    {'error': 'Загрузка не завершена', 'offset': session.offset, 'size': session.size},
+                    status=status.HTTP_409_CONFLICT
+                )
+            try:
+                name = finish(session, field.storage, field.max_length, request.data.get('sha256'))
+            except Incomplete:
+                return Response({'error': 'Файл еще не загружен в хранилище'}, status=status.HTTP_409_CONFLICT)
+            except ChecksumMismatch as e:
+                discard(session)
+                return Response(
+                    {'error': 'Контрольная сумма не совпадает, загрузите файл заново', 'sha256': str(e)},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            setattr(instance, field.attname, name)
+            instance.save()
+        return Response(self.get_serializer(instance).data)
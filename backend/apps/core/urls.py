@@ -0,0 +1,16 @@
+"""
+URL маршруты служебных API
+"""
+from django.urls import path
+from . import views
+
+urlpatterns = [
+    path('slow-queries/', views.slow_queries, name='slow_queries'),
+    path('profiles/', views.profiles, name='profiles'),
+    path('profiles/<str:profile_id>/', views.profile_detail, name='profile_detail'),
+    path('files/<str:digest>/<str:filename>', views.blob_file, name='blob_file'),
+    path('previews/<str:digest>.jpg', views.blob_preview, name='blob_preview'),
+    path('uploads/', views.upload_sessions, name='upload_sessions'),
+    path('uploads/direct/', views.upload_direct, name='upload_direct'),
+    path('uploads/<uuid:upload_id>/', views.upload_session, name='upload_session'),
+]
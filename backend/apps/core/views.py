@@ -0,0 +1,182 @@
+"""
+Служебные API для диагностики производительности (только для суперпользователя),
+отдача блобов файлов по неизменяемым URL и докачиваемая загрузка файлов
+"""
+import os
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, UnreadablePostError
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.response import Response
+
+from . import previews, profiling, uploads
+from .downloads import serve_stored
+from .models import Blob
+from .permissions import IsSuperUser
+from .serializers import DirectUploadSessionSerializer, SlowQuerySerializer, UploadSessionSerializer
+from .slow_queries import ORDERINGS, top_slow_queries
+from .storage import PREFIX, is_digest
+
+
+@api_view(['GET'])
+@permission_classes([IsSuperUser])
+def slow_queries(request):
+    """Самые затратные медленные запросы
+
+    Параметры: order (total, max, calls, avg), view (basename:action), limit (до 200).
+    """
+    order = request.query_params.get('order', 'total')
+    if order not in ORDERINGS:
+        return Response(
+            {'error': f'order должен быть одним из: {", ".join(sorted(ORDERINGS))}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        limit = min(int(request.query_params.get('limit', 50)), 200)
+    except ValueError:
+        return Response({'error': 'limit должен быть числом'}, status=status.HTTP_400_BAD_REQUEST)
+    queryset = top_slow_queries(order, request.query_params.get('view'))[:limit]
+    return Response(SlowQuerySerializer(queryset, many=True).data)
+
+
+@api_view(['GET'])
+@permission_classes([IsSuperUser])
+def profiles(request):
+    """Сохраненные профили запросов (новые первыми)"""
+    return Response(profiling.list_profiles())
+
+
+@api_view(['GET'])
+@permission_classes([IsSuperUser])
+def profile_detail(request, profile_id):
+    """Файл профиля: kind=pstats (по умолчанию), collapsed или summary"""
+    kind = request.query_params.get('kind', 'pstats')
+    path = profiling.path_for(profile_id, kind)
+    if path is None or not os.path.exists(path):
+        raise Http404
+    content_type = 'application/octet-stream' if kind == 'pstats' else 'text/plain; charset=utf-8'
+    return FileResponse(
+        open(path, 'rb'),
+        as_attachment=kind != 'summary',
+        filename=os.path.basename(path),
+        content_type=content_type,
+    )
+
+
+@api_view(['GET'])
+def blob_file(request, digest, filename):
+    """Файл из ContentAddressedStorage по дайджесту: содержимое URL не меняется и кэшируется клиентом"""
+    if not is_digest(digest) or not Blob.objects.filter(digest=digest, ref_count__gt=0).exists():
+        raise Http404
+    try:
+        return serve_stored(request, default_storage, f'{PREFIX}/{digest}/{filename}', immutable=True)
+    except FileNotFoundError:
+        raise Http404
+
+
+@api_view(['GET'])
+def blob_preview(request, digest):
+    """Превью блоба (JPEG); 404, пока превью не построено или если его не построить"""
+    if not is_digest(digest):
+        raise Http404
+    failed = Blob.objects.filter(digest=digest, ref_count__gt=0).values_list('preview_failed', flat=True).first()
+    if failed is None:
+        raise Http404
+    try:
+        return serve_stored(request, default_storage, previews.preview_name(digest), filename='preview.jpg',
+                            as_attachment=False, immutable=True)
+    except FileNotFoundError:
+        # Превью не построено (или очередь потеряна при перезапуске): строится в фоне
+        if not failed:
+            previews.schedule(digest)
+        raise Http404
+
+
+@api_view(['POST'])
+def upload_sessions(request):
+    """Создание сессии докачиваемой загрузки: filename, size"""
+    if not uploads.local_sessions():
+        return Response({'error': 'Хранилище принимает только прямую загрузку (uploads/direct/)'},
+                        status=status.HTTP_400_BAD_REQUEST)
+    serializer = UploadSessionSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    session = uploads.create(request.user, **serializer.validated_data)
+    response = Response(UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+    response['Location'] = reverse('upload_session', kwargs={'upload_id': session.pk})
+    response['Upload-Offset'] = session.offset
+    return response
+
+
+@api_view(['POST'])
+def upload_direct(request):
+    """Создание сессии прямой загрузки в хранилище: filename, size, sha256; в ответе форма upload"""
+    if not uploads.direct_uploads():
+        return Response({'error': 'Хранилище не поддерживает прямую загрузку'}, status=status.HTTP_400_BAD_REQUEST)
+    serializer = DirectUploadSessionSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    session, form = uploads.create_direct(request.user, **serializer.validated_data)
+    data = DirectUploadSessionSerializer(session).data
+    data['upload'] = form
+    return Response(data, status=status.HTTP_201_CREATED)
+
+
+@api_view(['GET', 'PUT', 'DELETE'])
+def upload_session(request, upload_id):
+    """Состояние сессии (GET), часть файла с позиции Upload-Offset (PUT), отмена (DELETE)"""
+    session = uploads.get_session(request.user, upload_id)
+    if session is None:
+        raise Http404
+    if request.method == 'DELETE':
+        uploads.discard(session)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    if request.method == 'PUT':
+        if session.direct:
+            return Response({'error': 'Файл прямой загрузки отправляется в хранилище'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        error = _receive_chunk(request, session)
+        if error is not None:
+            return error
+        session.refresh_from_db()
+    response = Response(UploadSessionSerializer(session).data)
+    response['Upload-Offset'] = session.offset
+    return response
+
+
+def _receive_chunk(request, session):
+    """Записать тело PUT в сессию; Response с ошибкой или None"""
+    try:
+        start = int(request.headers['Upload-Offset'])
+    except (KeyError, ValueError):
+        return Response({'error': 'Нужен заголовок Upload-Offset'}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = -1
+    if length <= 0:
+        return Response({'error': 'Нужно тело запроса с Content-Length'}, status=status.HTTP_411_LENGTH_REQUIRED)
+    if start != session.offset:
+        return _offset_conflict(session.offset)
+    if length > settings.UPLOADS['MAX_CHUNK_SIZE'] or start + length > session.size:
+        return Response(
+            {'error': f'Часть больше {settings.UPLOADS["MAX_CHUNK_SIZE"]} байт или выходит за размер файла'},
+            status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+        )
+    try:
+        uploads.receive(session, request.stream, start, length)
+    except uploads.OffsetConflict:
+        session.refresh_from_db()
+        return _offset_conflict(session.offset)
+    except UnreadablePostError:
+        # Клиент оборвал соединение: принятые байты учтены в offset
+        session.refresh_from_db()
+        return Response({'error': 'Часть принята не полностью', 'offset': session.offset},
+                        status=status.HTTP_400_BAD_REQUEST, headers={'Upload-Offset': session.offset})
+    return None
+
+
+def _offset_conflict(offset):
+    return Response({'error': 'Позиция не совпадает с принятым объемом', 'offset': offset},
+                    status=status.HTTP_409_CONFLICT, headers={'Upload-Offset': offset})
@@ -0,0 +1,59 @@
+"""
+Базовые ViewSet проекта
+
+Повторяют rest_framework.viewsets и добавляют замер времени проверки прав
+(этап permissions в Server-Timing).
+"""
+from django.db import transaction
+from rest_framework import viewsets
+
+from .timing import span
+
+
+class TimedPermissionsMixin:
+    """Учет времени check_permissions / check_object_permissions"""
+
+    def check_permissions(self, request):
+        with span('permissions'):
+            super().check_permissions(request)
+
+    def check_object_permissions(self, request, obj):
+        with span('permissions'):
+            super().check_object_permissions(request, obj)
+
+
+class AtomicWritesMixin:
+    """Создание, изменение и удаление записи в одной транзакции
+
+    Model.save() сам по себе не атомарен: без транзакции строка записи
+    фиксируется раньше, чем сигналы apps.core.blobs изменят Blob.ref_count, и
+    сбой между ними оставит счетчик неверным. Нужен ViewSet моделей с файлами.
+    """
+
+    def create(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().create(request, *args, **kwargs)
+
+    def update(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().update(request, *args, **kwargs)
+
+    def destroy(self, request, *args, **kwargs):
+        with transaction.atomic():
+            return super().destroy(request, *args, **kwargs)
+
+
+class ViewSet(TimedPermissionsMixin, viewsets.ViewSet):
+    pass
+
+
+class GenericViewSet(TimedPermissionsMixin, viewsets.GenericViewSet):
+    pass
+
+
+class ReadOnlyModelViewSet(TimedPermissionsMixin, viewsets.ReadOnlyModelViewSet):
+    pass
+
+
+class ModelViewSet(TimedPermissionsMixin, viewsets.ModelViewSet):
+    pass
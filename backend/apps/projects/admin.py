@@ -1,32 +1,13 @@
+import logging
 from django.contrib import admin
 from django.utils.html import format_html
 from django.db import connection
-from pathlib import Path
-import json
-import os
+from apps.core import instrumentation
 from .models import (
     Status, ConstructionSite, Project, ProjectSheet,
     ProjectStage, ProjectSheetNote
 )
 
-# #region agent log
-def _log(hypothesis_id, location, message, data=None):
-    log_path = r"r:\dev\my-tracker\my_tracker_v0.1\.cursor\debug.log"
-    try:
-        with open(log_path, 'a', encoding='utf-8') as f:
-            f.write(json.dumps({
-                "sessionId": "debug-session",
-                "runId": "run1",
-                "hypothesisId": hypothesis_id,
-                "location": location,
-                "message": message,
-                "data": data or {},
-                "timestamp": os.times().elapsed if hasattr(os.times(), 'elapsed') else 0
-            }, ensure_ascii=False) + '\n')
-    except:
-        pass
-# #endregion
-
 
 @admin.register(Status)
 class StatusAdmin(admin.ModelAdmin):
@@ -101,26 +82,23 @@ class ProjectSheetNoteAdmin(admin.ModelAdmin):
     raw_id_fields = ['project_sheet', 'author']
     
     def changelist_view(self, request, extra_context=None):
-        # #region agent log
-        _log("post-fix", "admin.py:changelist_view", "ProjectSheetNoteAdmin.changelist_view called", {
-            "path": request.path
-        })
-        # #endregion
+        instrumentation.event('admin.py:changelist_view', 'ProjectSheetNoteAdmin.changelist_view called', {
+            'path': request.path
+        }, hypothesis='post-fix')
         
-        # #region agent log
-        try:
-            with connection.cursor() as cursor:
-                cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' AND table_name LIKE 'projects_%'")
-                tables = [row[0] for row in cursor.fetchall()]
-                _log("post-fix", "admin.py:changelist_view", "Checking database tables after fix", {
-                    "projects_tables": tables,
-                    "projectsheet_exists": "projects_projectsheet" in tables
-                })
-        except Exception as e:
-            _log("post-fix", "admin.py:changelist_view", "Error checking database tables", {
-                "error": str(e)
-            })
-        # #endregion
+        # Проверка таблиц — лишний запрос, выполняется только при включенной диагностике
+        if instrumentation.is_enabled(logging.DEBUG) and connection.vendor == 'postgresql':
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute("SELECT table_name FROM information_schema.tables WHERE table_schema = 'public' AND table_name LIKE 'projects_%'")
+                    tables = [row[0] for row in cursor.fetchall()]
+                instrumentation.event('admin.py:changelist_view', 'Checking database tables after fix', {
+                    'projects_tables': tables,
+                    'projectsheet_exists': 'projects_projectsheet' in tables
+                }, hypothesis='post-fix')
+            except Exception as e:
+                instrumentation.event('admin.py:changelist_view', 'Error checking database tables', {
+                    'error': str(e)
+                }, level=logging.WARNING, hypothesis='post-fix')
         
         return super().changelist_view(request, extra_context)
-
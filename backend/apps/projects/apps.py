@@ -6,4 +6,7 @@ class ProjectsConfig(AppConfig):
     name = 'apps.projects'
     verbose_name = 'Проекты'
 
-
+    def ready(self):
+        # Подключение сигналов сброса кэша справочников
+        from . import attachments, reference  # noqa: F401
+        attachments.connect_model_signals()
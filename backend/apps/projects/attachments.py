@@ -0,0 +1,101 @@
+"""
+Индекс вложений проекта (Attachment)
+
+Размер, MIME-тип, SHA-256 и время загрузки файла листа, этапа или заметки
+записываются сигналом post_save в той же транзакции, когда у объекта меняется
+файл или проект. Размер берется из хранилища (stat, без чтения содержимого),
+SHA-256 — из имени cas/ (ContentAddressedStorage); у файлов со старыми именами
+он пуст. Строка индекса удаляется каскадом вместе с объектом.
+
+Список вложений проекта (ProjectViewSet.attachments) и поля file_size, file_type
+сериализаторов читают только индекс, без обращения к диску. Индекс для файлов,
+загруженных раньше, заполняет команда index_attachments.
+"""
+from django.db.models.signals import post_init, post_save
+from django.utils import timezone
+
+from apps.core.downloads import content_type
+
+from .models import Attachment, ProjectSheet, ProjectSheetNote, ProjectStage
+
+# Модель -> (kind, поле, определяющее проект)
+SOURCES = {
+    ProjectSheet: ('sheet', 'project_id'),
+    ProjectStage: ('stage', 'project_id'),
+    ProjectSheetNote: ('note', 'project_sheet_id'),
+}
+# Значение отложенного поля (only/defer): считается измененным
+_UNKNOWN = object()
+
+
+def _state(instance):
+    _, owner = SOURCES[type(instance)]
+    file = instance.__dict__.get('file', _UNKNOWN)
+    return getattr(file, 'name', file) or None, instance.__dict__.get(owner, _UNKNOWN)
+
+
+def _remember(sender, instance, **kwargs):
+    instance._attachment_state = _state(instance)
+
+
+def _project_id(instance):
+    if isinstance(instance, ProjectSheetNote):
+        if ProjectSheetNote.project_sheet.is_cached(instance):
+            return instance.project_sheet.project_id
+        return ProjectSheet.objects.filter(pk=instance.project_sheet_id).values_list('project_id', flat=True).first()
+    return instance.project_id
+
+
+def index(instance, uploaded_at=None):
+    """Записать файл объекта в индекс (или убрать, если файла нет); вернуть Attachment или None"""
+    kind, _ = SOURCES[type(instance)]
+    field_file = instance.file
+    if not field_file:
+        Attachment.objects.filter(**{kind: instance}).delete()
+        instance.attachment = None
+        return None
+    name = field_file.name
+    try:
+        size = field_file.storage.size(name)
+    except FileNotFoundError:
+        size = 0
+    digest = getattr(field_file.storage, 'digest', lambda name: None)(name)
+    attachment, _ = Attachment.objects.update_or_create(**{kind: instance}, defaults={
+        'project_id': _project_id(instance),
+        'kind': kind,
+        'file': name,
+        'size': size,
+        'content_type': content_type(name),
+        'sha256': digest or '',
+        'uploaded_at': uploaded_at or timezone.now(),
+    })
+    # Сериализатор ответа прочитает индекс без запроса
+    instance.attachment = attachment
+    return attachment
+
+
+def _on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_name, old_owner = getattr(instance, '_attachment_state', (_UNKNOWN, _UNKNOWN))
+    new_name, new_owner = _state(instance)
+    instance._attachment_state = (new_name, new_owner)
+    if old_name == new_name and old_owner == new_owner:
+        return
+    if created and new_name is None:
+        return
+    if old_name == new_name:
+        # Сменился только проект: время загрузки файла сохраняется
+        Attachment.objects.filter(**{SOURCES[sender][0]: instance}).update(project_id=_project_id(instance))
+    else:
+        index(instance)
+    if sender is ProjectSheet and old_owner != new_owner:
+        Attachment.objects.filter(note__project_sheet=instance).update(project_id=instance.project_id)
+
+
+def connect_model_signals():
+    """Вести индекс вложений для листов, этапов и заметок"""
+    for model in SOURCES:
+        label = model._meta.label
+        post_init.connect(_remember, sender=model, dispatch_uid=f'attachments:init:{label}')
+        post_save.connect(_on_save, sender=model, dispatch_uid=f'attachments:save:{label}')
@@ -0,0 +1,112 @@
+"""
+Выгрузка файлов проекта одним ZIP-архивом (ProjectViewSet.export_files)
+
+Структура архива:
+    Листы/<статус>/<отдел>/<файл>
+    Листы/<статус>/<отдел>/Заметки/<файл>   — файлы заметок листов
+    Этапы/<статус>/<файл>
+
+Параметры запроса: status_id — статус листа или этапа; department_id — отдел
+листа; is_completed — выполненность листа; include — какие файлы выгружать
+(sheets, stages, notes через запятую, по умолчанию все). У этапов нет отдела и
+отметки выполнения, поэтому с department_id или is_completed этапы не выгружаются.
+
+Записи читаются из БД итератором, файлы — частями (apps.core.archives):
+архив формируется по мере передачи клиенту.
+"""
+import os
+
+from rest_framework.exceptions import ValidationError
+
+from apps.auth.reference import departments
+from apps.core.archives import UniqueNames, ZipEntry, safe_component
+
+from .models import ProjectSheet, ProjectSheetNote, ProjectStage
+from .reference import statuses
+
+INCLUDE = ('sheets', 'stages', 'notes')
+_CHUNK_SIZE = 500
+
+
+def parse_filters(params):
+    """Фильтры выгрузки из параметров запроса; ValidationError для некорректных значений"""
+    filters = {'include': set(INCLUDE)}
+    for key in ('status_id', 'department_id'):
+        value = params.get(key)
+        if value:
+            try:
+                filters[key] = int(value)
+            except ValueError:
+                raise ValidationError({key: 'Должно быть числом'})
+    is_completed = params.get('is_completed')
+    if is_completed is not None:
+        filters['is_completed'] = is_completed.lower() in ('true', '1', 'yes')
+    include = params.get('include')
+    if include:
+        filters['include'] = {item.strip() for item in include.split(',') if item.strip()}
+        unknown = filters['include'] - set(INCLUDE)
+        if unknown:
+            raise ValidationError({'include': f'Неизвестные значения: {", ".join(sorted(unknown))}'})
+    return filters
+
+
+def _status(status_id):
+    status = statuses.get(status_id) if status_id else None
+    return safe_component(status.name if status else None, 'Без статуса')
+
+
+def _department(department_id):
+    department = departments.get(department_id) if department_id else None
+    return safe_component(department.name if department else None, 'Без отдела')
+
+
+def _sheet_filters(filters, prefix=''):
+    lookups = {}
+    if 'status_id' in filters:
+        lookups[f'{prefix}status_id'] = filters['status_id']
+    if 'department_id' in filters:
+        lookups[f'{prefix}responsible_department_id'] = filters['department_id']
+    if 'is_completed' in filters:
+        lookups[f'{prefix}is_completed'] = filters['is_completed']
+    return lookups
+
+
+def _with_file(queryset):
+    return queryset.exclude(file__isnull=True).exclude(file='')
+
+
+def entries(project, filters):
+    """Записи архива (ZipEntry) с файлами проекта"""
+    unique = UniqueNames()
+    include = filters['include']
+
+    if 'sheets' in include:
+        storage = ProjectSheet._meta.get_field('file').storage
+        rows = _with_file(ProjectSheet.objects.filter(project=project, **_sheet_filters(filters))).order_by(
+            'status_id', 'responsible_department_id', 'name', 'id'
+        ).values_list('file', 'status_id', 'responsible_department_id', 'updated_at')
+        for name, status_id, department_id, updated_at in rows.iterator(chunk_size=_CHUNK_SIZE):
+            path = f'Листы/{_status(status_id)}/{_department(department_id)}/{safe_component(os.path.basename(name))}'
+            yield ZipEntry(unique(path), storage, name, updated_at)
+
+    if 'notes' in include:
+        storage = ProjectSheetNote._meta.get_field('file').storage
+        rows = _with_file(ProjectSheetNote.objects.filter(
+            project_sheet__project=project, **_sheet_filters(filters, 'project_sheet__')
+        )).order_by(
+            'project_sheet__status_id', 'project_sheet__responsible_department_id', 'created_at', 'id'
+        ).values_list('file', 'project_sheet__status_id', 'project_sheet__responsible_department_id', 'updated_at')
+        for name, status_id, department_id, updated_at in rows.iterator(chunk_size=_CHUNK_SIZE):
+            path = (f'Листы/{_status(status_id)}/{_department(department_id)}/Заметки/'
+                    f'{safe_component(os.path.basename(name))}')
+            yield ZipEntry(unique(path), storage, name, updated_at)
+
+    if 'stages' in include and 'department_id' not in filters and 'is_completed' not in filters:
+        storage = ProjectStage._meta.get_field('file').storage
+        stages = ProjectStage.objects.filter(project=project)
+        if 'status_id' in filters:
+            stages = stages.filter(status_id=filters['status_id'])
+        rows = _with_file(stages).order_by('status_id', 'datetime', 'id').values_list('file', 'status_id', 'created_at')
+        for name, status_id, created_at in rows.iterator(chunk_size=_CHUNK_SIZE):
+            path = f'Этапы/{_status(status_id)}/{safe_component(os.path.basename(name))}'
+            yield ZipEntry(unique(path), storage, name, created_at)
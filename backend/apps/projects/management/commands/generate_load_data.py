@@ -0,0 +1,393 @@
+"""
+Команда для генерации синтетического набора данных для нагрузочного тестирования
+
+Создает отделы, пользователей с профилями, права доступа к страницам,
+строительные участки, проекты, проектные листы с исполнителями, этапы с
+ответственными и заметки. Объем задается коэффициентом --scale: при --scale 1
+около 10 тыс. листов, при --scale 100 — около миллиона.
+
+Строки вставляются пакетами в обход ORM: на PostgreSQL через COPY (id заранее
+выделяются из последовательности), на других СУБД — executemany. Поэтому
+сигналы не отправляются, а кэши справочников сбрасываются в конце. Результат
+воспроизводим при одинаковых --seed и --anchor.
+"""
+import csv
+import io
+import math
+import random
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from apps.auth.models import (
+    Department, PagePermission, UserProfile, USER_DIRECTORY_VERSION, PAGE_PERMISSIONS_VERSION
+)
+from apps.auth.reference import departments as departments_cache
+from apps.core import invalidation
+from apps.core.cache import bump_version
+from apps.projects.models import (
+    Status, ConstructionSite, Project, ProjectSheet, ProjectStage, ProjectSheetNote
+)
+from apps.projects.reference import statuses as statuses_cache
+
+# Префикс имен сгенерированных объектов (для --clear)
+PREFIX = 'load'
+
+SHEET_STATUSES = [
+    ('Новый', '#9E9E9E'), ('В работе', '#2196F3'), ('На проверке', '#FF9800'),
+    ('Замечания', '#F44336'), ('Согласован', '#4CAF50'),
+]
+STAGE_STATUSES = [
+    ('Проектирование', '#3F51B5'), ('Экспертиза', '#9C27B0'), ('Строительство', '#FF5722'),
+    ('Приемка', '#009688'), ('Сдан', '#4CAF50'),
+]
+DEPARTMENT_NAMES = [
+    'Проектный', 'Сметный', 'Технадзор', 'Снабжение', 'Юридический', 'ПТО',
+    'Геодезия', 'Электрика', 'Вентиляция', 'Водоснабжение', 'Конструкторский', 'Архитектурный',
+]
+WORDS = [
+    'фундамент', 'кровля', 'фасад', 'крыльцо', 'лестница', 'перекрытие', 'стена', 'проем',
+    'благоустройство', 'сети', 'котельная', 'парковка', 'ограждение', 'освещение', 'отделка',
+]
+
+
+class Command(BaseCommand):
+    help = 'Генерирует синтетический набор данных заданного масштаба для нагрузочного тестирования'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=float, default=1.0, help='Коэффициент объема данных')
+        parser.add_argument('--seed', type=int, default=42, help='Зерно генератора случайных чисел')
+        parser.add_argument('--anchor', help='Дата отсчета YYYY-MM-DD (по умолчанию сегодня)')
+        parser.add_argument('--date-span-days', type=int, default=730, help='Разброс дат создания, дней')
+        parser.add_argument('--completion-rate', type=float, default=0.4, help='Средняя доля выполненных листов')
+        parser.add_argument('--site-skew', type=float, default=1.1,
+                            help='Перекос распределения проектов по участкам (Zipf, 0 — равномерно)')
+        parser.add_argument('--sheets-per-project', type=float, default=50, help='Среднее число листов в проекте')
+        parser.add_argument('--stages-per-project', type=float, default=20, help='Среднее число этапов в проекте')
+        parser.add_argument('--notes-per-sheet', type=float, default=0.3, help='Среднее число заметок на лист')
+        parser.add_argument('--max-executors', type=int, default=3, help='Максимум исполнителей листа')
+        parser.add_argument('--max-responsible', type=int, default=3, help='Максимум ответственных этапа')
+        parser.add_argument('--permission-rate', type=float, default=0.6, help='Доля страниц, доступных отделу')
+        parser.add_argument('--batch-size', type=int, default=20000, help='Строк в одной пачке вставки')
+        parser.add_argument('--clear', action='store_true', help='Удалить ранее сгенерированные данные')
+
+    def handle(self, *args, **options):
+        if options['scale'] <= 0:
+            raise CommandError('--scale должен быть положительным')
+        if not 0 <= options['completion_rate'] <= 1:
+            raise CommandError('--completion-rate должен быть в диапазоне 0..1')
+
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        anchor_date = (
+            datetime.strptime(options['anchor'], '%Y-%m-%d').date() if options['anchor']
+            else datetime.now(dt_timezone.utc).date()
+        )
+        self.anchor = datetime.combine(anchor_date, time(), tzinfo=dt_timezone.utc)
+        self.span = timedelta(days=options['date_span_days'])
+
+        if options['clear']:
+            self._clear()
+        elif ConstructionSite.objects.filter(name__startswith=f'{PREFIX}:').exists():
+            raise CommandError('Сгенерированные данные уже есть: используйте --clear')
+
+        scale = options['scale']
+        counts = {
+            'departments': max(3, round(len(DEPARTMENT_NAMES) * math.sqrt(scale))),
+            'users': max(5, round(200 * scale)),
+            'sites': max(1, round(20 * scale)),
+            'projects': max(1, round(200 * scale)),
+        }
+
+        sheet_statuses = self._statuses('sheet', SHEET_STATUSES)
+        stage_statuses = self._statuses('stage', STAGE_STATUSES)
+        department_ids = self._departments(counts['departments'])
+        user_ids = self._users(counts['users'], department_ids)
+        site_ids = self._sites(counts['sites'], user_ids)
+        self._projects(counts['projects'], site_ids, user_ids, department_ids, sheet_statuses, stage_statuses)
+
+        # Вставка в обход ORM: сбрасываем кэши справочников и версии данных
+        departments_cache.invalidate()
+        statuses_cache.invalidate()
+        bump_version(USER_DIRECTORY_VERSION)
+        bump_version(PAGE_PERMISSIONS_VERSION)
+        invalidation.publish({'clear': True})
+        self.stdout.write(self.style.SUCCESS('Генерация завершена'))
+
+    # Вставка строк
+
+    @staticmethod
+    def _table(model):
+        return connection.ops.quote_name(model._meta.db_table)
+
+    @staticmethod
+    def _adapt(value):
+        if isinstance(value, datetime):
+            return connection.ops.adapt_datetimefield_value(value)
+        return value
+
+    def _allocate_ids(self, model, count):
+        """Выделить count значений первичного ключа для явной вставки"""
+        if not count:
+            return []
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                cursor.execute(
+                    'SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)',
+                    [model._meta.db_table, 'id', count]
+                )
+                return [row[0] for row in cursor.fetchall()]
+            cursor.execute(f'SELECT COALESCE(MAX(id), 0) FROM {self._table(model)}')
+            start = cursor.fetchone()[0] + 1
+        return list(range(start, start + count))
+
+    def _insert(self, table, columns, rows):
+        """Вставить строки (кортежи значений columns) пачками"""
+        quoted_table = connection.ops.quote_name(table)
+        quoted_columns = ', '.join(connection.ops.quote_name(column) for column in columns)
+        for offset in range(0, len(rows), self.batch_size):
+            batch = [tuple(self._adapt(value) for value in row) for row in rows[offset:offset + self.batch_size]]
+            with connection.cursor() as cursor:
+                if connection.vendor == 'postgresql':
+                    buffer = io.StringIO()
+                    writer = csv.writer(buffer)
+                    for row in batch:
+                        writer.writerow(['\\N' if value is None else value for value in row])
+                    buffer.seek(0)
+                    cursor.cursor.copy_expert(
+                        f"COPY {quoted_table} ({quoted_columns}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+                        buffer
+                    )
+                else:
+                    placeholders = ', '.join(['%s'] * len(columns))
+                    cursor.executemany(
+                        f'INSERT INTO {quoted_table} ({quoted_columns}) VALUES ({placeholders})', batch
+                    )
+
+    def _insert_model(self, model, columns, rows):
+        """Вставить строки модели с выделенными id; вернуть id"""
+        ids = self._allocate_ids(model, len(rows))
+        self._insert(model._meta.db_table, ['id', *columns], [(pk, *row) for pk, row in zip(ids, rows)])
+        return ids
+
+    def _insert_m2m(self, field, pairs):
+        through = field.remote_field.through
+        self._insert(
+            through._meta.db_table,
+            [field.m2m_column_name(), field.m2m_reverse_name()],
+            pairs
+        )
+
+    # Случайные значения
+
+    def _moment(self, after=None):
+        """Случайный момент в окне дат (равномерно), не раньше after"""
+        start = after or self.anchor - self.span
+        seconds = max(0, int((self.anchor - start).total_seconds()))
+        return start + timedelta(seconds=self.rng.randint(0, seconds))
+
+    def _count(self, mean):
+        """Случайное количество со средним mean (логнормальное распределение при mean >= 1)"""
+        if mean <= 0:
+            return 0
+        if mean < 1:
+            # Редкие объекты: есть с вероятностью mean
+            return int(self.rng.random() < mean)
+        sigma = 0.6
+        return max(0, round(self.rng.lognormvariate(math.log(mean) - sigma ** 2 / 2, sigma)))
+
+    def _text(self, words=3):
+        return ' '.join(self.rng.choice(WORDS) for _ in range(words)).capitalize()
+
+    # Сущности
+
+    def _clear(self):
+        """Удалить сгенерированные данные SQL-запросами (ORM загружал бы все удаляемые объекты)"""
+        site = f"(SELECT id FROM {self._table(ConstructionSite)} WHERE name LIKE %s)"
+        project = f"(SELECT id FROM {self._table(Project)} WHERE construction_site_id IN {site})"
+        sheet = f"(SELECT id FROM {self._table(ProjectSheet)} WHERE project_id IN {project})"
+        stage = f"(SELECT id FROM {self._table(ProjectStage)} WHERE project_id IN {project})"
+        user = f"(SELECT id FROM {self._table(User)} WHERE username LIKE %s)"
+        department = f"(SELECT id FROM {self._table(Department)} WHERE name LIKE %s)"
+        executors = ProjectSheet._meta.get_field('executors')
+        responsible = ProjectStage._meta.get_field('responsible_users')
+        # '_' в LIKE — любой символ; для префикса load_user это не мешает
+        site_like, user_like = f'{PREFIX}:%', f'{PREFIX}_user%'
+        statements = [
+            (ProjectSheetNote, f'project_sheet_id IN {sheet}', site_like),
+            (executors.remote_field.through, f'{executors.m2m_column_name()} IN {sheet}', site_like),
+            (responsible.remote_field.through, f'{responsible.m2m_column_name()} IN {stage}', site_like),
+            (ProjectSheet, f'project_id IN {project}', site_like),
+            (ProjectStage, f'project_id IN {project}', site_like),
+            (Project, f'construction_site_id IN {site}', site_like),
+            (ConstructionSite, 'name LIKE %s', site_like),
+            (PagePermission, f'department_id IN {department}', site_like),
+            (UserProfile, f'user_id IN {user}', user_like),
+            (User, 'username LIKE %s', user_like),
+            (Department, 'name LIKE %s', site_like),
+        ]
+        deleted = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            for model, condition, pattern in statements:
+                cursor.execute(f'DELETE FROM {self._table(model)} WHERE {condition}', [pattern])
+                deleted += max(cursor.rowcount, 0)
+        self.stdout.write(f'Удалены ранее сгенерированные данные ({deleted} строк)')
+
+    def _statuses(self, status_type, names):
+        result = []
+        for name, color in names:
+            status, _ = Status.objects.get_or_create(
+                name=name, status_type=status_type, defaults={'color': color}
+            )
+            result.append(status.id)
+        return result
+
+    def _departments(self, count):
+        with transaction.atomic():
+            rows = [
+                (f'{PREFIX}:{DEPARTMENT_NAMES[i % len(DEPARTMENT_NAMES)]} {i + 1}', None,
+                 '#%06X' % self.rng.randint(0, 0xFFFFFF))
+                for i in range(count)
+            ]
+            ids = self._insert_model(Department, ['name', 'description', 'color'], rows)
+            pages = [choice[0] for choice in PagePermission.PAGE_CHOICES]
+            self._insert_model(PagePermission, ['page_name', 'has_access', 'department_id'], [
+                (page, self.rng.random() < self.options['permission_rate'], department_id)
+                for department_id in ids for page in pages
+            ])
+        self.stdout.write(f'Отделов: {len(ids)}')
+        return ids
+
+    def _users(self, count, department_ids):
+        # Один хеш на всех: хеширование пароля — самая медленная часть создания пользователя
+        password = make_password('loadtest')
+        with transaction.atomic():
+            rows = []
+            for i in range(count):
+                joined = self._moment()
+                rows.append((
+                    password, None, False, f'{PREFIX}_user{i + 1}', f'Имя{i + 1}', f'Фамилия{i + 1}',
+                    f'{PREFIX}_user{i + 1}@example.com', False, True, joined,
+                ))
+            ids = self._insert_model(User, [
+                'password', 'last_login', 'is_superuser', 'username', 'first_name', 'last_name',
+                'email', 'is_staff', 'is_active', 'date_joined',
+            ], rows)
+            # Около 5% пользователей без отдела
+            self._insert_model(UserProfile, ['user_id', 'department_id'], [
+                (user_id, None if self.rng.random() < 0.05 else self.rng.choice(department_ids))
+                for user_id in ids
+            ])
+        self.stdout.write(f'Пользователей: {len(ids)}')
+        return ids
+
+    def _sites(self, count, user_ids):
+        with transaction.atomic():
+            rows = []
+            for i in range(count):
+                created = self._moment()
+                manager = self.rng.choice(user_ids) if self.rng.random() < 0.8 else None
+                rows.append((f'{PREFIX}:Участок {i + 1}', self._text(6), manager, created, created))
+            ids = self._insert_model(
+                ConstructionSite, ['name', 'description', 'manager_id', 'created_at', 'updated_at'], rows
+            )
+        self.stdout.write(f'Участков: {len(ids)}')
+        return ids
+
+    def _projects(self, count, site_ids, user_ids, department_ids, sheet_statuses, stage_statuses):
+        # Распределение проектов по участкам по закону Ципфа
+        weights = [1 / (rank + 1) ** self.options['site_skew'] for rank in range(len(site_ids))]
+        site_for_project = self.rng.choices(site_ids, weights=weights, k=count)
+        totals = {'projects': 0, 'sheets': 0, 'stages': 0, 'notes': 0, 'executors': 0, 'responsible': 0}
+
+        # Проекты обрабатываются порциями, чтобы объем строк в памяти был ограничен
+        chunk = max(1, int(self.batch_size / max(self.options['sheets_per_project'], 1)))
+        for offset in range(0, count, chunk):
+            with transaction.atomic():
+                self._project_chunk(
+                    range(offset, min(offset + chunk, count)), site_for_project,
+                    user_ids, department_ids, sheet_statuses, stage_statuses, totals
+                )
+            self.stdout.write(
+                f'Проектов: {totals["projects"]}/{count}, листов: {totals["sheets"]}, этапов: {totals["stages"]}'
+            )
+        self.stdout.write(
+            f'Заметок: {totals["notes"]}, исполнителей: {totals["executors"]}, '
+            f'ответственных: {totals["responsible"]}'
+        )
+
+    def _project_chunk(self, numbers, site_for_project, user_ids, department_ids,
+                       sheet_statuses, stage_statuses, totals):
+        options = self.options
+        rows = []
+        for number in numbers:
+            created = self._moment()
+            rows.append((
+                f'{PREFIX}:Проект {number + 1}', self._text(8), f'LD-{number + 1}', f'{PREFIX}-{options["seed"]}',
+                site_for_project[number], created, created,
+            ))
+        project_ids = self._insert_model(Project, [
+            'name', 'description', 'code', 'cipher', 'construction_site_id', 'created_at', 'updated_at',
+        ], rows)
+        totals['projects'] += len(project_ids)
+
+        sheet_rows, stage_rows = [], []
+        for project_id, row in zip(project_ids, rows):
+            project_created = row[5]
+            # Доля выполненных листов проекта — бета-распределение со средним completion_rate
+            rate = options['completion_rate']
+            completion = self.rng.betavariate(rate * 4 + 1e-6, (1 - rate) * 4 + 1e-6)
+            for _ in range(self._count(options['sheets_per_project'])):
+                created = self._moment(project_created)
+                completed = self.rng.random() < completion
+                sheet_rows.append((
+                    self._text(), None, project_id, self.rng.choice(sheet_statuses), completed,
+                    self._moment(created) if completed else None, '',
+                    self.rng.choice(department_ids) if self.rng.random() < 0.9 else None,
+                    self.rng.choice(user_ids), created, created,
+                ))
+            for _ in range(self._count(options['stages_per_project'])):
+                moment = self._moment(project_created)
+                stage_rows.append((
+                    project_id, self.rng.choice(stage_statuses), moment, self.rng.choice(user_ids),
+                    self._text(10), '', moment,
+                ))
+
+        sheet_ids = self._insert_model(ProjectSheet, [
+            'name', 'description', 'project_id', 'status_id', 'is_completed', 'completed_at', 'file',
+            'responsible_department_id', 'created_by_id', 'created_at', 'updated_at',
+        ], sheet_rows)
+        stage_ids = self._insert_model(ProjectStage, [
+            'project_id', 'status_id', 'datetime', 'author_id', 'description', 'file', 'created_at',
+        ], stage_rows)
+        totals['sheets'] += len(sheet_ids)
+        totals['stages'] += len(stage_ids)
+
+        executors = [
+            (sheet_id, user_id)
+            for sheet_id in sheet_ids
+            for user_id in self.rng.sample(user_ids, min(len(user_ids), self.rng.randint(0, options['max_executors'])))
+        ]
+        self._insert_m2m(ProjectSheet._meta.get_field('executors'), executors)
+        responsible = [
+            (stage_id, user_id)
+            for stage_id in stage_ids
+            for user_id in self.rng.sample(user_ids, min(len(user_ids), self.rng.randint(0, options['max_responsible'])))
+        ]
+        self._insert_m2m(ProjectStage._meta.get_field('responsible_users'), responsible)
+        totals['executors'] += len(executors)
+        totals['responsible'] += len(responsible)
+
+        note_rows = []
+        for sheet_id, sheet in zip(sheet_ids, sheet_rows):
+            for _ in range(self._count(options['notes_per_sheet'])):
+                created = self._moment(sheet[9])
+                note_rows.append((self._text(), self._text(20), '', self.rng.choice(user_ids), sheet_id, created, created))
+        self._insert_model(ProjectSheetNote, [
+            'name', 'note', 'file', 'author_id', 'project_sheet_id', 'created_at', 'updated_at',
+        ], note_rows)
+        totals['notes'] += len(note_rows)
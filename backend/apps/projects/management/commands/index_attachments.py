@@ -0,0 +1,33 @@
+"""
+Команда для заполнения индекса вложений проекта (apps.projects.attachments)
+
+Нужна для файлов, загруженных до появления индекса, и после переноса файлов в
+блобы командой dedupe_files (--rebuild): dedupe_files меняет имена файлов
+через update(), минуя сигналы. Время загрузки берется из updated_at/created_at
+объекта.
+"""
+from django.core.management.base import BaseCommand
+
+from apps.projects import attachments
+from apps.projects.models import ProjectSheetNote
+
+
+class Command(BaseCommand):
+    help = 'Заполняет индекс вложений (размер, MIME-тип, SHA-256) для файлов листов, этапов и заметок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rebuild', action='store_true', help='Переписать уже проиндексированные файлы')
+
+    def handle(self, *args, **options):
+        total = 0
+        for model in attachments.SOURCES:
+            queryset = model.objects.exclude(file__isnull=True).exclude(file='').order_by('pk')
+            if model is ProjectSheetNote:
+                # Проект заметки — через лист
+                queryset = queryset.select_related('project_sheet')
+            if not options['rebuild']:
+                queryset = queryset.filter(attachment__isnull=True)
+            for instance in queryset.iterator(chunk_size=500):
+                attachments.index(instance, uploaded_at=getattr(instance, 'updated_at', None) or instance.created_at)
+                total += 1
+        self.stdout.write(self.style.SUCCESS(f'Проиндексировано файлов: {total}'))
@@ -0,0 +1,36 @@
+# Generated by Django 5.0.6 on 2026-10-19 08:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('projects', '0005_add_responsible_users_to_project_stage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Attachment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('sheet', 'Проектный лист'), ('stage', 'Этап проекта'), ('note', 'Заметка листа')], max_length=10, verbose_name='Источник')),
+                ('file', models.CharField(max_length=255, verbose_name='Имя в хранилище')),
+                ('size', models.PositiveBigIntegerField(verbose_name='Размер, байт')),
+                ('content_type', models.CharField(max_length=100, verbose_name='MIME-тип')),
+                ('sha256', models.CharField(blank=True, db_index=True, max_length=64, verbose_name='SHA-256')),
+                ('uploaded_at', models.DateTimeField(verbose_name='Загружен')),
+                ('note', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='attachment', to='projects.projectsheetnote', verbose_name='Заметка листа')),
+                ('project', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='attachments', to='projects.project', verbose_name='Проект')),
+                ('sheet', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='attachment', to='projects.projectsheet', verbose_name='Проектный лист')),
+                ('stage', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='attachment', to='projects.projectstage', verbose_name='Этап проекта')),
+            ],
+            options={
+                'verbose_name': 'Вложение проекта',
+                'verbose_name_plural': 'Вложения проектов',
+                'ordering': ['-uploaded_at', '-id'],
+                'indexes': [models.Index(fields=['project', '-uploaded_at', '-id'], name='attachment_project_idx'), models.Index(fields=['project', 'kind', '-uploaded_at', '-id'], name='attachment_project_kind_idx')],
+            },
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Count, OuterRef, Prefetch, Q, Subquery
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from apps.auth.models import Department
@@ -25,6 +26,14 @@ class Status(models.Model):
         return f"{self.name} ({self.get_status_type_display()})"
 
 
+class ConstructionSiteQuerySet(models.QuerySet):
+    def for_serializer(self):
+        """Все данные для ConstructionSiteSerializer без запросов на каждую строку"""
+        return self.select_related('manager').prefetch_related(
+            Prefetch('projects', queryset=Project.objects.with_completion())
+        )
+
+
 class ConstructionSite(models.Model):
     """Строительный участок"""
     name = models.CharField('Название', max_length=200)
@@ -40,6 +49,8 @@ class ConstructionSite(models.Model):
     created_at = models.DateTimeField('Создан', auto_now_add=True)
     updated_at = models.DateTimeField('Обновлен', auto_now=True)
     
+    objects = ConstructionSiteQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Строительный участок'
         verbose_name_plural = 'Строительные участки'
@@ -57,6 +68,29 @@ class ConstructionSite(models.Model):
         return round(total_percentage / projects.count(), 2)
 
 
+class ProjectQuerySet(models.QuerySet):
+    def with_completion(self):
+        """Число листов и выполненных листов для completion_percentage"""
+        return self.annotate(
+            sheets_count=Count('sheets', distinct=True),
+            completed_sheets_count=Count('sheets', filter=Q(sheets__is_completed=True), distinct=True),
+        )
+
+    def with_last_stage_status(self):
+        """Статус последнего этапа для last_stage_status"""
+        return self.annotate(last_stage_status_id=Subquery(
+            ProjectStage.objects.filter(project=OuterRef('pk')).order_by('-datetime').values('status_id')[:1]
+        ))
+
+    def for_serializer(self):
+        """Все данные для ProjectSerializer без запросов на каждую строку"""
+        return self.with_completion().with_last_stage_status().select_related(
+            'construction_site__manager'
+        ).prefetch_related(
+            Prefetch('construction_site__projects', queryset=Project.objects.with_completion())
+        )
+
+
 class Project(models.Model):
     """Проект"""
     name = models.CharField('Название', max_length=200)
@@ -72,6 +106,8 @@ class Project(models.Model):
     created_at = models.DateTimeField('Создан', auto_now_add=True)
     updated_at = models.DateTimeField('Обновлен', auto_now=True)
     
+    objects = ProjectQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Проект'
         verbose_name_plural = 'Проекты'
@@ -83,21 +119,39 @@ class Project(models.Model):
     @property
     def completion_percentage(self):
         """Процент выполнения проекта (выполненные листы / все листы)"""
-        sheets = self.sheets.all()
-        if not sheets.exists():
+        # Счетчики из ProjectQuerySet.with_completion(), иначе отдельные запросы
+        total = getattr(self, 'sheets_count', None)
+        if total is None:
+            total = self.sheets.count()
+            completed = self.sheets.filter(is_completed=True).count() if total else 0
+        else:
+            completed = self.completed_sheets_count
+        if not total:
             return 0.0
-        completed = sheets.filter(is_completed=True).count()
-        return round((completed / sheets.count()) * 100, 2)
+        return round((completed / total) * 100, 2)
     
     @property
     def last_stage_status(self):
         """Статус последнего этапа проекта (по дате datetime)"""
+        if hasattr(self, 'last_stage_status_id'):
+            # Аннотация ProjectQuerySet.with_last_stage_status(), статус — из кэша справочника
+            from .reference import statuses
+            return statuses.get(self.last_stage_status_id) if self.last_stage_status_id else None
         last_stage = self.stages.order_by('-datetime').first()
         if last_stage and last_stage.status:
             return last_stage.status
         return None
 
 
+class ProjectSheetQuerySet(models.QuerySet):
+    def for_serializer(self):
+        """Все данные для ProjectSheetSerializer без запросов на каждую строку"""
+        return self.select_related('created_by', 'attachment').prefetch_related(
+            Prefetch('project', queryset=Project.objects.for_serializer()),
+            'executors',
+        )
+
+
 class ProjectSheet(models.Model):
     """Проектный лист"""
     name = models.CharField('Название', max_length=200, blank=True, null=True)
@@ -145,6 +199,8 @@ class ProjectSheet(models.Model):
     created_at = models.DateTimeField('Создан', auto_now_add=True)
     updated_at = models.DateTimeField('Обновлен', auto_now=True)
     
+    objects = ProjectSheetQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Проектный лист'
         verbose_name_plural = 'Проектные листы'
@@ -162,6 +218,15 @@ class ProjectSheet(models.Model):
         super().save(*args, **kwargs)
 
 
+class ProjectStageQuerySet(models.QuerySet):
+    def for_serializer(self):
+        """Все данные для ProjectStageSerializer без запросов на каждую строку"""
+        return self.select_related('author', 'attachment').prefetch_related(
+            Prefetch('project', queryset=Project.objects.for_serializer()),
+            'responsible_users',
+        )
+
+
 class ProjectStage(models.Model):
     """Этап проекта"""
     project = models.ForeignKey(
@@ -197,6 +262,8 @@ class ProjectStage(models.Model):
     file = models.FileField('Файл', upload_to='project_stages/', blank=True, null=True)
     created_at = models.DateTimeField('Создан', auto_now_add=True)
     
+    objects = ProjectStageQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Этап проекта'
         verbose_name_plural = 'Этапы проекта'
@@ -206,6 +273,14 @@ class ProjectStage(models.Model):
         return f"{self.project.name} - {self.datetime.strftime('%d.%m.%Y %H:%M')}"
 
 
+class ProjectSheetNoteQuerySet(models.QuerySet):
+    def for_serializer(self):
+        """Все данные для ProjectSheetNoteSerializer без запросов на каждую строку"""
+        return self.select_related('author', 'attachment').prefetch_related(
+            Prefetch('project_sheet', queryset=ProjectSheet.objects.for_serializer())
+        )
+
+
 class ProjectSheetNote(models.Model):
     """Заметка проектного листа"""
     name = models.CharField('Название', max_length=200)
@@ -227,6 +302,8 @@ class ProjectSheetNote(models.Model):
     created_at = models.DateTimeField('Создан', auto_now_add=True)
     updated_at = models.DateTimeField('Обновлен', auto_now=True)
     
+    objects = ProjectSheetNoteQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'Заметка проектного листа'
         verbose_name_plural = 'Заметки проектных листов'
@@ -236,3 +313,53 @@ class ProjectSheetNote(models.Model):
         return f"{self.name} - {self.project_sheet.name or 'Без названия'}"
 
 
+class Attachment(models.Model):
+    """Файл листа, этапа или заметки в индексе вложений проекта (apps.projects.attachments)"""
+    KINDS = [
+        ('sheet', 'Проектный лист'),
+        ('stage', 'Этап проекта'),
+        ('note', 'Заметка листа'),
+    ]
+
+    project = models.ForeignKey(
+        Project,
+        on_delete=models.CASCADE,
+        related_name='attachments',
+        verbose_name='Проект'
+    )
+    kind = models.CharField('Источник', max_length=10, choices=KINDS)
+    sheet = models.OneToOneField(
+        ProjectSheet, on_delete=models.CASCADE, null=True, blank=True,
+        related_name='attachment', verbose_name='Проектный лист'
+    )
+    stage = models.OneToOneField(
+        ProjectStage, on_delete=models.CASCADE, null=True, blank=True,
+        related_name='attachment', verbose_name='Этап проекта'
+    )
+    note = models.OneToOneField(
+        ProjectSheetNote, on_delete=models.CASCADE, null=True, blank=True,
+        related_name='attachment', verbose_name='Заметка листа'
+    )
+    file = models.CharField('Имя в хранилище', max_length=255)
+    size = models.PositiveBigIntegerField('Размер, байт')
+    content_type = models.CharField('MIME-тип', max_length=100)
+    sha256 = models.CharField('SHA-256', max_length=64, blank=True, db_index=True)
+    uploaded_at = models.DateTimeField('Загружен')
+
+    class Meta:
+        verbose_name = 'Вложение проекта'
+        verbose_name_plural = 'Вложения проектов'
+        ordering = ['-uploaded_at', '-id']
+        indexes = [
+            # Список вложений проекта (ProjectViewSet.attachments), в том числе с фильтром kind
+            models.Index(fields=['project', '-uploaded_at', '-id'], name='attachment_project_idx'),
+            models.Index(fields=['project', 'kind', '-uploaded_at', '-id'], name='attachment_project_kind_idx'),
+        ]
+
+    def __str__(self):
+        return self.file
+
+    @property
+    def object_id(self):
+        """id листа, этапа или заметки с этим файлом"""
+        return self.sheet_id or self.stage_id or self.note_id
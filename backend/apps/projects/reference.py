@@ -0,0 +1,7 @@
+"""
+Кэш справочника статусов
+"""
+from apps.core.reference import ReferenceCache
+from .models import Status
+
+statuses = ReferenceCache(Status)
@@ -1,64 +1,45 @@
-import json
-import traceback
+import logging
+import posixpath
 from rest_framework import serializers
+from django.core.files.storage import default_storage
+from django.urls import reverse
 from django.contrib.auth.models import User
-from django.utils import timezone
 from apps.auth.models import Department
+from apps.auth.reference import departments
+from apps.core import instrumentation, previews
+from apps.core.serializers import (
+    BulkPrimaryKeyRelatedField, ModelSerializer,
+    ReferencePrimaryKeyRelatedField, ReferenceSerializerField
+)
 from .models import (
     Status, ConstructionSite, Project, ProjectSheet,
-    ProjectStage, ProjectSheetNote
+    ProjectStage, ProjectSheetNote, Attachment
 )
-
-# #region agent log
-import os
-from pathlib import Path
-BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent
-LOG_PATH = BASE_DIR / '.cursor' / 'debug.log'
-def _log(hypothesis_id, location, message, data=None):
-    try:
-        LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
-        with open(LOG_PATH, 'a', encoding='utf-8') as f:
-            f.write(json.dumps({
-                'sessionId': 'debug-session',
-                'runId': 'run1',
-                'hypothesisId': hypothesis_id,
-                'location': location,
-                'message': message,
-                'data': data or {},
-                'timestamp': int(timezone.now().timestamp() * 1000)
-            }) + '\n')
-    except Exception as log_err:
-        try:
-            fallback_path = BASE_DIR / 'backend' / 'debug_fallback.log'
-            with open(fallback_path, 'a', encoding='utf-8') as f:
-                f.write(f"LOG ERROR at {location}: {log_err}\n")
-        except:
-            pass
-# #endregion
+from .reference import statuses
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(ModelSerializer):
     """Сериализатор пользователя"""
     class Meta:
         model = User
         fields = ['id', 'username', 'first_name', 'last_name', 'email']
 
 
-class StatusSerializer(serializers.ModelSerializer):
+class StatusSerializer(ModelSerializer):
     """Сериализатор статуса"""
     class Meta:
         model = Status
         fields = ['id', 'name', 'color', 'status_type', 'created_at']
 
 
-class DepartmentSerializer(serializers.ModelSerializer):
+class DepartmentSerializer(ModelSerializer):
     """Сериализатор отдела"""
     class Meta:
         model = Department
         fields = ['id', 'name', 'description', 'color']
 
 
-class ConstructionSiteSerializer(serializers.ModelSerializer):
+class ConstructionSiteSerializer(ModelSerializer):
     """Сериализатор строительного участка"""
     manager = UserSerializer(read_only=True)
     manager_id = serializers.PrimaryKeyRelatedField(
@@ -78,26 +59,19 @@ class ConstructionSiteSerializer(serializers.ModelSerializer):
         ]
     
     def to_representation(self, instance):
-        # #region agent log
-        _log('B', 'ConstructionSiteSerializer.to_representation:entry', 'Serializing ConstructionSite', {'instance_id': instance.id, 'has_manager': instance.manager_id is not None})
-        # #endregion
+        instrumentation.event('ConstructionSiteSerializer.to_representation:entry', 'Serializing ConstructionSite', lambda: {
+            'instance_id': instance.id, 'has_manager': instance.manager_id is not None,
+        }, hypothesis='B')
         try:
-            # #region agent log
-            _log('B', 'ConstructionSiteSerializer.to_representation:before_super', 'Before calling super().to_representation()')
-            # #endregion
-            data = super().to_representation(instance)
-            # #region agent log
-            _log('B', 'ConstructionSiteSerializer.to_representation:after_super', 'After calling super().to_representation()', {'has_manager_field': 'manager' in data})
-            # #endregion
-            return data
+            return super().to_representation(instance)
         except Exception as e:
-            # #region agent log
-            _log('B', 'ConstructionSiteSerializer.to_representation:error', 'Exception in to_representation', {'error': str(e), 'traceback': traceback.format_exc()})
-            # #endregion
+            instrumentation.event('ConstructionSiteSerializer.to_representation:error', 'Exception in to_representation', {
+                'error': str(e),
+            }, level=logging.ERROR, hypothesis='B', exc_info=True)
             raise
 
 
-class ProjectSerializer(serializers.ModelSerializer):
+class ProjectSerializer(ModelSerializer):
     """Сериализатор проекта"""
     construction_site = ConstructionSiteSerializer(read_only=True)
     construction_site_id = serializers.PrimaryKeyRelatedField(
@@ -118,7 +92,7 @@ class ProjectSerializer(serializers.ModelSerializer):
         ]
 
 
-class ProjectSheetSerializer(serializers.ModelSerializer):
+class ProjectSheetSerializer(ModelSerializer):
     """Сериализатор проектного листа"""
     project = ProjectSerializer(read_only=True)
     project_id = serializers.PrimaryKeyRelatedField(
@@ -126,25 +100,28 @@ class ProjectSheetSerializer(serializers.ModelSerializer):
         source='project',
         write_only=True
     )
-    status = StatusSerializer(read_only=True)
-    status_id = serializers.PrimaryKeyRelatedField(
-        queryset=Status.objects.filter(status_type='sheet'),
+    status = ReferenceSerializerField(StatusSerializer, statuses, source='status_id')
+    status_id = ReferencePrimaryKeyRelatedField(
+        statuses,
+        limit_choices_to={'status_type': 'sheet'},
         source='status',
         write_only=True,
         required=False,
         allow_null=True
     )
     executors = UserSerializer(many=True, read_only=True)
-    executor_ids = serializers.PrimaryKeyRelatedField(
+    executor_ids = BulkPrimaryKeyRelatedField(
         queryset=User.objects.all(),
         source='executors',
         many=True,
         write_only=True,
         required=False
     )
-    responsible_department = DepartmentSerializer(read_only=True)
-    responsible_department_id = serializers.PrimaryKeyRelatedField(
-        queryset=Department.objects.all(),
+    responsible_department = ReferenceSerializerField(
+        DepartmentSerializer, departments, source='responsible_department_id'
+    )
+    responsible_department_id = ReferencePrimaryKeyRelatedField(
+        departments,
         source='responsible_department',
         write_only=True,
         required=False,
@@ -160,13 +137,17 @@ class ProjectSheetSerializer(serializers.ModelSerializer):
         allow_null=True
     )
     file_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
+    # Из индекса вложений (apps.projects.attachments)
+    file_size = serializers.IntegerField(source='attachment.size', read_only=True, default=None)
+    file_type = serializers.CharField(source='attachment.content_type', read_only=True, default=None)
     
     class Meta:
         model = ProjectSheet
         fields = [
             'id', 'name', 'description', 'project', 'project_id',
             'status', 'status_id', 'is_completed', 'completed_at',
-            'file', 'file_url', 'executors', 'executor_ids',
+            'file', 'file_url', 'preview_url', 'file_size', 'file_type', 'executors', 'executor_ids',
             'responsible_department', 'responsible_department_id',
             'created_by', 'created_by_id', 'created_by_id_write', 'created_at', 'updated_at'
         ]
@@ -174,7 +155,7 @@ class ProjectSheetSerializer(serializers.ModelSerializer):
     
     def get_created_by_id(self, obj):
         """Возвращает ID инициатора"""
-        return obj.created_by.id if obj.created_by else None
+        return obj.created_by_id
     
     def get_file_url(self, obj):
         """Возвращает URL файла"""
@@ -184,9 +165,17 @@ class ProjectSheetSerializer(serializers.ModelSerializer):
                 return request.build_absolute_uri(obj.file.url)
             return obj.file.url
         return None
+    
+    def get_preview_url(self, obj):
+        """Возвращает URL превью файла (изображения и PDF)"""
+        url = previews.preview_url(obj.file)
+        request = self.context.get('request')
+        if url and request:
+            return request.build_absolute_uri(url)
+        return url
 
 
-class ProjectStageSerializer(serializers.ModelSerializer):
+class ProjectStageSerializer(ModelSerializer):
     """Сериализатор этапа проекта"""
     project = ProjectSerializer(read_only=True)
     project_id = serializers.PrimaryKeyRelatedField(
@@ -194,9 +183,10 @@ class ProjectStageSerializer(serializers.ModelSerializer):
         source='project',
         write_only=True
     )
-    status = StatusSerializer(read_only=True)
-    status_id = serializers.PrimaryKeyRelatedField(
-        queryset=Status.objects.filter(status_type='stage'),
+    status = ReferenceSerializerField(StatusSerializer, statuses, source='status_id')
+    status_id = ReferencePrimaryKeyRelatedField(
+        statuses,
+        limit_choices_to={'status_type': 'stage'},
         source='status',
         write_only=True,
         required=False,
@@ -211,7 +201,7 @@ class ProjectStageSerializer(serializers.ModelSerializer):
         allow_null=True
     )
     responsible_users = UserSerializer(many=True, read_only=True)
-    responsible_user_ids = serializers.PrimaryKeyRelatedField(
+    responsible_user_ids = BulkPrimaryKeyRelatedField(
         queryset=User.objects.all(),
         source='responsible_users',
         many=True,
@@ -219,14 +209,18 @@ class ProjectStageSerializer(serializers.ModelSerializer):
         required=False
     )
     file_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
+    # Из индекса вложений (apps.projects.attachments)
+    file_size = serializers.IntegerField(source='attachment.size', read_only=True, default=None)
+    file_type = serializers.CharField(source='attachment.content_type', read_only=True, default=None)
     
     class Meta:
         model = ProjectStage
         fields = [
             'id', 'project', 'project_id', 'status', 'status_id',
             'datetime', 'author', 'author_id', 'responsible_users',
-            'responsible_user_ids', 'description', 'file', 'file_url',
-            'created_at'
+            'responsible_user_ids', 'description', 'file', 'file_url', 'preview_url',
+            'file_size', 'file_type', 'created_at'
         ]
     
     def get_file_url(self, obj):
@@ -237,9 +231,17 @@ class ProjectStageSerializer(serializers.ModelSerializer):
                 return request.build_absolute_uri(obj.file.url)
             return obj.file.url
         return None
+    
+    def get_preview_url(self, obj):
+        """Возвращает URL превью файла (изображения и PDF)"""
+        url = previews.preview_url(obj.file)
+        request = self.context.get('request')
+        if url and request:
+            return request.build_absolute_uri(url)
+        return url
 
 
-class ProjectSheetNoteSerializer(serializers.ModelSerializer):
+class ProjectSheetNoteSerializer(ModelSerializer):
     """Сериализатор заметки проектного листа"""
     project_sheet = ProjectSheetSerializer(read_only=True)
     project_sheet_id = serializers.PrimaryKeyRelatedField(
@@ -256,11 +258,15 @@ class ProjectSheetNoteSerializer(serializers.ModelSerializer):
         allow_null=True
     )
     file_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
+    # Из индекса вложений (apps.projects.attachments)
+    file_size = serializers.IntegerField(source='attachment.size', read_only=True, default=None)
+    file_type = serializers.CharField(source='attachment.content_type', read_only=True, default=None)
     
     class Meta:
         model = ProjectSheetNote
         fields = [
-            'id', 'name', 'note', 'file', 'file_url',
+            'id', 'name', 'note', 'file', 'file_url', 'preview_url', 'file_size', 'file_type',
             'author', 'author_id', 'project_sheet', 'project_sheet_id',
             'created_at', 'updated_at'
         ]
@@ -273,6 +279,49 @@ class ProjectSheetNoteSerializer(serializers.ModelSerializer):
                 return request.build_absolute_uri(obj.file.url)
             return obj.file.url
         return None
+    
+    def get_preview_url(self, obj):
+        """Возвращает URL превью файла (изображения и PDF)"""
+        url = previews.preview_url(obj.file)
+        request = self.context.get('request')
+        if url and request:
+            return request.build_absolute_uri(url)
+        return url
+
+
+class AttachmentSerializer(ModelSerializer):
+    """Сериализатор вложения проекта: только данные индекса, без обращения к диску"""
+    object_id = serializers.IntegerField(read_only=True)
+    filename = serializers.SerializerMethodField()
+    file_url = serializers.SerializerMethodField()
+    preview_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Attachment
+        fields = [
+            'id', 'kind', 'object_id', 'filename', 'size', 'content_type', 'sha256',
+            'uploaded_at', 'file_url', 'preview_url'
+        ]
+        read_only_fields = fields
+
+    def get_filename(self, obj):
+        return posixpath.basename(obj.file)
+
+    def _absolute(self, url):
+        request = self.context.get('request')
+        if url and request:
+            return request.build_absolute_uri(url)
+        return url
+
+    def get_file_url(self, obj):
+        """URL файла: для блоба — неизменяемый /api/core/files/..., иначе MEDIA_URL"""
+        return self._absolute(default_storage.url(obj.file))
+
+    def get_preview_url(self, obj):
+        """URL превью (изображения и PDF в блобах)"""
+        if not obj.sha256 or not obj.file.lower().endswith(previews.EXTENSIONS):
+            return None
+        return self._absolute(reverse('blob_preview', kwargs={'digest': obj.sha256}))
 
 
 class DashboardDataSerializer(serializers.Serializer):
@@ -1,15 +1,29 @@
 """
 Тесты для проверки фильтрации этапов и листов на странице задач
 """
-from django.test import TestCase
+import hashlib
+import os
+import shutil
+import tempfile
+import zipfile
+from io import BytesIO, StringIO
+from urllib.parse import unquote
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase, override_settings
 from django.contrib.auth.models import User
 from django.utils import timezone
 from rest_framework.test import APIClient
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
 from apps.auth.models import Department, UserProfile
+from apps.core import nplusone
+from apps.core.testing import QueryBudgetMixin
 from .models import (
-    Status, ConstructionSite, Project, ProjectSheet, ProjectStage
+    Status, ConstructionSite, Project, ProjectSheet, ProjectStage, ProjectSheetNote, Attachment
 )
 
 
@@ -397,3 +411,500 @@ class TasksScreenFilteringTest(TestCase):
         self.assertIn(self.sheet1.id, sheet_ids)
         self.assertIn(self.sheet4.id, sheet_ids)
         self.assertNotIn(self.sheet3.id, sheet_ids)  # выполнен
+
+
+class GenerateLoadDataTest(TestCase):
+    """Команда generate_load_data: воспроизводимость и очистка"""
+
+    def _generate(self, *args):
+        call_command(
+            'generate_load_data', '--scale', '0.05', '--seed', '7', '--anchor', '2025-01-01',
+            '--sheets-per-project', '6', '--stages-per-project', '3', *args, stdout=StringIO()
+        )
+        sheets = ProjectSheet.objects.filter(project__code__startswith='LD-')
+        return {
+            'sites': ConstructionSite.objects.filter(name__startswith='load:').count(),
+            'projects': Project.objects.filter(code__startswith='LD-').count(),
+            'sheets': sheets.count(),
+            'completed': sheets.filter(is_completed=True).count(),
+            'stages': ProjectStage.objects.filter(project__code__startswith='LD-').count(),
+            'notes': ProjectSheetNote.objects.filter(project_sheet__in=sheets).count(),
+            'users': User.objects.filter(username__startswith='load_user').count(),
+            'names': list(sheets.order_by('id').values_list('name', 'created_at', 'executors__username')[:20]),
+        }
+
+    def test_same_seed_gives_same_data(self):
+        first = self._generate()
+        self.assertEqual(first['projects'], 10)
+        self.assertGreater(first['sheets'], 0)
+        self.assertTrue(0 < first['completed'] < first['sheets'])
+        self.assertEqual(
+            UserProfile.objects.filter(user__username__startswith='load_user').count(), first['users']
+        )
+        # Даты создания распределены до даты отсчета, а не равны моменту вставки
+        latest = ProjectSheet.objects.filter(project__code__startswith='LD-').latest('created_at')
+        self.assertLessEqual(latest.created_at.date().isoformat(), '2025-01-01')
+
+        second = self._generate('--clear')
+        self.assertEqual(first, second)
+
+    def test_refuses_to_duplicate_without_clear(self):
+        self._generate()
+        with self.assertRaises(CommandError):
+            self._generate()
+
+
+class QueryBudgetTest(QueryBudgetMixin, TransactionTestCase):
+    """Бюджеты SQL-запросов эндпоинтов проектов на двух объемах данных
+
+    TransactionTestCase: внутри транзакции TestCase кэш справочников не сохраняет
+    снимок и читает таблицу при каждом обращении, что исказило бы число запросов.
+    """
+
+    # (путь, параметры, максимум запросов); значения '$site' и т.п. заменяются id из setUp
+    BUDGETS = [
+        ('/api/projects/construction-sites/', {}, 3),
+        ('/api/projects/projects/', {}, 4),
+        ('/api/projects/projects/', {'construction_site_id': '$site'}, 4),
+        ('/api/projects/project-sheets/', {'project_id': '$project', 'page_size': 100}, 6),
+        ('/api/projects/project-sheets/', {'filter_by_user_department': 'true'}, 8),
+        ('/api/projects/project-sheets/', {'filter_by_created_by': 'true', 'is_completed': 'false'}, 6),
+        ('/api/projects/project-sheets/', {'construction_site_id': '$site'}, 6),
+        ('/api/projects/project-stages/', {'project_id': '$project'}, 6),
+        ('/api/projects/project-stages/', {}, 6),
+        ('/api/projects/project-sheet-notes/', {'project_sheet_id': '$sheet'}, 7),
+        ('/api/projects/dashboard/data/', {}, 8),
+        ('/api/projects/dashboard/data/', {'construction_site_ids[]': '$site', 'granularity': 'day'}, 8),
+    ]
+
+    def setUp(self):
+        """Настройка тестовых данных"""
+        self.client = APIClient()
+        self.department = Department.objects.create(name='IT', color='#0000FF')
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        self.user.profile.department = self.department
+        self.user.profile.save()
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        self.sheet_status = Status.objects.create(name='В работе', status_type='sheet')
+        self.stage_status = Status.objects.create(name='Начат', status_type='stage')
+        self.site = ConstructionSite.objects.create(name='Участок', manager=self.user)
+        self.project = Project.objects.create(name='Проект', code='P', cipher='C', construction_site=self.site)
+        self.sheet = ProjectSheet.objects.create(
+            name='Лист', project=self.project, created_by=self.user, responsible_department=self.department
+        )
+        self.ids = {'$site': self.site.id, '$project': self.project.id, '$sheet': self.sheet.id}
+        self.rows = 0
+        self._add_rows(1)
+
+    def _add_rows(self, count):
+        """Добавить строки во все списки (меньше размера страницы, чтобы страница росла)"""
+        for _ in range(count):
+            self.rows += 1
+            n = self.rows
+            executor = User.objects.create_user(username=f'executor{n}', password='testpass123')
+            site = ConstructionSite.objects.create(name=f'Участок {n}', manager=executor)
+            for project in (
+                self.project,
+                Project.objects.create(name=f'Проект {n}', code=f'P{n}', cipher='C', construction_site=self.site),
+                Project.objects.create(name=f'Проект {n}', code=f'P{n}', cipher='D', construction_site=site),
+            ):
+                sheet = ProjectSheet.objects.create(
+                    name=f'Лист {n}', project=project, status=self.sheet_status, created_by=self.user,
+                    responsible_department=self.department, is_completed=n % 2 == 0,
+                )
+                sheet.executors.set([self.user, executor])
+                stage = ProjectStage.objects.create(
+                    project=project, status=self.stage_status, datetime=timezone.now(), author=executor
+                )
+                stage.responsible_users.set([self.user, executor])
+            ProjectSheetNote.objects.create(name=f'Заметка {n}', note='Текст', author=executor, project_sheet=self.sheet)
+
+    def _reset(self):
+        """Вернуть данные к состоянию после setUp: каждый эндпоинт проверяется с одного объема"""
+        ProjectSheetNote.objects.all().delete()
+        ProjectStage.objects.all().delete()
+        ProjectSheet.objects.exclude(pk=self.sheet.pk).delete()
+        Project.objects.exclude(pk=self.project.pk).delete()
+        ConstructionSite.objects.exclude(pk=self.site.pk).delete()
+        User.objects.exclude(pk=self.user.pk).delete()
+        self.rows = 0
+        self._add_rows(1)
+
+    def _get(self, path, params):
+        params = {key: self.ids.get(value, value) for key, value in params.items()}
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, response.content[:500])
+        return response
+
+    def test_endpoints_stay_within_budget(self):
+        for path, params, budget in self.BUDGETS:
+            with self.subTest(path=path, params=params):
+                first, second = self.assertQueryBudgetStable(
+                    budget, lambda: self._get(path, params), lambda: self._add_rows(2)
+                )
+                # Второй объем действительно больше первого
+                self.assertGreater(len(second.content), len(first.content))
+            self._reset()
+
+    def test_endpoints_have_no_lazy_or_unused_loads(self):
+        """Проверка: нет ленивых загрузок связей по строкам и лишних select_related/prefetch_related"""
+        # track() подменяет дескрипторы связей Django: остальные тесты работают с исходными
+        if not nplusone.installed():
+            self.addCleanup(nplusone.uninstall)
+        self._add_rows(2)
+        for path, params, _ in self.BUDGETS:
+            with self.subTest(path=path, params=params), nplusone.track() as tracker:
+                self._get(path, params)
+                self.assertEqual([finding['message'] for finding in tracker.report()], [])
+
+
+class FileDownloadTest(TestCase):
+    """Тесты скачивания файлов листов, этапов и заметок"""
+    
+    CONTENT = b'%PDF-1.4 0123456789abcdef'
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.settings_override = override_settings(MEDIA_ROOT=media.name)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        site = ConstructionSite.objects.create(name='Участок')
+        project = Project.objects.create(name='Проект', code='P', cipher='C', construction_site=site)
+        self.sheet = ProjectSheet.objects.create(
+            name='Лист', project=project, created_by=self.user,
+            file=SimpleUploadedFile('Чертеж 1.pdf', self.CONTENT),
+        )
+        self.stage = ProjectStage.objects.create(
+            project=project, datetime=timezone.now(), author=self.user,
+            file=SimpleUploadedFile('plan.dwg', self.CONTENT),
+        )
+        self.note = ProjectSheetNote.objects.create(
+            name='Заметка', note='Текст', author=self.user, project_sheet=self.sheet,
+            file=SimpleUploadedFile('note.txt', b'note'),
+        )
+        self.url = f'/api/projects/project-sheets/{self.sheet.id}/download_file/'
+    
+    def test_full_download_has_type_and_validators(self):
+        """Проверка: файл целиком с MIME-типом, именем в UTF-8, ETag и Last-Modified"""
+        response = self.client.get(self.url)
+        
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Content-Length'], str(len(self.CONTENT)))
+        self.assertIn("filename*=utf-8''%D0%A7%D0%B5%D1%80%D1%82%D0%B5%D0%B6_1.pdf", response['Content-Disposition'])
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertTrue(response['ETag'].startswith('"'))
+        self.assertTrue(response.has_header('Last-Modified'))
+        self.assertIn('private', response['Cache-Control'])
+    
+    def test_conditional_requests(self):
+        """Проверка: совпадающий ETag или дата — 304, несовпадающий If-Match — 412"""
+        first = self.client.get(self.url)
+        
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], first['ETag'])
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get(self.url, HTTP_IF_MATCH='"other"')
+        self.assertEqual(response.status_code, status.HTTP_412_PRECONDITION_FAILED)
+    
+    def test_range_requests(self):
+        """Проверка: 206 для диапазона и суффикса, 416 за концом файла"""
+        size = len(self.CONTENT)
+        
+        response = self.client.get(self.url, HTTP_RANGE='bytes=9-12')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[9:13])
+        self.assertEqual(response['Content-Range'], f'bytes 9-12/{size}')
+        self.assertEqual(response['Content-Length'], '4')
+        
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-6')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[-6:])
+        response = self.client.get(self.url, HTTP_RANGE='bytes=20-')
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT[20:])
+        
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={size}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+        
+        # Несколько диапазонов и некорректный заголовок — файл целиком
+        for header in ('bytes=0-1,4-5', 'bytes=a-b', 'items=0-1'):
+            response = self.client.get(self.url, HTTP_RANGE=header)
+            self.assertEqual(response.status_code, status.HTTP_200_OK, header)
+    
+    def test_if_range(self):
+        """Проверка: диапазон отдается, только если If-Range совпадает с текущей версией"""
+        etag = self.client.get(self.url)['ETag']
+        
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE=etag)
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-3', HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), self.CONTENT)
+    
+    def test_stage_and_note_files(self):
+        """Проверка: файлы этапов и заметок отдаются так же"""
+        response = self.client.get(f'/api/projects/project-stages/{self.stage.id}/download_file/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['Content-Type'], 'image/vnd.dwg')
+        
+        response = self.client.get(f'/api/projects/project-sheet-notes/{self.note.id}/download_file/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), b'note')
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+    
+    def test_missing_file(self):
+        """Проверка: нет файла у записи или на диске — 404"""
+        os.remove(self.sheet.file.path)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(response.data['error'], 'Файл не найден на сервере')
+        
+        self.sheet.file = None
+        self.sheet.save()
+        response = self.client.get(self.url)
+        self.assertEqual(response.data['error'], 'Файл не прикреплен')
+    
+    def test_offload_to_proxy(self):
+        """Проверка: X-Accel-Redirect и X-Sendfile без тела ответа"""
+        options = {'OFFLOAD': 'accel', 'ACCEL_PREFIX': '/protected-media/', 'CHUNK_SIZE': 1024}
+        with override_settings(FILE_DOWNLOADS=options):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            response['X-Accel-Redirect'],
+            '/protected-media/' + self.sheet.file.storage.stored_name(self.sheet.file.name),
+        )
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        
+        with override_settings(FILE_DOWNLOADS={**options, 'OFFLOAD': 'sendfile'}):
+            response = self.client.get(self.url)
+        self.assertEqual(unquote(response['X-Sendfile']), self.sheet.file.path)
+
+
+class ProjectExportTest(TestCase):
+    """Тесты выгрузки файлов проекта ZIP-архивом"""
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.settings_override = override_settings(
+            MEDIA_ROOT=media.name, FILE_DOWNLOADS={'OFFLOAD': '', 'ACCEL_PREFIX': '/', 'CHUNK_SIZE': 1024},
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        self.client.force_authenticate(self.user)
+        self.in_work = Status.objects.create(name='В работе', status_type='sheet')
+        self.approved = Status.objects.create(name='Согласован', status_type='stage')
+        self.department = Department.objects.create(name='КБ/1')
+        site = ConstructionSite.objects.create(name='Участок')
+        self.project = Project.objects.create(name='Проект', code='P-1', cipher='Ш', construction_site=site)
+        self.drawing = os.urandom(5000)
+        self.sheet = ProjectSheet.objects.create(
+            name='Лист 1', project=self.project, status=self.in_work, responsible_department=self.department,
+            is_completed=True, file=SimpleUploadedFile('plan.pdf', self.drawing),
+        )
+        ProjectSheet.objects.create(
+            name='Лист 2', project=self.project, status=self.in_work, responsible_department=self.department,
+            file=SimpleUploadedFile('plan.pdf', b'second'),
+        )
+        ProjectSheet.objects.create(name='Лист 3', project=self.project, file='project_sheets/lost.pdf')
+        ProjectSheet.objects.create(name='Без файла', project=self.project)
+        ProjectSheetNote.objects.create(
+            name='Заметка', note='Текст', project_sheet=self.sheet, file=SimpleUploadedFile('note.txt', b'note ' * 100),
+        )
+        ProjectStage.objects.create(
+            project=self.project, status=self.approved, datetime=timezone.now(),
+            file=SimpleUploadedFile('act.dwg', b'stage'),
+        )
+        self.url = f'/api/projects/projects/{self.project.id}/export_files/'
+    
+    def archive(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        archive = zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        return archive
+    
+    def test_archive_grouped_by_status_and_department(self):
+        """Проверка: файлы разложены по статусам и отделам, повторные имена не теряются"""
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertIn('P-1_', response['Content-Disposition'])
+        archive = self.archive(response)
+        
+        self.assertEqual(sorted(archive.namelist()), sorted([
+            'Листы/В работе/КБ 1/plan.pdf',
+            'Листы/В работе/КБ 1/plan (2).pdf',
+            'Листы/В работе/КБ 1/Заметки/note.txt',
+            'Этапы/Согласован/act.dwg',
+            '_нет_на_сервере.txt',
+        ]))
+        self.assertEqual(archive.read('Листы/В работе/КБ 1/plan.pdf'), self.drawing)
+        self.assertEqual(archive.getinfo('Листы/В работе/КБ 1/plan.pdf').compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(archive.getinfo('Листы/В работе/КБ 1/Заметки/note.txt').compress_type, zipfile.ZIP_DEFLATED)
+        self.assertIn('Листы/Без статуса/Без отдела/lost.pdf', archive.read('_нет_на_сервере.txt').decode())
+    
+    def test_filters(self):
+        """Проверка: фильтры по статусу, отделу, выполнению и типам файлов"""
+        names = self.archive(self.client.get(self.url, {'is_completed': 'true'})).namelist()
+        self.assertEqual(names, ['Листы/В работе/КБ 1/plan.pdf', 'Листы/В работе/КБ 1/Заметки/note.txt'])
+        
+        names = self.archive(self.client.get(self.url, {'status_id': self.approved.id})).namelist()
+        self.assertEqual(names, ['Этапы/Согласован/act.dwg'])
+        
+        names = self.archive(self.client.get(self.url, {'department_id': self.department.id, 'include': 'notes'})).namelist()
+        self.assertEqual(names, ['Листы/В работе/КБ 1/Заметки/note.txt'])
+        
+        response = self.client.get(self.url, {'include': 'sheets,photos'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.get(self.url, {'status_id': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_archive_is_streamed(self):
+        """Проверка: архив отдается частями по мере чтения файлов"""
+        response = self.client.get(self.url, {'include': 'sheets'})
+        chunks = iter(response.streaming_content)
+        first = next(chunks)
+        self.assertTrue(first.startswith(b'PK'))
+        self.assertLessEqual(len(first), 1024 + 200)
+        self.assertGreater(len([first, *chunks]), len(self.drawing) // 1024)
+
+
+class AttachmentIndexTest(TestCase):
+    """Тесты индекса вложений и списка вложений проекта"""
+    
+    DRAWING = b'%PDF-1.4 drawing'
+    
+    def setUp(self):
+        """Настройка тестовых данных"""
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.settings_override = override_settings(
+            MEDIA_ROOT=media.name, PREVIEWS={**settings.PREVIEWS, 'ENABLED': False},
+            FILE_GC={**settings.FILE_GC, 'AUTO': False},
+        )
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        self.media = media.name
+        
+        self.client = APIClient()
+        self.user = User.objects.create_user(username='user', password='testpass123')
+        self.client.force_authenticate(self.user)
+        site = ConstructionSite.objects.create(name='Участок')
+        self.project = Project.objects.create(name='Проект', code='P-1', cipher='Ш', construction_site=site)
+        self.other = Project.objects.create(name='Другой', code='P-2', cipher='Ш', construction_site=site)
+        self.url = f'/api/projects/projects/{self.project.id}/attachments/'
+    
+    def test_index_written_on_upload(self):
+        """Проверка: размер, тип и SHA-256 записываются при загрузке и замене файла"""
+        response = self.client.post('/api/projects/project-sheets/', {
+            'name': 'Лист', 'project_id': self.project.id, 'file': SimpleUploadedFile('План.pdf', self.DRAWING),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['file_size'], len(self.DRAWING))
+        self.assertEqual(response.data['file_type'], 'application/pdf')
+        attachment = Attachment.objects.get()
+        self.assertEqual(attachment.kind, 'sheet')
+        self.assertEqual(attachment.object_id, response.data['id'])
+        self.assertEqual(attachment.project, self.project)
+        self.assertEqual(attachment.sha256, hashlib.sha256(self.DRAWING).hexdigest())
+        
+        sheet_url = f'/api/projects/project-sheets/{response.data["id"]}/'
+        response = self.client.patch(sheet_url, {'file': SimpleUploadedFile('схема.dwg', b'v2')}, format='multipart')
+        self.assertEqual(response.data['file_size'], 2)
+        self.assertEqual(response.data['file_type'], 'image/vnd.dwg')
+        self.assertEqual(Attachment.objects.get().size, 2)
+        
+        # Изменение без нового файла индекс не трогает
+        uploaded_at = Attachment.objects.get().uploaded_at
+        self.client.patch(sheet_url, {'name': 'Лист 2'}, format='json')
+        self.assertEqual(Attachment.objects.get().uploaded_at, uploaded_at)
+        
+        sheet = ProjectSheet.objects.get()
+        sheet.file = None
+        sheet.save()
+        self.assertFalse(Attachment.objects.exists())
+        self.assertIsNone(self.client.get(sheet_url).data['file_size'])
+    
+    def test_project_attachments_listing(self):
+        """Проверка: вложения листов, этапов и заметок одним списком из индекса"""
+        sheet = ProjectSheet.objects.create(
+            name='Лист', project=self.project, file=SimpleUploadedFile('plan.pdf', self.DRAWING),
+        )
+        ProjectStage.objects.create(
+            project=self.project, datetime=timezone.now(), file=SimpleUploadedFile('act.dwg', b'stage'),
+        )
+        ProjectSheetNote.objects.create(
+            name='Заметка', note='Текст', project_sheet=sheet, file=SimpleUploadedFile('note.txt', b'note'),
+        )
+        ProjectSheet.objects.create(name='Без файла', project=self.project)
+        ProjectSheet.objects.create(name='Чужой', project=self.other, file=SimpleUploadedFile('x.pdf', b'x'))
+        # Список не обращается к файлам
+        shutil.rmtree(self.media)
+        
+        with self.assertNumQueries(3):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 3)
+        results = response.data['results']
+        self.assertEqual([item['kind'] for item in results], ['note', 'stage', 'sheet'])
+        self.assertEqual(results[0]['filename'], 'note.txt')
+        self.assertEqual(results[0]['content_type'], 'text/plain')
+        self.assertEqual(results[2]['object_id'], sheet.id)
+        self.assertEqual(results[2]['size'], len(self.DRAWING))
+        digest = hashlib.sha256(self.DRAWING).hexdigest()
+        self.assertEqual(results[2]['file_url'], f'http://testserver/api/core/files/{digest}/plan.pdf')
+        self.assertEqual(results[2]['preview_url'], f'http://testserver/api/core/previews/{digest}.jpg')
+        self.assertIsNone(results[1]['preview_url'])
+        
+        response = self.client.get(self.url, {'kind': 'stage'})
+        self.assertEqual([item['filename'] for item in response.data['results']], ['act.dwg'])
+        self.assertEqual(self.client.get(self.url, {'kind': 'photo'}).status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_sheet_moved_to_other_project(self):
+        """Проверка: перенос листа переносит вложения листа и его заметок"""
+        sheet = ProjectSheet.objects.create(name='Лист', project=self.project, file=SimpleUploadedFile('a.pdf', b'a'))
+        ProjectSheetNote.objects.create(name='Заметка', note='Текст', project_sheet=sheet, file=SimpleUploadedFile('b.txt', b'b'))
+        uploaded_at = Attachment.objects.get(kind='sheet').uploaded_at
+        
+        sheet.project = self.other
+        sheet.save()
+        self.assertEqual(set(Attachment.objects.values_list('project_id', flat=True)), {self.other.id})
+        self.assertEqual(Attachment.objects.get(kind='sheet').uploaded_at, uploaded_at)
+        
+        sheet.delete()
+        self.assertFalse(Attachment.objects.exists())
+    
+    def test_index_attachments_command(self):
+        """Проверка: команда индексирует файлы, загруженные до индекса"""
+        sheet = ProjectSheet.objects.create(name='Лист', project=self.project, file=SimpleUploadedFile('a.pdf', b'abc'))
+        note = ProjectSheetNote.objects.create(name='Заметка', note='Текст', project_sheet=sheet)
+        ProjectSheetNote.objects.filter(pk=note.pk).update(file=sheet.file.name)
+        Attachment.objects.all().delete()
+        
+        out = StringIO()
+        call_command('index_attachments', stdout=out)
+        self.assertIn('Проиндексировано файлов: 2', out.getvalue())
+        self.assertEqual(
+            sorted(Attachment.objects.values_list('kind', 'project_id', 'size')),
+            [('note', self.project.id, 3), ('sheet', self.project.id, 3)],
+        )
+        self.assertEqual(Attachment.objects.get(kind='note').uploaded_at, ProjectSheetNote.objects.get().updated_at)
+        call_command('index_attachments', stdout=out)
+        self.assertIn('Проиндексировано файлов: 0', out.getvalue())
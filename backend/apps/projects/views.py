@@ -1,61 +1,49 @@
-import json
-import traceback
-import os
-from rest_framework import viewsets, status
+import logging
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from django.db.models import Q, Count, F
-from django.utils import timezone
-from django.http import FileResponse, Http404
+from django.http import Http404, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.http import content_disposition_header
 from datetime import datetime, timedelta
 from django.contrib.auth.models import User
 
 from apps.auth.views import HasPagePermission
+from apps.core import instrumentation, viewsets
+from apps.core.archives import safe_component, stream_zip
+from apps.core.downloads import FileDownloadMixin
+from apps.core.uploads import ResumableUploadMixin
 
 from .models import (
     Status, ConstructionSite, Project, ProjectSheet,
-    ProjectStage, ProjectSheetNote
+    ProjectStage, ProjectSheetNote, Attachment
 )
 from .serializers import (
     StatusSerializer, ConstructionSiteSerializer, ProjectSerializer,
     ProjectSheetSerializer, ProjectStageSerializer, ProjectSheetNoteSerializer,
-    DashboardDataSerializer
+    AttachmentSerializer, DashboardDataSerializer
 )
+from . import exports
+from .reference import statuses
 
-# #region agent log
-import os
-from pathlib import Path
-BASE_DIR = Path(__file__).resolve().parent.parent.parent.parent
-LOG_PATH = BASE_DIR / '.cursor' / 'debug.log'
-def _log(hypothesis_id, location, message, data=None):
-    try:
-        LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
-        with open(LOG_PATH, 'a', encoding='utf-8') as f:
-            f.write(json.dumps({
-                'sessionId': 'debug-session',
-                'runId': 'run1',
-                'hypothesisId': hypothesis_id,
-                'location': location,
-                'message': message,
-                'data': data or {},
-                'timestamp': int(timezone.now().timestamp() * 1000)
-            }) + '\n')
-    except Exception as log_err:
-        # Fallback: try to write to a simpler location
-        try:
-            fallback_path = BASE_DIR / 'backend' / 'debug_fallback.log'
-            with open(fallback_path, 'a', encoding='utf-8') as f:
-                f.write(f"LOG ERROR at {location}: {log_err}\n")
-        except:
-            pass
 
-# Log module import
-try:
-    _log('D', 'views.py:module_import', 'views.py module imported', {'models_imported': True})
-except:
-    pass
-# #endregion
+def _check_table(model, location):
+    """Диагностика: доступность таблицы модели и число строк в ней"""
+    from django.db import connection
+    table = model._meta.db_table
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT COUNT(*) FROM {connection.ops.quote_name(table)}")
+            count = cursor.fetchone()[0]
+        instrumentation.event(f'{location}:table_check', 'Table exists and accessible', {
+            'table_name': table, 'count': count,
+        }, hypothesis='A')
+    except Exception as table_error:
+        instrumentation.event(f'{location}:table_error', 'Table check failed', {
+            'table_name': table, 'error': str(table_error), 'error_type': type(table_error).__name__,
+        }, level=logging.WARNING, hypothesis='A')
 
 
 class StatusViewSet(viewsets.ModelViewSet):
@@ -64,58 +52,42 @@ class StatusViewSet(viewsets.ModelViewSet):
     serializer_class = StatusSerializer
     
     def __init__(self, *args, **kwargs):
-        # #region agent log
-        try:
-            _log('D', 'StatusViewSet.__init__', 'StatusViewSet initialized')
-        except:
-            pass
-        # #endregion
+        instrumentation.event('StatusViewSet.__init__', 'StatusViewSet initialized', hypothesis='D')
         super().__init__(*args, **kwargs)
     
     def list(self, request, *args, **kwargs):
-        # #region agent log
-        _log('A', 'StatusViewSet.list:entry', 'StatusViewSet.list called', {'user': str(request.user), 'authenticated': request.user.is_authenticated})
-        # #endregion
+        instrumentation.event('StatusViewSet.list:entry', 'StatusViewSet.list called', lambda: {
+            'user': str(request.user), 'authenticated': request.user.is_authenticated,
+        }, hypothesis='A')
         try:
-            # #region agent log
-            _log('A', 'StatusViewSet.list:before_query', 'Before querying Status.objects.all()')
-            # #endregion
-            from django.db import connection
-            # #region agent log
-            _log('A', 'StatusViewSet.list:check_table', 'Checking if table exists', {'table_name': Status._meta.db_table})
-            try:
-                with connection.cursor() as cursor:
-                    cursor.execute(f"SELECT COUNT(*) FROM {Status._meta.db_table}")
-                    count = cursor.fetchone()[0]
-                    _log('A', 'StatusViewSet.list:table_check', 'Table exists and accessible', {'count': count})
-            except Exception as table_error:
-                _log('A', 'StatusViewSet.list:table_error', 'Table check failed', {'error': str(table_error)})
-            # #endregion
-            queryset = self.get_queryset()
-            
-            # Фильтрация по status_type
+            # Проверка таблицы — лишний запрос, выполняется только при включенной диагностике
+            if instrumentation.is_enabled(logging.DEBUG):
+                _check_table(Status, 'StatusViewSet.list')
+            # Статусы берутся из кэша справочника
             status_type = request.query_params.get('status_type')
             if status_type:
-                queryset = queryset.filter(status_type=status_type)
+                status_list = statuses.filter(status_type=status_type)
+            else:
+                status_list = statuses.all()
             
-            # #region agent log
-            _log('A', 'StatusViewSet.list:after_query', 'After querying', {'count': queryset.count(), 'status_type': status_type})
-            # #endregion
-            serializer = self.get_serializer(queryset, many=True)
-            # #region agent log
-            _log('A', 'StatusViewSet.list:after_serialize', 'After serialization', {'data_count': len(serializer.data)})
-            # #endregion
+            instrumentation.event('StatusViewSet.list:after_query', 'After querying', lambda: {
+                'count': len(status_list), 'status_type': status_type,
+            }, hypothesis='A')
+            serializer = self.get_serializer(status_list, many=True)
+            instrumentation.event('StatusViewSet.list:after_serialize', 'After serialization', lambda: {
+                'data_count': len(serializer.data),
+            }, hypothesis='A')
             return Response(serializer.data)
         except Exception as e:
-            # #region agent log
-            _log('A', 'StatusViewSet.list:error', 'Exception in StatusViewSet.list', {'error': str(e), 'error_type': type(e).__name__, 'traceback': traceback.format_exc()})
-            # #endregion
+            instrumentation.event('StatusViewSet.list:error', 'Exception in StatusViewSet.list', {
+                'error': str(e), 'error_type': type(e).__name__,
+            }, level=logging.ERROR, hypothesis='A', exc_info=True)
             raise
 
 
 class ConstructionSiteViewSet(viewsets.ModelViewSet):
     """ViewSet для строительных участков"""
-    queryset = ConstructionSite.objects.all()
+    queryset = ConstructionSite.objects.for_serializer()
     serializer_class = ConstructionSiteSerializer
     permission_classes = [IsAuthenticated]
     
@@ -128,75 +100,96 @@ class ConstructionSiteViewSet(viewsets.ModelViewSet):
         return [IsAuthenticated(), HasPagePermission('project_id')]
     
     def __init__(self, *args, **kwargs):
-        # #region agent log
-        try:
-            _log('D', 'ConstructionSiteViewSet.__init__', 'ConstructionSiteViewSet initialized')
-        except:
-            pass
-        # #endregion
+        instrumentation.event('ConstructionSiteViewSet.__init__', 'ConstructionSiteViewSet initialized', hypothesis='D')
         super().__init__(*args, **kwargs)
     
     def list(self, request, *args, **kwargs):
-        # #region agent log
-        _log('A', 'ConstructionSiteViewSet.list:entry', 'ConstructionSiteViewSet.list called', {'user': str(request.user), 'authenticated': request.user.is_authenticated})
-        # #endregion
+        instrumentation.event('ConstructionSiteViewSet.list:entry', 'ConstructionSiteViewSet.list called', lambda: {
+            'user': str(request.user), 'authenticated': request.user.is_authenticated,
+        }, hypothesis='A')
         try:
-            # #region agent log
-            _log('A', 'ConstructionSiteViewSet.list:before_query', 'Before querying ConstructionSite.objects.all()')
-            # #endregion
-            from django.db import connection
-            # #region agent log
-            _log('A', 'ConstructionSiteViewSet.list:check_table', 'Checking if table exists', {'table_name': ConstructionSite._meta.db_table})
-            try:
-                with connection.cursor() as cursor:
-                    cursor.execute(f"SELECT COUNT(*) FROM {ConstructionSite._meta.db_table}")
-                    count = cursor.fetchone()[0]
-                    _log('A', 'ConstructionSiteViewSet.list:table_check', 'Table exists and accessible', {'count': count})
-            except Exception as table_error:
-                _log('A', 'ConstructionSiteViewSet.list:table_error', 'Table check failed', {'error': str(table_error), 'error_type': type(table_error).__name__})
-            # #endregion
+            # Проверка таблицы — лишний запрос, выполняется только при включенной диагностике
+            if instrumentation.is_enabled(logging.DEBUG):
+                _check_table(ConstructionSite, 'ConstructionSiteViewSet.list')
             queryset = self.get_queryset()
-            # #region agent log
-            _log('A', 'ConstructionSiteViewSet.list:after_query', 'After querying', {'count': queryset.count()})
-            # #endregion
             serializer = self.get_serializer(queryset, many=True, context={'request': request})
-            # #region agent log
-            _log('A', 'ConstructionSiteViewSet.list:after_serialize', 'After serialization', {'data_count': len(serializer.data)})
-            # #endregion
-            return Response(serializer.data)
+            data = serializer.data
+            instrumentation.event('ConstructionSiteViewSet.list:after_serialize', 'After serialization', {
+                'data_count': len(data),
+            }, hypothesis='A')
+            return Response(data)
         except Exception as e:
-            # #region agent log
-            _log('A', 'ConstructionSiteViewSet.list:error', 'Exception in ConstructionSiteViewSet.list', {'error': str(e), 'error_type': type(e).__name__, 'traceback': traceback.format_exc()})
-            # #endregion
+            instrumentation.event('ConstructionSiteViewSet.list:error', 'Exception in ConstructionSiteViewSet.list', {
+                'error': str(e), 'error_type': type(e).__name__,
+            }, level=logging.ERROR, hypothesis='A', exc_info=True)
             raise
 
 
 class ProjectViewSet(viewsets.ModelViewSet):
     """ViewSet для проектов"""
-    queryset = Project.objects.all()
+    queryset = Project.objects.for_serializer()
     serializer_class = ProjectSerializer
     permission_classes = [IsAuthenticated]
     
     def get_permissions(self):
         """Возвращает permissions в зависимости от действия"""
-        # Для чтения (list, retrieve) - доступ для всех авторизованных пользователей
-        if self.action in ['list', 'retrieve']:
+        # Для чтения (list, retrieve, вложения, выгрузка файлов) - доступ для всех авторизованных пользователей
+        if self.action in ['list', 'retrieve', 'attachments', 'export_files']:
             return [IsAuthenticated()]
         # Для создания, обновления, удаления - проверяем доступ к странице projects
         return [IsAuthenticated(), HasPagePermission('projects')]
     
     def get_queryset(self):
         """Фильтрация по строительному участку"""
-        queryset = super().get_queryset()
+        if self.action in ('attachments', 'export_files'):
+            # Для списка вложений и выгрузки нужен только сам проект
+            queryset = Project.objects.all()
+        else:
+            queryset = super().get_queryset()
         site_id = self.request.query_params.get('construction_site_id')
         if site_id:
             queryset = queryset.filter(construction_site_id=site_id)
         return queryset
+    
+    @action(detail=True, methods=['get'])
+    def attachments(self, request, pk=None):
+        """Вложения листов, этапов и заметок проекта из индекса, новые сначала
+
+        Фильтр kind: sheet, stage или note.
+        """
+        project = self.get_object()
+        queryset = Attachment.objects.filter(project=project)
+        kind = request.query_params.get('kind')
+        if kind:
+            if kind not in dict(Attachment.KINDS):
+                raise ValidationError({'kind': f'Допустимые значения: {", ".join(dict(Attachment.KINDS))}'})
+            queryset = queryset.filter(kind=kind)
+        page = self.paginate_queryset(queryset)
+        serializer = AttachmentSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
 
+    @action(detail=True, methods=['get'])
+    def export_files(self, request, pk=None):
+        """ZIP-архив файлов листов, этапов и заметок проекта, формируемый по мере передачи
 
-class ProjectSheetViewSet(viewsets.ModelViewSet):
+        Фильтры: status_id, department_id, is_completed, include (см. exports).
+        """
+        project = self.get_object()
+        filters = exports.parse_filters(request.query_params)
+        response = StreamingHttpResponse(
+            stream_zip(exports.entries(project, filters)), content_type='application/zip'
+        )
+        filename = safe_component(f'{project.code}_{project.cipher}', 'project') + '.zip'
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+        patch_cache_control(response, private=True, no_store=True)
+        return response
+
+
+class ProjectSheetViewSet(
+    FileDownloadMixin, ResumableUploadMixin, viewsets.AtomicWritesMixin, viewsets.ModelViewSet
+):
     """ViewSet для проектных листов"""
-    queryset = ProjectSheet.objects.all()
+    queryset = ProjectSheet.objects.for_serializer()
     serializer_class = ProjectSheetSerializer
     
     def get_queryset(self):
@@ -254,41 +247,12 @@ class ProjectSheetViewSet(viewsets.ModelViewSet):
                 raise PermissionDenied("Только инициатор листа может изменить статус выполнения")
         serializer.save()
     
-    @action(detail=True, methods=['get'])
-    def download_file(self, request, pk=None):
-        """Скачивание файла проектного листа"""
-        sheet = self.get_object()
-        if not sheet.file:
-            return Response(
-                {'error': 'Файл не прикреплен'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        
-        try:
-            file_path = sheet.file.path
-            if not os.path.exists(file_path):
-                return Response(
-                    {'error': 'Файл не найден на сервере'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-            
-            file_handle = open(file_path, 'rb')
-            response = FileResponse(
-                file_handle,
-                content_type='application/octet-stream'
-            )
-            response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_path)}"'
-            return response
-        except Exception as e:
-            return Response(
-                {'error': f'Ошибка при скачивании файла: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
 
-
-class ProjectStageViewSet(viewsets.ModelViewSet):
+class ProjectStageViewSet(
+    FileDownloadMixin, ResumableUploadMixin, viewsets.AtomicWritesMixin, viewsets.ModelViewSet
+):
     """ViewSet для этапов проекта"""
-    queryset = ProjectStage.objects.all()
+    queryset = ProjectStage.objects.for_serializer()
     serializer_class = ProjectStageSerializer
     
     def get_queryset(self):
@@ -328,41 +292,12 @@ class ProjectStageViewSet(viewsets.ModelViewSet):
         
         return queryset
     
-    @action(detail=True, methods=['get'])
-    def download_file(self, request, pk=None):
-        """Скачивание файла этапа проекта"""
-        stage = self.get_object()
-        if not stage.file:
-            return Response(
-                {'error': 'Файл не прикреплен'},
-                status=status.HTTP_404_NOT_FOUND
-            )
-        
-        try:
-            file_path = stage.file.path
-            if not os.path.exists(file_path):
-                return Response(
-                    {'error': 'Файл не найден на сервере'},
-                    status=status.HTTP_404_NOT_FOUND
-                )
-            
-            file_handle = open(file_path, 'rb')
-            response = FileResponse(
-                file_handle,
-                content_type='application/octet-stream'
-            )
-            response['Content-Disposition'] = f'attachment; filename="{os.path.basename(file_path)}"'
-            return response
-        except Exception as e:
-            return Response(
-                {'error': f'Ошибка при скачивании файла: {str(e)}'},
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
-
 
-class ProjectSheetNoteViewSet(viewsets.ModelViewSet):
+class ProjectSheetNoteViewSet(
+    FileDownloadMixin, ResumableUploadMixin, viewsets.AtomicWritesMixin, viewsets.ModelViewSet
+):
     """ViewSet для заметок проектного листа"""
-    queryset = ProjectSheetNote.objects.all()
+    queryset = ProjectSheetNote.objects.for_serializer()
     serializer_class = ProjectSheetNoteSerializer
     
     def get_queryset(self):
@@ -427,16 +362,18 @@ class DashboardViewSet(viewsets.ViewSet):
         
         # Получение строительных участков и проектов с учетом фильтров
         if construction_site_ids:
-            sites_qs = ConstructionSite.objects.filter(id__in=construction_site_ids)
+            sites_qs = ConstructionSite.objects.for_serializer().filter(id__in=construction_site_ids)
         else:
-            sites_qs = ConstructionSite.objects.all()
+            sites_qs = ConstructionSite.objects.for_serializer()
         
         if project_ids:
-            projects_qs = Project.objects.filter(id__in=project_ids)
+            projects_qs = Project.objects.for_serializer().filter(id__in=project_ids)
         elif construction_site_ids:
-            projects_qs = Project.objects.filter(construction_site_id__in=construction_site_ids)
+            projects_qs = Project.objects.for_serializer().filter(construction_site_id__in=construction_site_ids)
         else:
-            projects_qs = Project.objects.all()
+            projects_qs = Project.objects.for_serializer()
+        # Проекты нужны и для диаграммы, и для ответа: выбираются один раз
+        projects_qs = list(projects_qs)
         
         # Вычисление общего процента выполнения
         all_sheets = sheets_qs
@@ -463,30 +400,27 @@ class DashboardViewSet(viewsets.ViewSet):
     
     def _prepare_chart_data(self, sheets_qs, projects_qs, granularity):
         """Подготовка данных для диаграммы интенсивности"""
-        # Получаем выполненные листы с датами
+        # Получаем выполненные листы с датами одним запросом (id — чтобы distinct
+        # при фильтре по исполнителям не схлопнул листы с одинаковой датой)
         completed_sheets = sheets_qs.filter(
             is_completed=True,
             completed_at__isnull=False
-        ).select_related('project')
+        ).values_list('id', 'project_id', 'completed_at')
+        
+        # Группировка данных по проектам и датам в зависимости от детализации
+        grouped_by_project = {}
+        for _, project_id, completed_at in completed_sheets:
+            date_key = self._get_date_key(completed_at, granularity)
+            grouped_data = grouped_by_project.setdefault(project_id, {})
+            grouped_data[date_key] = grouped_data.get(date_key, 0) + 1
         
-        # Группируем по проектам и датам в зависимости от детализации
         chart_data = []
         
         for project in projects_qs:
-            project_sheets = completed_sheets.filter(project=project)
-            
-            if not project_sheets.exists():
+            grouped_data = grouped_by_project.get(project.id)
+            if not grouped_data:
                 continue
             
-            # Группировка данных по датам
-            grouped_data = {}
-            
-            for sheet in project_sheets:
-                date_key = self._get_date_key(sheet.completed_at, granularity)
-                if date_key not in grouped_data:
-                    grouped_data[date_key] = 0
-                grouped_data[date_key] += 1
-            
             # Преобразование в формат для диаграммы
             project_data = {
                 'project_id': project.id,
@@ -22,11 +22,16 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework_simplejwt',
     'corsheaders',
+    'apps.core',
     'apps.auth',
     'apps.projects',
 ]
 
 MIDDLEWARE = [
+    'apps.core.middleware.MetricsMiddleware',
+    'apps.core.middleware.ServerTimingMiddleware',
+    'apps.core.middleware.ProfilingMiddleware',
+    'apps.core.middleware.NPlusOneMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -94,6 +99,88 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Файлы моделей хранятся один раз на содержимое: на диске в MEDIA_ROOT
+# (apps.core.storage) или в S3-совместимом хранилище (apps.core.s3)
+STORAGE_BACKENDS = {
+    'filesystem': 'apps.core.storage.ContentAddressedStorage',
+    's3': 'apps.core.s3.S3ContentAddressedStorage',
+}
+STORAGES = {
+    'default': {'BACKEND': STORAGE_BACKENDS[config('STORAGE_BACKEND', default='filesystem')]},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+# S3-совместимое хранилище (STORAGE_BACKEND=s3)
+S3 = {
+    # Адрес API хранилища; пусто — AWS S3 региона REGION
+    'ENDPOINT_URL': config('S3_ENDPOINT_URL', default=''),
+    # Адрес хранилища для клиентов в подписанных URL, если он отличается от ENDPOINT_URL
+    'PUBLIC_ENDPOINT_URL': config('S3_PUBLIC_ENDPOINT_URL', default=''),
+    'REGION': config('S3_REGION', default='us-east-1'),
+    'BUCKET': config('S3_BUCKET', default=''),
+    'ACCESS_KEY': config('S3_ACCESS_KEY', default=''),
+    'SECRET_KEY': config('S3_SECRET_KEY', default=''),
+    # Префикс ключей объектов, например 'mytracker/'
+    'PREFIX': config('S3_PREFIX', default=''),
+    # 'path' — бакет в пути URL (MinIO), 'virtual' — в имени хоста
+    'ADDRESSING_STYLE': config('S3_ADDRESSING_STYLE', default='path'),
+    # Срок подписанного URL скачивания, сек
+    'URL_EXPIRES': config('S3_URL_EXPIRES', default=5 * 60, cast=int),
+    # Срок подписанной формы прямой загрузки, сек
+    'UPLOAD_EXPIRES': config('S3_UPLOAD_EXPIRES', default=60 * 60, cast=int),
+    # Хранилище проверяет SHA-256 прямой загрузки (x-amz-checksum-sha256 в форме POST)
+    'POST_CHECKSUM': config('S3_POST_CHECKSUM', default=True, cast=bool),
+}
+# SHA-256 загружаемого файла считается во время приема
+FILE_UPLOAD_HANDLERS = [
+    'apps.core.storage.HashingMemoryFileUploadHandler',
+    'apps.core.storage.HashingTemporaryFileUploadHandler',
+]
+
+# Докачиваемая загрузка файлов частями (apps.core.uploads)
+UPLOADS = {
+    'MAX_SIZE': config('UPLOADS_MAX_SIZE', default=4 * 1024 ** 3, cast=int),
+    'MAX_CHUNK_SIZE': config('UPLOADS_MAX_CHUNK_SIZE', default=64 * 1024 ** 2, cast=int),
+    # Буфер чтения тела части: память на запрос не зависит от размера части
+    'BUFFER_SIZE': 256 * 1024,
+    # Сессия без новых частей дольше этого срока (сек) удаляется командой clear_uploads
+    'EXPIRES': config('UPLOADS_EXPIRES', default=24 * 60 * 60, cast=int),
+}
+
+# Сборка файлов без ссылок (apps.core.filegc)
+FILE_GC = {
+    # Фоновый поток сборки в каждом процессе; без него — только команда reconcile_files
+    'AUTO': config('FILE_GC_AUTO', default=True, cast=bool),
+    # Файл удаляется не раньше чем через столько секунд после снятия последней ссылки
+    'DELAY': config('FILE_GC_DELAY', default=60 * 60, cast=int),
+    # Период проверки очереди фоновым потоком, сек
+    'INTERVAL': 60,
+    'BATCH_SIZE': 200,
+}
+
+# Превью вложений (apps.core.previews)
+PREVIEWS = {
+    'ENABLED': config('PREVIEWS_ENABLED', default=True, cast=bool),
+    # Потоков построения превью на процесс
+    'WORKERS': config('PREVIEWS_WORKERS', default=2, cast=int),
+    # Большая сторона превью, пикселей
+    'SIZE': 512,
+    'QUALITY': 80,
+    # Файлы больше этого размера не обрабатываются
+    'MAX_SOURCE_SIZE': 200 * 1024 ** 2,
+    # pdftoppm из poppler-utils и ограничение времени рендера страницы, сек
+    'PDFTOPPM': 'pdftoppm',
+    'TIMEOUT': 30,
+}
+
+# Скачивание файлов (apps.core.downloads)
+FILE_DOWNLOADS = {
+    # '' — файл отдает Django; 'accel' — nginx X-Accel-Redirect; 'sendfile' — X-Sendfile
+    'OFFLOAD': config('FILE_DOWNLOADS_OFFLOAD', default=''),
+    # Префикс internal location nginx, который отдает файлы из MEDIA_ROOT
+    'ACCEL_PREFIX': config('FILE_DOWNLOADS_ACCEL_PREFIX', default='/protected-media/'),
+    'CHUNK_SIZE': 64 * 1024,
+}
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 REST_FRAMEWORK = {
@@ -103,6 +190,17 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
     ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'apps.core.renderers.JSONRenderer',
+        'apps.core.renderers.MessagePackRenderer',
+        'apps.core.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'apps.core.parsers.MessagePackParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
     'EXCEPTION_HANDLER': 'apps.projects.exceptions.custom_exception_handler',
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 5,
@@ -124,3 +222,131 @@ CORS_ALLOWED_ORIGINS = config(
 
 CORS_ALLOW_CREDENTIALS = True
 
+# Заголовки ответа, доступные веб-клиенту
+CORS_EXPOSE_HEADERS = ['ETag', 'Server-Timing']
+
+# Интервал (сек) проверки общей версии кэша справочников (статусы, отделы)
+REFERENCE_CACHE_CHECK_INTERVAL = config('REFERENCE_CACHE_CHECK_INTERVAL', default=1.0, cast=float)
+
+# Время жизни (сек) кэшированного ответа /api/auth/bootstrap/ (сбрасывается по версиям данных)
+BOOTSTRAP_CACHE_TIMEOUT = config('BOOTSTRAP_CACHE_TIMEOUT', default=86400, cast=int)
+
+# Кэш: L1 в памяти процесса поверх общего L2 (таблица в БД; locmem — локальная замена)
+CACHE_L2_BACKEND = config('CACHE_L2_BACKEND', default='database')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'apps.core.cache_backends.TwoTierCache',
+        'OPTIONS': {
+            'L2': 'shared',
+            'L1_MAX_ENTRIES': config('CACHE_L1_MAX_ENTRIES', default=1000, cast=int),
+            'L1_TIMEOUT': config('CACHE_L1_TIMEOUT', default=300, cast=int),
+        },
+    },
+    'shared': (
+        {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'cache_table',
+        }
+        if CACHE_L2_BACKEND == 'database' else
+        {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'shared',
+        }
+    ),
+}
+
+# Инвалидация L1 между воркерами через PostgreSQL LISTEN/NOTIFY
+CACHE_INVALIDATION = {
+    'CHANNEL': 'mytracker_cache_invalidation',
+    'LISTEN': config('CACHE_INVALIDATION_LISTEN', default=True, cast=bool),
+    # Интервал (сек) проверки соединения LISTEN при отсутствии событий
+    'KEEPALIVE': 30,
+    # Приложения, изменения моделей которых рассылаются как события
+    'APPS': ['projects', 'user_auth', 'auth'],
+}
+
+# Диагностическое логирование (apps.core.instrumentation); выключено — без накладных расходов
+INSTRUMENTATION = {
+    'ENABLED': config('INSTRUMENTATION_ENABLED', default=False, cast=bool),
+    'LEVEL': config('INSTRUMENTATION_LEVEL', default='DEBUG'),
+    # Доля записей ниже WARNING, попадающих в лог
+    'SAMPLE_RATE': config('INSTRUMENTATION_SAMPLE_RATE', default=1.0, cast=float),
+    # Пустая строка — запись в stderr
+    'PATH': config('INSTRUMENTATION_PATH', default=''),
+    'QUEUE_SIZE': 10000,
+}
+
+# Замер этапов запроса (заголовок Server-Timing и запись в лог диагностики)
+SERVER_TIMING = {
+    'ENABLED': config('SERVER_TIMING_ENABLED', default=True, cast=bool),
+    # Доля запросов, для которых выполняется замер
+    'SAMPLE_RATE': config('SERVER_TIMING_SAMPLE_RATE', default=0.0, cast=float),
+    # Пользователи (username), для которых замер выполняется всегда
+    'USERS': config(
+        'SERVER_TIMING_USERS',
+        default='',
+        cast=lambda v: [s.strip() for s in v.split(',') if s.strip()]
+    ),
+}
+
+# Метрики Prometheus (/metrics); для нескольких воркеров задается PROMETHEUS_MULTIPROC_DIR
+METRICS = {
+    'ENABLED': config('METRICS_ENABLED', default=True, cast=bool),
+    # /metrics доступен с заголовком Authorization: Bearer <token> или с адресов ALLOWED_IPS
+    # (адреса и сети через запятую); без них — только при DEBUG или PUBLIC
+    'TOKEN': config('METRICS_TOKEN', default=''),
+    'ALLOWED_IPS': config(
+        'METRICS_ALLOWED_IPS', default='',
+        cast=lambda v: [s.strip() for s in v.split(',') if s.strip()]
+    ),
+    # Отдавать /metrics без проверки доступа
+    'PUBLIC': config('METRICS_PUBLIC', default=False, cast=bool),
+}
+
+# Медленные запросы к БД (модель core.SlowQuery)
+SLOW_QUERIES = {
+    'ENABLED': config('SLOW_QUERIES_ENABLED', default=True, cast=bool),
+    'THRESHOLD_MS': config('SLOW_QUERIES_THRESHOLD_MS', default=200, cast=float),
+    # Доля медленных SELECT, для которых снимается EXPLAIN (ANALYZE, BUFFERS) (только PostgreSQL)
+    'EXPLAIN_SAMPLE_RATE': config('SLOW_QUERIES_EXPLAIN_SAMPLE_RATE', default=0.05, cast=float),
+    'EXPLAIN_TIMEOUT_MS': 5000,
+    # Интервал сохранения буфера фоновым потоком, сек
+    'FLUSH_INTERVAL': 5,
+    'MAX_BUFFER': 1000,
+}
+
+# Профилирование запросов суперпользователя по флагу ?_profile=1 / X-Profile: 1
+PROFILING = {
+    'ENABLED': config('PROFILING_ENABLED', default=True, cast=bool),
+    'DIR': config('PROFILING_DIR', default=str(BASE_DIR / 'profiles')),
+    'MAX_PROFILES': config('PROFILING_MAX_PROFILES', default=100, cast=int),
+    'MAX_AGE_DAYS': config('PROFILING_MAX_AGE_DAYS', default=7, cast=int),
+    # Интервал семплирования стека для свернутых стеков, сек
+    'SAMPLE_INTERVAL': 0.001,
+}
+
+# Непрерывное семплирование стеков запросов в воркерах (команда dump_samples)
+SAMPLING = {
+    'ENABLED': config('SAMPLING_ENABLED', default=False, cast=bool),
+    # Базовый интервал семплирования, сек
+    'INTERVAL': config('SAMPLING_INTERVAL', default=0.01, cast=float),
+    # Максимальная доля времени семплера; при превышении интервал увеличивается
+    'MAX_OVERHEAD': config('SAMPLING_MAX_OVERHEAD', default=0.01, cast=float),
+    # Длительность окна и срок хранения окон, сек
+    'WINDOW': 60,
+    'RETENTION': 3600,
+    'DIR': config('SAMPLING_DIR', default=str(BASE_DIR / 'profiles' / 'samples')),
+}
+
+# Поиск N+1 и лишних select_related/prefetch_related во время запроса (apps.core.nplusone);
+# подменяет дескрипторы связей моделей, поэтому только для разработки и staging
+NPLUSONE = {
+    'ENABLED': config('NPLUSONE_ENABLED', default=False, cast=bool),
+    # Сколько ленивых загрузок одной связи за запрос считается N+1
+    'THRESHOLD': config('NPLUSONE_THRESHOLD', default=2, cast=int),
+    # Сообщать о связях, загруженных заранее, но не использованных
+    'REPORT_UNUSED': config('NPLUSONE_REPORT_UNUSED', default=True, cast=bool),
+    # NPlusOneError вместо записи в лог
+    'RAISE': config('NPLUSONE_RAISE', default=False, cast=bool),
+}
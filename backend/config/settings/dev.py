@@ -2,6 +2,7 @@
 Настройки для разработки
 """
 from .base import *
+from decouple import config
 
 DEBUG = True
 
@@ -10,4 +11,5 @@ ALLOWED_HOSTS = ['*']
 
 CORS_ALLOW_ALL_ORIGINS = True
 
-
+# Поиск N+1 в разработке включен по умолчанию (см. NPLUSONE в base.py)
+NPLUSONE['ENABLED'] = config('NPLUSONE_ENABLED', default=True, cast=bool)
@@ -5,11 +5,14 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from apps.core.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/auth/', include('apps.auth.urls')),
     path('api/projects/', include('apps.projects.urls')),
+    path('api/core/', include('apps.core.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ]
 
 # Раздача медиа файлов в режиме разработки
@@ -94,6 +94,7 @@ class ApiService {
   
   /// Сохранение токена
   static Future<void> saveToken(String accessToken, String refreshToken) async {
+    invalidateBootstrap();
     final prefs = await SharedPreferences.getInstance();
     await prefs.setString('access_token', accessToken);
     await prefs.setString('refresh_token', refreshToken);
@@ -264,6 +265,14 @@ class ApiService {
       if (token == null || token.isEmpty) {
         return null;
       }
+
+      final bootstrap = await _bootstrapData();
+      if (bootstrap != null) {
+        final user = bootstrap['user'] as Map<String, dynamic>;
+        await saveUsername(user['username']);
+        await saveIsSuperuser(user['is_superuser']);
+        return user;
+      }
       
       var response = await http.get(
         Uri.parse('$baseUrl/auth/me/'),
@@ -308,6 +317,7 @@ class ApiService {
   
   /// Выход пользователя
   static Future<void> logout() async {
+    invalidateBootstrap();
     final prefs = await SharedPreferences.getInstance();
     await prefs.remove('access_token');
     await prefs.remove('refresh_token');
@@ -461,6 +471,8 @@ class ApiService {
         body: jsonEncode(userData),
       );
 
+      invalidateBootstrap();
+
       if (response.statusCode == 201) {
         final data = jsonDecode(response.body);
         return {'success': true, 'data': data};
@@ -490,6 +502,8 @@ class ApiService {
         body: jsonEncode(userData),
       );
 
+      invalidateBootstrap();
+
       if (response.statusCode == 200) {
         final data = jsonDecode(response.body);
         return {'success': true, 'data': data};
@@ -518,6 +532,8 @@ class ApiService {
         },
       );
 
+      invalidateBootstrap();
+
       if (response.statusCode == 204) {
         return {'success': true};
       } else {
@@ -566,6 +582,11 @@ class ApiService {
         return {'success': false, 'error': 'Не авторизован'};
       }
 
+      final bootstrap = await _bootstrapData();
+      if (bootstrap != null) {
+        return {'success': true, 'data': bootstrap['departments']};
+      }
+
       final response = await http.get(
         Uri.parse('$baseUrl/auth/departments/'),
         headers: {
@@ -609,6 +630,8 @@ class ApiService {
         body: jsonEncode(requestBody),
       );
 
+      invalidateBootstrap();
+
       if (response.statusCode == 201) {
         final data = jsonDecode(response.body);
         return {'success': true, 'data': data};
@@ -638,6 +661,8 @@ class ApiService {
         body: jsonEncode(data),
       );
 
+      invalidateBootstrap();
+
       if (response.statusCode == 200) {
         final responseData = jsonDecode(response.body);
         return {'success': true, 'data': responseData};
@@ -666,6 +691,8 @@ class ApiService {
         },
       );
 
+      invalidateBootstrap();
+
       if (response.statusCode == 204) {
         return {'success': true};
       } else {
@@ -759,6 +786,8 @@ class ApiService {
         }
       }
 
+      invalidateBootstrap();
+
       if (response.statusCode == 200) {
         final data = jsonDecode(response.body);
         return {'success': true, 'data': data};
@@ -779,6 +808,11 @@ class ApiService {
         return {'success': false, 'error': 'Не авторизован'};
       }
 
+      final bootstrap = await _bootstrapData();
+      if (bootstrap != null) {
+        return {'success': true, 'data': {'pages': bootstrap['pages']}};
+      }
+
       var response = await http.get(
         Uri.parse('$baseUrl/auth/user-permissions/'),
         headers: {
@@ -815,6 +849,83 @@ class ApiService {
     }
   }
 
+  /// Запрос стартовых данных текущего сеанса: один на все экраны, открытые при запуске
+  static Future<Map<String, dynamic>>? _bootstrapRequest;
+
+  /// Стартовые данные сеанса или null, если их не удалось получить
+  static Future<Map<String, dynamic>?> _bootstrapData() async {
+    _bootstrapRequest ??= getBootstrap();
+    final result = await _bootstrapRequest!;
+    if (result['success'] != true) {
+      _bootstrapRequest = null;
+      return null;
+    }
+    return result['data'] as Map<String, dynamic>;
+  }
+
+  /// Сброс стартовых данных сеанса после входа, выхода или изменения входящих в них данных:
+  /// следующий запрос перепроверит их по ETag
+  static void invalidateBootstrap() {
+    _bootstrapRequest = null;
+  }
+
+  /// Получение стартовых данных одним запросом (пользователь, страницы, статусы, отделы, пользователи)
+  /// Ответ кэшируется локально и перепроверяется по ETag: при 304 используется сохраненная копия
+  static Future<Map<String, dynamic>> getBootstrap() async {
+    try {
+      var token = await getAccessToken();
+      if (token == null || token.isEmpty) {
+        return {'success': false, 'error': 'Не авторизован', 'requiresLogin': true};
+      }
+
+      final prefs = await SharedPreferences.getInstance();
+      final cachedEtag = prefs.getString('bootstrap_etag');
+      final cachedBody = prefs.getString('bootstrap_body');
+
+      Map<String, String> buildHeaders(String accessToken) => {
+        'Authorization': 'Bearer $accessToken',
+        'Content-Type': 'application/json',
+        if (cachedEtag != null && cachedBody != null) 'If-None-Match': cachedEtag,
+      };
+
+      var response = await http.get(
+        Uri.parse('$baseUrl/auth/bootstrap/'),
+        headers: buildHeaders(token),
+      );
+
+      if (response.statusCode == 401) {
+        final refreshed = await refreshAccessToken();
+        if (refreshed) {
+          token = await getAccessToken();
+          if (token != null) {
+            response = await http.get(
+              Uri.parse('$baseUrl/auth/bootstrap/'),
+              headers: buildHeaders(token),
+            );
+          }
+        }
+      }
+
+      if (response.statusCode == 304 && cachedBody != null) {
+        return {'success': true, 'data': jsonDecode(cachedBody)};
+      } else if (response.statusCode == 200) {
+        final body = utf8.decode(response.bodyBytes);
+        final etag = response.headers['etag'];
+        if (etag != null) {
+          await prefs.setString('bootstrap_etag', etag);
+          await prefs.setString('bootstrap_body', body);
+        }
+        return {'success': true, 'data': jsonDecode(body)};
+      } else if (response.statusCode == 401) {
+        return {'success': false, 'error': 'Не авторизован', 'requiresLogin': true};
+      } else {
+        return {'success': false, 'error': 'Ошибка получения стартовых данных'};
+      }
+    } catch (e) {
+      return {'success': false, 'error': 'Ошибка подключения: ${e.toString()}'};
+    }
+  }
+
   /// Сохранение текущего экрана
   static Future<void> saveCurrentScreen(String screen) async {
     final prefs = await SharedPreferences.getInstance();
@@ -1300,6 +1411,16 @@ class ApiService {
         return {'success': false, 'error': 'Не авторизован'};
       }
 
+      final bootstrap = await _bootstrapData();
+      if (bootstrap != null) {
+        final byType = bootstrap['statuses'] as Map<String, dynamic>;
+        final data = statusType != null
+            ? List<dynamic>.from(byType[statusType] ?? [])
+            : (byType.values.expand((items) => items as List).toList()
+                ..sort((a, b) => (a['id'] as int).compareTo(b['id'] as int)));
+        return {'success': true, 'data': data};
+      }
+
       var uri = Uri.parse('$baseUrl/projects/statuses/');
       if (statusType != null) {
         uri = uri.replace(queryParameters: {'status_type': statusType});
@@ -1368,6 +1489,8 @@ class ApiService {
         body: jsonEncode(requestBody),
       );
 
+      invalidateBootstrap();
+
       if (response.statusCode == 201) {
         final data = jsonDecode(response.body);
         return {'success': true, 'data': data};
@@ -1397,6 +1520,8 @@ class ApiService {
         body: jsonEncode(data),
       );
 
+      invalidateBootstrap();
+
       if (response.statusCode == 200) {
         final responseData = jsonDecode(response.body);
         return {'success': true, 'data': responseData};
@@ -1425,6 +1550,8 @@ class ApiService {
         },
       );
 
+      invalidateBootstrap();
+
       if (response.statusCode == 204) {
         return {'success': true};
       } else {